@@ -3,16 +3,30 @@
 检查系统消费数据脚本
 
 功能：
-- 显示消费记录统计
-- 显示月度汇总统计
+- 显示按类型、模型来源、模型的消费统计
 - 显示用户和设备消费分布
+- 显示按天/按小时的消费趋势
+
+所有消费统计只读取预聚合的汇总表（consumption_rollup_daily / consumption_rollup_hourly），
+不扫描 consumption_records 明细，历史数据量大时也能快速返回。
+
+用法：
+    python check_consumption.py                       # 最近30天，按天
+    python check_consumption.py --days 2 --granularity hour
+    python check_consumption.py --user <user_id> --start 2025-01-01 --end 2025-01-31
 """
 
+import sys
 import sqlite3
-import json
+import argparse
 from pathlib import Path
-from datetime import datetime
-from collections import defaultdict
+from datetime import datetime, timedelta
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.consumption_rollups import is_rollup_ready, query_rollups
 
 # 从配置文件读取数据库路径
 def get_db_path():
@@ -64,209 +78,80 @@ def format_duration(ms):
     return f"{ms}ms"
 
 
-def check_consumption_records(conn):
-    """检查消费记录表"""
+def check_consumption_rollups(conn, args):
+    """检查消费统计（只读取汇总表）"""
     cursor = conn.cursor()
+    filters = {
+        'granularity': args.granularity,
+        'start': args.start,
+        'end': args.end,
+        'user_id': args.user,
+        'device_id': args.device,
+    }
     
     print("\n" + "="*80)
-    print("📊 消费记录统计 (consumption_records)")
+    print(f"📊 消费统计 ({args.start} ~ {args.end}, 粒度: {args.granularity})")
     print("="*80)
     
-    # 总记录数
-    cursor.execute("SELECT COUNT(*) as total FROM consumption_records")
-    total = cursor.fetchone()[0]
+    if not is_rollup_ready(cursor):
+        print("\n⚠️  汇总表回填尚未完成，统计结果可能不完整（启动 API 服务后会在后台继续回填）")
+    
+    # 按类型和模型来源统计
+    rows = query_rollups(cursor, group_by=['type', 'model_source'], **filters)
+    total = sum(row['record_count'] or 0 for row in rows)
     print(f"\n总记录数: {total}")
     
     if total == 0:
-        print("⚠️  暂无消费记录")
+        print("⚠️  该时间范围内暂无消费记录")
         return
     
-    # 按类型统计
-    cursor.execute("""
-        SELECT type, COUNT(*) as count, 
-               SUM(amount) as total_amount,
-               AVG(amount) as avg_amount
-        FROM consumption_records
-        GROUP BY type
-    """)
-    
     print("\n按类型统计:")
     print("-" * 80)
-    for row in cursor.fetchall():
-        type_name = row[0]
-        count = row[1]
-        total_amount = row[2] or 0
-        avg_amount = row[3] or 0
-        
-        if type_name == 'asr':
-            print(f"  ASR: {count} 条记录, 总时长: {format_duration(int(total_amount))}, 平均: {format_duration(int(avg_amount))}")
+    for row in rows:
+        count = row['record_count'] or 0
+        if row['type'] == 'asr':
+            total_ms = int(row['asr_duration_ms'] or 0)
+            print(f"  ASR: {count} 条记录, 总时长: {format_duration(total_ms)}, 平均: {format_duration(total_ms // count)}")
         else:
-            print(f"  LLM: {count} 条记录, 总tokens: {format_number(int(total_amount))}, 平均: {format_number(int(avg_amount))}")
-    
-    # 按模型来源统计
-    cursor.execute("""
-        SELECT model_source, COUNT(*) as count, 
-               SUM(amount) as total_amount
-        FROM consumption_records
-        WHERE type = 'llm'
-        GROUP BY model_source
-    """)
+            total_tokens = int(row['llm_total_tokens'] or 0)
+            print(f"  LLM ({row['model_source']}): {count} 条记录, 总tokens: {format_number(total_tokens)}, "
+                  f"平均: {format_number(total_tokens // count)}")
     
-    print("\nLLM按模型来源统计:")
+    # 按模型统计（LLM为模型名称，ASR为提供商）
+    print("\n按模型统计:")
     print("-" * 80)
-    for row in cursor.fetchall():
-        source = row[0] or 'unknown'
-        count = row[1]
-        total_amount = row[2] or 0
-        print(f"  {source}: {count} 条记录, 总tokens: {format_number(int(total_amount))}")
+    for row in query_rollups(cursor, group_by=['type', 'model'], **filters):
+        model = row['model'] or 'unknown'
+        if row['type'] == 'asr':
+            print(f"  [ASR] {model}: {row['record_count']} 条记录, 时长: {format_duration(int(row['asr_duration_ms'] or 0))}")
+        else:
+            print(f"  [LLM] {model}: {row['record_count']} 条记录, tokens: {format_number(int(row['llm_total_tokens'] or 0))} "
+                  f"(prompt {format_number(int(row['llm_prompt_tokens'] or 0))}, "
+                  f"completion {format_number(int(row['llm_completion_tokens'] or 0))})")
     
     # 按用户统计
-    cursor.execute("""
-        SELECT user_id, COUNT(*) as count,
-               SUM(CASE WHEN type = 'asr' THEN amount ELSE 0 END) as asr_total,
-               SUM(CASE WHEN type = 'llm' THEN amount ELSE 0 END) as llm_total
-        FROM consumption_records
-        GROUP BY user_id
-        ORDER BY count DESC
-        LIMIT 10
-    """)
-    
-    print("\n按用户统计 (Top 10):")
+    print(f"\n按用户统计 (Top {args.top}):")
     print("-" * 80)
-    for row in cursor.fetchall():
-        user_id = row[0]
-        count = row[1]
-        asr_total = row[2] or 0
-        llm_total = row[3] or 0
-        print(f"  {user_id[:8]}...: {count} 条记录, ASR: {format_duration(int(asr_total))}, LLM: {format_number(int(llm_total))} tokens")
+    for row in query_rollups(cursor, group_by=['user_id'], limit=args.top, **filters):
+        print(f"  {row['user_id'][:8]}...: {row['record_count']} 条记录, "
+              f"ASR: {format_duration(int(row['asr_duration_ms'] or 0))}, "
+              f"LLM: {format_number(int(row['llm_total_tokens'] or 0))} tokens")
     
     # 按设备统计（device_id仅用于记录消费发生的设备）
-    cursor.execute("""
-        SELECT device_id, COUNT(*) as count,
-               SUM(CASE WHEN type = 'asr' THEN amount ELSE 0 END) as asr_total,
-               SUM(CASE WHEN type = 'llm' THEN amount ELSE 0 END) as llm_total
-        FROM consumption_records
-        GROUP BY device_id
-        ORDER BY count DESC
-        LIMIT 10
-    """)
-    
-    print("\n按设备统计 (Top 10) - device_id仅用于标识消费发生的设备:")
-    print("-" * 80)
-    for row in cursor.fetchall():
-        device_id = row[0]
-        count = row[1]
-        asr_total = row[2] or 0
-        llm_total = row[3] or 0
-        print(f"  {device_id[:8]}...: {count} 条记录, ASR: {format_duration(int(asr_total))}, LLM: {format_number(int(llm_total))} tokens")
-    
-    # 最近10条记录
-    cursor.execute("""
-        SELECT id, user_id, device_id, type, amount, unit, model_source, created_at
-        FROM consumption_records
-        ORDER BY timestamp DESC
-        LIMIT 10
-    """)
-    
-    print("\n最近10条记录:")
-    print("-" * 80)
-    for row in cursor.fetchall():
-        record_id = row[0]
-        user_id = row[1]
-        device_id = row[2]
-        type_name = row[3]
-        amount = row[4]
-        unit = row[5]
-        model_source = row[6] or 'vendor'
-        created_at = row[7]
-        
-        amount_str = format_duration(int(amount)) if unit == 'ms' else format_number(int(amount))
-        print(f"  [{created_at}] {type_name.upper()} | {user_id[:8]}... | {device_id[:8]}... | {amount_str} {unit} | {model_source}")
-
-
-def check_monthly_consumption(conn):
-    """检查月度汇总表"""
-    cursor = conn.cursor()
-    
-    print("\n" + "="*80)
-    print("📅 月度消费汇总 (monthly_consumption)")
-    print("="*80)
-    
-    # 总记录数
-    cursor.execute("SELECT COUNT(*) as total FROM monthly_consumption")
-    total = cursor.fetchone()[0]
-    print(f"\n总记录数: {total}")
-    
-    if total == 0:
-        print("⚠️  暂无月度汇总记录")
-        return
-    
-    # 按年月统计
-    cursor.execute("""
-        SELECT year, month, 
-               COUNT(*) as record_count,
-               SUM(asr_duration_ms) as total_asr,
-               SUM(llm_total_tokens) as total_llm,
-               SUM(record_count) as total_records
-        FROM monthly_consumption
-        GROUP BY year, month
-        ORDER BY year DESC, month DESC
-    """)
-    
-    print("\n按年月统计:")
-    print("-" * 80)
-    for row in cursor.fetchall():
-        year = row[0]
-        month = row[1]
-        record_count = row[2]
-        total_asr = row[3] or 0
-        total_llm = row[4] or 0
-        total_records = row[5] or 0
-        print(f"  {year}-{month:02d}: {record_count} 条汇总记录, ASR: {format_duration(int(total_asr))}, LLM: {format_number(int(total_llm))} tokens, 明细记录: {total_records}")
-    
-    # 按用户统计（月度汇总以user_id为主）
-    cursor.execute("""
-        SELECT user_id, 
-               COUNT(*) as month_count,
-               SUM(asr_duration_ms) as total_asr,
-               SUM(llm_total_tokens) as total_llm
-        FROM monthly_consumption
-        GROUP BY user_id
-        ORDER BY total_llm DESC
-        LIMIT 10
-    """)
-    
-    print("\n按用户统计 (Top 10) - 月度汇总以user_id为主:")
+    print(f"\n按设备统计 (Top {args.top}) - device_id仅用于标识消费发生的设备:")
     print("-" * 80)
-    for row in cursor.fetchall():
-        user_id = row[0]
-        month_count = row[1]
-        total_asr = row[2] or 0
-        total_llm = row[3] or 0
-        print(f"  {user_id[:8]}...: {month_count} 个月, ASR: {format_duration(int(total_asr))}, LLM: {format_number(int(total_llm))} tokens")
-    
-    # 当前月份汇总（按user_id汇总，不区分device_id）
-    now = datetime.now()
-    cursor.execute("""
-        SELECT user_id, asr_duration_ms, llm_total_tokens, record_count, updated_at
-        FROM monthly_consumption
-        WHERE year = ? AND month = ?
-        ORDER BY llm_total_tokens DESC
-    """, (now.year, now.month))
+    for row in query_rollups(cursor, group_by=['device_id'], limit=args.top, **filters):
+        print(f"  {row['device_id'][:8]}...: {row['record_count']} 条记录, "
+              f"ASR: {format_duration(int(row['asr_duration_ms'] or 0))}, "
+              f"LLM: {format_number(int(row['llm_total_tokens'] or 0))} tokens")
     
-    print(f"\n当前月份 ({now.year}-{now.month:02d}) 汇总（按user_id汇总，包含所有设备）:")
+    # 时间趋势
+    print(f"\n消费趋势（按{'天' if args.granularity == 'day' else '小时'}）:")
     print("-" * 80)
-    rows = cursor.fetchall()
-    if rows:
-        for row in rows:
-            user_id = row[0]
-            asr_ms = row[1] or 0
-            llm_tokens = row[2] or 0
-            record_count = row[3] or 0
-            updated_at = row[4]
-            print(f"  {user_id[:8]}... | ASR: {format_duration(int(asr_ms))}, LLM: {format_number(int(llm_tokens))} tokens, 记录数: {record_count}, 更新: {updated_at}")
-    else:
-        print("  ⚠️  当前月份暂无汇总记录")
+    for row in query_rollups(cursor, group_by=['bucket'], **filters):
+        print(f"  {row['bucket']} | {row['record_count']} 条 | "
+              f"ASR: {format_duration(int(row['asr_duration_ms'] or 0))} | "
+              f"LLM: {format_number(int(row['llm_total_tokens'] or 0))} tokens")
 
 
 def check_system_status(conn):
@@ -311,8 +196,30 @@ def check_system_status(conn):
             print(f"  {user_id[:8]}... | {tier} | {status} | 激活: {activated_at} | 到期: {expires_at}")
 
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="MindVoice 消费数据检查工具（读取消费统计汇总表）")
+    parser.add_argument('--granularity', choices=['day', 'hour'], default='day', help="时间粒度（默认按天）")
+    parser.add_argument('--days', type=int, default=30, help="统计最近N天（未指定 --start 时生效，默认30）")
+    parser.add_argument('--start', help="起始日期（含），如 2025-01-01")
+    parser.add_argument('--end', help="结束日期（含），如 2025-01-31")
+    parser.add_argument('--user', help="只统计指定用户")
+    parser.add_argument('--device', help="只统计指定设备")
+    parser.add_argument('--top', type=int, default=10, help="用户/设备排行数量（默认10）")
+    args = parser.parse_args()
+    
+    today = datetime.now()
+    if not args.end:
+        args.end = today.strftime('%Y-%m-%d')
+    if not args.start:
+        args.start = (today - timedelta(days=max(1, args.days) - 1)).strftime('%Y-%m-%d')
+    return args
+
+
 def main():
     """主函数"""
+    args = parse_args()
+    
     print("="*80)
     print("🔍 MindVoice 消费数据检查工具")
     print("="*80)
@@ -336,23 +243,18 @@ def main():
         # 检查系统状态
         check_system_status(conn)
         
-        # 检查表是否存在
+        # 检查汇总表是否存在
         cursor = conn.cursor()
         cursor.execute("""
             SELECT name FROM sqlite_master 
-            WHERE type='table' AND name IN ('consumption_records', 'monthly_consumption')
+            WHERE type='table' AND name IN ('consumption_rollup_daily', 'consumption_rollup_hourly')
         """)
         tables = [row[0] for row in cursor.fetchall()]
         
-        if 'consumption_records' not in tables:
-            print("\n⚠️  消费记录表不存在，可能尚未初始化数据库")
+        if len(tables) < 2:
+            print("\n⚠️  消费统计汇总表不存在，请先启动一次 API 服务完成数据库迁移")
         else:
-            check_consumption_records(conn)
-        
-        if 'monthly_consumption' not in tables:
-            print("\n⚠️  月度汇总表不存在，可能尚未初始化数据库")
-        else:
-            check_monthly_consumption(conn)
+            check_consumption_rollups(conn, args)
         
         conn.close()
         
@@ -368,4 +270,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -1389,7 +1389,7 @@ function App() {
           // 等待组件渲染后恢复对话
           setTimeout(() => {
             if (smartChatRef.current) {
-              smartChatRef.current.loadConversation(record.metadata.messages);
+              smartChatRef.current.loadConversation(record.metadata.messages, recordId);
               setToast({ message: '已恢复对话，可以继续聊天', type: 'success' });
             } else {
               console.warn('[历史记录] SmartChat ref 未初始化');
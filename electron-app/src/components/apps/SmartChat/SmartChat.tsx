@@ -18,7 +18,7 @@ interface Message {
 // 导出接口供 App.tsx 使用
 export interface SmartChatHandle {
   appendAsrText: (text: string, isDefiniteUtterance?: boolean) => void;
-  loadConversation: (messages: Message[]) => void;
+  loadConversation: (messages: Message[], conversationId?: string) => void;
 }
 
 interface SmartChatProps {
@@ -49,6 +49,8 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
   const [isLoading, setIsLoading] = useState(false);
   const [useKnowledge, setUseKnowledge] = useState(true);
   const [isPressingMic, setIsPressingMic] = useState(false);
+  // 后端对话ID（首次回复后由后端返回，后续消息传回以继续该对话）
+  const conversationIdRef = useRef<string | null>(null);
   
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLTextAreaElement>(null);
@@ -62,8 +64,9 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
       // 空实现 - 语音输入接口预留，由用户后续集成
       console.log('[SmartChat] ASR接口预留，暂不实现', { text, isDefiniteUtterance });
     },
-    loadConversation: (conversationMessages: Message[]) => {
-      console.log('[SmartChat] 恢复对话', { messageCount: conversationMessages.length });
+    loadConversation: (conversationMessages: Message[], conversationId?: string) => {
+      console.log('[SmartChat] 恢复对话', { messageCount: conversationMessages.length, conversationId });
+      conversationIdRef.current = conversationId || null;
       setMessages(conversationMessages);
     }
   }), []);
@@ -102,7 +105,8 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
           stream: true,
           use_history: true,
           use_knowledge: useKnowledge,
-          device_id: deviceId  // 传递device_id用于消费记录
+          device_id: deviceId,  // 传递device_id用于消费记录
+          conversation_id: conversationIdRef.current
         })
       });
 
@@ -148,6 +152,9 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
                     )
                   );
                 }
+                if (parsed.conversation_id) {
+                  conversationIdRef.current = parsed.conversation_id;
+                }
                 if (parsed.error) {
                   throw new Error(parsed.error.message || '对话失败');
                 }
@@ -179,10 +186,13 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
     try {
       // 清空后端对话历史（后端会自动保存）
       await fetch(`${API_BASE_URL}/api/smartchat/clear_history`, {
-        method: 'POST'
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ conversation_id: conversationIdRef.current })
       });
       
-      // 清空前端状态
+      // 清空前端状态，下一条消息开始新对话
+      conversationIdRef.current = null;
       setMessages([]);
       
       console.log('[SmartChat] ✅ 对话已清空');
@@ -226,6 +236,7 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
   const handleStartWork = () => {
     // 清空当前对话，开始新会话
     setMessages([]);
+    conversationIdRef.current = null;
     onStartWork();
   };
   
@@ -233,6 +244,7 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
   const handleEndWork = () => {
     // 清空对话（后端会自动保存）
     setMessages([]);
+    conversationIdRef.current = null;
     onEndWork();
   };
 
@@ -418,6 +430,7 @@ export const SmartChat = forwardRef<SmartChatHandle, SmartChatProps>(({
                   <AppButton
                     onClick={() => {
                       setMessages([]);
+                      conversationIdRef.current = null;
                       setInputText('');
                     }}
                     disabled={asrState !== 'idle' || messages.length === 0}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+数据批量导出脚本
+
+功能：
+- 导出消费明细（consumption_records）、月度汇总（monthly_consumption）、记录元数据（records，不含正文）
+- 支持 CSV、Arrow IPC 流、Parquet（后两者需要 pip install pyarrow）
+- 按月份 / 日期范围、用户过滤
+
+分块读取并逐块写入文件，百万行级别的月度明细也只占用固定内存。
+
+用法：
+    python export_data.py --dataset consumption_records --month 2025-01 --format parquet
+    python export_data.py --dataset monthly_consumption --start 2025-01-01 --end 2025-06-30
+    python export_data.py --dataset records --user <user_id> --output ~/records.csv
+"""
+
+import sys
+import argparse
+import calendar
+from pathlib import Path
+from datetime import datetime
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.config import Config
+from src.services.data_export_service import DATASETS, EXPORT_FORMATS, DataExportService
+
+
+def month_range(month: str):
+    """月份（YYYY-MM）转换为起止日期"""
+    start = datetime.strptime(month, '%Y-%m')
+    last_day = calendar.monthrange(start.year, start.month)[1]
+    return start.strftime('%Y-%m-01'), start.replace(day=last_day).strftime('%Y-%m-%d')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MindVoice 数据批量导出工具")
+    parser.add_argument('--dataset', choices=list(DATASETS), default='consumption_records', help="导出的数据集")
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', help="导出格式（默认CSV）")
+    parser.add_argument('--month', help="导出指定月份，如 2025-01（与 --start/--end 二选一）")
+    parser.add_argument('--start', help="起始日期（含），如 2025-01-01")
+    parser.add_argument('--end', help="结束日期（含），如 2025-01-31")
+    parser.add_argument('--user', help="只导出指定用户")
+    parser.add_argument('--output', help="输出文件路径（默认当前目录下按数据集和时间命名）")
+    args = parser.parse_args()
+
+    start, end = args.start, args.end
+    if args.month:
+        start, end = month_range(args.month)
+
+    config = Config()
+    service = DataExportService(config)
+    if args.format not in service.available_formats():
+        print(f"❌ {args.format} 格式需要安装 pyarrow: pip install pyarrow")
+        sys.exit(1)
+
+    extension = EXPORT_FORMATS[args.format][1]
+    output = args.output or f"{args.dataset}_{args.month or start or 'all'}.{extension}"
+
+    print(f"📦 导出 {args.dataset} ({start or '最早'} ~ {end or '最新'}"
+          f"{', 用户 ' + args.user if args.user else ''}) → {output}")
+    written = service.export_to_file(args.dataset, output, args.format, start=start, end=end, user_id=args.user)
+    print(f"✅ 导出完成: {written / 1024 / 1024:.2f} MB")
+
+
+if __name__ == '__main__':
+    main()
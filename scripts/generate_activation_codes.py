@@ -2,48 +2,137 @@
 """
 激活码批量生成工具
 
+激活码按批次写入数据库 activation_codes 表，兑换时由服务端原子标记为已使用。
+
 用法：
     python scripts/generate_activation_codes.py --tier vip --months 3 --count 100 --output codes.csv
+    python scripts/generate_activation_codes.py --list-batches
+    python scripts/generate_activation_codes.py --import-csv old_codes.csv
+    python scripts/generate_activation_codes.py --export-batch <batch_id> --output status.csv
 
 参数：
-    --tier: 会员等级 (free/vip/pro/pro_plus)
+    --tier: 会员等级 (vip/pro/pro_plus)
     --months: 订阅月数 (1-120)
     --count: 生成数量
+    --expires-days: 激活码有效天数（可选，默认不过期）
+    --batch-id: 批次ID（可选，默认自动生成）
+    --list-batches: 列出最近生成的批次及兑换数量（不生成新激活码）
+    --import-csv: 导入早期版本生成的激活码 CSV（第一列为激活码），导入后才能兑换
+    --export-batch: 导出指定批次的兑换状态（不生成新激活码）
     --output: 输出文件路径 (CSV格式)
+
+批次列表和导出文件包含未兑换的激活码，不通过 API 提供，只能在服务器本地用本工具读取。
 """
 
 import argparse
 import csv
 import sys
 from pathlib import Path
-from datetime import datetime
 
 # 添加项目根目录到路径
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from src.services.activation_service import ActivationService
+from src.providers.storage.sqlite import SQLiteStorageProvider
 from src.core.config import Config
 from src.core.logger import get_logger
 
 logger = get_logger("ActivationCodeGenerator")
 
 
+def export_batch(service: ActivationService, batch_id: str, output_path: Path):
+    """导出批次兑换状态"""
+    status = service.get_batch_status(batch_id)
+    if not status:
+        logger.error(f"[导出] 批次不存在: {batch_id}")
+        sys.exit(1)
+    
+    with open(output_path, 'wb') as f:
+        for chunk in service.export_batch_csv(batch_id):
+            f.write(chunk)
+    
+    logger.info(f"[导出] 批次 {batch_id}: 共 {status['total']} 个，已使用 {status['used']}，"
+                f"已过期 {status['expired']}，可用 {status['available']}")
+    logger.info(f"[导出] 📄 文件保存到: {output_path.absolute()}")
+
+
+def list_batches(service: ActivationService):
+    """列出最近生成的批次"""
+    batches = service.list_batches()
+    if not batches:
+        logger.info("[批次] 暂无激活码批次")
+        return
+    for batch in batches:
+        logger.info(f"[批次] {batch['batch_id']}: {batch['tier']} {batch['months']}个月，"
+                    f"共 {batch['total']} 个，已使用 {batch['used']}，生成于 {batch['created_at']}")
+
+
+def import_csv(service: ActivationService, input_path: Path):
+    """导入早期版本生成的激活码 CSV（第一列为激活码，表头会被当作无效行跳过）"""
+    if not input_path.exists():
+        logger.error(f"[导入] 文件不存在: {input_path}")
+        sys.exit(1)
+    
+    with open(input_path, 'r', newline='', encoding='utf-8-sig') as f:
+        codes = [row[0] for row in csv.reader(f) if row]
+    
+    result = service.import_codes(codes)
+    logger.info(f"[导入] {input_path.name}: 新增 {result['imported']}，已存在 {result['existing']}，"
+                f"跳过 {result['invalid']}")
+
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description='批量生成激活码')
-    parser.add_argument('--tier', required=True, choices=['free', 'vip', 'pro', 'pro_plus'],
+    parser.add_argument('--tier', choices=list(ActivationService.REDEEMABLE_TIERS),
                         help='会员等级')
-    parser.add_argument('--months', type=int, required=True,
+    parser.add_argument('--months', type=int,
                         help='订阅月数 (1-120)')
-    parser.add_argument('--count', type=int, required=True,
+    parser.add_argument('--count', type=int,
                         help='生成数量')
-    parser.add_argument('--output', required=True,
+    parser.add_argument('--expires-days', type=int, default=None,
+                        help='激活码有效天数（默认不过期）')
+    parser.add_argument('--batch-id', default=None,
+                        help='批次ID（默认自动生成）')
+    parser.add_argument('--export-batch', default=None,
+                        help='导出指定批次的兑换状态')
+    parser.add_argument('--list-batches', action='store_true',
+                        help='列出最近生成的批次')
+    parser.add_argument('--import-csv', default=None,
+                        help='导入早期版本生成的激活码 CSV')
+    parser.add_argument('--output', default=None,
                         help='输出文件路径 (CSV格式)')
     
     args = parser.parse_args()
     
+    if not args.list_batches and not args.import_csv and not args.output:
+        parser.error("生成或导出激活码需要 --output")
+    
+    # 初始化服务（确保数据库表结构已就绪）
+    config = Config()
+    SQLiteStorageProvider().initialize(config.get('storage'))
+    service = ActivationService(config)
+    
+    if args.list_batches:
+        list_batches(service)
+        return
+    
+    if args.import_csv:
+        import_csv(service, Path(args.import_csv))
+        return
+    
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    if args.export_batch:
+        export_batch(service, args.export_batch, output_path)
+        return
+    
     # 验证参数
+    if not args.tier or args.months is None or args.count is None:
+        parser.error("生成激活码需要 --tier、--months 和 --count")
+    
     if not (1 <= args.months <= 120):
         logger.error(f"订阅月数必须在1-120之间: {args.months}")
         sys.exit(1)
@@ -52,38 +141,26 @@ def main():
         logger.error(f"生成数量必须大于0: {args.count}")
         sys.exit(1)
     
-    # 初始化服务
-    config = Config()
-    service = ActivationService(config)
-    
     logger.info(f"[生成] 开始生成激活码...")
     logger.info(f"[生成] 等级: {args.tier}, 月数: {args.months}, 数量: {args.count}")
     
-    # 生成激活码
-    codes = []
-    for i in range(args.count):
-        code = service.generate_code(args.tier, args.months)
-        codes.append(code)
-        
-        if (i + 1) % 100 == 0:
-            logger.info(f"[生成] 进度: {i + 1}/{args.count}")
+    # 生成激活码（一个事务批量写入）
+    batch = service.generate_batch(args.tier, args.months, args.count,
+                                   expires_days=args.expires_days, batch_id=args.batch_id)
+    codes = batch['codes']
     
     # 写入CSV文件
-    output_path = Path(args.output)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    
     with open(output_path, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
         
         # 写入表头
-        writer.writerow(['激活码', '等级', '月数', '生成时间', '状态'])
+        writer.writerow(['激活码', '等级', '月数', '批次', '过期时间'])
         
         # 写入数据
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         for code in codes:
-            writer.writerow([code, args.tier, args.months, timestamp, '未使用'])
+            writer.writerow([code, args.tier, args.months, batch['batch_id'], batch['expires_at'] or ''])
     
-    logger.info(f"[生成] ✅ 已生成 {args.count} 个激活码")
+    logger.info(f"[生成] ✅ 已生成 {len(codes)} 个激活码，批次: {batch['batch_id']}")
     logger.info(f"[生成] 📄 文件保存到: {output_path.absolute()}")
     
     # 打印示例
@@ -97,4 +174,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -7,6 +7,10 @@ from abc import ABC, abstractmethod
 from typing import AsyncIterator, Union, Optional, Dict, Any
 import logging
 
+from .response_cache import (
+    ResponseCache, CACHE_HIT, CACHE_MISS, CACHE_BYPASS, make_key, replay, set_cache_status
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,15 +20,22 @@ class BaseAgent(ABC):
     所有Agent都应该继承此类并实现必要的方法
     """
     
-    def __init__(self, llm_service, config: Optional[Dict[str, Any]] = None):
+    # LLM 路由名称（llm.routes 中按任务选择模型，未配置时使用默认模型），可通过 config['llm_route'] 覆盖
+    default_route: Optional[str] = None
+    
+    def __init__(self, llm_service, config: Optional[Dict[str, Any]] = None,
+                 response_cache: Optional[ResponseCache] = None):
         """初始化Agent
         
         Args:
             llm_service: LLM服务实例
             config: Agent配置（可选）
+            response_cache: 响应缓存（可选，传入后低温度的相同请求直接返回缓存结果）
         """
         self.llm_service = llm_service
         self.config = config or {}
+        self.llm_route = self.config.get('llm_route', self.default_route)
+        self.response_cache = response_cache
         self.logger = logger
     
     @property
@@ -74,17 +85,32 @@ class BaseAgent(ABC):
         """
         return output_text
     
+    def _get_model_name(self) -> str:
+        """获取当前路由的模型名称（用于缓存键）"""
+        get_route_model = getattr(self.llm_service, 'get_route_model', None)
+        if get_route_model is not None:
+            return get_route_model(self.llm_route) or ''
+        get_provider_info = getattr(self.llm_service, 'get_provider_info', None)
+        if get_provider_info is None:
+            return ''
+        return get_provider_info().get('model') or ''
+    
     async def generate(
         self, 
         input_text: str, 
         stream: bool = False,
+        use_cache: bool = True,
         **kwargs
     ) -> Union[str, AsyncIterator[str]]:
         """生成响应
         
+        配置了响应缓存且温度不高于缓存阈值时，相同请求直接返回缓存结果（流式请求按块回放），
+        本次调用的缓存状态可通过 response_cache.get_cache_status() 获取。
+        
         Args:
             input_text: 输入文本
             stream: 是否使用流式输出
+            use_cache: 是否允许使用响应缓存（False 时强制重新生成并刷新缓存）
             **kwargs: 其他参数（如temperature, max_tokens等）
             
         Returns:
@@ -107,6 +133,22 @@ class BaseAgent(ABC):
             **kwargs  # 允许调用时覆盖配置
         }
         
+        # 响应缓存（只缓存低温度的确定性调用）
+        cache_key = None
+        if self.response_cache is not None and self.response_cache.is_cacheable(generation_config):
+            cache_key = make_key(
+                generation_config.get('model') or self._get_model_name(),
+                system_prompt, processed_input, generation_config
+            )
+            cached = self.response_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                set_cache_status(CACHE_HIT)
+                self.logger.info(f"[{self.name}] 命中响应缓存，流式={stream}, 长度={len(cached)}")
+                return replay(cached) if stream else self.postprocess_output(cached)
+            set_cache_status(CACHE_MISS)
+        else:
+            set_cache_status(CACHE_BYPASS if self.response_cache is not None else None)
+        
         self.logger.info(f"[{self.name}] 开始生成，流式={stream}")
         
         try:
@@ -119,6 +161,7 @@ class BaseAgent(ABC):
                         user_message=processed_input,
                         system_prompt=system_prompt,
                         stream=True,
+                        route=self.llm_route,
                         **generation_config
                     )
                     
@@ -126,8 +169,10 @@ class BaseAgent(ABC):
                         accumulated += chunk
                         yield chunk
                     
-                    # 记录完整输出
+                    # 记录完整输出（完整生成后才写入缓存）
                     self.logger.info(f"[{self.name}] 流式生成完成，总长度={len(accumulated)}")
+                    if cache_key:
+                        self.response_cache.put(cache_key, accumulated)
                 
                 return stream_with_postprocess()
             else:
@@ -136,8 +181,11 @@ class BaseAgent(ABC):
                     user_message=processed_input,
                     system_prompt=system_prompt,
                     stream=False,
+                    route=self.llm_route,
                     **generation_config
                 )
+                if cache_key:
+                    self.response_cache.put(cache_key, response)
                 
                 # 后处理输出
                 processed_output = self.postprocess_output(response)
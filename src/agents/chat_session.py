@@ -0,0 +1,222 @@
+"""
+智能助手对话会话
+
+功能：
+- 每个对话一个会话对象，保存对话历史、早期对话摘要、对应的记录ID和用户信息
+- 会话以对话ID（即保存后的记录ID）为键，内存中按最近使用保留有限数量（LRU）
+- 不在内存中的对话在访问时从已保存的消息（或早期版本记录的 metadata）中重建
+- 同一对话的轮次通过会话锁串行执行，不同对话可以并行
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from src.core.logger import get_logger
+
+logger = get_logger("ChatSession")
+
+# 智能助手记录的应用类型
+SMART_CHAT_APP_TYPE = 'smart-chat'
+
+
+class ChatSession:
+    """单个对话的状态"""
+
+    def __init__(self, conversation_id: Optional[str] = None):
+        """初始化会话
+
+        Args:
+            conversation_id: 对话ID（记录ID），新对话在首次保存前为 None
+        """
+        self.conversation_id = conversation_id
+        # 完整历史用于保存记录，已并入摘要的早期消息不再发送给模型
+        self.history: List[Dict[str, Any]] = []
+        self.history_summary: Optional[str] = None
+        self.summarized_count = 0
+        self.last_context_stats: Dict[str, Any] = {}
+        self.user_id: Optional[str] = None
+        self.device_id: Optional[str] = None
+        self.started_at = time.time()
+        self.use_knowledge = True
+        self.lock = asyncio.Lock()
+        
+        # 持久化状态：已写入消息表的消息数；已进入全文检索的消息数；记录投影（metadata）是否需要刷新
+        self.persisted_count = 0
+        self.indexed_count = 0
+        self.projection_dirty = False
+        self.projection_task: Optional[asyncio.Task] = None
+
+    @property
+    def record_id(self) -> Optional[str]:
+        """对话对应的记录ID（与对话ID相同）"""
+        return self.conversation_id
+
+    def add_message(self, role: str, content: str):
+        """追加一条消息
+
+        Args:
+            role: 角色（user/assistant）
+            content: 消息内容
+        """
+        timestamp = int(time.time() * 1000)
+        if self.history and timestamp <= self.history[-1]['timestamp']:
+            timestamp = self.history[-1]['timestamp'] + 1
+        self.history.append({
+            'id': str(timestamp),
+            'role': role,
+            'content': content,
+            'timestamp': timestamp
+        })
+
+    def set_user_info(self, user_id: Optional[str], device_id: Optional[str]):
+        """设置用户信息（用于保存记录）"""
+        if user_id:
+            self.user_id = user_id
+        if device_id:
+            self.device_id = device_id
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any],
+                    messages: Optional[List[Dict[str, Any]]] = None) -> 'ChatSession':
+        """从已保存的记录重建会话
+        
+        Args:
+            record: 对话记录
+            messages: 消息表中的消息（为空时使用记录 metadata 中的消息，之后首次保存会写入完整历史）
+        """
+        metadata = record.get('metadata') or {}
+        conversation_metadata = metadata.get('conversation_metadata') or {}
+        session = cls(record['id'])
+        session.persisted_count = len(messages or [])
+        session.use_knowledge = metadata.get('use_knowledge', True)
+        for i, msg in enumerate(messages or metadata.get('messages') or []):
+            timestamp = msg.get('timestamp') or i
+            session.history.append({
+                'id': str(msg.get('id') or timestamp),
+                'role': msg.get('role', 'user'),
+                'content': msg.get('content', ''),
+                'timestamp': timestamp
+            })
+        session.history_summary = conversation_metadata.get('history_summary')
+        session.summarized_count = min(conversation_metadata.get('summarized_count', 0), len(session.history))
+        # 已保存的消息都已在记录 text 或追加的索引中
+        session.indexed_count = len(session.history)
+        session.user_id = record.get('user_id')
+        session.device_id = record.get('device_id')
+        return session
+
+
+class ChatSessionStore:
+    """对话会话存储（内存 LRU + 记录持久化）"""
+
+    def __init__(self, storage_provider=None, max_sessions: int = 256,
+                 on_evict: Optional[Callable[[ChatSession], None]] = None):
+        """初始化会话存储
+
+        Args:
+            storage_provider: 存储服务实例（可选，用于按需加载已保存的对话）
+            max_sessions: 内存中保留的会话数上限
+            on_evict: 会话被淘汰后的回调（可选，用于刷新待写入的记录投影）
+        """
+        self.storage_provider = storage_provider
+        self.max_sessions = max(1, int(max_sessions))
+        self.on_evict = on_evict
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def create(self) -> ChatSession:
+        """创建新对话（首次保存后通过 register 加入存储）"""
+        return ChatSession()
+
+    def get(self, conversation_id: str) -> Optional[ChatSession]:
+        """获取对话会话，不在内存中时从记录加载
+
+        Args:
+            conversation_id: 对话ID（记录ID）
+
+        Returns:
+            会话对象；对话不存在或不是智能助手记录时返回 None
+        """
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is not None:
+                self._sessions.move_to_end(conversation_id)
+                self.hits += 1
+                return session
+
+        if not self.storage_provider:
+            return None
+        try:
+            record = self.storage_provider.get_record(conversation_id)
+        except Exception as e:
+            logger.error(f"[对话会话] 加载对话失败: {conversation_id}, 错误: {e}")
+            return None
+        if not record or record.get('app_type') != SMART_CHAT_APP_TYPE:
+            return None
+
+        get_chat_messages = getattr(self.storage_provider, 'get_chat_messages', None)
+        messages = get_chat_messages(conversation_id) if get_chat_messages else None
+        session = ChatSession.from_record(record, messages)
+        with self._lock:
+            # 并发加载同一对话时以先加入的为准
+            session = self._sessions.setdefault(conversation_id, session)
+            self._sessions.move_to_end(conversation_id)
+            self.loads += 1
+            evicted = self._evict()
+        self._notify_evicted(evicted)
+        logger.info(f"[对话会话] 从记录恢复对话: {conversation_id}, 消息数: {len(session.history)}")
+        return session
+
+    def register(self, session: ChatSession):
+        """加入已有对话ID的会话（新对话首次保存后调用）"""
+        if not session.conversation_id:
+            return
+        with self._lock:
+            self._sessions[session.conversation_id] = session
+            self._sessions.move_to_end(session.conversation_id)
+            evicted = self._evict()
+        self._notify_evicted(evicted)
+
+    def discard(self, conversation_id: str) -> bool:
+        """从内存中移除对话（已保存的记录不受影响）
+
+        Returns:
+            对话是否在内存中
+        """
+        with self._lock:
+            return self._sessions.pop(conversation_id, None) is not None
+
+    def _evict(self) -> List[ChatSession]:
+        # 调用方持有 self._lock；被淘汰的会话已保存到记录，下次访问时重新加载
+        evicted = []
+        while len(self._sessions) > self.max_sessions:
+            evicted.append(self._sessions.popitem(last=False)[1])
+            self.evictions += 1
+        return evicted
+
+    def _notify_evicted(self, evicted: List[ChatSession]):
+        # 在锁外回调，回调中可能写数据库
+        if not self.on_evict:
+            return
+        for session in evicted:
+            try:
+                self.on_evict(session)
+            except Exception as e:
+                logger.error(f"[对话会话] 淘汰回调失败: {session.conversation_id}, 错误: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'hits': self.hits,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,181 @@
+"""
+对话上下文构建
+
+功能：
+- 按 Token 计数：优先使用 tiktoken 编码器（进程内只加载一次），未安装时按字符估算；文本计数结果有 LRU 缓存
+- 在预算内打包上下文：系统提示词和本轮用户消息必选，其次是知识库片段（按检索顺序），
+  剩余预算从最新一轮开始向前填入对话历史
+- 超出预算或轮数上限的早期对话作为“被淘汰轮次”返回，由调用方并入历史摘要
+- 历史以真实的 user / assistant 角色消息发送；系统提示词与历史在前、每轮变化的知识库内容在最后一条
+  用户消息中，保证请求前缀稳定，便于服务端的提示词缓存命中
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 未配置上下文长度时的默认值
+DEFAULT_MAX_CONTEXT_TOKENS = 8192
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """加载 tiktoken 编码器（进程内只加载一次，加载失败时返回 None）"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        return None
+
+
+def _estimate_tokens(text: str) -> int:
+    """估算 Token 数：CJK 等非 ASCII 字符约 1 个 Token，ASCII 约 4 个字符 1 个 Token"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """计算文本的 Token 数（结果缓存）"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return _estimate_tokens(text)
+
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    """计算单条消息的 Token 数（含格式开销）"""
+    return count_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+class BuiltContext:
+    """上下文构建结果"""
+
+    def __init__(self, messages: List[Dict[str, str]], evicted: List[Dict[str, str]],
+                 stats: Dict[str, Any]):
+        self.messages = messages
+        self.evicted = evicted
+        self.stats = stats
+
+
+class ContextBuilder:
+    """按 Token 预算构建对话上下文"""
+
+    def __init__(self, max_context_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS,
+                 max_history_turns: int = 10, knowledge_ratio: float = 0.4):
+        """初始化上下文构建器
+
+        Args:
+            max_context_tokens: 模型上下文长度（输入 + 输出）
+            max_history_turns: 最多保留的对话轮数
+            knowledge_ratio: 知识库内容最多占输入预算的比例
+        """
+        self.max_context_tokens = max(1, int(max_context_tokens))
+        self.max_history_turns = max(0, int(max_history_turns))
+        self.knowledge_ratio = float(knowledge_ratio)
+
+    def build(
+        self,
+        system_prompt: str,
+        user_message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        knowledge_chunks: Optional[List[str]] = None,
+        knowledge_template: str = '{knowledge_content}',
+        history_summary: Optional[str] = None,
+        history_summary_template: str = '{summary}',
+        max_output_tokens: int = 2000,
+    ) -> BuiltContext:
+        """构建消息列表
+
+        Args:
+            system_prompt: 系统提示词
+            user_message: 本轮用户消息
+            history: 对话历史（按时间顺序的 user / assistant 消息）
+            knowledge_chunks: 知识库片段（按相关度排序）
+            knowledge_template: 知识库内容模板（含 {knowledge_content}）
+            history_summary: 早期对话摘要
+            history_summary_template: 摘要模板（含 {summary}）
+            max_output_tokens: 为输出预留的 Token 数
+
+        Returns:
+            BuiltContext：messages 为发送给模型的消息，evicted 为未能放入的早期历史消息
+        """
+        history = history or []
+        budget = self.max_context_tokens - max(0, int(max_output_tokens or 0))
+
+        system_content = system_prompt
+        if history_summary:
+            system_content = system_prompt.rstrip() + '\n' + history_summary_template.format(summary=history_summary)
+        system_message = {'role': 'system', 'content': system_content}
+        used = count_message_tokens(system_message) + count_message_tokens({'content': user_message})
+
+        # 知识库片段：按检索顺序整段放入，不超过知识库预算
+        knowledge_budget = max(0, int((budget - used) * self.knowledge_ratio))
+        wrapper_tokens = count_tokens(knowledge_template.format(knowledge_content=''))
+        selected_chunks: List[str] = []
+        knowledge_used = 0
+        for chunk in knowledge_chunks or []:
+            chunk_tokens = count_tokens(chunk) + 1
+            if wrapper_tokens + knowledge_used + chunk_tokens > knowledge_budget:
+                break
+            selected_chunks.append(chunk)
+            knowledge_used += chunk_tokens
+        if selected_chunks:
+            knowledge_used += wrapper_tokens
+        used += knowledge_used
+
+        # 对话历史：从最新一轮开始向前填入
+        turns = self._split_turns(history)
+        kept_turns: List[List[Dict[str, str]]] = []
+        for turn in reversed(turns):
+            if len(kept_turns) >= self.max_history_turns:
+                break
+            turn_tokens = sum(count_message_tokens(message) for message in turn)
+            if used + turn_tokens > budget:
+                break
+            kept_turns.append(turn)
+            used += turn_tokens
+        kept_turns.reverse()
+        evicted = [message for turn in turns[:len(turns) - len(kept_turns)] for message in turn]
+
+        final_user = user_message
+        if selected_chunks:
+            knowledge_text = knowledge_template.format(knowledge_content='\n'.join(selected_chunks))
+            final_user = knowledge_text + '\n' + user_message
+
+        messages = [system_message]
+        for turn in kept_turns:
+            messages.extend({'role': message['role'], 'content': message['content']} for message in turn)
+        messages.append({'role': 'user', 'content': final_user})
+
+        stats = {
+            'budget_tokens': budget,
+            'used_tokens': used,
+            'history_turns': len(kept_turns),
+            'evicted_turns': len(turns) - len(kept_turns),
+            'knowledge_chunks': len(selected_chunks),
+            'dropped_knowledge_chunks': len(knowledge_chunks or []) - len(selected_chunks),
+        }
+        return BuiltContext(messages, evicted, stats)
+
+    @staticmethod
+    def _split_turns(history: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+        """将历史按轮次分组（每轮从一条 user 消息开始）"""
+        turns: List[List[Dict[str, str]]] = []
+        for message in history:
+            if message.get('role') == 'user' or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+        return turns
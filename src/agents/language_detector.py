@@ -0,0 +1,173 @@
+"""
+语言检测
+
+功能：
+- 预先构建 Unicode 区间查找表，每段文本只需一次 str.translate 即可得到逐字符的文字类别
+- 检测结果附带置信度（判定语言的字符占全部文字字符的比例）
+- 混合语言文本（如中英夹杂）按语言切分为连续片段
+- 批量检测可选使用 NumPy 对所有文本的码位一次性向量化统计（未安装时逐条检测）
+
+判定规则与 TranslationAgent 原有的字符统计法一致：
+汉字占全文长度 > 20% 判为中文；否则出现假名判为日文；否则出现韩文判为韩文；其余为英文。
+"""
+import re
+from typing import Dict, List, Sequence, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# 文字类别（查找表中的字符）
+OTHER, HAN, KANA, HANGUL, LATIN = ' ', 'h', 'k', 'g', 'l'
+CLASSES = (OTHER, HAN, KANA, HANGUL, LATIN)
+
+# Unicode 区间 → 文字类别（区间为闭区间）
+SCRIPT_RANGES = (
+    (0x4E00, 0x9FA5, HAN),      # CJK 统一汉字
+    (0x3040, 0x309F, KANA),     # 平假名
+    (0x30A0, 0x30FF, KANA),     # 片假名
+    (0xAC00, 0xD7AF, HANGUL),   # 韩文音节
+    (0x0041, 0x005A, LATIN),    # A-Z
+    (0x0061, 0x007A, LATIN),    # a-z
+    (0x00C0, 0x00D6, LATIN),    # 带变音符号的拉丁字母
+    (0x00D8, 0x00F6, LATIN),
+    (0x00F8, 0x024F, LATIN),
+)
+
+# 文字类别 → 语言代码
+CLASS_LANGUAGES = {HAN: 'zh', KANA: 'ja', HANGUL: 'ko', LATIN: 'en'}
+
+DEFAULT_LANGUAGE = 'en'
+
+# 汉字占全文长度超过该比例判为中文
+HAN_RATIO_THRESHOLD = 0.2
+
+
+def _build_table() -> str:
+    """构建 BMP 码位 → 文字类别的查找表（str.translate 使用，超出 BMP 的字符保持不变）"""
+    table = [OTHER] * 0x10000
+    for start, end, cls in SCRIPT_RANGES:
+        table[start:end + 1] = [cls] * (end - start + 1)
+    return ''.join(table)
+
+
+_TABLE = _build_table()
+
+# NumPy 查找表：码位 → 类别序号（CLASSES 中的下标）
+if NUMPY_AVAILABLE:
+    _NP_TABLE = np.array([CLASSES.index(cls) for cls in _TABLE], dtype=np.int64)
+
+_RUN_RE = re.compile(r'h+|k+|g+|l+')
+
+
+def classify(text: str) -> str:
+    """将文本逐字符映射为文字类别（返回与原文等长的类别字符串）"""
+    return text.translate(_TABLE)
+
+
+def count_scripts(text: str) -> Dict[str, int]:
+    """统计各文字类别的字符数"""
+    classes = classify(text)
+    return {cls: classes.count(cls) for cls in (HAN, KANA, HANGUL, LATIN)}
+
+
+def _decide(counts: Dict[str, int], length: int) -> Tuple[str, float]:
+    """根据各类别字符数判定语言并计算置信度"""
+    letters = counts[HAN] + counts[KANA] + counts[HANGUL] + counts[LATIN]
+
+    if counts[HAN] / length > HAN_RATIO_THRESHOLD:
+        lang, matched = 'zh', counts[HAN]
+    elif counts[KANA] > 0:
+        # 日文中的汉字也计入日文
+        lang, matched = 'ja', counts[KANA] + counts[HAN]
+    elif counts[HANGUL] > 0:
+        lang, matched = 'ko', counts[HANGUL]
+    else:
+        lang, matched = DEFAULT_LANGUAGE, counts[LATIN]
+
+    return lang, round(matched / letters, 4) if letters else 0.0
+
+
+def detect(text: str) -> Tuple[str, float]:
+    """检测文本语言
+
+    Args:
+        text: 待检测文本
+
+    Returns:
+        (语言代码, 置信度)，空文本返回 ('en', 0.0)
+    """
+    if not text or not text.strip():
+        return DEFAULT_LANGUAGE, 0.0
+    return _decide(count_scripts(text), len(text))
+
+
+def detect_batch(texts: Sequence[str]) -> List[Tuple[str, float]]:
+    """批量检测文本语言
+
+    安装了 NumPy 时，所有文本的码位拼接为一个数组，一次查表、一次 bincount 得到每条文本的各类别字符数。
+
+    Args:
+        texts: 待检测文本列表
+
+    Returns:
+        与输入顺序一致的 (语言代码, 置信度) 列表
+    """
+    if not NUMPY_AVAILABLE or len(texts) < 2:
+        return [detect(text) for text in texts]
+
+    count = len(texts)
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=count)
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+    # 超出 BMP 的码位统一映射到 U+FFFF（类别为 OTHER）
+    classes = _NP_TABLE[np.minimum(codes, 0xFFFF)]
+    owners = np.repeat(np.arange(count, dtype=np.int64), lengths)
+    counts = np.bincount(owners * len(CLASSES) + classes, minlength=count * len(CLASSES))
+    counts = counts.reshape(count, len(CLASSES)).tolist()
+
+    results = []
+    for text, row in zip(texts, counts):
+        if not text.strip():
+            results.append((DEFAULT_LANGUAGE, 0.0))
+            continue
+        results.append(_decide(dict(zip(CLASSES, row)), len(text)))
+    return results
+
+
+def segment(text: str) -> List[Tuple[str, str]]:
+    """将混合语言文本按语言切分
+
+    空白、数字和标点归入前一个片段，各片段按顺序拼接后与原文完全一致。
+    含假名的文本中，汉字视为日文汉字。
+
+    Args:
+        text: 待切分文本
+
+    Returns:
+        [(语言代码, 片段文本), ...]，空文本返回空列表
+    """
+    if not text:
+        return []
+
+    classes = classify(text)
+    if KANA in classes:
+        classes = classes.replace(HAN, KANA)
+
+    runs: List[Tuple[str, int]] = []
+    for match in _RUN_RE.finditer(classes):
+        cls = classes[match.start()]
+        if not runs or runs[-1][0] != cls:
+            runs.append((cls, match.start()))
+
+    if not runs:
+        return [(DEFAULT_LANGUAGE, text)]
+
+    segments = []
+    for i, (cls, start) in enumerate(runs):
+        begin = 0 if i == 0 else start
+        end = runs[i + 1][1] if i + 1 < len(runs) else len(text)
+        segments.append((CLASS_LANGUAGES[cls], text[begin:end]))
+    return segments
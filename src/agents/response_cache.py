@@ -0,0 +1,127 @@
+"""
+Agent 响应缓存
+
+功能：
+- 缓存确定性（低温度）Agent 调用的完整响应，相同请求不再重复调用 LLM（也不再计费）
+- 缓存键为 (模型, 系统提示词哈希, 输入哈希, 生成参数)，提示词或参数变化后自然失效
+- 容量有限的 LRU 淘汰 + TTL 过期，超长响应不缓存
+- 流式请求命中时按块回放缓存内容，与实时生成使用同一 AsyncIterator 接口
+- 最近一次调用的缓存状态（hit / miss / bypass）写入当前上下文，供 API 在响应中返回
+
+缓存为可选功能：只有创建 Agent 时传入 ResponseCache 实例才会生效（见 config.yml 中的 llm.response_cache）。
+"""
+import hashlib
+import json
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Optional
+
+from src.providers.storage.identity_cache import LRUTTLCache, _MISSING
+
+# 缓存状态
+CACHE_HIT = 'hit'
+CACHE_MISS = 'miss'
+CACHE_BYPASS = 'bypass'
+
+# 流式回放每块的字符数
+REPLAY_CHUNK_CHARS = 32
+
+_last_status: ContextVar[Optional[str]] = ContextVar('agent_cache_status', default=None)
+
+
+def get_cache_status() -> Optional[str]:
+    """获取当前上下文中最近一次 Agent 调用的缓存状态（未使用缓存时返回 None）"""
+    return _last_status.get()
+
+
+def set_cache_status(status: Optional[str]):
+    """设置当前上下文的缓存状态"""
+    _last_status.set(status)
+
+
+def make_key(model: str, system_prompt: str, input_text: str, params: Dict[str, Any]) -> str:
+    """生成缓存键
+
+    Args:
+        model: 模型名称
+        system_prompt: 系统提示词
+        input_text: 预处理后的输入
+        params: 生成参数（temperature、max_tokens 等）
+
+    Returns:
+        缓存键（十六进制摘要）
+    """
+    prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    input_hash = hashlib.sha256(input_text.encode('utf-8')).hexdigest()
+    params_text = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    raw = '\x1f'.join([model or '', prompt_hash, input_hash, params_text])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+async def replay(text: str, chunk_chars: int = REPLAY_CHUNK_CHARS) -> AsyncIterator[str]:
+    """按块回放缓存的响应（流式接口）"""
+    for start in range(0, len(text), chunk_chars):
+        yield text[start:start + chunk_chars]
+
+
+class ResponseCache:
+    """Agent 响应缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: float = 3600,
+                 max_temperature: float = 0.3, max_entry_chars: int = 50000):
+        """初始化响应缓存
+
+        Args:
+            max_entries: 缓存条目上限（超出后淘汰最久未使用的）
+            ttl_seconds: 条目过期时间（秒）
+            max_temperature: 允许缓存的最高温度（温度更高的调用结果不确定，不缓存）
+            max_entry_chars: 单条响应的最大字符数（更长的响应不缓存）
+        """
+        self.max_temperature = float(max_temperature)
+        self.max_entry_chars = max(1, int(max_entry_chars))
+        self._cache = LRUTTLCache(max_entries, ttl_seconds)
+        self.stores = 0
+        self.bypasses = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'ResponseCache':
+        """根据配置（config.yml 中的 llm.response_cache）创建缓存"""
+        config = config or {}
+        return cls(
+            max_entries=config.get('max_entries', 500),
+            ttl_seconds=config.get('ttl_seconds', 3600),
+            max_temperature=config.get('max_temperature', 0.3),
+            max_entry_chars=config.get('max_entry_chars', 50000),
+        )
+
+    def is_cacheable(self, params: Dict[str, Any]) -> bool:
+        """判断该生成参数下的调用是否可以缓存"""
+        temperature = params.get('temperature')
+        if temperature is None or temperature > self.max_temperature:
+            self.bypasses += 1
+            return False
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存的响应（未命中或已过期时返回 None）"""
+        value = self._cache.get(key)
+        return None if value is _MISSING else value
+
+    def put(self, key: str, response: str):
+        """写入响应（空响应和超长响应不缓存）"""
+        if not response or len(response) > self.max_entry_chars:
+            return
+        self._cache.set(key, response)
+        self.stores += 1
+
+    def clear(self):
+        self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中率等指标"""
+        stats = self._cache.get_stats()
+        stats.update({
+            'max_temperature': self.max_temperature,
+            'stores': self.stores,
+            'bypasses': self.bypasses,
+        })
+        return stats
@@ -4,23 +4,30 @@ SmartChat Agent
 智能对话助手，支持上下文记忆和知识库检索增强(RAG)
 """
 from typing import AsyncIterator, Union, Optional, Dict, Any, List
+import asyncio
 import uuid
 import json
 from datetime import datetime
 from .base_agent import BaseAgent
+from .chat_session import ChatSession, ChatSessionStore, SMART_CHAT_APP_TYPE
+from .context_builder import ContextBuilder, BuiltContext, DEFAULT_MAX_CONTEXT_TOKENS
 from .prompts import PromptLoader
+from src.providers.storage.chat_messages import render_chat_text
 
 
 class SmartChatAgent(BaseAgent):
     """SmartChat 智能对话 Agent
     
     功能：
-    - 多轮对话管理（上下文记忆）
+    - 多轮对话管理（上下文记忆），每个对话独立的会话状态，不同对话可并行
+    - 按 Token 预算打包上下文，超出预算的早期对话并入摘要
     - 知识库检索增强（RAG）
     - 多种对话模式（简洁/专业/创意）
     - 支持流式和非流式输出
     """
     
+    default_route = 'chat'
+    
     def __init__(
         self, 
         llm_service, 
@@ -66,16 +73,23 @@ class SmartChatAgent(BaseAgent):
         prompt_params = self.prompt_config.get('parameters', {})
         self.config = {**prompt_params, **(config or {})}
         
-        # 对话历史管理
-        self.conversation_history: List[Dict[str, str]] = []
+        # 对话会话（按对话ID保存历史，内存中保留最近使用的对话，其余按需从记录加载）
         self.max_history_turns = config.get('max_history_turns', 10) if config else 10
+        self.sessions = ChatSessionStore(storage_provider, max_sessions=self.config.get('max_sessions', 256),
+                                         on_evict=self._on_session_evicted)
+        
+        # 对话持久化：每轮只追加新消息（全文检索随之增量更新），记录的 metadata 投影在对话空闲后刷新
+        self.projection_delay = float(self.config.get('projection_delay_seconds', 5.0))
+        self._pending_projections: Dict[str, ChatSession] = {}
+        self.projection_writes = 0
         
-        # 当前对话会话
-        self.current_record_id: Optional[str] = None
-        self.session_start_time: Optional[float] = None
-        self.use_knowledge: bool = True
-        self.user_id: Optional[str] = None
-        self.device_id: Optional[str] = None
+        # 上下文构建器（预算来自 config 或 llm.max_context_tokens）
+        self.context_builder = ContextBuilder(
+            max_context_tokens=self._resolve_max_context_tokens(),
+            max_history_turns=self.max_history_turns,
+            knowledge_ratio=self.config.get('knowledge_ratio', 0.4)
+        )
+
     
     @property
     def name(self) -> str:
@@ -92,40 +106,111 @@ class SmartChatAgent(BaseAgent):
         """
         return self.prompt_config['system_prompt']
     
-    def add_to_history(self, role: str, content: str):
-        """添加消息到对话历史
+    def _resolve_max_context_tokens(self) -> int:
+        """获取上下文长度：Agent 配置优先，其次为 LLM 路由中的 max_context_tokens"""
+        if self.config.get('max_context_tokens'):
+            return int(self.config['max_context_tokens'])
+        get_provider_info = getattr(self.llm_service, 'get_provider_info', None)
+        if get_provider_info is not None:
+            max_context_tokens = get_provider_info(self.llm_route).get('max_context_tokens')
+            if max_context_tokens:
+                return int(max_context_tokens)
+        return DEFAULT_MAX_CONTEXT_TOKENS
+    
+    def get_session(self, conversation_id: Optional[str] = None) -> Optional[ChatSession]:
+        """获取对话会话
         
         Args:
-            role: 角色（user/assistant）
-            content: 消息内容
+            conversation_id: 对话ID（记录ID），为空时创建新对话
+            
+        Returns:
+            会话对象；指定的对话不存在时返回 None
         """
-        self.conversation_history.append({
-            'role': role,
-            'content': content
-        })
-        
-        # 限制历史长度（保留最近的N轮对话）
-        if len(self.conversation_history) > self.max_history_turns * 2:
-            # 每轮对话包含 user + assistant 两条消息
-            self.conversation_history = self.conversation_history[-(self.max_history_turns * 2):]
-            self.logger.info(f"[{self.name}] 对话历史已截断，保留最近 {self.max_history_turns} 轮")
+        if not conversation_id:
+            return self.sessions.create()
+        return self.sessions.get(conversation_id)
     
-    def clear_history(self):
-        """清空对话历史"""
-        self.conversation_history = []
-        self.current_record_id = None
-        self.session_start_time = None
-        self.logger.info(f"[{self.name}] 对话历史已清空")
+    def clear_history(self, conversation_id: str) -> bool:
+        """结束对话：从内存中移除会话（已保存的记录保留，之后的消息开始新对话）
+        
+        Args:
+            conversation_id: 对话ID
+            
+        Returns:
+            对话是否在内存中
+        """
+        removed = self.sessions.discard(conversation_id)
+        pending = self._pending_projections.get(conversation_id)
+        if pending is not None:
+            self.flush_projection(pending)
+        self.logger.info(f"[{self.name}] 对话已结束: {conversation_id}")
+        return removed
+    
+    def _on_session_evicted(self, session: ChatSession):
+        """会话被淘汰出内存时刷新待写入的记录投影"""
+        if session.record_id in self._pending_projections:
+            self.flush_projection(session)
     
-    def set_user_info(self, user_id: str, device_id: str):
-        """设置用户信息（用于保存记录）"""
-        self.user_id = user_id
-        self.device_id = device_id
+    def _build_projection(self, session: ChatSession) -> Dict[str, Any]:
+        """生成对话记录的 metadata 投影
+        
+        消息本身保存在消息表中（读取记录时补齐），投影只包含对话统计，大小与对话长度无关。
+        
+        Args:
+            session: 对话会话
+            
+        Returns:
+            metadata
+        """
+        messages = session.history
+        
+        # 计算时间信息
+        first_msg = messages[0]
+        last_msg = messages[-1]
+        first_time = datetime.fromtimestamp(first_msg['timestamp'] / 1000).isoformat() + 'Z'
+        last_time = datetime.fromtimestamp(last_msg['timestamp'] / 1000).isoformat() + 'Z'
+        duration = (last_msg['timestamp'] - first_msg['timestamp']) / 1000
+        
+        # 生成对话标题（使用第一条用户消息）
+        title = messages[0]['content'][:30] + ('...' if len(messages[0]['content']) > 30 else '')
+        
+        # 构建 metadata
+        metadata = {
+            'conversation_metadata': {
+                'total_messages': len(messages),
+                'total_turns': len(messages) // 2,
+                'first_message_time': first_time,
+                'last_message_time': last_time,
+                'conversation_duration': duration,
+                'use_knowledge': session.use_knowledge,
+                'use_history': True,
+                'knowledge_top_k': 3,
+                'llm_provider': getattr(self.llm_service, 'provider', 'unknown'),
+                'llm_model': getattr(self.llm_service, 'model', 'unknown'),
+                'temperature': self.config.get('temperature', 0.7),
+                'max_tokens': self.config.get('max_tokens'),
+                'max_history_turns': self.max_history_turns,
+                'history_summary': session.history_summary,
+                'summarized_count': session.summarized_count,
+                'language': 'zh-CN',
+                'session_id': f"session-{datetime.fromtimestamp(session.started_at).strftime('%Y%m%d-%H%M%S')}",
+                'title': title
+            },
+            'message_count': len(messages),
+            'use_knowledge': session.use_knowledge,
+            'app_type': SMART_CHAT_APP_TYPE
+        }
+        
+        return metadata
     
-    async def save_conversation(self, use_knowledge: bool = True) -> Optional[str]:
-        """保存当前对话到数据库
+    async def save_conversation(self, session: ChatSession, use_knowledge: bool = True) -> Optional[str]:
+        """保存对话到数据库
+        
+        新对话创建记录（text 为首轮对话）；之后每轮只追加新消息并为其建立全文索引，
+        记录的 metadata 投影在对话空闲 projection_delay_seconds 后刷新一次。
         
         Args:
+            session: 对话会话
             use_knowledge: 是否使用了知识库
             
         Returns:
@@ -135,108 +220,109 @@ class SmartChatAgent(BaseAgent):
             self.logger.warn(f"[{self.name}] 存储服务未配置，无法保存对话")
             return None
         
-        if len(self.conversation_history) < 2:
+        if len(session.history) < 2:
             self.logger.warn(f"[{self.name}] 对话内容不足，无法保存")
             return None
         
+        session.use_knowledge = use_knowledge
         try:
-            # 构建 messages 数组
-            import time
-            base_timestamp = int(time.time() * 1000)
-            messages = []
-            for i, msg in enumerate(self.conversation_history):
-                messages.append({
-                    'id': str(base_timestamp + i),
-                    'role': msg['role'],
-                    'content': msg['content'],
-                    'timestamp': base_timestamp + i
-                })
-            
-            # 计算时间信息
-            first_msg = messages[0]
-            last_msg = messages[-1]
-            first_time = datetime.fromtimestamp(first_msg['timestamp'] / 1000).isoformat() + 'Z'
-            last_time = datetime.fromtimestamp(last_msg['timestamp'] / 1000).isoformat() + 'Z'
-            duration = (last_msg['timestamp'] - first_msg['timestamp']) / 1000
-            
-            # 生成对话标题（使用第一条用户消息）
-            title = messages[0]['content'][:30] + ('...' if len(messages[0]['content']) > 30 else '')
-            
-            # 构建 metadata
-            metadata = {
-                'messages': messages,
-                'conversation_metadata': {
-                    'total_messages': len(messages),
-                    'total_turns': len(messages) // 2,
-                    'first_message_time': first_time,
-                    'last_message_time': last_time,
-                    'conversation_duration': duration,
-                    'use_knowledge': use_knowledge,
-                    'use_history': True,
-                    'knowledge_top_k': 3,
-                    'llm_provider': getattr(self.llm_service, 'provider', 'unknown'),
-                    'llm_model': getattr(self.llm_service, 'model', 'unknown'),
-                    'temperature': self.config.get('temperature', 0.7),
-                    'max_tokens': self.config.get('max_tokens'),
-                    'max_history_turns': self.max_history_turns,
-                    'language': 'zh-CN',
-                    'session_id': f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
-                    'title': title
-                },
-                'message_count': len(messages),
-                'use_knowledge': use_knowledge,
-                'app_type': 'smart-chat'
-            }
-            
-            # 生成纯文本
-            text = '\n\n'.join([
-                f"[{'用户' if msg['role'] == 'user' else '助手'}] {datetime.fromtimestamp(msg['timestamp']/1000).strftime('%H:%M')}\n{msg['content']}"
-                for msg in messages
-            ])
-            
-            # 保存到数据库
-            if self.current_record_id:
-                # 更新已有记录
-                success = self.storage_provider.update_record(
-                    self.current_record_id,
-                    text=text,
-                    metadata=metadata,
-                    user_id=self.user_id,
-                    device_id=self.device_id
-                )
-                if success:
-                    self.logger.info(f"[{self.name}] ✅ 对话记录已更新: {self.current_record_id}")
-                    return self.current_record_id
-            else:
-                # 创建新记录
+            if not session.record_id:
+                # 创建新记录，记录ID即对话ID
                 record_id = self.storage_provider.save_record(
-                    text=text,
-                    metadata=metadata,
-                    user_id=self.user_id,
-                    device_id=self.device_id
+                    text=render_chat_text(session.history),
+                    metadata=self._build_projection(session),
+                    user_id=session.user_id,
+                    device_id=session.device_id
                 )
-                if record_id:
-                    self.current_record_id = record_id
-                    self.logger.info(f"[{self.name}] ✅ 对话记录已保存: {record_id}")
-                    return record_id
+                if not record_id:
+                    return None
+                session.conversation_id = record_id
+                session.indexed_count = len(session.history)
+                self.sessions.register(session)
+                self.logger.info(f"[{self.name}] ✅ 对话记录已保存: {record_id}")
+            else:
+                session.projection_dirty = True
             
-            return None
+            # 追加尚未写入的消息
+            new_messages = session.history[session.persisted_count:]
+            if new_messages:
+                self.storage_provider.append_chat_messages(session.record_id, session.persisted_count,
+                                                           new_messages, index_from=session.indexed_count)
+                session.persisted_count += len(new_messages)
+                session.indexed_count = max(session.indexed_count, session.persisted_count)
+            
+            if session.projection_dirty:
+                self._schedule_projection(session)
+            return session.record_id
             
         except Exception as e:
             self.logger.error(f"[{self.name}] ❌ 保存对话失败: {e}", exc_info=True)
             return None
     
-    def get_history_text(self) -> str:
+    def _schedule_projection(self, session: ChatSession):
+        """安排刷新记录投影（对话空闲 projection_delay_seconds 后写入，每轮重新计时）"""
+        if self.projection_delay <= 0:
+            self.flush_projection(session)
+            return
+        
+        self._pending_projections[session.record_id] = session
+        if session.projection_task is not None and not session.projection_task.done():
+            session.projection_task.cancel()
+        session.projection_task = asyncio.get_running_loop().create_task(self._delayed_projection(session))
+    
+    async def _delayed_projection(self, session: ChatSession):
+        await asyncio.sleep(self.projection_delay)
+        self.flush_projection(session)
+    
+    def flush_projection(self, session: ChatSession) -> bool:
+        """立即刷新对话记录的 metadata 投影
+        
+        Args:
+            session: 对话会话
+            
+        Returns:
+            是否写入了记录
+        """
+        self._pending_projections.pop(session.record_id, None)
+        task, session.projection_task = session.projection_task, None
+        if task is not None and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+        
+        if not session.projection_dirty or not session.record_id or not self.storage_provider:
+            return False
+        
+        session.projection_dirty = False
+        try:
+            success = self.storage_provider.update_chat_projection(session.record_id, self._build_projection(session))
+        except Exception as e:
+            session.projection_dirty = True
+            self.logger.error(f"[{self.name}] ❌ 刷新对话记录失败: {session.record_id}, 错误: {e}", exc_info=True)
+            return False
+        
+        if success:
+            self.projection_writes += 1
+            self.logger.info(f"[{self.name}] ✅ 对话记录已更新: {session.record_id}, 消息数: {len(session.history)}")
+        return success
+    
+    async def flush_all(self):
+        """刷新所有待更新的对话记录（服务关闭时调用）"""
+        for session in list(self._pending_projections.values()):
+            self.flush_projection(session)
+    
+    def get_history_text(self, session: ChatSession) -> str:
         """获取格式化的对话历史文本
         
+        Args:
+            session: 对话会话
+            
         Returns:
             格式化的历史文本
         """
-        if not self.conversation_history:
+        if not session.history:
             return ""
         
         history_lines = []
-        for msg in self.conversation_history:
+        for msg in session.history:
             role_name = "用户" if msg['role'] == 'user' else "助手"
             history_lines.append(f"{role_name}: {msg['content']}")
         
@@ -246,6 +332,42 @@ class SmartChatAgent(BaseAgent):
         template = self.prompt_config.get('conversation_history_template', "\n## 对话历史\n\n{history}\n---\n")
         return template.format(history=history_text)
     
+    def get_knowledge_template(self) -> str:
+        """获取知识库内容模板"""
+        return self.prompt_config.get('knowledge_context_template',
+                                      "\n## 相关知识库内容\n\n{knowledge_content}\n---\n")
+    
+    async def search_knowledge_chunks(
+        self,
+        query: str,
+        top_k: int = 3
+    ) -> List[str]:
+        """从知识库检索相关内容（每个结果格式化为一个片段）
+        
+        Args:
+            query: 查询文本
+            top_k: 返回前K个结果
+            
+        Returns:
+            按相关度排序的片段列表，没有结果或检索失败时返回空列表
+        """
+        if not self.knowledge_service:
+            return []
+        
+        try:
+            results = await self.knowledge_service.search(query, top_k=top_k)
+        except Exception as e:
+            self.logger.error(f"[{self.name}] 知识库检索失败: {e}")
+            return []
+        
+        chunks = []
+        for i, result in enumerate(results or [], 1):
+            source = result.get('source', '未知来源')
+            content = result.get('content', '')
+            score = result.get('score', 0.0)
+            chunks.append(f"### {i}. 来源: {source} (相关度: {score:.2f})\n{content}\n")
+        return chunks
+    
     async def search_knowledge(
         self, 
         query: str, 
@@ -260,36 +382,73 @@ class SmartChatAgent(BaseAgent):
         Returns:
             格式化的知识库内容，如果没有结果返回None
         """
-        if not self.knowledge_service:
+        chunks = await self.search_knowledge_chunks(query, top_k=top_k)
+        if not chunks:
             return None
+        return self.get_knowledge_template().format(knowledge_content="\n".join(chunks))
+    
+    def build_context(
+        self,
+        session: ChatSession,
+        user_message: str,
+        use_history: bool = True,
+        knowledge_chunks: Optional[List[str]] = None,
+        max_output_tokens: int = 2000
+    ) -> BuiltContext:
+        """按 Token 预算构建本轮发送给模型的消息
         
-        try:
-            results = await self.knowledge_service.search(query, top_k=top_k)
-            
-            if not results:
-                return None
-            
-            # 格式化知识库内容
-            knowledge_lines = []
-            for i, result in enumerate(results, 1):
-                source = result.get('source', '未知来源')
-                content = result.get('content', '')
-                score = result.get('score', 0.0)
-                
-                knowledge_lines.append(f"### {i}. 来源: {source} (相关度: {score:.2f})")
-                knowledge_lines.append(f"{content}")
-                knowledge_lines.append("")  # 空行
-            
-            knowledge_content = "\n".join(knowledge_lines)
-            
-            # 使用模板格式化
-            template = self.prompt_config.get('knowledge_context_template', 
-                                             "\n## 相关知识库内容\n\n{knowledge_content}\n---\n")
-            return template.format(knowledge_content=knowledge_content)
+        Args:
+            session: 对话会话
+            user_message: 预处理后的用户消息
+            use_history: 是否使用对话历史
+            knowledge_chunks: 知识库片段
+            max_output_tokens: 为输出预留的 Token 数
             
+        Returns:
+            BuiltContext（messages、被淘汰的早期历史、统计信息）
+        """
+        return self.context_builder.build(
+            system_prompt=self.get_system_prompt(),
+            user_message=user_message,
+            history=session.history[session.summarized_count:] if use_history else [],
+            knowledge_chunks=knowledge_chunks,
+            knowledge_template=self.get_knowledge_template(),
+            history_summary=session.history_summary if use_history else None,
+            history_summary_template=self.prompt_config.get('history_summary_template', '\n{summary}\n'),
+            max_output_tokens=max_output_tokens
+        )
+    
+    async def summarize_evicted(self, session: ChatSession, evicted: List[Dict[str, str]]):
+        """将超出上下文预算的早期对话并入历史摘要
+        
+        无论摘要是否成功，这些消息之后都不再发送给模型（完整历史仍保留用于保存记录）。
+        
+        Args:
+            session: 对话会话
+            evicted: 被淘汰的早期消息（按时间顺序）
+        """
+        if not evicted:
+            return
+        
+        dialogue = "\n".join(
+            f"{'用户' if msg['role'] == 'user' else '助手'}: {msg['content']}" for msg in evicted
+        )
+        user_message = f"【已有摘要】\n{session.history_summary or '（暂无）'}\n\n【早期对话】\n{dialogue}"
+        try:
+            summary = await self.llm_service.simple_chat(
+                user_message=user_message,
+                system_prompt=self.prompt_config.get('history_summary_prompt', '请将早期对话并入摘要。'),
+                stream=False,
+                temperature=0.3,
+                max_tokens=self.config.get('history_summary_max_tokens', 500),
+                route=self.llm_route
+            )
+            session.history_summary = summary.strip() or session.history_summary
+            self.logger.info(f"[{self.name}] 早期对话已并入摘要: {len(evicted)} 条消息, 摘要长度={len(session.history_summary or '')}")
         except Exception as e:
-            self.logger.error(f"[{self.name}] 知识库检索失败: {e}")
-            return None
+            self.logger.error(f"[{self.name}] 早期对话摘要失败，直接丢弃: {e}")
+        finally:
+            session.summarized_count += len(evicted)
     
     def preprocess_input(self, input_text: str) -> str:
         """预处理输入文本
@@ -320,6 +479,7 @@ class SmartChatAgent(BaseAgent):
         use_history: bool = True,
         use_knowledge: bool = True,
         knowledge_top_k: int = 3,
+        session: Optional[ChatSession] = None,
         **kwargs
     ) -> Union[str, AsyncIterator[str]]:
         """智能对话主方法
@@ -330,79 +490,110 @@ class SmartChatAgent(BaseAgent):
             use_history: 是否使用对话历史
             use_knowledge: 是否检索知识库
             knowledge_top_k: 知识库检索数量
+            session: 对话会话（通过 get_session 获取，为空时开始新对话）；
+                     回复完成并保存后 session.conversation_id 为对话ID
             **kwargs: 其他参数
             
         Returns:
             助手回复（字符串或流式迭代器）
         """
+        session = session or self.sessions.create()
+        
         # 1. 预处理用户输入
         user_message = self.preprocess_input(user_message)
         
-        # 2. 构建完整的输入
-        enhanced_input = user_message
+        if not self.llm_service or not self.llm_service.is_available():
+            raise RuntimeError(f"{self.name} 不可用：LLM服务未初始化")
         
-        # 2.1 添加对话历史
-        if use_history and self.conversation_history:
-            history_text = self.get_history_text()
-            enhanced_input = history_text + "\n" + enhanced_input
-        
-        # 2.2 检索并添加知识库内容
-        knowledge_text = None
+        # 2. 检索知识库
+        knowledge_chunks: List[str] = []
         if use_knowledge and self.knowledge_service:
-            knowledge_text = await self.search_knowledge(user_message, top_k=knowledge_top_k)
-            if knowledge_text:
-                enhanced_input = knowledge_text + "\n" + enhanced_input
-                self.logger.info(f"[{self.name}] 已添加知识库上下文")
+            knowledge_chunks = await self.search_knowledge_chunks(user_message, top_k=knowledge_top_k)
+        
+        generation_config = {
+            'temperature': self.config.get('temperature', 0.7),
+            'max_tokens': self.config.get('max_tokens', 2000),
+            **kwargs
+        }
+        
+        def prepare() -> BuiltContext:
+            # 3. 按 Token 预算构建上下文（历史以角色消息发送）
+            context = self.build_context(
+                session,
+                user_message,
+                use_history=use_history,
+                knowledge_chunks=knowledge_chunks,
+                max_output_tokens=generation_config.get('max_tokens') or 0
+            )
+            session.last_context_stats = context.stats
+            self.logger.info(f"[{self.name}] 开始生成回复，对话={session.conversation_id or '新对话'}，"
+                             f"历史={context.stats['history_turns']}轮（淘汰{context.stats['evicted_turns']}轮），"
+                             f"知识库片段={context.stats['knowledge_chunks']}，"
+                             f"输入≈{context.stats['used_tokens']}/{context.stats['budget_tokens']} tokens")
+            return context
         
-        # 3. 调用LLM生成回复
-        self.logger.info(f"[{self.name}] 开始生成回复，历史={len(self.conversation_history)//2}轮，知识库={'有' if knowledge_text else '无'}")
+        async def finish_turn(context: BuiltContext, response: str):
+            # 更新对话历史，早期轮次并入摘要
+            if use_history:
+                session.add_message('user', user_message)
+                session.add_message('assistant', response)
+                await self.summarize_evicted(session, context.evicted)
+            
+            # 自动保存对话
+            await self.save_conversation(session, use_knowledge=use_knowledge)
         
+        # 4. 调用LLM生成回复（同一对话的轮次串行执行）
         if stream:
             # 流式生成
             async def stream_chat():
-                accumulated = ""
-                result = await self.generate(enhanced_input, stream=True, **kwargs)
-                
-                async for chunk in result:
-                    accumulated += chunk
-                    yield chunk
-                
-                # 生成完成后，更新对话历史
-                if use_history:
-                    self.add_to_history('user', user_message)
-                    self.add_to_history('assistant', accumulated)
-                
-                # 自动保存对话
-                await self.save_conversation(use_knowledge=use_knowledge)
-                
+                async with session.lock:
+                    context = prepare()
+                    accumulated = ""
+                    result = await self.llm_service.chat(
+                        context.messages, stream=True, route=self.llm_route, **generation_config
+                    )
+                    
+                    async for chunk in result:
+                        accumulated += chunk
+                        yield chunk
+                    
+                    await finish_turn(context, accumulated)
                 self.logger.info(f"[{self.name}] 流式对话完成，回复长度={len(accumulated)}")
             
             return stream_chat()
         else:
             # 非流式生成
-            response = await self.generate(enhanced_input, stream=False, **kwargs)
-            
-            # 更新对话历史
-            if use_history:
-                self.add_to_history('user', user_message)
-                self.add_to_history('assistant', response)
-            
-            # 自动保存对话
-            await self.save_conversation(use_knowledge=use_knowledge)
-            
+            async with session.lock:
+                context = prepare()
+                response = await self.llm_service.chat(
+                    context.messages, stream=False, route=self.llm_route, **generation_config
+                )
+                response = self.postprocess_output(response)
+                
+                await finish_turn(context, response)
             self.logger.info(f"[{self.name}] 对话完成，回复长度={len(response)}")
             return response
     
-    def get_conversation_summary(self) -> Dict[str, Any]:
-        """获取当前对话状态摘要
+    def get_conversation_summary(self, session: Optional[ChatSession] = None) -> Dict[str, Any]:
+        """获取对话状态摘要
         
+        Args:
+            session: 对话会话（为空时只返回通用状态）
+            
         Returns:
             对话状态信息
         """
+        history = session.history if session else []
         return {
-            'total_turns': len(self.conversation_history) // 2,
-            'total_messages': len(self.conversation_history),
+            'conversation_id': session.conversation_id if session else None,
+            'total_turns': len(history) // 2,
+            'total_messages': len(history),
             'has_knowledge_service': self.knowledge_service is not None,
-            'max_history_turns': self.max_history_turns
+            'max_history_turns': self.max_history_turns,
+            'summarized_messages': session.summarized_count if session else 0,
+            'has_history_summary': bool(session and session.history_summary),
+            'last_context': session.last_context_stats if session else {},
+            'sessions': self.sessions.get_stats(),
+            'pending_projections': len(self._pending_projections),
+            'projection_writes': self.projection_writes
         }
-
@@ -3,9 +3,11 @@
 
 专门用于生成会议记录和笔记的结构化小结
 """
-from typing import AsyncIterator, Union, Optional, Dict, Any
+from typing import AsyncIterator, Union, Optional, Dict, Any, List
+import asyncio
 import re
 from .base_agent import BaseAgent
+from .response_cache import ResponseCache
 from .prompts import PromptLoader
 
 
@@ -17,20 +19,32 @@ class SummaryAgent(BaseAgent):
     - 生成结构化、易读的小结
     - 使用emoji作为视觉标记
     - 支持流式和非流式输出
+    - 长记录分段并发小结后合并（map-reduce）
+    - 录音过程中按新增语句增量更新小结（滚动小结）
     """
     
+    default_route = 'summary'
+    
     # 小结块的标记（用于识别和过滤）
     SUMMARY_MARKER_START = "[SUMMARY_BLOCK_START]"
     SUMMARY_MARKER_END = "[SUMMARY_BLOCK_END]"
     
-    def __init__(self, llm_service, config: Optional[Dict[str, Any]] = None):
+    # 笔记内容标记（之前的笔记信息作为每一段的上下文）
+    NOTE_CONTENT_MARKER = "【笔记内容】"
+    
+    # 超长的单条 utterance 按句末标点切分
+    _SENTENCE_END_RE = re.compile(r'(?<=[。！？!?；;.])')
+    
+    def __init__(self, llm_service, config: Optional[Dict[str, Any]] = None,
+                 response_cache: Optional[ResponseCache] = None):
         """初始化SummaryAgent
         
         Args:
             llm_service: LLM服务实例
             config: Agent配置（可选）
+            response_cache: 响应缓存（可选，相同内容、场景和参数的小结直接复用）
         """
-        super().__init__(llm_service, config)
+        super().__init__(llm_service, config, response_cache=response_cache)
         
         # 加载提示词配置
         self.prompt_config = PromptLoader.load('summary_agent')
@@ -125,6 +139,220 @@ class SummaryAgent(BaseAgent):
         
         return cleaned.strip()
     
+    def split_transcript(self, text: str, max_chars: int) -> List[str]:
+        """按 utterance 边界（行）将记录切分为不超过 max_chars 的段落
+        
+        超过 max_chars 的单行按句末标点切分，仍然过长时按长度硬切。
+        
+        Args:
+            text: 预处理后的记录
+            max_chars: 每段的最大字符数
+            
+        Returns:
+            段落列表（按原文顺序）
+        """
+        # (片段, 与前一片段的分隔符)：新的一行以换行分隔，同一行切出的句子直接相连
+        units = []
+        for line in text.split('\n'):
+            if len(line) <= max_chars:
+                units.append((line, '\n'))
+                continue
+            separator = '\n'
+            for sentence in self._SENTENCE_END_RE.split(line):
+                for start in range(0, len(sentence), max_chars):
+                    if sentence[start:start + max_chars]:
+                        units.append((sentence[start:start + max_chars], separator))
+                        separator = ''
+        
+        chunks = []
+        current = ''
+        for unit, separator in units:
+            if current and len(current) + len(separator) + len(unit) > max_chars:
+                chunks.append(current.strip())
+                current = ''
+            current = current + separator + unit if current else unit
+        if current:
+            chunks.append(current.strip())
+        return [chunk for chunk in chunks if chunk]
+    
+    @staticmethod
+    def _label_partials(partials: List[str]) -> List[str]:
+        return [f"【第{i}段小结】\n{partial}" for i, partial in enumerate(partials, 1)]
+    
+    def _group_partials(self, partials: List[str], max_chars: int) -> List[str]:
+        """将各段小结按顺序分组，每组合并输入不超过 max_chars（单份小结不拆分）"""
+        groups: List[List[str]] = []
+        group_len = 0
+        for labeled in self._label_partials(partials):
+            if groups and group_len + len(labeled) + 2 <= max_chars:
+                groups[-1].append(labeled)
+                group_len += len(labeled) + 2
+            else:
+                groups.append([labeled])
+                group_len = len(labeled)
+        return ['\n\n'.join(group) for group in groups]
+    
+    def _stage_prompt(self, key: str) -> str:
+        """场景提示词 + 分段/合并说明"""
+        return self.get_system_prompt().rstrip() + '\n\n' + self.prompt_config.get(key, '').strip()
+    
+    async def generate_map_reduce(
+        self,
+        content: str,
+        chunk_chars: int = 6000,
+        max_concurrency: int = 4,
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """分段生成长记录小结（map-reduce）
+        
+        1. map：按 utterance 边界切分记录，各段在并发上限内同时小结
+        2. reduce：合并各段小结；合并输入仍超过 chunk_chars 时逐层分组合并
+        3. 最后一次合并以流式输出
+        
+        记录不超过一段时直接按普通方式流式生成。
+        
+        Args:
+            content: 记录内容
+            chunk_chars: 每段（及每次合并输入）的最大字符数
+            max_concurrency: 同时进行的 LLM 调用数
+            **kwargs: 生成参数（temperature、max_tokens 等，max_tokens 只作用于最终小结）
+            
+        Yields:
+            进度事件 {"type": "progress", "stage": "map"|"reduce", ...}
+            和小结片段 {"type": "chunk", "text": "..."}
+            
+        Raises:
+            ValueError: 输入内容为空
+        """
+        if not self.llm_service or not self.llm_service.is_available():
+            raise RuntimeError(f"{self.name} 不可用：LLM服务未初始化")
+        
+        processed = self.preprocess_input(content)
+        
+        # 笔记信息作为每一段的上下文
+        header = ''
+        body = processed
+        if self.NOTE_CONTENT_MARKER in processed:
+            header, body = processed.split(self.NOTE_CONTENT_MARKER, 1)
+            header = header.strip() + '\n\n'
+        
+        chunk_chars = max(200, int(chunk_chars))
+        chunks = self.split_transcript(body, chunk_chars)
+        if len(chunks) <= 1:
+            async for chunk in await self.generate(content, stream=True, **kwargs):
+                yield {"type": "chunk", "text": chunk}
+            return
+        
+        generation_config = {
+            'temperature': self.config.get('temperature', 0.5),
+            'max_tokens': self.config.get('max_tokens', 2000),
+            **kwargs
+        }
+        partial_config = {
+            **generation_config,
+            'max_tokens': self.config.get('map_max_tokens', 1000),
+        }
+        semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+        
+        async def summarize(index: int, user_message: str, system_prompt: str):
+            async with semaphore:
+                result = await self.llm_service.simple_chat(
+                    user_message=user_message,
+                    system_prompt=system_prompt,
+                    stream=False,
+                    route=self.llm_route,
+                    **partial_config
+                )
+            return index, self.postprocess_output(result)
+        
+        # map：各段并发小结，每完成一段发送一次进度
+        self.logger.info(f"[{self.name}] 分段小结开始: {len(chunks)} 段, 总长度={len(body)}")
+        map_prompt = self._stage_prompt('map_prompt')
+        partials: List[Optional[str]] = [None] * len(chunks)
+        tasks = [
+            asyncio.ensure_future(summarize(i, f"{header}【第 {i + 1}/{len(chunks)} 段】\n{chunk}", map_prompt))
+            for i, chunk in enumerate(chunks)
+        ]
+        try:
+            for completed, future in enumerate(asyncio.as_completed(tasks), 1):
+                index, partial = await future
+                partials[index] = partial
+                yield {"type": "progress", "stage": "map", "completed": completed, "total": len(chunks)}
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        # reduce：合并输入过长时逐层分组合并
+        reduce_prompt = self._stage_prompt('reduce_prompt')
+        level = 0
+        while True:
+            groups = self._group_partials(partials, chunk_chars)
+            if len(groups) <= 1 or len(groups) >= len(partials):
+                # 已能一次合并（或单份小结已超长，无法继续分组）
+                break
+            level += 1
+            results = await asyncio.gather(*[
+                summarize(i, header + group, reduce_prompt) for i, group in enumerate(groups)
+            ])
+            partials = [partial for _, partial in sorted(results)]
+            yield {"type": "progress", "stage": "reduce", "level": level, "completed": len(groups),
+                   "total": len(groups)}
+        
+        # 最后一次合并流式输出
+        level += 1
+        yield {"type": "progress", "stage": "reduce", "level": level, "completed": 0, "total": 1}
+        result = await self.llm_service.simple_chat(
+            user_message=header + '\n\n'.join(self._label_partials(partials)),
+            system_prompt=reduce_prompt,
+            stream=True,
+            route=self.llm_route,
+            **generation_config
+        )
+        total_len = 0
+        async for chunk in result:
+            total_len += len(chunk)
+            yield {"type": "chunk", "text": chunk}
+        self.logger.info(f"[{self.name}] 分段小结完成: {len(chunks)} 段, 合并 {level} 层, 总长度={total_len}")
+    
+    async def fold_utterances(
+        self,
+        summary: Optional[str],
+        utterances: List[str],
+        **kwargs
+    ) -> str:
+        """将新增的语句并入已有小结（增量滚动小结）
+        
+        Args:
+            summary: 已有小结（首次为空）
+            utterances: 新增的确定语句（按时间顺序）
+            **kwargs: 生成参数（temperature、max_tokens 等）
+            
+        Returns:
+            更新后的完整小结
+        """
+        if not self.llm_service or not self.llm_service.is_available():
+            raise RuntimeError(f"{self.name} 不可用：LLM服务未初始化")
+        
+        generation_config = {
+            'temperature': self.config.get('temperature', 0.5),
+            'max_tokens': self.config.get('max_tokens', 2000),
+            **kwargs
+        }
+        user_message = (
+            f"【已有小结】\n{summary or '（暂无）'}\n\n"
+            f"【新增记录】\n" + '\n'.join(utterances)
+        )
+        result = await self.llm_service.simple_chat(
+            user_message=user_message,
+            system_prompt=self._stage_prompt('delta_prompt'),
+            stream=False,
+            route=self.llm_route,
+            **generation_config
+        )
+        updated = self.postprocess_output(result)
+        self.logger.info(f"[{self.name}] 增量小结完成: 新增 {len(utterances)} 句, 小结长度={len(updated)}")
+        return updated
+    
     async def generate_summary(
         self,
         content: str,
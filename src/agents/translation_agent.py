@@ -3,10 +3,13 @@
 
 专门用于语音笔记的多语言翻译，支持双向互译
 """
-from typing import AsyncIterator, Union, Optional, Dict, Any, Tuple
-import re
+from typing import AsyncIterator, Union, Optional, Dict, Any, List, Tuple
+from pathlib import Path
+import hashlib
 from .base_agent import BaseAgent
 from .prompts import PromptLoader
+from . import language_detector
+from .translation_engine import BatchTranslationEngine
 
 
 class TranslationAgent(BaseAgent):
@@ -18,8 +21,12 @@ class TranslationAgent(BaseAgent):
     - 保留原文的语气和风格
     - 针对ASR文本优化（处理口语化表达）
     - 支持流式和非流式输出
+    - 批量翻译并发执行，短文本打包为一次调用
+    - 翻译记忆缓存（可选），提示词文件变更后自动失效
     """
     
+    default_route = 'translation'
+    
     # 支持的语言对（互译对，会根据内容自动判断翻译方向）
     SUPPORTED_PAIRS = {
         'zh-en': ('zh', 'en', '中文', '英文'),
@@ -37,21 +44,87 @@ class TranslationAgent(BaseAgent):
         'ko': '韩文',
     }
     
-    def __init__(self, llm_service, config: Optional[Dict[str, Any]] = None):
+    def __init__(self, llm_service, config: Optional[Dict[str, Any]] = None, translation_memory=None):
         """初始化TranslationAgent
         
         Args:
             llm_service: LLM服务实例
-            config: Agent配置（可选）
+            config: Agent配置（可选），其中 batch 为批量翻译引擎配置（见 config.yml 的 translation.batch）
+            translation_memory: 翻译记忆缓存（TranslationMemory，可选）
         """
         super().__init__(llm_service, config)
+        self._agent_config = config or {}
+        self.translation_memory = translation_memory
         
         # 加载提示词配置
-        self.prompt_config = PromptLoader.load('translation_agent')
+        self._apply_prompt_config(PromptLoader.load('translation_agent'))
+        
+        # 清除旧版本提示词产生的译文
+        if self.translation_memory:
+            self.translation_memory.invalidate(keep_version=self.prompt_version)
+        
+        # 批量翻译引擎（并发、限流、短文本打包）
+        self.batch_engine = BatchTranslationEngine.from_config(self, self.config.get('batch'))
+    
+    def _apply_prompt_config(self, prompt_config: Dict[str, Any]):
+        """应用提示词配置，并根据提示词文件内容计算提示词版本"""
+        self.prompt_config = prompt_config
         
         # 使用提示词配置中的默认参数
         prompt_params = self.prompt_config.get('parameters', {})
-        self.config = {**prompt_params, **(config or {})}
+        self.config = {**prompt_params, **self._agent_config}
+        
+        # 提示词版本 = 元数据版本 + 文件内容摘要（翻译记忆按版本区分）
+        prompt_file = Path(self.prompt_config['_file_path'])
+        self._prompt_mtime = prompt_file.stat().st_mtime_ns
+        digest = hashlib.sha256(prompt_file.read_bytes()).hexdigest()[:12]
+        self.prompt_version = f"{self.prompt_config['metadata']['version']}-{digest}"
+    
+    def refresh_prompt_config(self) -> bool:
+        """提示词文件变更时重新加载，并使旧版本的翻译记忆失效
+        
+        Returns:
+            提示词版本是否发生变化
+        """
+        try:
+            mtime = Path(self.prompt_config['_file_path']).stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._prompt_mtime:
+            return False
+        
+        old_version = self.prompt_version
+        self._apply_prompt_config(PromptLoader.reload('translation_agent'))
+        if self.prompt_version == old_version:
+            return False
+        
+        self.logger.info(f"[{self.name}] 提示词已变更: {old_version} -> {self.prompt_version}")
+        if self.translation_memory:
+            self.translation_memory.invalidate(keep_version=self.prompt_version)
+        return True
+    
+    def recall_translations(self, items: List[Tuple[str, str, str]]) -> List[Optional[str]]:
+        """从翻译记忆批量查询译文
+        
+        Args:
+            items: (text, source_lang, target_lang) 列表
+            
+        Returns:
+            与输入顺序一致的译文列表，未命中（或未启用翻译记忆）的为 None
+        """
+        self.refresh_prompt_config()
+        if not self.translation_memory or not items:
+            return [None] * len(items)
+        return self.translation_memory.get_many(items, self.prompt_version)
+    
+    def remember_translations(self, entries: List[Tuple[str, str, str, str]]):
+        """将译文写入翻译记忆
+        
+        Args:
+            entries: (text, source_lang, target_lang, translation) 列表
+        """
+        if self.translation_memory and entries:
+            self.translation_memory.put_many(entries, self.prompt_version)
     
     @property
     def name(self) -> str:
@@ -64,7 +137,7 @@ class TranslationAgent(BaseAgent):
     def detect_language(self, text: str) -> str:
         """检测文本的语言
         
-        使用简单的字符统计方法进行语言检测
+        使用预构建的 Unicode 区间查找表统计各文字字符数（单次遍历）
         
         Args:
             text: 待检测文本
@@ -72,39 +145,38 @@ class TranslationAgent(BaseAgent):
         Returns:
             语言代码（zh/en/ja/ko）
         """
-        if not text or not text.strip():
-            return 'en'  # 默认英文
-        
-        # 统计各语言字符数量
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fa5]', text))
-        japanese_hiragana = len(re.findall(r'[\u3040-\u309f]', text))
-        japanese_katakana = len(re.findall(r'[\u30a0-\u30ff]', text))
-        korean_chars = len(re.findall(r'[\uac00-\ud7af]', text))
-        
-        total_chars = len(text)
-        
-        # 中文检测（汉字占比 > 20%）
-        if chinese_chars / total_chars > 0.2:
-            return 'zh'
-        
-        # 日文检测（平假名或片假名）
-        japanese_chars = japanese_hiragana + japanese_katakana
-        if japanese_chars > 0:
-            return 'ja'
+        return language_detector.detect(text)[0]
+    
+    def detect_language_with_confidence(self, text: str) -> Tuple[str, float]:
+        """检测文本的语言并返回置信度
         
-        # 韩文检测（韩文字符）
-        if korean_chars > 0:
-            return 'ko'
+        Args:
+            text: 待检测文本
+            
+        Returns:
+            (语言代码, 置信度)，置信度为判定语言的字符占全部文字字符的比例
+        """
+        return language_detector.detect(text)
+    
+    def segment_languages(self, text: str) -> List[Tuple[str, str]]:
+        """将中英夹杂等混合语言文本按语言切分
         
-        # 默认英文
-        return 'en'
+        Args:
+            text: 待切分文本
+            
+        Returns:
+            [(语言代码, 片段文本), ...]，片段按顺序拼接后与原文一致
+        """
+        return language_detector.segment(text)
     
-    def resolve_translation_direction(self, pair_key: str, text: str) -> Tuple[str, str, bool]:
+    def resolve_translation_direction(self, pair_key: str, text: str,
+                                      detected_lang: Optional[str] = None) -> Tuple[str, str, bool]:
         """根据语言对和文本内容，自动判断翻译方向
         
         Args:
             pair_key: 语言对键（如 'zh-en'）
             text: 待翻译文本
+            detected_lang: 已检测出的语言（批量检测时传入，避免重复检测）
             
         Returns:
             (source_lang, target_lang, is_valid) 元组
@@ -125,7 +197,8 @@ class TranslationAgent(BaseAgent):
         lang1_code, lang2_code, _, _ = self.SUPPORTED_PAIRS[pair_key]
         
         # 检测文本语言
-        detected_lang = self.detect_language(text)
+        if detected_lang is None:
+            detected_lang = self.detect_language(text)
         
         self.logger.debug(f"[{self.name}] 语言对={pair_key}, 检测到语言={detected_lang}")
         
@@ -170,6 +243,18 @@ class TranslationAgent(BaseAgent):
             target_language=target_name
         )
     
+    def get_batch_system_prompt(self, source_lang: str, target_lang: str) -> str:
+        """获取多段打包翻译的系统提示词
+        
+        Args:
+            source_lang: 源语言代码
+            target_lang: 目标语言代码
+            
+        Returns:
+            系统提示词（翻译提示词 + 多段格式说明）
+        """
+        return self.get_system_prompt(source_lang, target_lang) + self.prompt_config.get('batch_prompt', '')
+    
     def preprocess_input(self, input_text: str) -> str:
         """预处理输入文本
         
@@ -196,6 +281,7 @@ class TranslationAgent(BaseAgent):
         source_lang: str,
         target_lang: str,
         stream: bool = False,
+        use_memory: bool = True,
         **kwargs
     ) -> Union[str, AsyncIterator[str]]:
         """翻译文本（指定源语言和目标语言）
@@ -205,6 +291,7 @@ class TranslationAgent(BaseAgent):
             source_lang: 源语言代码（zh/en/ja/ko）
             target_lang: 目标语言代码（zh/en/ja/ko）
             stream: 是否使用流式输出
+            use_memory: 是否使用翻译记忆（命中时不调用LLM，流式输出一次返回完整译文）
             **kwargs: 其他参数
             
         Returns:
@@ -213,6 +300,14 @@ class TranslationAgent(BaseAgent):
         # 预处理输入
         text = self.preprocess_input(text)
         
+        # 查询翻译记忆
+        memory_enabled = use_memory and self.translation_memory is not None
+        if memory_enabled:
+            cached = self.recall_translations([(text, source_lang, target_lang)])[0]
+            if cached is not None:
+                self.logger.info(f"[{self.name}] 翻译记忆命中: {source_lang} -> {target_lang}, 长度={len(text)}")
+                return self._replay(cached) if stream else cached
+        
         # 获取针对该语言对的系统提示词
         system_prompt = self.get_system_prompt(source_lang, target_lang)
         
@@ -226,8 +321,11 @@ class TranslationAgent(BaseAgent):
                     user_message=text,
                     system_prompt=system_prompt,
                     stream=True,
+                    route=self.llm_route,
                     **kwargs
                 )
+                if memory_enabled:
+                    return self._stream_and_remember(result, text, source_lang, target_lang)
                 return result
             else:
                 # 非流式生成
@@ -235,16 +333,67 @@ class TranslationAgent(BaseAgent):
                     user_message=text,
                     system_prompt=system_prompt,
                     stream=False,
+                    route=self.llm_route,
                     **kwargs
                 )
                 
                 self.logger.info(f"[{self.name}] 翻译完成，长度={len(response)}")
+                if memory_enabled:
+                    self.remember_translations([(text, source_lang, target_lang, response)])
                 return response
                 
         except Exception as e:
             self.logger.error(f"[{self.name}] 翻译失败: {e}", exc_info=True)
             raise
     
+    async def _replay(self, translation: str) -> AsyncIterator[str]:
+        """以流式接口返回翻译记忆中的译文"""
+        yield translation
+    
+    async def _stream_and_remember(
+        self,
+        result: AsyncIterator[str],
+        text: str,
+        source_lang: str,
+        target_lang: str
+    ) -> AsyncIterator[str]:
+        """透传流式译文，完整结束后写入翻译记忆"""
+        chunks = []
+        async for chunk in result:
+            chunks.append(chunk)
+            yield chunk
+        self.remember_translations([(text, source_lang, target_lang, ''.join(chunks))])
+    
+    async def translate_packed(
+        self,
+        packed_text: str,
+        source_lang: str,
+        target_lang: str,
+        **kwargs
+    ) -> str:
+        """翻译以 [序号] 标记打包的多段文本（由批量翻译引擎调用）
+        
+        Args:
+            packed_text: 打包后的文本（每段以 [序号] 开头）
+            source_lang: 源语言代码
+            target_lang: 目标语言代码
+            **kwargs: 其他参数
+            
+        Returns:
+            带序号标记的译文
+        """
+        system_prompt = self.get_batch_system_prompt(source_lang, target_lang)
+        
+        self.logger.info(f"[{self.name}] 开始打包翻译: {source_lang} -> {target_lang}, 长度={len(packed_text)}")
+        
+        return await self.llm_service.simple_chat(
+            user_message=packed_text,
+            system_prompt=system_prompt,
+            stream=False,
+            route=self.llm_route,
+            **kwargs
+        )
+    
     async def translate_with_pair(
         self,
         text: str,
@@ -290,6 +439,8 @@ class TranslationAgent(BaseAgent):
     ) -> list[str]:
         """批量翻译（指定源语言和目标语言）
         
+        由批量翻译引擎并发执行，短文本会合并为一次调用，结果顺序与输入一致。
+        
         Args:
             texts: 待翻译文本列表
             source_lang: 源语言代码
@@ -297,19 +448,16 @@ class TranslationAgent(BaseAgent):
             **kwargs: 其他参数
             
         Returns:
-            翻译结果列表
+            翻译结果列表（空文本对应空字符串）
         """
-        results = []
-        for text in texts:
-            if not text.strip():
-                results.append("")
-                continue
-            
-            result = await self.translate(
-                text, source_lang, target_lang, 
-                stream=False, **kwargs
-            )
-            results.append(result)
+        results = [""] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text.strip()]
+        
+        translations = await self.batch_engine.translate(
+            [(texts[i].strip(), source_lang, target_lang) for i in indices], **kwargs
+        )
+        for i, translation in zip(indices, translations):
+            results[i] = translation
         
         self.logger.info(f"[{self.name}] 批量翻译完成: {len(texts)} 条")
         return results
@@ -322,6 +470,8 @@ class TranslationAgent(BaseAgent):
     ) -> list[Union[str, Dict[str, Any]]]:
         """批量翻译（使用语言对，自动检测每条文本的翻译方向）
         
+        由批量翻译引擎并发执行，同一翻译方向的短文本会合并为一次调用，结果顺序与输入一致。
+        
         Args:
             texts: 待翻译文本列表
             pair_key: 语言对键（如 'zh-en', 'en-ja'）
@@ -332,19 +482,35 @@ class TranslationAgent(BaseAgent):
             - 成功：返回翻译后的字符串
             - 失败：返回 {"error": "language_not_detected", "message": "..."}
         """
-        results = []
-        for text in texts:
+        results: list[Union[str, Dict[str, Any]]] = [""] * len(texts)
+        indices = []
+        items = []
+        # 整批文本一次完成语言检测
+        detections = language_detector.detect_batch(texts)
+        for i, text in enumerate(texts):
             if not text.strip():
-                results.append("")
                 continue
             
             # 每条文本单独判断翻译方向
-            result = await self.translate_with_pair(
-                text, pair_key, 
-                stream=False, **kwargs
+            detected_lang = detections[i][0]
+            source_lang, target_lang, is_valid = self.resolve_translation_direction(
+                pair_key, text, detected_lang=detected_lang
             )
-            results.append(result)
+            if not is_valid:
+                results[i] = {
+                    "error": "language_not_detected",
+                    "message": f"未检测到互译语种（{pair_key}）",
+                    "detected_lang": detected_lang,
+                    "expected_langs": [source_lang, target_lang]
+                }
+                continue
+            
+            indices.append(i)
+            items.append((text.strip(), source_lang, target_lang))
+        
+        translations = await self.batch_engine.translate(items, **kwargs)
+        for i, translation in zip(indices, translations):
+            results[i] = translation
         
         self.logger.info(f"[{self.name}] 批量翻译完成: {len(texts)} 条，语言对={pair_key}")
         return results
-
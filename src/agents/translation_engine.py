@@ -0,0 +1,222 @@
+"""
+批量翻译引擎
+
+功能：
+- 多条文本并发翻译，并发数由信号量控制，LLM 调用频率由令牌桶限制
+- 同一翻译方向的短文本按 [序号] 标记打包进一次调用，再按序号拆分译文
+- 打包调用失败或译文缺少某些序号时，只对缺失的片段逐条重试
+- 翻译记忆命中的条目和批次内重复的文本不重复调用 LLM
+- 结果顺序与输入一致
+
+引擎由 TranslationAgent 持有，同一实例的信号量和令牌桶在所有批量请求间共享。
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 译文中的片段标记：行首 [序号]
+_MARKER_RE = re.compile(r'^\s*\[(\d+)\]\s?', re.MULTILINE)
+
+
+class TokenBucket:
+    """令牌桶限流（每次 LLM 调用消耗一个令牌）"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数（<= 0 表示不限流）
+            capacity: 桶容量（允许的突发调用数，默认与 rate 相同且至少为 1）
+        """
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity if capacity is not None else rate))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        """获取令牌（不足时等待补充）"""
+        if self.rate <= 0:
+            return
+
+        # 持锁等待，保证按请求顺序获得令牌
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+def pack_segments(texts: List[str]) -> str:
+    """将多个片段打包为带序号标记的文本（序号从 1 开始）"""
+    return '\n'.join(f'[{i}] {text}' for i, text in enumerate(texts, 1))
+
+
+def unpack_segments(response: str, count: int) -> List[Optional[str]]:
+    """按序号标记拆分打包译文
+
+    Args:
+        response: 模型返回的译文
+        count: 打包的片段数
+
+    Returns:
+        按序号排列的译文列表，缺失或为空的片段为 None
+    """
+    results: List[Optional[str]] = [None] * count
+    matches = list(_MARKER_RE.finditer(response))
+    for i, match in enumerate(matches):
+        index = int(match.group(1)) - 1
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+        text = response[match.end():end].strip()
+        if 0 <= index < count and text and results[index] is None:
+            results[index] = text
+    return results
+
+
+class BatchTranslationEngine:
+    """并发、限流的批量翻译引擎"""
+
+    def __init__(self, agent, max_concurrency: int = 4, requests_per_second: float = 2.0,
+                 burst: Optional[int] = None, pack_max_chars: int = 800,
+                 pack_max_segments: int = 20, short_text_chars: int = 200):
+        """初始化批量翻译引擎
+
+        Args:
+            agent: TranslationAgent 实例
+            max_concurrency: 同时进行的 LLM 调用数
+            requests_per_second: 每秒最多发起的 LLM 调用数（<= 0 表示不限流）
+            burst: 允许的突发调用数（默认与并发数相同）
+            pack_max_chars: 每次打包调用的原文总字符数上限
+            pack_max_segments: 每次打包调用的片段数上限（<= 1 表示不打包）
+            short_text_chars: 参与打包的单条文本长度上限（更长或多行的文本单独翻译）
+        """
+        self.agent = agent
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.pack_max_chars = max(1, int(pack_max_chars))
+        self.pack_max_segments = max(1, int(pack_max_segments))
+        self.short_text_chars = max(1, int(short_text_chars))
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(requests_per_second,
+                                   burst if burst is not None else self.max_concurrency)
+
+    @classmethod
+    def from_config(cls, agent, config: Optional[Dict[str, Any]] = None) -> 'BatchTranslationEngine':
+        """根据配置（config.yml 中的 translation.batch）创建引擎"""
+        config = config or {}
+        return cls(
+            agent,
+            max_concurrency=config.get('max_concurrency', 4),
+            requests_per_second=config.get('requests_per_second', 2.0),
+            burst=config.get('burst'),
+            pack_max_chars=config.get('pack_max_chars', 800),
+            pack_max_segments=config.get('pack_max_segments', 20),
+            short_text_chars=config.get('short_text_chars', 200),
+        )
+
+    async def translate(self, items: List[Tuple[str, str, str]], **kwargs) -> List[str]:
+        """并发翻译
+
+        Args:
+            items: (text, source_lang, target_lang) 列表，text 不能为空
+            **kwargs: 透传给 LLM 调用的参数
+
+        Returns:
+            与输入顺序一致的译文列表
+
+        Raises:
+            Exception: 某条文本逐条重试后仍然失败
+        """
+        # 翻译记忆命中的条目不再调用 LLM，批次内重复的文本只翻译一次
+        results = self.agent.recall_translations(items)
+        unique: Dict[Tuple[str, str, str], int] = {}
+        for index, item in enumerate(items):
+            if results[index] is None:
+                unique.setdefault(item, len(unique))
+        pending = list(unique)
+
+        translations: List[Optional[str]] = [None] * len(pending)
+        jobs = [self._run_job(job, pending, translations, **kwargs) for job in self._plan(pending)]
+        await asyncio.gather(*jobs)
+
+        for index, item in enumerate(items):
+            if results[index] is None:
+                results[index] = translations[unique[item]]
+        self.agent.remember_translations(
+            [(text, source_lang, target_lang, translation)
+             for (text, source_lang, target_lang), translation in zip(pending, translations)]
+        )
+        return results
+
+    def _plan(self, items: List[Tuple[str, str, str]]) -> List[List[int]]:
+        """将条目分组：短文本按翻译方向打包，长文本单独一组"""
+        jobs: List[List[int]] = []
+        open_packs: Dict[Tuple[str, str], List[int]] = {}
+        pack_chars: Dict[Tuple[str, str], int] = {}
+
+        for index, (text, source_lang, target_lang) in enumerate(items):
+            if self.pack_max_segments <= 1 or len(text) > self.short_text_chars or '\n' in text:
+                jobs.append([index])
+                continue
+
+            direction = (source_lang, target_lang)
+            pack = open_packs.get(direction)
+            if pack and (len(pack) >= self.pack_max_segments
+                         or pack_chars[direction] + len(text) > self.pack_max_chars):
+                pack = None
+            if not pack:
+                pack = []
+                open_packs[direction] = pack
+                pack_chars[direction] = 0
+                jobs.append(pack)
+            pack.append(index)
+            pack_chars[direction] += len(text)
+
+        return jobs
+
+    async def _call(self, coro_factory):
+        """在并发和频率限制下执行一次 LLM 调用"""
+        async with self._semaphore:
+            await self._bucket.acquire()
+            return await coro_factory()
+
+    async def _run_job(self, indices: List[int], items: List[Tuple[str, str, str]],
+                       results: List[Optional[str]], **kwargs):
+        source_lang, target_lang = items[indices[0]][1], items[indices[0]][2]
+
+        if len(indices) > 1:
+            texts = [items[i][0] for i in indices]
+            try:
+                response = await self._call(lambda: self.agent.translate_packed(
+                    pack_segments(texts), source_lang, target_lang, **kwargs
+                ))
+                for index, text in zip(indices, unpack_segments(response, len(indices))):
+                    results[index] = text
+            except Exception as e:
+                logger.warning(f"[批量翻译] 打包翻译失败，改为逐条重试: {len(indices)} 条, 错误: {e}")
+
+            missing = [i for i in indices if results[i] is None]
+            if missing and len(missing) < len(indices):
+                logger.warning(f"[批量翻译] 打包译文缺少 {len(missing)}/{len(indices)} 个片段，逐条重试")
+        else:
+            missing = indices
+
+        # 逐条翻译（单独的长文本，或打包失败/缺失的片段）
+        await asyncio.gather(*[
+            self._translate_single(index, items, results, **kwargs) for index in missing
+        ])
+
+    async def _translate_single(self, index: int, items: List[Tuple[str, str, str]],
+                                results: List[Optional[str]], **kwargs):
+        text, source_lang, target_lang = items[index]
+        results[index] = await self._call(lambda: self.agent.translate(
+            text, source_lang, target_lang, stream=False, use_memory=False, **kwargs
+        ))
@@ -6,8 +6,11 @@
 - 支持多设备共享会员权益
 
 提供会员信息、消费统计、激活码等相关接口
+激活码批次的列表和导出包含未兑换的激活码，只通过 scripts/generate_activation_codes.py 在服务器本地提供
 """
 
+import asyncio
+from functools import partial
 from typing import Optional, Dict, Any
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
@@ -55,6 +58,7 @@ class ActivateRequest(BaseModel):
     """激活请求"""
     user_id: str = Field(..., description="用户ID")
     activation_code: str = Field(..., description="激活码")
+    device_id: Optional[str] = Field(default=None, description="兑换设备ID（可选）")
 
 
 class ActivateResponse(BaseModel):
@@ -171,27 +175,119 @@ async def check_quota(request: QuotaCheckRequest):
 
 @router.post("/membership/validate-code", response_model=ValidateCodeResponse)
 async def validate_activation_code(request: ValidateCodeRequest):
-    """验证激活码（功能未实现）"""
-    logger.info(f"[API] 激活码验证请求（功能未实现） user_id={request.user_id}")
+    """验证激活码（不占用激活码）"""
+    if not activation_service:
+        raise HTTPException(status_code=503, detail="激活码服务未初始化")
     
-    return ValidateCodeResponse(
-        success=True,
-        is_valid=False,
-        message="激活码功能暂未实现",
-        error="FEATURE_NOT_AVAILABLE"
-    )
+    try:
+        code = request.activation_code.strip().upper()
+        result = activation_service.validate_code(code)
+        
+        if not result['valid']:
+            return ValidateCodeResponse(
+                success=True,
+                is_valid=False,
+                message=result['error'],
+                error="INVALID_CODE"
+            )
+        
+        return ValidateCodeResponse(
+            success=True,
+            is_valid=True,
+            message=f"激活码有效：{membership_service.get_tier_name(result['tier'])} {result['months']}个月",
+            data={
+                'tier': result['tier'],
+                'months': result['months']
+            }
+        )
+    except Exception as e:
+        logger.error(f"[API] 验证激活码失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/membership/activate", response_model=ActivateResponse)
 async def activate_membership(request: ActivateRequest):
-    """激活会员（功能未实现）"""
-    logger.info(f"[API] 激活请求（功能未实现） user_id={request.user_id}")
+    """使用激活码激活会员"""
+    if not membership_service or not activation_service:
+        raise HTTPException(status_code=503, detail="会员服务未初始化")
+    
+    code = request.activation_code.strip().upper()
+    
+    try:
+        if not membership_service.get_membership(request.user_id):
+            return ActivateResponse(
+                success=False,
+                message="会员信息不存在，请先完成用户注册",
+                error="MEMBERSHIP_NOT_FOUND"
+            )
+        
+        # 原子兑换：并发使用同一激活码时只有一个请求成功
+        result = activation_service.redeem_code(code, request.user_id, request.device_id)
+        if not result['valid']:
+            return ActivateResponse(
+                success=False,
+                message=result['error'],
+                error="INVALID_CODE"
+            )
+        
+        try:
+            membership = membership_service.activate_membership(request.user_id, result['tier'], result['months'])
+        except Exception:
+            # 会员激活失败，归还激活码
+            activation_service.release_code(code, request.user_id)
+            raise
+        
+        logger.info(f"[API] 激活成功 user_id={request.user_id}, tier={result['tier']}, months={result['months']}")
+        
+        return ActivateResponse(
+            success=True,
+            message=f"已激活{membership_service.get_tier_name(result['tier'])}，有效期{result['months']}个月",
+            data=membership
+        )
+    except Exception as e:
+        logger.error(f"[API] 激活会员失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/consumption/reports")
+async def get_consumption_report(
+    granularity: str = 'day',
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    user_id: Optional[str] = None,
+    device_id: Optional[str] = None,
+    group_by: Optional[str] = None,
+    limit: Optional[int] = None
+):
+    """获取消费统计报表（按小时/按天汇总）
+    
+    group_by 为逗号分隔的分组维度，如 "bucket,model" 或 "user_id"
+    """
+    if not consumption_service:
+        raise HTTPException(status_code=503, detail="消费服务未初始化")
     
-    return ActivateResponse(
-        success=False,
-        message="激活码功能暂未实现",
-        error="FEATURE_NOT_AVAILABLE"
-    )
+    try:
+        # 读取前要写入消费队列（同步数据库写入），放到线程池执行，不阻塞事件循环
+        report = await asyncio.get_running_loop().run_in_executor(None, partial(
+            consumption_service.get_consumption_report,
+            granularity=granularity,
+            start=start,
+            end=end,
+            user_id=user_id,
+            device_id=device_id,
+            group_by=[column.strip() for column in group_by.split(',') if column.strip()] if group_by else None,
+            limit=limit
+        ))
+        
+        return {
+            "success": True,
+            "data": report
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"[API] 获取消费报表失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/consumption/{user_id}/history")
@@ -207,13 +303,14 @@ async def get_consumption_history(
         raise HTTPException(status_code=503, detail="消费服务未初始化")
     
     try:
-        records = consumption_service.get_consumption_records(
+        records = await asyncio.get_running_loop().run_in_executor(None, partial(
+            consumption_service.get_consumption_records,
             user_id=user_id,
             device_id=device_id,
             consumption_type=consumption_type,
             limit=limit,
             offset=offset
-        )
+        ))
         
         return {
             "success": True,
@@ -241,12 +338,13 @@ async def get_monthly_consumption(
         raise HTTPException(status_code=503, detail="消费服务未初始化")
     
     try:
-        monthly_data = consumption_service.get_monthly_consumption(
+        monthly_data = await asyncio.get_running_loop().run_in_executor(None, partial(
+            consumption_service.get_monthly_consumption,
             user_id=user_id,
             device_id=device_id,
             year=year,
             month=month
-        )
+        ))
         
         return {
             "success": True,
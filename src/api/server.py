@@ -8,7 +8,6 @@ import sys
 import os
 import json
 import base64
-import uuid
 from datetime import datetime
 from contextlib import asynccontextmanager
 from pathlib import Path
@@ -31,12 +30,35 @@ from src.services.voice_service import VoiceService
 from src.services.llm_service import LLMService
 from src.services.knowledge_service import KnowledgeService
 from src.services.export_service import MarkdownExportService, HtmlExportService
+from src.services.data_export_service import DataExportService, EXPORT_FORMATS
 from src.services.cleanup_service import CleanupService
+from src.providers.storage.migrations import MigrationRunner
+from src.providers.storage.image_store import ImageStore
+from src.providers.storage.translation_memory import TranslationMemory
+from src.providers.llm.usage import LLMUsage, usage_scope
+from src.providers.llm.scheduler import (
+    ERROR_AUTH,
+    ERROR_QUOTA,
+    ERROR_RATE_LIMIT,
+    ERROR_TIMEOUT,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    classify_error,
+    llm_priority,
+)
 from src.services.consumption_service import ConsumptionService
+from src.services.consumption_queue import close_consumption_queues
+from src.services.quota_ledger import close_quota_ledgers
 from src.utils.audio_recorder import SoundDeviceRecorder
 from src.agents import SummaryAgent, SmartChatAgent
 from src.agents.translation_agent import TranslationAgent
+from src.agents.response_cache import ResponseCache, get_cache_status
 from src.api.membership_api import router as membership_router, init_membership_services
+from src.api import membership_api
+from src.services.membership_sweeper import MembershipExpirySweeper
+from src.services.live_translation import LiveTranslationService
+from src.services.rolling_summary import RollingSummaryService
+from src.providers.storage.rolling_summary_store import RollingSummaryStore
 from src.api.user_api import router as user_router, init_user_service
 from src.api import user_api
 from src.api.tag_api import router as tag_router, init_tag_service
@@ -50,6 +72,7 @@ async def lifespan(app: FastAPI):
     setup_voice_service()
     setup_llm_service()
     setup_cleanup_service()
+    setup_migration_runner()
     setup_membership_services()
     setup_user_service()
     setup_tag_service()
@@ -68,6 +91,23 @@ async def lifespan(app: FastAPI):
     if cleanup_service:
         await cleanup_service.start()
     
+    # 启动数据库回填任务（在线分批执行）
+    global migration_runner
+    if migration_runner:
+        await migration_runner.start()
+    
+    # 启动会员到期降级定时任务
+    if membership_sweeper:
+        await membership_sweeper.start()
+    
+    # 启动实时字幕翻译（绑定当前事件循环）
+    if live_translation_service:
+        await live_translation_service.start()
+    
+    # 启动录音过程中的滚动小结
+    if rolling_summary_service:
+        await rolling_summary_service.start()
+    
     yield
     
     global voice_service, llm_service, recorder
@@ -77,6 +117,27 @@ async def lifespan(app: FastAPI):
     if cleanup_service:
         await cleanup_service.stop()
     
+    # 停止回填任务（进度已持久化，下次启动继续）
+    if migration_runner:
+        await migration_runner.stop()
+    
+    if membership_sweeper:
+        await membership_sweeper.stop()
+    
+    if live_translation_service:
+        await live_translation_service.stop()
+    
+    if rolling_summary_service:
+        await rolling_summary_service.stop()
+    
+    # 刷新尚未更新的对话记录（消息已逐轮保存）
+    if smart_chat_agent:
+        await smart_chat_agent.flush_all()
+    
+    # 写回翻译记忆中尚未落盘的命中统计
+    if translation_agent and translation_agent.translation_memory:
+        translation_agent.translation_memory.flush()
+    
     if voice_service:
         try:
             voice_service.cleanup()
@@ -89,6 +150,18 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error(f"清理录音器失败: {e}")
     
+    # 语音服务清理时可能产生最后一条ASR消费，因此最后关闭
+    # 写入消费事件队列中的剩余事件，再写回额度账本中尚未落盘的月度用量
+    try:
+        close_consumption_queues()
+    except Exception as e:
+        logger.error(f"写入消费事件失败: {e}")
+    
+    try:
+        close_quota_ledgers()
+    except Exception as e:
+        logger.error(f"写回额度账本失败: {e}")
+    
     logger.info("[API] 服务已关闭")
 
 
@@ -123,25 +196,51 @@ voice_service: Optional[VoiceService] = None
 llm_service: Optional[LLMService] = None
 knowledge_service: Optional[KnowledgeService] = None
 consumption_service: Optional[ConsumptionService] = None
+data_export_service: Optional[DataExportService] = None
 summary_agent: Optional[SummaryAgent] = None
+response_cache: Optional[ResponseCache] = None
 smart_chat_agent: Optional[SmartChatAgent] = None
 translation_agent: Optional[TranslationAgent] = None
+live_translation_service: Optional[LiveTranslationService] = None
+rolling_summary_service: Optional[RollingSummaryService] = None
 cleanup_service: Optional[CleanupService] = None
+migration_runner: Optional[MigrationRunner] = None
+membership_sweeper: Optional[MembershipExpirySweeper] = None
 config: Optional[Config] = None
 recorder: Optional[SoundDeviceRecorder] = None
 
 
 def get_user_id_by_device(device_id: str) -> Optional[str]:
-    """通过device_id获取user_id"""
+    """通过device_id获取user_id（经由进程内缓存，绑定关系变更时自动失效）"""
     if not device_id or not user_api.user_storage:
         return None
     try:
-        user_info = user_api.user_storage.get_user_by_device(device_id)
-        return user_info['user_id'] if user_info else None
+        return user_api.user_storage.get_user_id_by_device(device_id)
     except Exception as e:
         logger.error(f"[API] 获取user_id失败: {e}", exc_info=True)
         return None
 
+
+def _record_llm_usage(device_id: Optional[str], usage: LLMUsage, tag: str):
+    """按请求用量上下文记录LLM消费（写入消费事件队列，不阻塞响应）
+    
+    Args:
+        device_id: 设备ID（为空时不记录）
+        usage: 本次请求的用量对象
+        tag: 日志前缀
+    """
+    if not device_id or not consumption_service or usage.call_count == 0:
+        return
+    try:
+        user_id = get_user_id_by_device(device_id)
+        if not user_id:
+            logger.warning(f"[{tag}] 无法获取user_id，跳过LLM消费记录: device_id={device_id}")
+            return
+        consumption_service.record_llm_usage(user_id, device_id, usage)
+        logger.info(f"[{tag}] ✅ LLM消费已记录: user_id={user_id}, {usage.total_tokens} tokens（{usage.call_count}次调用）")
+    except Exception as e:
+        logger.error(f"[{tag}] 记录LLM消费失败: {e}", exc_info=True)
+
 # WebSocket连接管理（单连接模式）
 current_connection: Optional[WebSocket] = None
 
@@ -218,6 +317,8 @@ class ChatResponse(BaseModel):
     success: bool
     message: Optional[str] = None
     error: Optional[Dict[str, Any]] = None  # 可以是字符串或 SystemErrorInfo 对象
+    cache: Optional[str] = None  # 缓存状态：hit / miss / bypass / rolling（复用滚动小结），未使用缓存时为空
+    conversation_id: Optional[str] = None  # SmartChat 对话ID（后续消息传回以继续该对话）
 
 
 class SimpleChatRequest(BaseModel):
@@ -239,6 +340,15 @@ class SummaryRequest(BaseModel):
     temperature: float = Field(default=0.5, ge=0, le=2, description="温度参数")
     max_tokens: Optional[int] = Field(default=2500, description="最大生成token数")
     stream: bool = Field(default=True, description="是否使用流式输出")
+    use_cache: bool = Field(default=True, description="是否允许返回缓存的小结（False 时强制重新生成）")
+    mode: Optional[str] = Field(
+        default='auto',
+        description="生成方式: single(一次生成), map_reduce(分段并发小结后合并), auto(超过 summary.map_reduce.threshold_chars 时分段)"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        description="滚动小结会话ID（text_final 消息中的 summary_session_id），存在时直接返回录音过程中维护的小结"
+    )
     device_id: Optional[str] = Field(default=None, description="设备ID（用于消费记录）")
 
 
@@ -261,6 +371,21 @@ class BatchTranslateRequest(BaseModel):
     device_id: Optional[str] = Field(default=None, description="设备ID（用于消费记录）")
 
 
+class LiveTranslationRequest(BaseModel):
+    """实时字幕翻译设置请求"""
+    enabled: bool = Field(..., description="是否开启实时翻译")
+    language_pair: Optional[str] = Field(None, description="语言对（如 zh-en），自动判断每句的翻译方向")
+    device_id: Optional[str] = Field(default=None, description="设备ID（用于消费记录）")
+
+
+class RollingSummaryRequest(BaseModel):
+    """滚动小结设置请求"""
+    enabled: bool = Field(..., description="是否开启录音过程中的滚动小结")
+    summary_type: Optional[str] = Field(None, description="小结类型（只影响之后开始的录音会话）")
+    fold_every: Optional[int] = Field(None, ge=1, description="每积累多少条确定的语句更新一次小结")
+    device_id: Optional[str] = Field(default=None, description="设备ID（关闭时只结束该设备进行中的会话）")
+
+
 class LLMInfoResponse(BaseModel):
     """LLM信息响应"""
     available: bool
@@ -376,14 +501,31 @@ def setup_voice_service():
             if voice_service._current_app_id:
                 message["app_id"] = voice_service._current_app_id
             
+            # 确定的utterance提交实时翻译，译文以 translation 消息按 utterance_id 对应
+            if is_definite and live_translation_service:
+                utterance_id = live_translation_service.submit(text, time_info, message.get("app_id"))
+                if utterance_id:
+                    message["utterance_id"] = utterance_id
+            
+            # 确定的utterance并入滚动小结，生成小结时可通过 summary_session_id 直接复用
+            if is_definite and rolling_summary_service:
+                session_id = rolling_summary_service.submit(text, time_info, message.get("app_id"),
+                                                            voice_service._device_id)
+                if session_id:
+                    message["summary_session_id"] = session_id
+            
             # 详细日志：记录广播的消息类型
             logger.debug(f"[API] 广播消息: type={message['type']}, text_len={len(text)}, is_definite={is_definite}, app_id={message.get('app_id')}")
             broadcast(message)
         
         voice_service.set_on_text_callback(on_text_callback)
-        voice_service.set_on_state_change_callback(
-            lambda state: broadcast({"type": "state_change", "state": state.value, "app_id": voice_service._current_app_id if voice_service._current_app_id else None})
-        )
+        def on_state_change_callback(state: RecordingState):
+            # 录音结束时结束滚动小结会话（剩余语句在后台并入）
+            if state == RecordingState.IDLE and rolling_summary_service:
+                rolling_summary_service.end_session(voice_service._device_id)
+            broadcast({"type": "state_change", "state": state.value, "app_id": voice_service._current_app_id if voice_service._current_app_id else None})
+        
+        voice_service.set_on_state_change_callback(on_state_change_callback)
         
         # 错误回调 - 传递完整的 SystemErrorInfo 对象
         def on_error_callback(error_type: str, msg: str):
@@ -435,9 +577,34 @@ def setup_cleanup_service():
         cleanup_service = None
 
 
+def setup_migration_runner():
+    """初始化数据库迁移执行器（结构迁移已在存储初始化时应用，这里负责后台回填）"""
+    global migration_runner, config
+    
+    logger.info("[API] 初始化数据库迁移执行器...")
+    
+    try:
+        if config is None:
+            config = Config()
+        
+        data_dir = Path(config.get('storage.data_dir', '~/Library/Application Support/MindVoice')).expanduser()
+        db_path = data_dir / config.get('storage.database', 'database/history.db')
+        
+        migration_runner = MigrationRunner(
+            str(db_path),
+            batch_size=config.get('storage.migrations.batch_size', 500),
+            pause_ms=config.get('storage.migrations.pause_ms', 50)
+        )
+        migration_runner.apply_pending()
+        logger.info("[API] 数据库迁移执行器初始化完成")
+    except Exception as e:
+        logger.error(f"[API] 数据库迁移执行器初始化失败: {e}", exc_info=True)
+        migration_runner = None
+
+
 def setup_membership_services():
     """初始化会员服务"""
-    global config, consumption_service
+    global config, consumption_service, data_export_service, membership_sweeper
     
     logger.info("[API] 初始化会员服务...")
     
@@ -452,6 +619,17 @@ def setup_membership_services():
         consumption_service = ConsumptionService(config)
         logger.info("[API] 消费服务初始化完成")
         
+        # 初始化数据批量导出服务（消费明细、月度汇总、记录元数据）
+        data_export_service = DataExportService(config)
+        
+        # 初始化会员到期降级定时任务
+        membership_sweeper = MembershipExpirySweeper(
+            membership_api.membership_service,
+            interval_minutes=config.get('membership.auto_downgrade.sweep_interval_minutes', 10),
+            batch_size=config.get('membership.auto_downgrade.sweep_batch_size', 1000),
+            enabled=config.get('membership.auto_downgrade.enabled', True)
+        )
+        
         logger.info("[API] 会员服务初始化完成")
     except Exception as e:
         logger.error(f"[API] 会员服务初始化失败: {e}")
@@ -528,28 +706,86 @@ def setup_llm_service():
                 knowledge_service = None
             
             # 使用 global 声明以修改全局变量
-            global summary_agent, smart_chat_agent, translation_agent
+            global summary_agent, smart_chat_agent, translation_agent, live_translation_service, response_cache
+            global rolling_summary_service
+            
+            # 初始化响应缓存（可选，低温度的相同小结请求直接复用结果）
+            response_cache = None
+            if config.get('llm.response_cache.enabled', False):
+                response_cache = ResponseCache.from_config(config.get('llm.response_cache', {}) or {})
+                logger.info(f"[API] 响应缓存已启用 (温度上限: {response_cache.max_temperature})")
             
             # 初始化 SummaryAgent
-            summary_agent = SummaryAgent(llm_service)
+            summary_agent = SummaryAgent(llm_service, response_cache=response_cache)
             logger.info(f"[API] {summary_agent.name} 初始化完成")
             
             # 初始化 SmartChatAgent（使用 voice_service 的 storage_provider）
             smart_chat_agent = SmartChatAgent(
                 llm_service=llm_service,
                 knowledge_service=knowledge_service,
-                storage_provider=voice_service.storage_provider if voice_service else None
+                storage_provider=voice_service.storage_provider if voice_service else None,
+                config={
+                    'max_sessions': config.get('smart_chat.max_sessions', 256),
+                    'projection_delay_seconds': config.get('smart_chat.projection_delay_seconds', 5.0)
+                }
             )
             logger.info(f"[API] {smart_chat_agent.name} 初始化完成")
             
-            # 初始化 TranslationAgent
-            translation_agent = TranslationAgent(llm_service)
+            # 初始化翻译记忆（重复的句子直接复用译文）
+            translation_memory = None
+            if config.get('translation.memory.enabled', True):
+                try:
+                    data_dir = Path(config.get('storage.data_dir')).expanduser()
+                    translation_memory = TranslationMemory(
+                        data_dir / config.get('storage.database', 'database/history.db'),
+                        max_entries=config.get('translation.memory.max_entries', 100000),
+                        memory_entries=config.get('translation.memory.memory_entries', 2000)
+                    )
+                except Exception as e:
+                    logger.warning(f"[API] 翻译记忆初始化失败，翻译将不使用缓存: {e}")
+            
+            # 初始化 TranslationAgent（批量翻译的并发与限流见 translation.batch）
+            translation_agent = TranslationAgent(
+                llm_service,
+                config={'batch': config.get('translation.batch', {}) or {}},
+                translation_memory=translation_memory
+            )
             logger.info(f"[API] {translation_agent.name} 初始化完成")
+            
+            # 初始化实时字幕翻译（可通过 /api/translate/live 开启或关闭）
+            live_translation_service = LiveTranslationService(
+                translation_agent,
+                publish=broadcast,
+                language_pair=config.get('translation.live.language_pair', 'zh-en'),
+                max_concurrency=config.get('translation.live.max_concurrency', 2),
+                max_pending=config.get('translation.live.max_pending', 20),
+                enabled=config.get('translation.live.enabled', False),
+                on_usage=lambda device_id, usage: _record_llm_usage(device_id, usage, "LiveTranslation")
+            )
+            
+            # 初始化滚动小结（录音过程中增量维护小结，可通过 /api/summary/rolling 开启或关闭）
+            rolling_summary_service = None
+            try:
+                data_dir = Path(config.get('storage.data_dir')).expanduser()
+                rolling_store = RollingSummaryStore(data_dir / config.get('storage.database', 'database/history.db'))
+                rolling_store.prune(config.get('summary.rolling.retention_days', 7))
+                rolling_summary_service = RollingSummaryService(
+                    llm_service,
+                    rolling_store,
+                    summary_type=config.get('summary.rolling.summary_type', 'meeting'),
+                    fold_every=config.get('summary.rolling.fold_every', 8),
+                    enabled=config.get('summary.rolling.enabled', False),
+                    on_usage=lambda device_id, usage: _record_llm_usage(device_id, usage, "RollingSummary")
+                )
+            except Exception as e:
+                logger.warning(f"[API] 滚动小结初始化失败: {e}")
         else:
             logger.warning("[API] LLM 服务不可用，请检查配置")
             summary_agent = None
             smart_chat_agent = None
             translation_agent = None
+            live_translation_service = None
+            rolling_summary_service = None
             knowledge_service = None
             
     except Exception as e:
@@ -558,6 +794,8 @@ def setup_llm_service():
         summary_agent = None
         smart_chat_agent = None
         translation_agent = None
+        live_translation_service = None
+        rolling_summary_service = None
         knowledge_service = None
 
 
@@ -696,6 +934,10 @@ async def start_recording(request: StartRecordingRequest = None):
     
     app_id = request.app_id if request else None
     
+    # 新录音的开始时间从头计，不能对应到上一次录音的 utterance
+    if live_translation_service:
+        live_translation_service.begin_recording()
+    
     try:
         success = voice_service.start_recording(app_id=app_id)
         if success:
@@ -1312,6 +1554,103 @@ async def export_record_markdown(record_id: str, format: str = 'md'):
         raise HTTPException(status_code=500, detail=f"导出失败: {str(e)}")
 
 
+@app.get("/api/export/{dataset}")
+async def export_dataset(dataset: str, format: str = 'csv', start: Optional[str] = None,
+                         end: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    批量导出数据集（流式响应，内存占用与数据量无关）
+    
+    Args:
+        dataset: 数据集，'consumption_records'、'monthly_consumption' 或 'records'（仅元数据）
+        format: 导出格式，'csv'、'arrow'（Arrow IPC 流）或 'parquet'（后两者需要 pyarrow）
+        start: 起始日期（含），如 '2025-01-01'
+        end: 结束日期（含）
+        user_id: 用户ID（可选）
+        
+    Returns:
+        文件流
+    """
+    if not data_export_service:
+        raise HTTPException(status_code=503, detail="数据导出服务未初始化")
+    
+    try:
+        # 导出消费数据前先写入队列中尚未落盘的事件（同步数据库写入，放到线程池执行）
+        if consumption_service and dataset != 'records':
+            await asyncio.get_running_loop().run_in_executor(None, consumption_service.consumption_queue.flush)
+        
+        content = data_export_service.export(dataset, format, start=start, end=end, user_id=user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"{dataset}_{start or 'all'}_{end or 'all'}.{extension}"
+    logger.info(f"[Export] 批量导出 {dataset} 为 {format}: {filename}")
+    
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"'
+        }
+    )
+
+
+@app.get("/api/sync/changes")
+async def get_sync_changes(device_id: str, since: int = 0, limit: int = 500):
+    """
+    获取多设备同步增量（记录、标签、标签关联的变更）
+    
+    客户端保存上次返回的 next_since，下次请求时作为 since 传入；has_more 为 true 时继续拉取。
+    
+    Args:
+        device_id: 设备ID（用于确定用户）
+        since: 已同步到的变更序号，首次同步传 0
+        limit: 本批最多读取的变更条数（1-2000）
+        
+    Returns:
+        {'changes': [...], 'next_since': int, 'has_more': bool}
+    """
+    if not voice_service or not voice_service.storage_provider:
+        raise HTTPException(status_code=503, detail="存储服务未初始化")
+    
+    user_id = get_user_id_by_device(device_id)
+    if not user_id:
+        raise HTTPException(status_code=404, detail="设备未绑定用户")
+    
+    try:
+        result = voice_service.storage_provider.get_changes(user_id, since=max(0, since), limit=min(max(1, limit), 2000))
+        return {"success": True, "data": result}
+    except Exception as e:
+        logger.error(f"[Sync] 获取同步增量失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"获取同步增量失败: {str(e)}")
+
+
+@app.get("/api/user/stats")
+async def get_user_stats(device_id: str):
+    """
+    获取用户统计（侧边栏计数）
+    
+    Args:
+        device_id: 设备ID（用于确定用户）
+        
+    Returns:
+        {'total', 'app_types', 'starred', 'archived', 'deleted', 'tags': [{'tag_id', 'tag_name', 'color', 'icon', 'count'}]}
+    """
+    if not voice_service or not voice_service.storage_provider:
+        raise HTTPException(status_code=503, detail="存储服务未初始化")
+    
+    user_id = get_user_id_by_device(device_id)
+    if not user_id:
+        raise HTTPException(status_code=404, detail="设备未绑定用户")
+    
+    try:
+        stats = voice_service.storage_provider.get_user_stats(user_id)
+        return {"success": True, "data": stats}
+    except Exception as e:
+        logger.error(f"[Stats] 获取用户统计失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"获取用户统计失败: {str(e)}")
+
+
 @app.delete("/api/records/{record_id}")
 async def delete_record(record_id: str):
     """删除记录"""
@@ -1410,10 +1749,23 @@ class SaveImageResponse(BaseModel):
     """保存图片响应"""
     success: bool
     image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
     message: str
     error: Optional[Dict[str, Any]] = None
 
 
+def get_image_store() -> ImageStore:
+    """获取图片存储（优先复用存储提供商的实例）"""
+    if voice_service and voice_service.storage_provider and hasattr(voice_service.storage_provider, 'image_store'):
+        return voice_service.storage_provider.image_store
+    
+    data_dir = Path(config.get('storage.data_dir')).expanduser()
+    return ImageStore(
+        data_dir / config.get('storage.images', 'images'),
+        data_dir / config.get('storage.database', 'database/history.db')
+    )
+
+
 @app.post("/api/images/save", response_model=SaveImageResponse)
 async def save_image(request: SaveImageRequest):
     """保存Base64编码的图片到本地
@@ -1446,34 +1798,28 @@ async def save_image(request: SaveImageRequest):
                 }
             )
         
-        # 创建图片存储目录
-        data_dir = Path(config.get('storage.data_dir')).expanduser()
-        images_relative = Path(config.get('storage.images'))
-        images_dir = data_dir / images_relative
-        images_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 生成唯一文件名
-        if request.filename:
-            filename = request.filename
-        else:
-            # 使用时间戳 + UUID 生成唯一文件名
-            timestamp = int(asyncio.get_event_loop().time() * 1000)
-            unique_id = str(uuid.uuid4())[:8]
-            filename = f"{timestamp}-{unique_id}.png"
+        if request.filename and ('..' in request.filename or '/' in request.filename or '\\' in request.filename):
+            return SaveImageResponse(
+                success=False,
+                message="无效的文件名",
+                error={
+                    "code": "INVALID_FILENAME",
+                    "details": request.filename
+                }
+            )
         
-        # 保存图片
-        image_path = images_dir / filename
-        with open(image_path, 'wb') as f:
-            f.write(image_bytes)
+        # 按内容哈希保存（相同图片只存一份，并预生成缩略图）
+        result = get_image_store().save(image_bytes, filename=request.filename)
         
         # 返回相对路径（前端可以通过 /api/images/{filename} 访问）
-        relative_url = f"images/{filename}"
+        relative_url = result['image_url']
         
-        logger.info(f"[API] 已保存图片: {relative_url}, 大小: {len(image_bytes)} bytes")
+        logger.info(f"[API] 已保存图片: {relative_url}, 大小: {len(image_bytes)} bytes, 复用: {result['deduplicated']}")
         
         return SaveImageResponse(
             success=True,
             image_url=relative_url,
+            thumbnail_url=result['thumbnail_url'],
             message="图片已保存"
         )
         
@@ -1521,6 +1867,27 @@ async def get_image(filename: str):
         raise HTTPException(status_code=500, detail="获取图片失败")
 
 
+@app.get("/api/images/thumbs/{filename}")
+async def get_image_thumbnail(filename: str):
+    """获取图片缩略图（列表视图使用，缩略图不存在时返回原图）
+    
+    Args:
+        filename: 图片文件名
+    
+    Returns:
+        缩略图文件
+    """
+    if '..' in filename or '/' in filename or '\\' in filename:
+        raise HTTPException(status_code=400, detail="无效的文件名")
+    
+    image_store = get_image_store()
+    thumb_path = image_store.get_thumbnail_path(filename)
+    if thumb_path:
+        return FileResponse(thumb_path)
+    
+    return await get_image(filename)
+
+
 # ==================== 音频设备管理 API ====================
 
 class AudioDeviceInfo(BaseModel):
@@ -1776,6 +2143,38 @@ async def get_llm_info():
         return LLMInfoResponse(available=False)
 
 
+@app.get("/api/llm/scheduler/stats")
+async def get_llm_scheduler_stats():
+    """获取 LLM 请求调度指标（各模型的并发、各通道排队等待时间、重试、对冲、熔断状态）"""
+    if not llm_service:
+        raise HTTPException(status_code=503, detail="LLM服务不可用")
+    
+    return {"success": True, "data": llm_service.scheduler.get_stats()}
+
+
+@app.get("/api/llm/routes")
+async def get_llm_routes():
+    """获取 LLM 路由表及各路由的健康状态、降级次数和延迟统计"""
+    if not llm_service:
+        raise HTTPException(status_code=503, detail="LLM服务不可用")
+    
+    return {"success": True, "data": llm_service.get_route_stats()}
+
+
+@app.post("/api/llm/routes/reload")
+async def reload_llm_routes():
+    """重新读取 config.yml 中的 llm 配置段（模型和路由表；新配置无可用模型时保留当前路由表）"""
+    if not llm_service:
+        raise HTTPException(status_code=503, detail="LLM服务不可用")
+    
+    try:
+        data = llm_service.reload_routes()
+    except RuntimeError as e:
+        logger.error(f"[API] 重新加载LLM路由失败: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "data": data}
+
+
 @app.post("/api/llm/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """LLM对话接口（非流式）
@@ -1823,59 +2222,42 @@ async def chat(request: ChatRequest):
         messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
         
         # 调用LLM服务
-        response = await llm_service.chat(
-            messages=messages,
-            stream=False,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens
-        )
+        with usage_scope() as usage, llm_priority(PRIORITY_INTERACTIVE):
+            response = await llm_service.chat(
+                messages=messages,
+                stream=False,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens
+            )
         
         # 记录LLM消费（如果提供了device_id）
-        if device_id and consumption_service and llm_service.llm_provider:
-            try:
-                user_id = get_user_id_by_device(device_id)
-                if not user_id:
-                    logger.warning(f"[API] 无法获取user_id，跳过LLM消费记录: device_id={device_id}")
-                else:
-                    usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                    if usage:
-                        consumption_service.record_llm_consumption(
-                            user_id=user_id,
-                            device_id=device_id,
-                            prompt_tokens=usage.get('prompt_tokens', 0),
-                            completion_tokens=usage.get('completion_tokens', 0),
-                            total_tokens=usage.get('total_tokens', 0),
-                            model=llm_service.llm_provider._config.get('model', 'unknown')
-                        )
-                        logger.info(f"[API] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-            except Exception as e:
-                logger.error(f"[API] 记录LLM消费失败: {e}", exc_info=True)
+        _record_llm_usage(device_id, usage, "API")
         
         return ChatResponse(success=True, message=response)
         
     except Exception as e:
         # LLM服务已经在内部进行了错误分类，这里捕获异常后创建错误信息
-        error_msg = str(e).lower()
+        error_kind = classify_error(e)
         
-        if "rate" in error_msg or "limit" in error_msg:
+        if error_kind == ERROR_RATE_LIMIT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_RATE_LIMIT,
                 details="请求频率超限",
                 technical_info=str(e)
             )
-        elif "auth" in error_msg or "401" in error_msg or "403" in error_msg:
+        elif error_kind == ERROR_AUTH:
             error_info = SystemErrorInfo(
                 SystemError.LLM_AUTH_FAILED,
                 details="认证失败",
                 technical_info=str(e)
             )
-        elif "timeout" in error_msg:
+        elif error_kind == ERROR_TIMEOUT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_REQUEST_TIMEOUT,
                 details="请求超时",
                 technical_info=str(e)
             )
-        elif "quota" in error_msg or "balance" in error_msg:
+        elif error_kind == ERROR_QUOTA:
             error_info = SystemErrorInfo(
                 SystemError.LLM_QUOTA_EXCEEDED,
                 details="配额已用完",
@@ -1969,21 +2351,21 @@ async def simple_chat(request: SimpleChatRequest):
             return ChatResponse(success=True, message=response)
         
     except Exception as e:
-        error_msg = str(e).lower()
+        error_kind = classify_error(e)
         
-        if "rate" in error_msg or "limit" in error_msg:
+        if error_kind == ERROR_RATE_LIMIT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_RATE_LIMIT,
                 details="请求频率超限",
                 technical_info=str(e)
             )
-        elif "auth" in error_msg or "401" in error_msg or "403" in error_msg:
+        elif error_kind == ERROR_AUTH:
             error_info = SystemErrorInfo(
                 SystemError.LLM_AUTH_FAILED,
                 details="认证失败",
                 technical_info=str(e)
             )
-        elif "timeout" in error_msg:
+        elif error_kind == ERROR_TIMEOUT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_REQUEST_TIMEOUT,
                 details="请求超时",
@@ -2017,6 +2399,13 @@ async def generate_summary(request: SummaryRequest):
     - 支持6种场景类型，每种有专门优化的提示词
     - 输入内容会自动过滤掉已有的小结块
     - 支持流式和非流式输出
+    - 启用响应缓存（llm.response_cache）时，低温度的相同请求直接返回缓存结果；
+      缓存状态在非流式响应的 cache 字段、流式响应的首个 {"cache": ...} 事件中返回
+    - 长记录使用分段模式（mode=map_reduce，或 auto 且超过阈值）：按 utterance 边界切分后并发小结再合并，
+      流式响应在每个阶段完成时发送 {"progress": {"stage": "map"|"reduce", ...}} 事件
+    - 传入 session_id（录音时 text_final 消息中的 summary_session_id）且滚动小结场景和内容一致时，
+      只需并入最后几句即可返回录音过程中维护的小结（响应中 cache 为 rolling）；
+      内容被编辑或补充过时改为完整生成
     """
     # 验证 summary_type
     valid_types = ['meeting', 'diary', 'lecture', 'interview', 'reading', 'brainstorm']
@@ -2029,6 +2418,15 @@ async def generate_summary(request: SummaryRequest):
         )
         return ChatResponse(success=False, error=error_info.to_dict())
     
+    mode = request.mode or 'auto'
+    if mode not in ('auto', 'single', 'map_reduce'):
+        error_info = SystemErrorInfo(
+            SystemError.STORAGE_INVALID_CONTENT,
+            details=f"无效的生成方式: {mode}",
+            technical_info="支持的方式: auto, single, map_reduce"
+        )
+        return ChatResponse(success=False, error=error_info.to_dict())
+    
     # 检查基础 LLM 服务是否可用
     if not llm_service or not llm_service.is_available():
         error_info = SystemErrorInfo(
@@ -2041,6 +2439,40 @@ async def generate_summary(request: SummaryRequest):
             error=error_info.to_dict()
         )
     
+    # 录音过程中已维护滚动小结：并入剩余语句后直接返回
+    if request.session_id and rolling_summary_service:
+        try:
+            rolling_summary = await rolling_summary_service.get_summary(
+                request.session_id, summary_type, request.message
+            )
+        except Exception as e:
+            logger.warning(f"[API] 读取滚动小结失败，改为完整生成: {e}")
+            rolling_summary = None
+        if rolling_summary:
+            logger.info(f"[API] 生成小结 - 复用滚动小结: {request.session_id}")
+            if not request.stream:
+                return ChatResponse(success=True, message=rolling_summary, cache='rolling')
+            
+            async def replay_rolling():
+                yield f"data: {json.dumps({'cache': 'rolling'})}\n\n"
+                yield f"data: {json.dumps({'chunk': rolling_summary}, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+            
+            return StreamingResponse(
+                replay_rolling(),
+                media_type="text/event-stream",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "Connection": "keep-alive",
+                    "X-Accel-Buffering": "no"
+                }
+            )
+    
+    map_reduce_config = (config.get('summary.map_reduce', {}) if config else None) or {}
+    use_map_reduce = mode == 'map_reduce' or (
+        mode == 'auto' and len(request.message) > map_reduce_config.get('threshold_chars', 12000)
+    )
+    
     try:
         # 根据 summary_type 动态创建 SummaryAgent（使用对应的 variant）
         from src.agents.summary_agent import SummaryAgent
@@ -2052,48 +2484,53 @@ async def generate_summary(request: SummaryRequest):
         }
         
         # 创建针对特定场景的 agent
-        current_agent = SummaryAgent(llm_service, config=agent_config)
+        current_agent = SummaryAgent(llm_service, config=agent_config, response_cache=response_cache)
+        
+        def map_reduce_events():
+            return current_agent.generate_map_reduce(
+                content=request.message,
+                chunk_chars=map_reduce_config.get('chunk_chars', 6000),
+                max_concurrency=map_reduce_config.get('max_concurrency', 4),
+                temperature=request.temperature,
+                max_tokens=request.max_tokens
+            )
         
-        logger.info(f"[API] 生成小结 - 类型: {summary_type}, 内容长度: {len(request.message)}, 流式: {request.stream}")
+        logger.info(f"[API] 生成小结 - 类型: {summary_type}, 内容长度: {len(request.message)}, "
+                    f"流式: {request.stream}, 分段: {use_map_reduce}")
         
         # 判断是否使用流式输出
         if request.stream:
             # 返回流式响应
             async def generate():
                 try:
-                    # generate_summary 返回 AsyncIterator，直接迭代
-                    async for chunk in await current_agent.generate_summary(
-                        content=request.message,
-                        stream=True,
-                        temperature=request.temperature,
-                        max_tokens=request.max_tokens
-                    ):
-                        # 使用SSE格式发送数据
-                        yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
-                    yield "data: [DONE]\n\n"
+                    with usage_scope() as usage:
+                        if use_map_reduce:
+                            # 分段小结：转发各阶段进度和最终小结片段
+                            async for event in map_reduce_events():
+                                if event['type'] == 'progress':
+                                    progress = {k: v for k, v in event.items() if k != 'type'}
+                                    yield f"data: {json.dumps({'progress': progress})}\n\n"
+                                else:
+                                    yield f"data: {json.dumps({'chunk': event['text']}, ensure_ascii=False)}\n\n"
+                        else:
+                            # generate_summary 返回 AsyncIterator，直接迭代
+                            chunks = await current_agent.generate_summary(
+                                content=request.message,
+                                stream=True,
+                                use_cache=request.use_cache,
+                                temperature=request.temperature,
+                                max_tokens=request.max_tokens
+                            )
+                            cache_status = get_cache_status()
+                            if cache_status:
+                                yield f"data: {json.dumps({'cache': cache_status})}\n\n"
+                            async for chunk in chunks:
+                                # 使用SSE格式发送数据
+                                yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
+                        yield "data: [DONE]\n\n"
                     
                     # 记录LLM消费（流式响应完成后）
-                    if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-                        try:
-                            user_id = get_user_id_by_device(request.device_id)
-                            if not user_id:
-                                logger.warning(f"[Summary] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                            else:
-                                usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                                if usage:
-                                    consumption_service.record_llm_consumption(
-                                        user_id=user_id,
-                                        device_id=request.device_id,
-                                        prompt_tokens=usage.get('prompt_tokens', 0),
-                                        completion_tokens=usage.get('completion_tokens', 0),
-                                        total_tokens=usage.get('total_tokens', 0),
-                                        model=llm_service.llm_provider._config.get('model', 'unknown'),
-                                        provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                                        model_source='vendor'
-                                    )
-                                    logger.info(f"[Summary] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-                        except Exception as e:
-                            logger.error(f"[Summary] 记录LLM消费失败: {e}", exc_info=True)
+                    _record_llm_usage(request.device_id, usage, "Summary")
                 except Exception as e:
                     logger.error(f"流式生成小结失败: {e}", exc_info=True)
                     error_info = SystemErrorInfo(
@@ -2114,37 +2551,25 @@ async def generate_summary(request: SummaryRequest):
             )
         else:
             # 非流式响应
-            summary = await current_agent.generate_summary(
-                content=request.message,
-                stream=False,
-                temperature=request.temperature,
-                max_tokens=request.max_tokens
-            )
+            with usage_scope() as usage:
+                if use_map_reduce:
+                    parts = [event['text'] async for event in map_reduce_events() if event['type'] == 'chunk']
+                    summary = current_agent.postprocess_output(''.join(parts))
+                    cache_status = None
+                else:
+                    summary = await current_agent.generate_summary(
+                        content=request.message,
+                        stream=False,
+                        use_cache=request.use_cache,
+                        temperature=request.temperature,
+                        max_tokens=request.max_tokens
+                    )
+                    cache_status = get_cache_status()
             
             # 记录LLM消费（非流式响应后）
-            if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-                try:
-                    user_id = get_user_id_by_device(request.device_id)
-                    if not user_id:
-                        logger.warning(f"[Summary] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                    else:
-                        usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                        if usage:
-                            consumption_service.record_llm_consumption(
-                                user_id=user_id,
-                                device_id=request.device_id,
-                                prompt_tokens=usage.get('prompt_tokens', 0),
-                                completion_tokens=usage.get('completion_tokens', 0),
-                                total_tokens=usage.get('total_tokens', 0),
-                                model=llm_service.llm_provider._config.get('model', 'unknown'),
-                                provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                                model_source='vendor'
-                            )
-                            logger.info(f"[Summary] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-                except Exception as e:
-                    logger.error(f"[Summary] 记录LLM消费失败: {e}", exc_info=True)
+            _record_llm_usage(request.device_id, usage, "Summary")
             
-            return ChatResponse(success=True, message=summary)
+            return ChatResponse(success=True, message=summary, cache=cache_status)
         
     except ValueError as e:
         # 输入验证错误
@@ -2156,15 +2581,15 @@ async def generate_summary(request: SummaryRequest):
         )
         return ChatResponse(success=False, error=error_info.to_dict())
     except Exception as e:
-        error_msg = str(e).lower()
+        error_kind = classify_error(e)
         
-        if "rate" in error_msg or "limit" in error_msg:
+        if error_kind == ERROR_RATE_LIMIT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_RATE_LIMIT,
                 details="请求频率超限",
                 technical_info=str(e)
             )
-        elif "timeout" in error_msg:
+        elif error_kind == ERROR_TIMEOUT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_REQUEST_TIMEOUT,
                 details="请求超时",
@@ -2181,6 +2606,42 @@ async def generate_summary(request: SummaryRequest):
         return ChatResponse(success=False, error=error_info.to_dict())
 
 
+@app.post("/api/summary/rolling")
+async def set_rolling_summary(request: RollingSummaryRequest):
+    """
+    开启或关闭录音过程中的滚动小结
+    
+    开启后，录音中每条确定的 utterance（text_final 消息，带 summary_session_id）会累积到当前会话，
+    每 fold_every 条通过增量提示词并入小结；生成小结时传入 session_id 即可直接复用。
+    """
+    if not rolling_summary_service or not llm_service or not llm_service.is_available():
+        raise HTTPException(status_code=503, detail="小结服务不可用")
+    
+    valid_types = ['meeting', 'diary', 'lecture', 'interview', 'reading', 'brainstorm']
+    if request.summary_type and request.summary_type not in valid_types:
+        raise HTTPException(status_code=400, detail=f"无效的小结类型: {request.summary_type}")
+    
+    rolling_summary_service.configure(request.enabled, request.summary_type, request.fold_every, request.device_id)
+    return {"success": True, "data": rolling_summary_service.get_stats(request.device_id)}
+
+
+@app.get("/api/summary/rolling")
+async def get_rolling_summary(device_id: Optional[str] = None):
+    """获取滚动小结状态（是否开启、设备当前会话、待并入语句数）"""
+    if not rolling_summary_service:
+        raise HTTPException(status_code=503, detail="小结服务不可用")
+    return {"success": True, "data": rolling_summary_service.get_stats(device_id)}
+
+
+@app.get("/api/summary/cache/stats")
+async def get_summary_cache_stats():
+    """获取响应缓存指标（条目数、命中率、淘汰数）"""
+    if not response_cache:
+        raise HTTPException(status_code=503, detail="响应缓存未启用")
+    
+    return {"success": True, "data": response_cache.get_stats()}
+
+
 # ==================== 翻译 API ====================
 
 @app.post("/api/translate")
@@ -2212,11 +2673,12 @@ async def translate_text(request: TranslateRequest):
                 raise ValueError("流式翻译暂不支持 language_pair 参数")
             else:
                 # 非流式翻译
-                result = await translation_agent.translate_with_pair(
-                    text=request.text,
-                    pair_key=request.language_pair,
-                    stream=False
-                )
+                with usage_scope() as usage:
+                    result = await translation_agent.translate_with_pair(
+                        text=request.text,
+                        pair_key=request.language_pair,
+                        stream=False
+                    )
                 
                 # 检查是否是错误结果（语种不匹配）
                 if isinstance(result, dict) and 'error' in result:
@@ -2232,27 +2694,7 @@ async def translate_text(request: TranslateRequest):
                     }
                 
                 # 记录LLM消费（非流式翻译完成后）
-                if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-                    try:
-                        user_id = get_user_id_by_device(request.device_id)
-                        if not user_id:
-                            logger.warning(f"[Translation] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                        else:
-                            usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                            if usage:
-                                consumption_service.record_llm_consumption(
-                                    user_id=user_id,
-                                    device_id=request.device_id,
-                                    prompt_tokens=usage.get('prompt_tokens', 0),
-                                    completion_tokens=usage.get('completion_tokens', 0),
-                                    total_tokens=usage.get('total_tokens', 0),
-                                    model=llm_service.llm_provider._config.get('model', 'unknown'),
-                                    provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                                    model_source='vendor'
-                                )
-                                logger.info(f"[Translation] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-                    except Exception as e:
-                        logger.error(f"[Translation] 记录LLM消费失败: {e}", exc_info=True)
+                _record_llm_usage(request.device_id, usage, "Translation")
                 
                 return {
                     "success": True,
@@ -2267,40 +2709,21 @@ async def translate_text(request: TranslateRequest):
                 # 流式翻译
                 async def generate():
                     try:
-                        result = await translation_agent.translate(
-                            text=request.text,
-                            source_lang=request.source_lang,
-                            target_lang=request.target_lang,
-                            stream=True
-                        )
+                        with usage_scope() as usage:
+                            result = await translation_agent.translate(
+                                text=request.text,
+                                source_lang=request.source_lang,
+                                target_lang=request.target_lang,
+                                stream=True
+                            )
                         
-                        async for chunk in result:
-                            yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
+                            async for chunk in result:
+                                yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
                         
-                        yield "data: [DONE]\n\n"
+                            yield "data: [DONE]\n\n"
                         
                         # 记录LLM消费（流式翻译完成后）
-                        if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-                            try:
-                                user_id = get_user_id_by_device(request.device_id)
-                                if not user_id:
-                                    logger.warning(f"[Translation] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                                else:
-                                    usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                                    if usage:
-                                        consumption_service.record_llm_consumption(
-                                            user_id=user_id,
-                                            device_id=request.device_id,
-                                            prompt_tokens=usage.get('prompt_tokens', 0),
-                                            completion_tokens=usage.get('completion_tokens', 0),
-                                            total_tokens=usage.get('total_tokens', 0),
-                                            model=llm_service.llm_provider._config.get('model', 'unknown'),
-                                            provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                                            model_source='vendor'
-                                        )
-                                        logger.info(f"[Translation] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-                            except Exception as e:
-                                logger.error(f"[Translation] 记录LLM消费失败: {e}", exc_info=True)
+                        _record_llm_usage(request.device_id, usage, "Translation")
                         
                     except Exception as e:
                         logger.error(f"[API] 流式翻译失败: {e}")
@@ -2321,35 +2744,16 @@ async def translate_text(request: TranslateRequest):
                 )
             else:
                 # 非流式翻译
-                result = await translation_agent.translate(
-                    text=request.text,
-                    source_lang=request.source_lang,
-                    target_lang=request.target_lang,
-                    stream=False
-                )
+                with usage_scope() as usage:
+                    result = await translation_agent.translate(
+                        text=request.text,
+                        source_lang=request.source_lang,
+                        target_lang=request.target_lang,
+                        stream=False
+                    )
                 
                 # 记录LLM消费（非流式翻译完成后）
-                if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-                    try:
-                        user_id = get_user_id_by_device(request.device_id)
-                        if not user_id:
-                            logger.warning(f"[Translation] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                        else:
-                            usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                            if usage:
-                                consumption_service.record_llm_consumption(
-                                    user_id=user_id,
-                                    device_id=request.device_id,
-                                    prompt_tokens=usage.get('prompt_tokens', 0),
-                                    completion_tokens=usage.get('completion_tokens', 0),
-                                    total_tokens=usage.get('total_tokens', 0),
-                                    model=llm_service.llm_provider._config.get('model', 'unknown'),
-                                    provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                                    model_source='vendor'
-                                )
-                                logger.info(f"[Translation] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-                    except Exception as e:
-                        logger.error(f"[Translation] 记录LLM消费失败: {e}", exc_info=True)
+                _record_llm_usage(request.device_id, usage, "Translation")
                 
                 return {
                     "success": True,
@@ -2386,50 +2790,29 @@ async def batch_translate(request: BatchTranslateRequest):
         return {"success": False, "error": error_info.to_dict()}
     
     try:
-        # 优先使用 language_pair（双向互译）
-        if request.language_pair:
-            logger.info(f"[API] 使用语言对批量翻译: {request.language_pair}, 文本数={len(request.texts)}")
-            results = await translation_agent.batch_translate_with_pair(
-                texts=request.texts,
-                pair_key=request.language_pair
-            )
-        # 否则使用固定方向翻译（向后兼容）
-        elif request.source_lang and request.target_lang:
-            logger.info(f"[API] 使用固定方向批量翻译: {request.source_lang} -> {request.target_lang}")
-            results = await translation_agent.batch_translate(
-                texts=request.texts,
-                source_lang=request.source_lang,
-                target_lang=request.target_lang
-            )
-        else:
-            raise ValueError("必须提供 language_pair 或 (source_lang + target_lang)")
+        # 批量翻译的每条调用都记入同一个用量上下文
+        with usage_scope() as usage, llm_priority(PRIORITY_BATCH):
+            # 优先使用 language_pair（双向互译）
+            if request.language_pair:
+                logger.info(f"[API] 使用语言对批量翻译: {request.language_pair}, 文本数={len(request.texts)}")
+                results = await translation_agent.batch_translate_with_pair(
+                    texts=request.texts,
+                    pair_key=request.language_pair
+                )
+            # 否则使用固定方向翻译（向后兼容）
+            elif request.source_lang and request.target_lang:
+                logger.info(f"[API] 使用固定方向批量翻译: {request.source_lang} -> {request.target_lang}")
+                results = await translation_agent.batch_translate(
+                    texts=request.texts,
+                    source_lang=request.source_lang,
+                    target_lang=request.target_lang
+                )
+            else:
+                raise ValueError("必须提供 language_pair 或 (source_lang + target_lang)")
         
-        # 记录LLM消费（批量翻译完成后）
-        # 注意：批量翻译是循环调用单条翻译，get_last_usage()只能获取最后一次调用的token使用量
-        # 如果需要精确统计，需要在批量翻译循环中累加每次调用的token使用量
-        if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-            try:
-                user_id = get_user_id_by_device(request.device_id)
-                if not user_id:
-                    logger.warning(f"[Translation] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                else:
-                    usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                    if usage:
-                        # 注意：这里只记录了最后一次翻译的token使用量
-                        # 批量翻译实际消耗的token可能更多（等于所有单条翻译的token总和）
-                        consumption_service.record_llm_consumption(
-                            user_id=user_id,
-                            device_id=request.device_id,
-                            prompt_tokens=usage.get('prompt_tokens', 0),
-                            completion_tokens=usage.get('completion_tokens', 0),
-                            total_tokens=usage.get('total_tokens', 0),
-                            model=llm_service.llm_provider._config.get('model', 'unknown'),
-                            provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                            model_source='vendor'
-                        )
-                        logger.info(f"[Translation] ✅ LLM消费已记录（批量翻译，仅最后一次）: user_id={user_id}, {usage['total_tokens']} tokens")
-            except Exception as e:
-                logger.error(f"[Translation] 记录LLM消费失败: {e}", exc_info=True)
+        
+        # 记录LLM消费（批量翻译完成后，包含每条翻译调用的用量）
+        _record_llm_usage(request.device_id, usage, "Translation")
         
         return {
             "success": True,
@@ -2446,6 +2829,43 @@ async def batch_translate(request: BatchTranslateRequest):
         raise HTTPException(status_code=500, detail=error_info.to_dict())
 
 
+@app.post("/api/translate/live")
+async def set_live_translation(request: LiveTranslationRequest):
+    """
+    开启或关闭实时字幕翻译
+    
+    开启后，录音中每条确定的 utterance（text_final 消息，带 utterance_id）会在服务端翻译，
+    译文以 type=translation 的消息写入同一消息流（/api/messages），通过 utterance_id 对应原文。
+    """
+    if not live_translation_service or not translation_agent or not translation_agent.is_available():
+        raise HTTPException(status_code=503, detail="翻译服务不可用")
+    
+    try:
+        live_translation_service.configure(request.enabled, request.language_pair, request.device_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "data": live_translation_service.get_stats()}
+
+
+@app.get("/api/translate/live")
+async def get_live_translation():
+    """获取实时字幕翻译状态（是否开启、语言对、积压与丢弃数）"""
+    if not live_translation_service:
+        raise HTTPException(status_code=503, detail="翻译服务不可用")
+    return {"success": True, "data": live_translation_service.get_stats()}
+
+
+@app.get("/api/translate/memory/stats")
+async def get_translation_memory_stats():
+    """获取翻译记忆缓存指标（条目数、命中率、淘汰与失效数）"""
+    if not translation_agent or not translation_agent.translation_memory:
+        raise HTTPException(status_code=503, detail="翻译记忆未启用")
+    
+    stats = translation_agent.translation_memory.get_stats()
+    stats['prompt_version'] = translation_agent.prompt_version
+    return {"success": True, "data": stats}
+
+
 # ==================== SmartChat API ====================
 
 class SmartChatRequest(BaseModel):
@@ -2458,11 +2878,18 @@ class SmartChatRequest(BaseModel):
     temperature: Optional[float] = Field(default=None, description="温度参数")
     max_tokens: Optional[int] = Field(default=None, description="最大token数")
     device_id: Optional[str] = Field(default=None, description="设备ID（用于消费记录）")
+    conversation_id: Optional[str] = Field(default=None, description="对话ID（为空时开始新对话）")
+
+
+class SmartChatClearRequest(BaseModel):
+    """结束 SmartChat 对话请求模型"""
+    conversation_id: Optional[str] = Field(default=None, description="对话ID")
 
 
 class SmartChatHistoryResponse(BaseModel):
     """对话历史响应"""
     success: bool
+    conversation_id: Optional[str] = None
     total_turns: int
     total_messages: int
     has_knowledge_service: bool
@@ -2473,7 +2900,7 @@ async def smart_chat(request: SmartChatRequest):
     """SmartChat 智能对话
     
     功能：
-    - 支持多轮对话（自动管理上下文）
+    - 支持多轮对话（按对话ID管理上下文，不同对话互不影响）
     - 自动检索知识库（如果可用）
     - 流式和非流式输出
     
@@ -2482,8 +2909,11 @@ async def smart_chat(request: SmartChatRequest):
         "message": "你好，请介绍一下知识库的内容",
         "stream": true,
         "use_history": true,
-        "use_knowledge": true
+        "use_knowledge": true,
+        "conversation_id": null
     }
+    
+    响应中的 conversation_id（流式输出时在 [DONE] 之前单独发送）用于后续消息继续该对话。
     """
     if not smart_chat_agent or not smart_chat_agent.is_available():
         error_info = SystemErrorInfo(
@@ -2496,13 +2926,20 @@ async def smart_chat(request: SmartChatRequest):
             error=error_info.to_dict()
         )
     
-    try:
+    session = smart_chat_agent.get_session(request.conversation_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"对话不存在: {request.conversation_id}")
+    
+    user_id = get_user_id_by_device(request.device_id) if request.device_id else None
+    if request.conversation_id:
+        # 已有对话只能由其所属用户继续，不接管他人的对话
+        if session.user_id != user_id:
+            raise HTTPException(status_code=404, detail=f"对话不存在: {request.conversation_id}")
+    elif user_id:
         # 设置用户信息（用于保存记录）
-        if request.device_id:
-            user_id = get_user_id_by_device(request.device_id)
-            if user_id:
-                smart_chat_agent.set_user_info(user_id, request.device_id)
-        
+        session.set_user_info(user_id, request.device_id)
+    
+    try:
         # 准备参数
         kwargs = {}
         if request.temperature is not None:
@@ -2514,44 +2951,26 @@ async def smart_chat(request: SmartChatRequest):
             # 流式响应
             async def generate():
                 try:
-                    result = await smart_chat_agent.chat(
-                        user_message=request.message,
-                        stream=True,
-                        use_history=request.use_history,
-                        use_knowledge=request.use_knowledge,
-                        knowledge_top_k=request.knowledge_top_k,
-                        **kwargs
-                    )
+                    with usage_scope() as usage, llm_priority(PRIORITY_INTERACTIVE):
+                        result = await smart_chat_agent.chat(
+                            user_message=request.message,
+                            stream=True,
+                            use_history=request.use_history,
+                            use_knowledge=request.use_knowledge,
+                            knowledge_top_k=request.knowledge_top_k,
+                            session=session,
+                            **kwargs
+                        )
                     
-                    async for chunk in result:
-                        yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
+                        async for chunk in result:
+                            yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
                     
-                    yield "data: [DONE]\n\n"
+                        if session.conversation_id:
+                            yield f"data: {json.dumps({'conversation_id': session.conversation_id})}\n\n"
+                        yield "data: [DONE]\n\n"
                     
                     # 记录LLM消费（如果提供了device_id）
-                    logger.info(f"[SmartChat] 准备记录LLM消费: device_id={request.device_id}, consumption_service={consumption_service is not None}, llm_service={llm_service is not None}")
-                    if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-                        try:
-                            user_id = get_user_id_by_device(request.device_id)
-                            if not user_id:
-                                logger.warning(f"[SmartChat] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                            else:
-                                usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                                logger.info(f"[SmartChat] 获取usage: {usage}")
-                                if usage:
-                                    consumption_service.record_llm_consumption(
-                                        user_id=user_id,
-                                        device_id=request.device_id,
-                                        prompt_tokens=usage.get('prompt_tokens', 0),
-                                        completion_tokens=usage.get('completion_tokens', 0),
-                                        total_tokens=usage.get('total_tokens', 0),
-                                        model=llm_service.llm_provider._config.get('model', 'unknown'),
-                                        provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                                        model_source='vendor'
-                                    )
-                                    logger.info(f"[SmartChat] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-                        except Exception as e:
-                            logger.error(f"[SmartChat] 记录LLM消费失败: {e}", exc_info=True)
+                    _record_llm_usage(request.device_id, usage, "SmartChat")
                     
                 except Exception as e:
                     logger.error(f"SmartChat 流式生成失败: {e}", exc_info=True)
@@ -2573,51 +2992,33 @@ async def smart_chat(request: SmartChatRequest):
             )
         else:
             # 非流式响应
-            response = await smart_chat_agent.chat(
-                user_message=request.message,
-                stream=False,
-                use_history=request.use_history,
-                use_knowledge=request.use_knowledge,
-                knowledge_top_k=request.knowledge_top_k,
-                **kwargs
-            )
+            with usage_scope() as usage, llm_priority(PRIORITY_INTERACTIVE):
+                response = await smart_chat_agent.chat(
+                    user_message=request.message,
+                    stream=False,
+                    use_history=request.use_history,
+                    use_knowledge=request.use_knowledge,
+                    knowledge_top_k=request.knowledge_top_k,
+                    session=session,
+                    **kwargs
+                )
             
             # 记录LLM消费（如果提供了device_id）
-            if request.device_id and consumption_service and llm_service and llm_service.llm_provider:
-                try:
-                    user_id = get_user_id_by_device(request.device_id)
-                    if not user_id:
-                        logger.warning(f"[SmartChat] 无法获取user_id，跳过LLM消费记录: device_id={request.device_id}")
-                    else:
-                        usage = llm_service.llm_provider.get_last_usage() if hasattr(llm_service.llm_provider, 'get_last_usage') else None
-                        if usage:
-                            consumption_service.record_llm_consumption(
-                                user_id=user_id,
-                                device_id=request.device_id,
-                                prompt_tokens=usage.get('prompt_tokens', 0),
-                                completion_tokens=usage.get('completion_tokens', 0),
-                                total_tokens=usage.get('total_tokens', 0),
-                                model=llm_service.llm_provider._config.get('model', 'unknown'),
-                                provider=llm_service.llm_provider._config.get('provider', 'unknown'),
-                                model_source='vendor'
-                            )
-                            logger.info(f"[SmartChat] ✅ LLM消费已记录: user_id={user_id}, {usage['total_tokens']} tokens")
-                except Exception as e:
-                    logger.error(f"[SmartChat] 记录LLM消费失败: {e}", exc_info=True)
+            _record_llm_usage(request.device_id, usage, "SmartChat")
             
-            return ChatResponse(success=True, message=response)
+            return ChatResponse(success=True, message=response, conversation_id=session.conversation_id)
     
     except Exception as e:
         logger.error(f"SmartChat 对话失败: {e}", exc_info=True)
-        error_msg = str(e).lower()
+        error_kind = classify_error(e)
         
-        if "rate" in error_msg or "limit" in error_msg:
+        if error_kind == ERROR_RATE_LIMIT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_RATE_LIMIT,
                 details="请求频率超限",
                 technical_info=str(e)
             )
-        elif "timeout" in error_msg:
+        elif error_kind == ERROR_TIMEOUT:
             error_info = SystemErrorInfo(
                 SystemError.LLM_REQUEST_TIMEOUT,
                 details="请求超时",
@@ -2634,22 +3035,30 @@ async def smart_chat(request: SmartChatRequest):
 
 
 @app.post("/api/smartchat/clear_history")
-async def clear_chat_history():
-    """清空对话历史"""
+async def clear_chat_history(request: Optional[SmartChatClearRequest] = None):
+    """结束对话（只影响指定的对话，已保存的记录保留）
+    
+    客户端清空界面后不再传 conversation_id，下一条消息即开始新对话。
+    """
     if not smart_chat_agent:
         raise HTTPException(status_code=503, detail="SmartChat 服务不可用")
     
-    smart_chat_agent.clear_history()
+    if request and request.conversation_id:
+        smart_chat_agent.clear_history(request.conversation_id)
     return {"success": True, "message": "对话历史已清空"}
 
 
 @app.get("/api/smartchat/history_status")
-async def get_history_status():
+async def get_history_status(conversation_id: Optional[str] = None):
     """获取对话历史状态"""
     if not smart_chat_agent:
         raise HTTPException(status_code=503, detail="SmartChat 服务不可用")
     
-    summary = smart_chat_agent.get_conversation_summary()
+    session = smart_chat_agent.get_session(conversation_id) if conversation_id else None
+    if conversation_id and session is None:
+        raise HTTPException(status_code=404, detail=f"对话不存在: {conversation_id}")
+    
+    summary = smart_chat_agent.get_conversation_summary(session)
     return SmartChatHistoryResponse(success=True, **summary)
 
 
@@ -2753,6 +3162,25 @@ async def get_cleanup_status():
     }
 
 
+@app.get("/api/storage/migrations/status")
+async def get_migration_status():
+    """获取数据库迁移状态和回填进度"""
+    if not migration_runner:
+        return {
+            "success": False,
+            "message": "数据库迁移执行器未初始化"
+        }
+    
+    try:
+        return {
+            "success": True,
+            "data": migration_runner.get_status()
+        }
+    except Exception as e:
+        logger.error(f"[API] 获取迁移状态失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"获取迁移状态失败: {str(e)}")
+
+
 # ==================== 知识库 API ====================
 
 class KnowledgeUploadRequest(BaseModel):
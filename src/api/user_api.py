@@ -309,6 +309,18 @@ async def unbind_device(device_id: str):
         )
 
 
+@router.get("/cache/stats")
+async def get_identity_cache_stats():
+    """获取设备→用户映射缓存的命中率等指标"""
+    if not user_storage:
+        raise HTTPException(status_code=503, detail="用户服务未初始化")
+    
+    return {
+        "success": True,
+        "data": user_storage.identity_cache.get_stats()
+    }
+
+
 @router.get("/devices/{user_id}")
 async def get_user_devices(user_id: str):
     """获取用户的所有设备"""
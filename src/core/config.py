@@ -83,6 +83,20 @@ class Config:
         print("[配置] 使用默认配置")
         return self._default_config()
     
+    def read_section(self, key: str) -> Any:
+        """从 config.yml 重新读取一个配置段（支持点号分隔的嵌套键）
+        
+        只返回文件中的当前内容，不修改已加载的配置，供单个服务热加载自己的配置段使用。
+        文件不存在或没有该配置段时返回 None。
+        """
+        if not self.project_config_file.exists():
+            return None
+        with open(self.project_config_file, 'r', encoding='utf-8') as f:
+            value = yaml.safe_load(f) or {}
+        for k in key.split('.'):
+            value = value.get(k) if isinstance(value, dict) else None
+        return value
+    
     def _default_config(self) -> Dict[str, Any]:
         """默认配置"""
         return {
@@ -2,6 +2,11 @@
 LLM Provider 模块
 """
 from .litellm_provider import LiteLLMProvider
+from .usage import LLMUsage, usage_scope, get_current_usage
+from .scheduler import LLMRequestScheduler, CircuitOpenError, classify_error, llm_priority
 
-__all__ = ['LiteLLMProvider']
+__all__ = [
+    'LiteLLMProvider', 'LLMUsage', 'usage_scope', 'get_current_usage',
+    'LLMRequestScheduler', 'CircuitOpenError', 'classify_error', 'llm_priority',
+]
 
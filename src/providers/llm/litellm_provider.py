@@ -3,8 +3,9 @@ LiteLLM 提供商实现
 支持通过 LiteLLM 统一调用多种 LLM 服务
 """
 import logging
-from typing import Dict, Any, AsyncIterator, Union, Tuple, Optional
+from typing import Dict, Any, AsyncIterator, Union, Tuple
 from .base_llm import BaseLLMProvider
+from .usage import record_usage
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +24,6 @@ class LiteLLMProvider(BaseLLMProvider):
     def __init__(self):
         super().__init__()
         self._client = None
-        self._last_usage: Optional[Dict[str, int]] = None  # 最后一次调用的token使用情况
     
     @property
     def name(self) -> str:
@@ -138,18 +138,9 @@ class LiteLLMProvider(BaseLLMProvider):
                 response = await litellm.acompletion(**request_params)
                 content = response.choices[0].message.content
                 
-                # 提取token使用信息
+                # 提取token使用信息，记入当前请求的用量上下文
                 if hasattr(response, 'usage') and response.usage:
-                    self._last_usage = {
-                        'prompt_tokens': response.usage.prompt_tokens,
-                        'completion_tokens': response.usage.completion_tokens,
-                        'total_tokens': response.usage.total_tokens
-                    }
-                    logger.info(f"[LiteLLM] Token使用: prompt={self._last_usage['prompt_tokens']}, "
-                              f"completion={self._last_usage['completion_tokens']}, "
-                              f"total={self._last_usage['total_tokens']}")
-                else:
-                    self._last_usage = None
+                    self._record_usage(response.usage, "Token使用")
                 
                 logger.info(f"[LiteLLM] 收到响应，长度: {len(content)}")
                 return content
@@ -172,40 +163,42 @@ class LiteLLMProvider(BaseLLMProvider):
             
             response = await litellm.acompletion(**request_params)
             
-            # 重置token使用信息
-            self._last_usage = None
-            
+            usage = None
             async for chunk in response:
                 # 提取token使用信息（流式响应中通常在最后一个chunk）
                 if hasattr(chunk, 'usage') and chunk.usage:
-                    self._last_usage = {
-                        'prompt_tokens': chunk.usage.prompt_tokens,
-                        'completion_tokens': chunk.usage.completion_tokens,
-                        'total_tokens': chunk.usage.total_tokens
-                    }
+                    usage = chunk.usage
                 
-                if chunk.choices[0].delta.content:
+                if chunk.choices and chunk.choices[0].delta.content:
                     content = chunk.choices[0].delta.content
                     yield content
             
-            # 流式结束后记录token使用
-            if self._last_usage:
-                logger.info(f"[LiteLLM] 流式完成，Token使用: prompt={self._last_usage['prompt_tokens']}, "
-                          f"completion={self._last_usage['completion_tokens']}, "
-                          f"total={self._last_usage['total_tokens']}")
+            # 流式结束后记入用量（每次调用各自持有，不与并发请求共享）
+            if usage:
+                self._record_usage(usage, "流式完成，Token使用")
                     
         except Exception as e:
             logger.error(f"[LiteLLM] 流式响应错误: {e}")
             raise
     
-    def get_last_usage(self) -> Optional[Dict[str, int]]:
-        """获取最后一次调用的token使用情况
+    def _record_usage(self, usage: Any, label: str):
+        """将一次调用的token使用情况记入当前请求的用量上下文
         
-        Returns:
-            包含 prompt_tokens, completion_tokens, total_tokens 的字典，
-            如果没有可用数据则返回 None
+        Args:
+            usage: LiteLLM 返回的 usage 对象
+            label: 日志说明
         """
-        return self._last_usage
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        total_tokens = usage.total_tokens or 0
+        logger.info(f"[LiteLLM] {label}: prompt={prompt_tokens}, "
+                  f"completion={completion_tokens}, "
+                  f"total={total_tokens}")
+        record_usage(
+            prompt_tokens, completion_tokens, total_tokens,
+            model=self._config.get('model', 'unknown'),
+            provider=self._config.get('provider', 'unknown')
+        )
     
     def is_available(self) -> bool:
         """检查服务是否可用"""
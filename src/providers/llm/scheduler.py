@@ -0,0 +1,522 @@
+"""
+LLM 请求调度
+
+功能：
+- 每个模型一个并发上限，排队的请求按优先级通道出队（交互对话 > 普通 > 批量后台任务），同一通道先到先得
+- 可重试的错误（频率限制、超时、5xx、连接错误）按指数退避加随机抖动重试，服务端返回 Retry-After 时至少等待该时间
+- 每个请求有总时间预算，排队、重试等待和各次尝试都计入
+- 熔断：同一模型连续失败达到阈值后，冷却期内的请求直接失败；冷却结束后放行一个探测请求，
+  探测请求被取消或排队超时（未得出结果）时由下一个请求重新探测
+- 对冲请求（可选）：非流式请求超过对冲延迟仍未返回且有空闲并发时，再发一份相同的请求，先成功者胜出
+- 统计各通道的排队等待时间、重试、对冲、熔断和各类错误次数
+
+优先级通过 llm_priority() 设置（与 usage_scope 一样由 contextvars 传递），也可在提交时显式指定。
+流式请求只在收到第一个片段之前重试，开始输出后出错直接抛出。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道（数值越小越先出队）
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_BATCH = 'batch'
+_LANE_RANK = {PRIORITY_INTERACTIVE: 0, PRIORITY_NORMAL: 1, PRIORITY_BATCH: 2}
+
+# 错误分类
+ERROR_RATE_LIMIT = 'rate_limit'
+ERROR_TIMEOUT = 'timeout'
+ERROR_SERVER = 'server'
+ERROR_CONNECTION = 'connection'
+ERROR_AUTH = 'auth'
+ERROR_QUOTA = 'quota'
+ERROR_CIRCUIT_OPEN = 'circuit_open'
+ERROR_OTHER = 'other'
+
+# 可重试（同时计入熔断）的错误
+RETRYABLE_ERRORS = frozenset({ERROR_RATE_LIMIT, ERROR_TIMEOUT, ERROR_SERVER, ERROR_CONNECTION})
+
+# 排队等待 / 延迟样本保留数（用于计算分位数）
+_SAMPLE_SIZE = 1000
+
+_current_priority: ContextVar[str] = ContextVar('llm_priority', default=PRIORITY_NORMAL)
+
+
+class CircuitOpenError(RuntimeError):
+    """模型处于熔断状态，请求未发送"""
+
+
+@contextmanager
+def llm_priority(priority: str) -> Iterator[str]:
+    """在作用域内以指定优先级通道发送 LLM 请求
+
+    Args:
+        priority: PRIORITY_INTERACTIVE / PRIORITY_NORMAL / PRIORITY_BATCH
+    """
+    if priority not in _LANE_RANK:
+        raise ValueError(f"未知的优先级通道: {priority}")
+    token = _current_priority.set(priority)
+    try:
+        yield priority
+    finally:
+        try:
+            _current_priority.reset(token)
+        except ValueError:
+            pass
+
+
+def get_current_priority() -> str:
+    """获取当前上下文的优先级通道"""
+    return _current_priority.get()
+
+
+def classify_error(exc: BaseException) -> str:
+    """按异常类型、HTTP 状态码和错误信息分类
+
+    Returns:
+        ERROR_* 常量之一
+    """
+    if isinstance(exc, CircuitOpenError):
+        return ERROR_CIRCUIT_OPEN
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return ERROR_TIMEOUT
+
+    status = getattr(exc, 'status_code', None)
+    status = status if isinstance(status, int) else None
+    name = type(exc).__name__.lower()
+    message = str(exc).lower()
+
+    if 'quota' in message or 'balance' in message or 'insufficient' in message:
+        return ERROR_QUOTA
+    if status == 429 or 'ratelimit' in name or 'rate limit' in message or 'too many requests' in message:
+        return ERROR_RATE_LIMIT
+    if status in (401, 403) or 'authentication' in name or 'permissiondenied' in name:
+        return ERROR_AUTH
+    if 'timeout' in name or 'timeout' in message or 'timed out' in message:
+        return ERROR_TIMEOUT
+    if (status is not None and status >= 500) or 'serviceunavailable' in name or 'internalserver' in name:
+        return ERROR_SERVER
+    if isinstance(exc, ConnectionError) or 'connection' in name:
+        return ERROR_CONNECTION
+    return ERROR_OTHER
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """读取服务端建议的重试等待时间（秒）"""
+    value = getattr(exc, 'retry_after', None)
+    if value is None:
+        headers = getattr(getattr(exc, 'response', None), 'headers', None)
+        if headers is not None:
+            try:
+                value = headers.get('retry-after')
+            except Exception:
+                value = None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize_samples(samples) -> Dict[str, float]:
+    """样本的平均值、p50、p95、最大值（毫秒）"""
+    if not samples:
+        return {'count': 0, 'avg_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'avg_ms': round(sum(ordered) / len(ordered) * 1000, 1),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 1),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        'max_ms': round(ordered[-1] * 1000, 1),
+    }
+
+
+class _ModelState:
+    """单个模型的并发、熔断状态和统计"""
+
+    def __init__(self, model: str, max_concurrency: int):
+        self.model = model
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.in_flight = 0
+        self.waiters: list = []
+        self.queued: Counter = Counter()
+
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+        self.requests = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+        self.circuit_opens = 0
+        self.errors: Counter = Counter()
+        self.queue_waits: Dict[str, deque] = {lane: deque(maxlen=_SAMPLE_SIZE) for lane in _LANE_RANK}
+        self.latencies: deque = deque(maxlen=_SAMPLE_SIZE)
+
+
+class LLMRequestScheduler:
+    """LLM 请求调度器"""
+
+    def __init__(self, max_concurrency: int = 8, model_concurrency: Optional[Dict[str, int]] = None,
+                 max_retries: int = 3, base_backoff_seconds: float = 0.5, max_backoff_seconds: float = 8.0,
+                 timeout_seconds: float = 120.0, attempt_timeout_seconds: float = 60.0,
+                 hedge_after_seconds: float = 0.0, circuit_failure_threshold: int = 5,
+                 circuit_cooldown_seconds: float = 30.0):
+        """初始化调度器
+
+        Args:
+            max_concurrency: 每个模型的默认并发上限
+            model_concurrency: 按模型覆盖并发上限 {model: n}
+            max_retries: 最多重试次数
+            base_backoff_seconds: 退避基数（第 n 次重试的等待上限为 base * 2^n）
+            max_backoff_seconds: 单次退避等待上限
+            timeout_seconds: 单个请求的总时间预算（含排队和重试）
+            attempt_timeout_seconds: 单次尝试的超时（流式请求为首个片段的超时）
+            hedge_after_seconds: 非流式请求超过该时间未返回时发送对冲请求（0 表示不对冲）
+            circuit_failure_threshold: 连续失败多少次后熔断（0 表示不熔断）
+            circuit_cooldown_seconds: 熔断冷却时间
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.model_concurrency = dict(model_concurrency or {})
+        self.max_retries = max(0, int(max_retries))
+        self.base_backoff_seconds = max(0.0, float(base_backoff_seconds))
+        self.max_backoff_seconds = max(0.0, float(max_backoff_seconds))
+        self.timeout_seconds = max(0.001, float(timeout_seconds))
+        self.attempt_timeout_seconds = max(0.001, float(attempt_timeout_seconds))
+        self.hedge_after_seconds = max(0.0, float(hedge_after_seconds))
+        self.circuit_failure_threshold = max(0, int(circuit_failure_threshold))
+        self.circuit_cooldown_seconds = max(0.0, float(circuit_cooldown_seconds))
+
+        self._models: Dict[str, _ModelState] = {}
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'LLMRequestScheduler':
+        """从 llm.scheduler 配置创建"""
+        return cls(
+            max_concurrency=config.get('max_concurrency', 8),
+            model_concurrency=config.get('model_concurrency') or {},
+            max_retries=config.get('max_retries', 3),
+            base_backoff_seconds=config.get('base_backoff_seconds', 0.5),
+            max_backoff_seconds=config.get('max_backoff_seconds', 8.0),
+            timeout_seconds=config.get('timeout_seconds', 120.0),
+            attempt_timeout_seconds=config.get('attempt_timeout_seconds', 60.0),
+            hedge_after_seconds=config.get('hedge_after_seconds', 0.0),
+            circuit_failure_threshold=config.get('circuit_failure_threshold', 5),
+            circuit_cooldown_seconds=config.get('circuit_cooldown_seconds', 30.0),
+        )
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            state = _ModelState(model, self.model_concurrency.get(model, self.max_concurrency))
+            self._models[model] = state
+        return state
+
+    # ==================== 并发槽位 ====================
+
+    async def _acquire(self, state: _ModelState, lane: str, deadline: float):
+        """获取并发槽位（排队时按通道优先级出队），超出时间预算时抛出 TimeoutError"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if state.in_flight < state.max_concurrency and not state.waiters:
+            state.in_flight += 1
+            state.queue_waits[lane].append(0.0)
+            return
+
+        future = loop.create_future()
+        heapq.heappush(state.waiters, (_LANE_RANK[lane], next(self._seq), future))
+        state.queued[lane] += 1
+        try:
+            await asyncio.wait_for(future, max(0.0, deadline - loop.time()))
+        except BaseException:
+            # 槽位已交给本请求但等待方被取消时归还
+            if future.done() and not future.cancelled():
+                self._release(state)
+            raise
+        finally:
+            state.queued[lane] -= 1
+        state.queue_waits[lane].append(loop.time() - started)
+
+    def _try_acquire(self, state: _ModelState) -> bool:
+        """有空闲槽位且无人排队时立即占用（对冲请求使用，不与排队请求争抢）"""
+        if state.in_flight < state.max_concurrency and not state.waiters:
+            state.in_flight += 1
+            return True
+        return False
+
+    def _release(self, state: _ModelState):
+        """归还槽位：有排队请求时直接交给优先级最高的一个"""
+        while state.waiters:
+            _, _, future = heapq.heappop(state.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        state.in_flight -= 1
+
+    # ==================== 熔断 ====================
+
+    def _check_circuit(self, state: _ModelState, claim: bool = True) -> bool:
+        """熔断检查：熔断中抛出 CircuitOpenError，冷却结束后放行一个探测请求
+
+        Args:
+            claim: 是否占用探测名额（为 False 时只检查）
+
+        Returns:
+            本次是否占用了探测名额；占用方在请求未得出结果就结束时（取消、排队超时）须调用 _end_probe
+        """
+        if state.opened_at is None:
+            return False
+        if time.monotonic() - state.opened_at < self.circuit_cooldown_seconds or state.probing:
+            state.rejected += 1
+            raise CircuitOpenError(f"模型 {state.model} 熔断中（连续失败 {state.consecutive_failures} 次）")
+        # 冷却结束，放行一个探测请求
+        if claim:
+            state.probing = True
+        return claim
+
+    def _end_probe(self, state: _ModelState):
+        """归还未得出结果的探测名额，下一个请求重新探测"""
+        state.probing = False
+
+    def _on_success(self, state: _ModelState, latency: float):
+        state.succeeded += 1
+        state.latencies.append(latency)
+        state.consecutive_failures = 0
+        state.probing = False
+        if state.opened_at is not None:
+            state.opened_at = None
+            logger.info(f"[LLM调度] 模型 {state.model} 恢复，熔断关闭")
+
+    def _on_failure(self, state: _ModelState, kind: str):
+        state.errors[kind] += 1
+        if kind not in RETRYABLE_ERRORS:
+            state.probing = False
+            return
+        state.consecutive_failures += 1
+        if state.probing or (self.circuit_failure_threshold
+                             and state.consecutive_failures >= self.circuit_failure_threshold
+                             and state.opened_at is None):
+            state.opened_at = time.monotonic()
+            state.circuit_opens += 1
+            logger.warning(f"[LLM调度] 模型 {state.model} 连续失败 {state.consecutive_failures} 次，"
+                           f"熔断 {self.circuit_cooldown_seconds:.0f} 秒")
+        state.probing = False
+
+    def _retry_delay(self, exc: BaseException, kind: str, attempt: int, deadline: float) -> Optional[float]:
+        """计算重试等待时间（不重试时返回 None）"""
+        if kind not in RETRYABLE_ERRORS or attempt >= self.max_retries:
+            return None
+        # 指数退避 + 全抖动，避免大量请求同时重试
+        delay = random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * (2 ** attempt)))
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if asyncio.get_running_loop().time() + delay >= deadline:
+            return None
+        return delay
+
+    # ==================== 请求执行 ====================
+
+    async def submit(self, call: Callable[[], Awaitable[Any]], stream: bool = False,
+                     model: str = 'default', priority: Optional[str] = None) -> Any:
+        """提交一个 LLM 请求
+
+        Args:
+            call: 无参协程函数，每次调用发起一次请求（重试和对冲时会被多次调用）；
+                  流式请求返回 AsyncIterator[str]
+            stream: 是否流式请求
+            model: 模型名称（并发上限和熔断按模型区分）
+            priority: 优先级通道（为空时使用 llm_priority() 设置的通道）
+
+        Returns:
+            非流式请求返回 call 的结果；流式请求返回 AsyncIterator[str]
+
+        Raises:
+            CircuitOpenError: 模型处于熔断状态
+            asyncio.TimeoutError: 超出时间预算
+        """
+        lane = priority or get_current_priority()
+        if lane not in _LANE_RANK:
+            raise ValueError(f"未知的优先级通道: {lane}")
+        state = self._state(model)
+        # 熔断中立即失败；探测名额在请求实际执行时占用（流式请求为开始迭代时）
+        self._check_circuit(state, claim=False)
+        state.requests += 1
+        deadline = asyncio.get_running_loop().time() + self.timeout_seconds
+        if stream:
+            return self._stream(state, lane, call, deadline)
+        return await self._run(state, lane, call, deadline)
+
+    def _attempt_timeout(self, deadline: float) -> float:
+        return max(0.0, min(self.attempt_timeout_seconds, deadline - asyncio.get_running_loop().time()))
+
+    async def _run(self, state: _ModelState, lane: str, call: Callable[[], Awaitable[Any]], deadline: float) -> Any:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        probe = False
+        try:
+            while True:
+                probe = self._check_circuit(state)
+                await self._acquire(state, lane, deadline)
+                started = loop.time()
+                try:
+                    result = await self._attempt(state, call, deadline)
+                except Exception as e:
+                    kind = classify_error(e)
+                    self._on_failure(state, kind)
+                    probe = False
+                    delay = self._retry_delay(e, kind, attempt, deadline)
+                    if delay is None:
+                        state.failed += 1
+                        raise
+                    attempt += 1
+                    state.retries += 1
+                    logger.warning(f"[LLM调度] {state.model} 请求失败（{kind}），{delay:.2f} 秒后第 {attempt} 次重试: {e}")
+                else:
+                    self._on_success(state, loop.time() - started)
+                    probe = False
+                    return result
+                finally:
+                    self._release(state)
+                await asyncio.sleep(delay)
+        finally:
+            # 探测请求被取消或排队超时
+            if probe:
+                self._end_probe(state)
+
+    async def _attempt(self, state: _ModelState, call: Callable[[], Awaitable[Any]], deadline: float) -> Any:
+        """执行一次尝试，必要时发送对冲请求"""
+        timeout = self._attempt_timeout(deadline)
+        if not self.hedge_after_seconds or self.hedge_after_seconds >= timeout:
+            return await asyncio.wait_for(call(), timeout)
+
+        loop = asyncio.get_running_loop()
+        attempt_deadline = loop.time() + timeout
+        primary = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after_seconds)
+        if done:
+            return primary.result()
+        if not self._try_acquire(state):
+            # 没有空闲并发，不对冲
+            return await asyncio.wait_for(primary, max(0.0, attempt_deadline - loop.time()))
+
+        state.hedges += 1
+        hedge = asyncio.ensure_future(call())
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, attempt_deadline - loop.time()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            state.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if not task.done():
+                    task.cancel()
+            self._release(state)
+
+    async def _stream(self, state: _ModelState, lane: str, call: Callable[[], Awaitable[Any]],
+                      deadline: float) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        probe = False
+        try:
+            while True:
+                probe = self._check_circuit(state)
+                await self._acquire(state, lane, deadline)
+                started = loop.time()
+                try:
+                    try:
+                        iterator = (await asyncio.wait_for(call(), self._attempt_timeout(deadline))).__aiter__()
+                        first = await asyncio.wait_for(iterator.__anext__(), self._attempt_timeout(deadline))
+                    except StopAsyncIteration:
+                        self._on_success(state, loop.time() - started)
+                        probe = False
+                        return
+                    except Exception as e:
+                        kind = classify_error(e)
+                        self._on_failure(state, kind)
+                        probe = False
+                        delay = self._retry_delay(e, kind, attempt, deadline)
+                        if delay is None:
+                            state.failed += 1
+                            raise
+                        attempt += 1
+                        state.retries += 1
+                        logger.warning(f"[LLM调度] {state.model} 流式请求失败（{kind}），{delay:.2f} 秒后第 {attempt} 次重试: {e}")
+                    else:
+                        # 延迟按首个片段计
+                        self._on_success(state, loop.time() - started)
+                        probe = False
+                        yield first
+                        async for chunk in iterator:
+                            yield chunk
+                        return
+                finally:
+                    self._release(state)
+                await asyncio.sleep(delay)
+        finally:
+            # 探测请求被取消、排队超时或在首个片段前被关闭
+            if probe:
+                self._end_probe(state)
+
+    # ==================== 统计 ====================
+
+    def circuit_state(self, model: str) -> str:
+        """模型的熔断状态：closed / open / half_open（未发送过请求的模型为 closed）"""
+        state = self._models.get(model)
+        if state is None or state.opened_at is None:
+            return 'closed'
+        if time.monotonic() - state.opened_at < self.circuit_cooldown_seconds:
+            return 'open'
+        return 'half_open'
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各模型的调度统计"""
+        models = {}
+        for model, state in self._models.items():
+            models[model] = {
+                'max_concurrency': state.max_concurrency,
+                'in_flight': state.in_flight,
+                'queued': {lane: state.queued[lane] for lane in _LANE_RANK},
+                'queue_wait': {lane: summarize_samples(state.queue_waits[lane]) for lane in _LANE_RANK},
+                'latency': summarize_samples(state.latencies),
+                'requests': state.requests,
+                'succeeded': state.succeeded,
+                'failed': state.failed,
+                'retries': state.retries,
+                'hedges': state.hedges,
+                'hedge_wins': state.hedge_wins,
+                'rejected': state.rejected,
+                'circuit': self.circuit_state(model),
+                'circuit_opens': state.circuit_opens,
+                'errors': dict(state.errors),
+            }
+        return {
+            'max_retries': self.max_retries,
+            'timeout_seconds': self.timeout_seconds,
+            'hedge_after_seconds': self.hedge_after_seconds,
+            'models': models,
+        }
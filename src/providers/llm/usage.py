@@ -0,0 +1,117 @@
+"""
+LLM Token 用量上下文
+
+每个请求在 usage_scope() 中执行 LLM 调用，提供商把每次调用的用量记入当前上下文，
+而不是写到提供商实例的共享字段上，因此并发请求之间互不干扰。
+
+上下文通过 contextvars 传递：在作用域内创建的 asyncio 任务（如 asyncio.gather 并发翻译）
+共享同一个用量对象，扇出调用的用量会自动累加。
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class LLMUsage:
+    """单个请求范围内的 Token 用量（按模型累加）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: List[Dict[str, Any]] = []
+
+    def add(self, prompt_tokens: int, completion_tokens: int, total_tokens: int,
+            model: str = 'unknown', provider: str = 'unknown'):
+        """记入一次 LLM 调用的用量"""
+        with self._lock:
+            self.calls.append({
+                'prompt_tokens': int(prompt_tokens or 0),
+                'completion_tokens': int(completion_tokens or 0),
+                'total_tokens': int(total_tokens or 0),
+                'model': model or 'unknown',
+                'provider': provider or 'unknown',
+            })
+
+    @property
+    def call_count(self) -> int:
+        return len(self.calls)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call['prompt_tokens'] for call in self.calls)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(call['completion_tokens'] for call in self.calls)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(call['total_tokens'] for call in self.calls)
+
+    def by_model(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """按 (model, provider) 汇总用量
+
+        Returns:
+            {(model, provider): {'prompt_tokens', 'completion_tokens', 'total_tokens', 'calls'}}
+        """
+        totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            key = (call['model'], call['provider'])
+            bucket = totals.setdefault(key, {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'calls': 0})
+            bucket['prompt_tokens'] += call['prompt_tokens']
+            bucket['completion_tokens'] += call['completion_tokens']
+            bucket['total_tokens'] += call['total_tokens']
+            bucket['calls'] += 1
+        return totals
+
+    def to_dict(self) -> Dict[str, int]:
+        """汇总用量字典（与旧的 get_last_usage 返回格式兼容）"""
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.total_tokens,
+            'calls': self.call_count,
+        }
+
+
+_current_usage: ContextVar[Optional[LLMUsage]] = ContextVar('llm_usage', default=None)
+
+
+@contextmanager
+def usage_scope() -> Iterator[LLMUsage]:
+    """开启一个请求范围的用量上下文
+
+    Yields:
+        本次请求的用量对象（作用域内所有 LLM 调用的用量都会记入）
+    """
+    usage = LLMUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        try:
+            _current_usage.reset(token)
+        except ValueError:
+            # 流式生成器可能在其他上下文中被关闭（如客户端断开），此时无需还原
+            pass
+
+
+def get_current_usage() -> Optional[LLMUsage]:
+    """获取当前请求的用量对象（不在作用域内时返回 None）"""
+    return _current_usage.get()
+
+
+def record_usage(prompt_tokens: int, completion_tokens: int, total_tokens: int,
+                 model: str = 'unknown', provider: str = 'unknown') -> bool:
+    """记入一次调用的用量到当前请求上下文
+
+    Returns:
+        是否记入（不在作用域内时返回 False）
+    """
+    usage = _current_usage.get()
+    if usage is None:
+        return False
+    usage.add(prompt_tokens, completion_tokens, total_tokens, model=model, provider=provider)
+    return True
@@ -0,0 +1,307 @@
+"""
+多设备同步变更日志
+
+功能：
+- change_log 表按自增序号记录 records / tags / record_tags 的每次变更
+  （新建、内容修改、软删除/恢复、收藏、归档、彻底删除、标签增删改、标签关联）
+- 变更由触发器在写事务内同步写入，所有写入路径（包括扩展功能和级联删除）都会记录
+- 同步接口按序号增量读取，同一批次内按实体合并，只返回变更实体的当前状态
+
+日志中只保存实体键和操作类型，同步时再读取实体的当前状态：
+内容变更返回完整记录，仅状态变更（收藏、归档、软删除）只返回状态字段。
+"""
+import json
+import sqlite3
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .chat_messages import fill_chat_messages
+
+logger = logging.getLogger(__name__)
+
+# 存量数据补录任务名称（见 migrations.py）
+CHANGE_LOG_BACKFILL_NAMES = {
+    'record': 'change_log_records',
+    'tag': 'change_log_tags',
+    'record_tag': 'change_log_record_tags',
+}
+
+RECORD_FIELDS = ('id', 'text', 'metadata', 'app_type', 'device_id', 'is_deleted', 'deleted_at',
+                 'is_starred', 'is_archived', 'created_at', 'updated_at')
+RECORD_STATE_FIELDS = ('id', 'is_deleted', 'deleted_at', 'is_starred', 'is_archived', 'updated_at')
+
+# 涉及记录内容的操作（同步时需要返回完整记录）
+CONTENT_OPS = {'insert', 'update'}
+
+_NOW = "datetime('now', 'localtime')"
+
+_TRIGGERS = {
+    # ---- records ----
+    'change_log_records_insert': f'''
+        AFTER INSERT ON records BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (new.user_id, 'record', new.id, 'insert', {_NOW});
+        END
+    ''',
+    'change_log_records_update': f'''
+        AFTER UPDATE OF text, metadata, app_type, user_id ON records
+        WHEN old.text IS NOT new.text OR old.metadata IS NOT new.metadata
+            OR old.app_type IS NOT new.app_type OR old.user_id IS NOT new.user_id
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (new.user_id, 'record', new.id, 'update', {_NOW});
+        END
+    ''',
+    'change_log_records_reassign': f'''
+        AFTER UPDATE OF user_id ON records
+        WHEN old.user_id IS NOT NULL AND old.user_id IS NOT new.user_id
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (old.user_id, 'record', old.id, 'purge', {_NOW});
+        END
+    ''',
+    'change_log_records_deleted': f'''
+        AFTER UPDATE OF is_deleted ON records
+        WHEN old.is_deleted IS NOT new.is_deleted
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (new.user_id, 'record', new.id,
+                    CASE WHEN new.is_deleted THEN 'delete' ELSE 'restore' END, {_NOW});
+        END
+    ''',
+    'change_log_records_starred': f'''
+        AFTER UPDATE OF is_starred ON records
+        WHEN old.is_starred IS NOT new.is_starred
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (new.user_id, 'record', new.id,
+                    CASE WHEN new.is_starred THEN 'star' ELSE 'unstar' END, {_NOW});
+        END
+    ''',
+    'change_log_records_archived': f'''
+        AFTER UPDATE OF is_archived ON records
+        WHEN old.is_archived IS NOT new.is_archived
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (new.user_id, 'record', new.id,
+                    CASE WHEN new.is_archived THEN 'archive' ELSE 'unarchive' END, {_NOW});
+        END
+    ''',
+    'change_log_records_purge': f'''
+        AFTER DELETE ON records BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (old.user_id, 'record', old.id, 'purge', {_NOW});
+        END
+    ''',
+    # ---- tags ----
+    'change_log_tags_insert': f'''
+        AFTER INSERT ON tags BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (new.user_id, 'tag', CAST(new.tag_id AS TEXT), 'upsert', {_NOW});
+        END
+    ''',
+    'change_log_tags_update': f'''
+        AFTER UPDATE ON tags
+        WHEN old.tag_name IS NOT new.tag_name OR old.color IS NOT new.color
+            OR old.icon IS NOT new.icon OR old.sort_order IS NOT new.sort_order
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (new.user_id, 'tag', CAST(new.tag_id AS TEXT), 'upsert', {_NOW});
+        END
+    ''',
+    'change_log_tags_delete': f'''
+        AFTER DELETE ON tags BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES (old.user_id, 'tag', CAST(old.tag_id AS TEXT), 'delete', {_NOW});
+        END
+    ''',
+    # ---- record_tags ----
+    'change_log_record_tags_insert': f'''
+        AFTER INSERT ON record_tags BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES ((SELECT user_id FROM tags WHERE tag_id = new.tag_id), 'record_tag',
+                    new.record_id || ':' || new.tag_id, 'link', {_NOW});
+        END
+    ''',
+    'change_log_record_tags_delete': f'''
+        AFTER DELETE ON record_tags BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+            VALUES ((SELECT user_id FROM tags WHERE tag_id = old.tag_id), 'record_tag',
+                    old.record_id || ':' || old.tag_id, 'unlink', {_NOW});
+        END
+    ''',
+}
+
+
+def create_change_log(cursor: sqlite3.Cursor):
+    """创建变更日志表及 records / tags / record_tags 上的触发器"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            entity TEXT NOT NULL,
+            entity_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_user_seq ON change_log(user_id, seq)')
+
+    for name, body in _TRIGGERS.items():
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+
+# ==================== 存量数据补录 ====================
+
+def _backfill(cursor: sqlite3.Cursor, last_key: Optional[str], batch_size: int,
+              select_sql: str, entity: str, op: str) -> Tuple[Optional[str], int]:
+    last_rowid = int(last_key) if last_key else 0
+    cursor.execute(select_sql, (last_rowid, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return None, 0
+
+    cursor.executemany(f'''
+        INSERT INTO change_log (user_id, entity, entity_id, op, changed_at)
+        VALUES (?, '{entity}', ?, '{op}', {_NOW})
+    ''', [(row[1], str(row[2])) for row in rows if row[1]])
+    return str(rows[-1][0]), len(rows)
+
+
+def backfill_records(cursor: sqlite3.Cursor, last_key: Optional[str],
+                     batch_size: int) -> Tuple[Optional[str], int]:
+    """将存量记录补录为 insert 变更（首次同步可完全通过变更日志完成）"""
+    return _backfill(cursor, last_key, batch_size, '''
+        SELECT rowid, user_id, id FROM records WHERE rowid > ? ORDER BY rowid LIMIT ?
+    ''', 'record', 'insert')
+
+
+def backfill_tags(cursor: sqlite3.Cursor, last_key: Optional[str],
+                  batch_size: int) -> Tuple[Optional[str], int]:
+    """将存量标签补录为 upsert 变更"""
+    return _backfill(cursor, last_key, batch_size, '''
+        SELECT tag_id, user_id, tag_id FROM tags WHERE tag_id > ? ORDER BY tag_id LIMIT ?
+    ''', 'tag', 'upsert')
+
+
+def backfill_record_tags(cursor: sqlite3.Cursor, last_key: Optional[str],
+                         batch_size: int) -> Tuple[Optional[str], int]:
+    """将存量标签关联补录为 link 变更"""
+    return _backfill(cursor, last_key, batch_size, '''
+        SELECT rt.id, t.user_id, rt.record_id || ':' || rt.tag_id
+        FROM record_tags rt JOIN tags t ON t.tag_id = rt.tag_id
+        WHERE rt.id > ? ORDER BY rt.id LIMIT ?
+    ''', 'record_tag', 'link')
+
+
+def count_tags(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('SELECT COUNT(*) FROM tags')
+    return cursor.fetchone()[0]
+
+
+def count_record_tags(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('SELECT COUNT(*) FROM record_tags')
+    return cursor.fetchone()[0]
+
+
+# ==================== 增量读取 ====================
+
+def _fetch_by_ids(cursor: sqlite3.Cursor, sql: str, ids: List[Any]) -> Dict[Any, sqlite3.Row]:
+    """按主键批量读取当前状态"""
+    if not ids:
+        return {}
+    placeholders = ', '.join('?' for _ in ids)
+    cursor.execute(sql.format(placeholders=placeholders), ids)
+    columns = [description[0] for description in cursor.description]
+    return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+
+def read_changes(cursor: sqlite3.Cursor, user_id: str, since: int = 0,
+                 limit: int = 500) -> Dict[str, Any]:
+    """读取用户在 since 之后的变更（一批）
+
+    Args:
+        cursor: 数据库游标
+        user_id: 用户ID
+        since: 客户端已同步到的序号（首次同步传 0）
+        limit: 本批最多读取的日志条数
+
+    Returns:
+        {
+            'changes': [...],      # 按实体合并后的增量，按序号升序
+            'next_since': int,     # 下次请求使用的 since
+            'has_more': bool,      # 是否还有更多变更
+        }
+    """
+    cursor.execute('''
+        SELECT seq, entity, entity_id, op
+        FROM change_log
+        WHERE user_id = ? AND seq > ?
+        ORDER BY seq
+        LIMIT ?
+    ''', (user_id, since, limit))
+    rows = cursor.fetchall()
+
+    # 同一实体在本批内只返回一次（取最后一次变更的序号）
+    entities: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+    for seq, entity, entity_id, op in rows:
+        key = (entity, entity_id)
+        item = entities.pop(key, None) or {'ops': set()}
+        item['seq'] = seq
+        item['ops'].add(op)
+        entities[key] = item
+
+    record_ids = [entity_id for (entity, entity_id) in entities if entity == 'record']
+    tag_ids = [int(entity_id) for (entity, entity_id) in entities if entity == 'tag']
+    link_keys = [entity_id for (entity, entity_id) in entities if entity == 'record_tag']
+
+    records = _fetch_by_ids(cursor, f'''
+        SELECT {', '.join(RECORD_FIELDS)}, user_id FROM records WHERE id IN ({{placeholders}})
+    ''', record_ids)
+    tags = _fetch_by_ids(cursor, '''
+        SELECT tag_id, tag_name, color, icon, sort_order, created_at, user_id
+        FROM tags WHERE tag_id IN ({placeholders})
+    ''', tag_ids)
+    link_record_ids = sorted({key.rsplit(':', 1)[0] for key in link_keys})
+    links = _fetch_by_ids(cursor, '''
+        SELECT record_id || ':' || tag_id AS link_key, record_id, tag_id
+        FROM record_tags WHERE record_id IN ({placeholders})
+    ''', link_record_ids)
+
+    changes = []
+    for (entity, entity_id), item in entities.items():
+        change: Dict[str, Any] = {'seq': item['seq'], 'entity': entity, 'id': entity_id}
+        if entity == 'record':
+            record = records.get(entity_id)
+            if not record or record['user_id'] != user_id:
+                change['op'] = 'delete'
+            elif item['ops'] & CONTENT_OPS:
+                change['op'] = 'upsert'
+                change['data'] = {field: record[field] for field in RECORD_FIELDS}
+                change['data']['metadata'] = json.loads(record['metadata']) if record['metadata'] else {}
+                if record['app_type'] == 'smart-chat':
+                    fill_chat_messages(cursor, entity_id, change['data']['metadata'])
+            else:
+                # 仅收藏/归档/软删除状态变化，只返回状态字段
+                change['op'] = 'patch'
+                change['data'] = {field: record[field] for field in RECORD_STATE_FIELDS}
+        elif entity == 'tag':
+            tag = tags.get(int(entity_id))
+            if not tag or tag['user_id'] != user_id:
+                change['op'] = 'delete'
+            else:
+                change['op'] = 'upsert'
+                change['data'] = {k: v for k, v in tag.items() if k != 'user_id'}
+        else:
+            record_id, tag_id = entity_id.rsplit(':', 1)
+            change['op'] = 'link' if entity_id in links else 'unlink'
+            change['data'] = {'record_id': record_id, 'tag_id': int(tag_id)}
+        changes.append(change)
+
+    return {
+        'changes': changes,
+        'next_since': rows[-1][0] if rows else since,
+        'has_more': len(rows) == limit,
+    }
+
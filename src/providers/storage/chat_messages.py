@@ -0,0 +1,108 @@
+"""
+智能助手对话消息（按轮追加）
+
+功能：
+- chat_messages 表按 (record_id, seq) 保存对话的每条消息，每轮对话只追加新消息，不改写整条记录
+- 记录的 text 保持创建时的内容（列表预览），之后追加的消息按批写入 records_fts，全文检索增量更新
+- metadata 只保存对话统计等投影（不含消息），读取记录时用消息表补齐 metadata.messages
+- 记录被删除时由触发器同步删除消息（records_fts 中的行由 records_ad 触发器删除）
+
+早期版本保存的对话只有投影（metadata.messages 和完整 text），没有消息行；
+继续这类对话时首次追加会从 seq 0 写入完整历史，已在 text 中的消息不重复建立索引。
+"""
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+def create_chat_messages_table(cursor: sqlite3.Cursor):
+    """创建 chat_messages 表和删除同步触发器"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            record_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            message_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            PRIMARY KEY (record_id, seq)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_records_delete AFTER DELETE ON records BEGIN
+            DELETE FROM chat_messages WHERE record_id = old.id;
+        END
+    ''')
+
+
+def append_chat_messages(cursor: sqlite3.Cursor, record_id: str, start_seq: int,
+                         messages: List[Dict[str, Any]], index_from: Optional[int] = None) -> int:
+    """追加消息（已存在的序号跳过，重试时不会重复写入）
+
+    Args:
+        cursor: 数据库游标
+        record_id: 记录ID
+        start_seq: 第一条消息的序号
+        messages: 消息列表（id、role、content、timestamp）
+        index_from: 序号不小于该值的新消息写入全文检索（更早的消息已在记录 text 中）；
+            为 None 时不建立索引
+
+    Returns:
+        实际写入的消息数
+    """
+    existing = count_chat_messages(cursor, record_id) if index_from is not None else 0
+    before = cursor.connection.total_changes
+    cursor.executemany('''
+        INSERT OR IGNORE INTO chat_messages (record_id, seq, message_id, role, content, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        (record_id, start_seq + i, str(msg['id']), msg['role'], msg['content'], msg['timestamp'])
+        for i, msg in enumerate(messages)
+    ])
+    written = cursor.connection.total_changes - before
+
+    if index_from is not None:
+        # 序号连续，已存在的消息在首次写入时已建立索引
+        indexed = messages[max(0, max(existing, index_from) - start_seq):]
+        if indexed:
+            cursor.execute('INSERT INTO records_fts (record_id, text) VALUES (?, ?)',
+                           (record_id, render_chat_text(indexed)))
+    return written
+
+
+def read_chat_messages(cursor: sqlite3.Cursor, record_id: str) -> List[Dict[str, Any]]:
+    """按顺序读取对话的全部消息"""
+    cursor.execute('''
+        SELECT message_id, role, content, timestamp
+        FROM chat_messages
+        WHERE record_id = ?
+        ORDER BY seq
+    ''', (record_id,))
+    return [
+        {'id': row[0], 'role': row[1], 'content': row[2], 'timestamp': row[3]}
+        for row in cursor.fetchall()
+    ]
+
+
+def count_chat_messages(cursor: sqlite3.Cursor, record_id: str) -> int:
+    """对话已保存的消息数"""
+    cursor.execute('SELECT COUNT(*) FROM chat_messages WHERE record_id = ?', (record_id,))
+    return cursor.fetchone()[0]
+
+
+def fill_chat_messages(cursor: sqlite3.Cursor, record_id: str, metadata: Dict[str, Any]):
+    """用消息表补齐对话记录的 metadata.messages（早期版本的投影不落后时保持不变）"""
+    projected = len(metadata.get('messages') or [])
+    if count_chat_messages(cursor, record_id) > projected:
+        messages = read_chat_messages(cursor, record_id)
+        metadata['messages'] = messages
+        metadata['message_count'] = len(messages)
+
+
+def render_chat_text(messages: List[Dict[str, Any]]) -> str:
+    """生成对话的纯文本投影（记录列表预览和全文检索使用）"""
+    return '\n\n'.join(
+        f"[{'用户' if msg['role'] == 'user' else '助手'}] "
+        f"{datetime.fromtimestamp(msg['timestamp'] / 1000).strftime('%H:%M')}\n{msg['content']}"
+        for msg in messages
+    )
@@ -0,0 +1,226 @@
+"""
+消费统计汇总表（按小时 / 按天）
+
+功能：
+- consumption_rollup_hourly / consumption_rollup_daily 按
+  (时间桶, user_id, device_id, 类型, 模型, 模型来源) 预聚合 ASR 时长与 tokens
+- 消费事件批量写入 consumption_records 时，在同一事务中增量累加到汇总表
+- 历史明细由迁移回填任务（见 migrations.py）分批计入
+- 报表查询只读取汇总表，不扫描消费明细
+
+回填完成前，新写入的明细由回填任务按 rowid 顺序一并计入；回填完成后改由写入方增量维护，
+两者通过在写事务内检查回填状态衔接，保证每条明细只计入一次。
+"""
+import json
+import sqlite3
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .image_store import is_backfill_completed
+
+logger = logging.getLogger(__name__)
+
+# 汇总表回填任务名称（见 migrations.py）
+ROLLUP_BACKFILL_NAME = 'consumption_rollups'
+
+ROLLUP_TABLES = {
+    'hour': 'consumption_rollup_hourly',
+    'day': 'consumption_rollup_daily',
+}
+
+GROUP_COLUMNS = ('bucket', 'user_id', 'device_id', 'type', 'model', 'model_source')
+
+
+def create_rollup_tables(cursor: sqlite3.Cursor):
+    """创建按小时、按天的消费汇总表"""
+    for granularity, table in ROLLUP_TABLES.items():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                device_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                model TEXT NOT NULL DEFAULT '',
+                model_source TEXT NOT NULL DEFAULT 'vendor',
+                record_count INTEGER NOT NULL DEFAULT 0,
+                amount INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, user_id, device_id, type, model, model_source)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table}(user_id, bucket)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_device ON {table}(device_id, bucket)')
+
+
+def is_rollup_ready(cursor: sqlite3.Cursor) -> bool:
+    """汇总表是否已覆盖全部历史明细（回填完成后由写入方增量维护）"""
+    return is_backfill_completed(cursor, ROLLUP_BACKFILL_NAME)
+
+
+def _parse_details(details: Any) -> Dict[str, Any]:
+    if isinstance(details, str):
+        try:
+            return json.loads(details) or {}
+        except ValueError:
+            return {}
+    return details or {}
+
+
+def _rollup_key(record: Dict[str, Any], details: Dict[str, Any]) -> Tuple[str, str, str, str, str, str]:
+    """计算明细所属的小时桶与分组键
+
+    Returns:
+        (hour_bucket, user_id, device_id, type, model, model_source)
+    """
+    # LLM 按模型统计，ASR 按提供商统计
+    if record['type'] == 'llm':
+        model = details.get('model') or ''
+    else:
+        model = details.get('provider') or ''
+    hour_bucket = f"{str(record['created_at'])[:13]}:00:00"
+    return (hour_bucket, record['user_id'], record['device_id'], record['type'],
+            model, record.get('model_source') or 'vendor')
+
+
+def apply_rollups(cursor: sqlite3.Cursor, records: Iterable[Dict[str, Any]]) -> int:
+    """将一批消费明细累加到汇总表（调用方负责事务）
+
+    Args:
+        cursor: 数据库游标
+        records: 明细字典（至少包含 user_id, device_id, type, amount, model_source, details, created_at）
+
+    Returns:
+        累加的明细条数
+    """
+    totals: Dict[Tuple, List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+    count = 0
+    for record in records:
+        details = _parse_details(record.get('details'))
+        key = _rollup_key(record, details)
+        bucket = totals[key]
+        bucket[0] += 1
+        bucket[1] += int(record['amount'] or 0)
+        if record['type'] == 'llm':
+            bucket[2] += int(details.get('prompt_tokens') or 0)
+            bucket[3] += int(details.get('completion_tokens') or 0)
+        count += 1
+
+    if not totals:
+        return 0
+
+    # 同一批次内先在内存合并，再按小时、按天各做一次 upsert
+    daily: Dict[Tuple, List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+    for key, values in totals.items():
+        day_key = (key[0][:10],) + key[1:]
+        for i, value in enumerate(values):
+            daily[day_key][i] += value
+
+    for table, rows in ((ROLLUP_TABLES['hour'], totals), (ROLLUP_TABLES['day'], daily)):
+        cursor.executemany(f'''
+            INSERT INTO {table}
+            (bucket, user_id, device_id, type, model, model_source, record_count, amount, prompt_tokens, completion_tokens)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(bucket, user_id, device_id, type, model, model_source) DO UPDATE SET
+                record_count = record_count + excluded.record_count,
+                amount = amount + excluded.amount,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens
+        ''', [key + tuple(values) for key, values in rows.items()])
+    return count
+
+
+def backfill_rollups(cursor: sqlite3.Cursor, last_key: Optional[str],
+                     batch_size: int) -> Tuple[Optional[str], int]:
+    """按 rowid 顺序将历史明细计入汇总表（迁移回填批次函数）"""
+    last_rowid = int(last_key) if last_key else 0
+    cursor.execute('''
+        SELECT rowid, user_id, device_id, type, amount, model_source, details, created_at
+        FROM consumption_records
+        WHERE rowid > ?
+        ORDER BY rowid
+        LIMIT ?
+    ''', (last_rowid, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return None, 0
+
+    apply_rollups(cursor, [
+        {
+            'user_id': row[1], 'device_id': row[2], 'type': row[3], 'amount': row[4],
+            'model_source': row[5], 'details': row[6], 'created_at': row[7],
+        }
+        for row in rows
+    ])
+    return str(rows[-1][0]), len(rows)
+
+
+def count_consumption_records(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('SELECT COUNT(*) FROM consumption_records')
+    return cursor.fetchone()[0]
+
+
+def query_rollups(cursor: sqlite3.Cursor, granularity: str = 'day',
+                  start: Optional[str] = None, end: Optional[str] = None,
+                  user_id: Optional[str] = None, device_id: Optional[str] = None,
+                  group_by: Optional[List[str]] = None,
+                  limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """查询汇总表
+
+    Args:
+        cursor: 数据库游标
+        granularity: 时间粒度（'hour' 或 'day'）
+        start: 起始时间桶（含），如 '2025-01-01' 或 '2025-01-01 08:00:00'
+        end: 结束时间桶（含）
+        user_id: 按用户过滤
+        device_id: 按设备过滤
+        group_by: 分组维度（bucket/user_id/device_id/type/model/model_source 的子集），
+            默认按时间桶分组；不含 bucket 时汇总整个时间范围
+        limit: 返回行数上限
+
+    Returns:
+        汇总行列表（含 bucket 时按时间桶升序，否则按用量降序）
+    """
+    table = ROLLUP_TABLES.get(granularity)
+    if not table:
+        raise ValueError(f"不支持的时间粒度: {granularity}")
+
+    select_columns = [column for column in (group_by or ['bucket']) if column in GROUP_COLUMNS]
+    if not select_columns:
+        raise ValueError(f"不支持的分组维度: {group_by}")
+
+    where, params = [], []
+    if start:
+        where.append('bucket >= ?')
+        params.append(start)
+    if end:
+        # 结束时间为日期时包含当天所有小时桶
+        where.append('bucket <= ?')
+        params.append(end if len(end) > 10 else f"{end} 23:59:59")
+    if user_id:
+        where.append('user_id = ?')
+        params.append(user_id)
+    if device_id:
+        where.append('device_id = ?')
+        params.append(device_id)
+
+    sql = f'''
+        SELECT {', '.join(select_columns)},
+               SUM(record_count) AS record_count,
+               SUM(CASE WHEN type = 'asr' THEN amount ELSE 0 END) AS asr_duration_ms,
+               SUM(CASE WHEN type = 'llm' THEN amount ELSE 0 END) AS llm_total_tokens,
+               SUM(prompt_tokens) AS llm_prompt_tokens,
+               SUM(completion_tokens) AS llm_completion_tokens
+        FROM {table}
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        GROUP BY {', '.join(select_columns)}
+        ORDER BY {'bucket' if 'bucket' in select_columns else 'SUM(record_count) DESC'}
+    '''
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(int(limit))
+
+    cursor.execute(sql, params)
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
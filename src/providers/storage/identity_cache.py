@@ -0,0 +1,189 @@
+"""
+身份映射缓存模块
+
+功能：
+- 缓存 device_id → user_id 映射（含“未绑定”的否定结果），避免每次请求都查询数据库
+- 容量有限的 LRU 淘汰 + TTL 过期
+- 绑定/解绑设备、删除/恢复用户时主动失效
+- 统计命中率等指标
+- 进程内按数据库路径共享同一个缓存实例（多个服务实例共用）
+
+user_id → 会员等级不在这里缓存：额度检查使用的会员信息由 QuotaLedger 按用户保存在内存中，
+会员变更时由 MembershipService 失效。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set
+
+from src.core.logger import get_logger
+
+logger = get_logger("IdentityCache")
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 300
+
+_MISSING = object()
+
+
+class LRUTTLCache:
+    """容量有限、带过期时间的 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        """初始化缓存
+
+        Args:
+            max_entries: 最大条目数
+            ttl_seconds: 默认过期时间（秒）
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Any:
+        """读取缓存，未命中或已过期时返回 _MISSING"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return _MISSING
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """写入缓存（超出容量时淘汰最久未使用的条目）"""
+        ttl = self.ttl_seconds if ttl_seconds is None else min(self.ttl_seconds, ttl_seconds)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: str) -> Any:
+        """移除条目，返回原值（不存在时返回 _MISSING）"""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return _MISSING
+            self.invalidations += 1
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中率等指标"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class IdentityCache:
+    """设备→用户映射缓存"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.devices = LRUTTLCache(max_entries, ttl_seconds)
+        # user_id → 已缓存的 device_id 集合（用户删除时批量失效）
+        self._user_devices: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        # 每次失效递增；加载期间发生失效时不写入缓存，避免旧值覆盖
+        self._generation = 0
+
+    # ==================== 设备 → 用户 ====================
+
+    def get_user_id(self, device_id: str, loader: Callable[[str], Optional[str]]) -> Optional[str]:
+        """获取设备绑定的用户ID（未命中时调用 loader 加载并缓存，包括未绑定的结果）
+
+        Args:
+            device_id: 设备ID
+            loader: 从数据库加载 user_id 的函数
+
+        Returns:
+            用户ID，设备未绑定或用户已删除时返回 None
+        """
+        user_id = self.devices.get(device_id)
+        if user_id is not _MISSING:
+            return user_id
+
+        generation = self._generation
+        user_id = loader(device_id)
+        with self._lock:
+            if generation != self._generation:
+                return user_id
+            self.devices.set(device_id, user_id)
+            if user_id:
+                self._user_devices.setdefault(user_id, set()).add(device_id)
+        return user_id
+
+    def invalidate_device(self, device_id: str):
+        """设备绑定关系变更后失效"""
+        with self._lock:
+            self._generation += 1
+            user_id = self.devices.pop(device_id)
+            if user_id not in (_MISSING, None):
+                devices = self._user_devices.get(user_id)
+                if devices is not None:
+                    devices.discard(device_id)
+                    if not devices:
+                        del self._user_devices[user_id]
+
+    def invalidate_user(self, user_id: str):
+        """用户删除/恢复后失效该用户的全部设备映射"""
+        with self._lock:
+            self._generation += 1
+            for device_id in self._user_devices.pop(user_id, set()):
+                self.devices.pop(device_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存指标"""
+        return {
+            'device_to_user': self.devices.get_stats(),
+        }
+
+
+# ==================== 进程内共享实例 ====================
+
+_caches: Dict[str, IdentityCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_identity_cache(db_path) -> IdentityCache:
+    """获取指定数据库的共享身份映射缓存
+
+    Args:
+        db_path: 数据库文件路径
+
+    Returns:
+        身份映射缓存实例
+    """
+    key = str(Path(db_path).expanduser().resolve())
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = IdentityCache()
+            _caches[key] = cache
+        return cache
@@ -0,0 +1,521 @@
+"""
+内容寻址图片存储
+
+功能：
+- 以图片内容的 BLAKE2 哈希作为文件名，相同图片只存储一份
+- image_blobs 表维护每个图片文件被记录引用的次数（引用计数）
+- 上传时预生成列表视图使用的缩略图（需要 Pillow，未安装时跳过）
+- 孤儿图片通过 ref_count 索引查询，无需全表解析记录
+"""
+import io
+import re
+import hashlib
+import threading
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# 条件导入（缩略图为可选功能）
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 图片引用计数 / 记录-图片关联回填任务名称（见 migrations.py）
+REFCOUNT_BACKFILL_NAME = 'image_blobs_refcount'
+RECORD_IMAGES_BACKFILL_NAME = 'record_images'
+
+THUMBNAIL_DIR = 'thumbs'
+THUMBNAIL_MAX_SIZE = (320, 320)
+
+_IMAGE_PLACEHOLDER_PATTERN = re.compile(r'\[IMAGE:\s*([^\]]+)\]')
+
+# Base64 文件头 -> 扩展名
+_IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'RIFF', 'webp'),
+]
+
+
+def extract_image_urls(text: Optional[str], metadata: Any) -> List[str]:
+    """从记录的 text 和 metadata 中提取所有图片URL
+
+    Args:
+        text: 记录文本
+        metadata: 元数据（dict 或 JSON 字符串）
+
+    Returns:
+        图片URL列表（相对路径，如 'images/xxx.png'），已去重并保持顺序
+    """
+    import json
+
+    image_urls = []
+
+    # 从 metadata.blocks 中提取图片
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata) if metadata else {}
+        except json.JSONDecodeError:
+            metadata = {}
+    if isinstance(metadata, dict):
+        for block in metadata.get('blocks', []) or []:
+            if isinstance(block, dict) and block.get('type') == 'image':
+                image_url = block.get('imageUrl')
+                if image_url and image_url not in image_urls:
+                    image_urls.append(image_url)
+
+    # 从 text 字段提取图片占位符（降级方案）
+    if text:
+        for match in _IMAGE_PLACEHOLDER_PATTERN.findall(text):
+            match = match.strip()
+            if match not in image_urls:
+                image_urls.append(match)
+
+    return image_urls
+
+
+def image_filename(url: str) -> str:
+    """将图片URL（'images/xxx.png' 或 'xxx.png'）转换为文件名"""
+    return url.strip().replace('\\', '/').split('/')[-1]
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def create_image_tables(cursor: sqlite3.Cursor):
+    """创建图片引用计数表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_blobs (
+            filename TEXT PRIMARY KEY,
+            content_hash TEXT,
+            size INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            thumbnail TEXT,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL,
+            CHECK (ref_count >= 0)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_blobs_orphan ON image_blobs(ref_count, updated_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_blobs_hash ON image_blobs(content_hash)')
+
+
+def add_image_refs(cursor: sqlite3.Cursor, urls: Iterable[str]):
+    """增加图片引用计数（在调用方事务内执行）
+
+    Args:
+        cursor: 数据库游标
+        urls: 图片URL列表（同一记录内的重复URL只计一次）
+    """
+    now = _now()
+    for filename in {image_filename(url) for url in urls if url}:
+        cursor.execute('''
+            INSERT INTO image_blobs (filename, ref_count, created_at, updated_at)
+            VALUES (?, 1, ?, ?)
+            ON CONFLICT(filename) DO UPDATE SET
+                ref_count = ref_count + 1,
+                updated_at = excluded.updated_at
+        ''', (filename, now, now))
+
+
+def release_image_refs(cursor: sqlite3.Cursor, urls: Iterable[str]) -> List[str]:
+    """减少图片引用计数（在调用方事务内执行）
+
+    Args:
+        cursor: 数据库游标
+        urls: 图片URL列表（重复的URL只计一次）
+
+    Returns:
+        引用计数已降为 0 的文件名列表
+    """
+    return _decrement_refs(cursor, Counter({image_filename(url) for url in urls if url}))
+
+
+def _decrement_refs(cursor: sqlite3.Cursor, counts: Counter) -> List[str]:
+    """按文件名批量减少引用计数，返回计数降为 0 的文件名"""
+    if not counts:
+        return []
+
+    now = _now()
+    cursor.executemany('''
+        UPDATE image_blobs SET ref_count = MAX(ref_count - ?, 0), updated_at = ?
+        WHERE filename = ?
+    ''', [(count, now, filename) for filename, count in sorted(counts.items())])
+
+    filenames = sorted(counts)
+    placeholders = ','.join(['?'] * len(filenames))
+    cursor.execute(f'''
+        SELECT filename FROM image_blobs
+        WHERE filename IN ({placeholders}) AND ref_count = 0
+    ''', filenames)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_record_images_table(cursor: sqlite3.Cursor):
+    """创建记录-图片关联表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS record_images (
+            record_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            PRIMARY KEY (record_id, filename),
+            FOREIGN KEY (record_id) REFERENCES records(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_record_images_filename ON record_images(filename)')
+
+
+def get_record_image_filenames(cursor: sqlite3.Cursor, record_id: str) -> Set[str]:
+    """获取记录引用的图片文件名（走 record_images 主键索引）"""
+    cursor.execute('SELECT filename FROM record_images WHERE record_id = ?', (record_id,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def link_record_images(cursor: sqlite3.Cursor, record_id: str, urls: Iterable[str]):
+    """登记新记录的图片引用：写入关联并增加引用计数（在调用方事务内执行）
+
+    Args:
+        cursor: 数据库游标
+        record_id: 记录ID
+        urls: 图片URL列表
+    """
+    filenames = {image_filename(url) for url in urls if url}
+    cursor.executemany('INSERT OR IGNORE INTO record_images (record_id, filename) VALUES (?, ?)',
+                       [(record_id, filename) for filename in filenames])
+    add_image_refs(cursor, filenames)
+
+
+def sync_record_images(cursor: sqlite3.Cursor, record_id: str, urls: Iterable[str]):
+    """记录内容更新后同步图片引用（与 record_images 中的旧引用做差集，在调用方事务内执行）
+
+    引用计数降为 0 的图片不立即删除，由清理服务在宽限期后处理。
+
+    Args:
+        cursor: 数据库游标
+        record_id: 记录ID
+        urls: 更新后的图片URL列表
+    """
+    old = get_record_image_filenames(cursor, record_id)
+    new = {image_filename(url) for url in urls if url}
+
+    removed = old - new
+    added = new - old
+    if removed:
+        cursor.executemany('DELETE FROM record_images WHERE record_id = ? AND filename = ?',
+                           [(record_id, filename) for filename in removed])
+        release_image_refs(cursor, removed)
+    if added:
+        link_record_images(cursor, record_id, added)
+
+
+def unlink_record_images(cursor: sqlite3.Cursor, record_ids: List[str]) -> List[str]:
+    """删除记录前释放其图片引用（在调用方事务内执行）
+
+    Args:
+        cursor: 数据库游标
+        record_ids: 记录ID列表
+
+    Returns:
+        引用计数已降为 0 的文件名列表
+    """
+    if not record_ids:
+        return []
+
+    placeholders = ','.join(['?'] * len(record_ids))
+    cursor.execute(f'SELECT filename FROM record_images WHERE record_id IN ({placeholders})', record_ids)
+    counts = Counter(row[0] for row in cursor.fetchall())
+    cursor.execute(f'DELETE FROM record_images WHERE record_id IN ({placeholders})', record_ids)
+    return _decrement_refs(cursor, counts)
+
+
+def ensure_record_image_links(cursor: sqlite3.Cursor, record_ids: List[str]):
+    """为已计入引用计数但尚未写入 record_images 的记录补齐关联
+
+    仅在 record_images 回填完成前需要（v1.3.0 计数的历史记录没有关联行），不改变引用计数。
+
+    Args:
+        cursor: 数据库游标
+        record_ids: 记录ID列表
+    """
+    if not record_ids or is_backfill_completed(cursor, RECORD_IMAGES_BACKFILL_NAME):
+        return
+
+    placeholders = ','.join(['?'] * len(record_ids))
+    cursor.execute(f'''
+        SELECT id, text, metadata FROM records
+        WHERE id IN ({placeholders}) AND images_indexed = 1
+          AND NOT EXISTS (SELECT 1 FROM record_images ri WHERE ri.record_id = records.id)
+    ''', record_ids)
+    for record_id, text, metadata in cursor.fetchall():
+        cursor.executemany('INSERT OR IGNORE INTO record_images (record_id, filename) VALUES (?, ?)',
+                           [(record_id, image_filename(url)) for url in extract_image_urls(text, metadata)])
+
+
+def is_backfill_completed(cursor: sqlite3.Cursor, name: str) -> bool:
+    """指定的迁移回填任务是否已完成"""
+    try:
+        cursor.execute('SELECT status FROM migration_backfills WHERE name = ?', (name,))
+    except sqlite3.OperationalError:
+        return False
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'completed'
+
+
+def is_refcount_ready(cursor: sqlite3.Cursor) -> bool:
+    """引用计数是否已覆盖全部历史记录（回填完成前计数可能偏小，不能据此删除文件）"""
+    return is_backfill_completed(cursor, REFCOUNT_BACKFILL_NAME)
+
+
+class ImageStore:
+    """内容寻址图片存储
+
+    文件名为 `<blake2b>.<ext>`，同一内容的图片重复上传时直接复用已有文件。
+    """
+
+    # 保存与删除互斥，避免删除文件的同时有相同内容的图片被上传复用
+    _lock = threading.Lock()
+
+    def __init__(self, images_dir: Path, db_path: Path):
+        """初始化图片存储
+
+        Args:
+            images_dir: 图片目录
+            db_path: 数据库文件路径
+        """
+        self.images_dir = Path(images_dir)
+        self.thumbs_dir = self.images_dir / THUMBNAIL_DIR
+        self.db_path = Path(db_path)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @staticmethod
+    def content_hash(image_bytes: bytes) -> str:
+        """计算图片内容哈希（BLAKE2b, 128 位）"""
+        return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+    @staticmethod
+    def detect_extension(image_bytes: bytes, default: str = 'png') -> str:
+        """根据文件头识别图片扩展名"""
+        for signature, ext in _IMAGE_SIGNATURES:
+            if image_bytes.startswith(signature):
+                return ext
+        return default
+
+    def save(self, image_bytes: bytes, filename: Optional[str] = None) -> Dict[str, Any]:
+        """保存图片（内容相同则复用已有文件）
+
+        Args:
+            image_bytes: 图片二进制数据
+            filename: 指定文件名（可选，兼容旧接口；不指定时按内容哈希命名）
+
+        Returns:
+            {'image_url', 'thumbnail_url', 'filename', 'deduplicated'}
+        """
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+
+        digest = self.content_hash(image_bytes)
+        if not filename:
+            filename = f"{digest}.{self.detect_extension(image_bytes)}"
+
+        with self._lock:
+            return self._save_locked(image_bytes, digest, filename)
+
+    def _save_locked(self, image_bytes: bytes, digest: str, filename: str) -> Dict[str, Any]:
+        image_path = self.images_dir / filename
+        # 按内容哈希命名的文件同名即同内容；调用方指定的文件名需比对已有文件的内容
+        deduplicated = image_path.exists() and (
+            Path(filename).stem == digest or self.content_hash(image_path.read_bytes()) == digest
+        )
+        if not deduplicated:
+            if image_path.exists():
+                # 指定文件名已存在但内容不同：覆盖（与旧接口行为一致），旧缩略图作废
+                logger.warning(f"[ImageStore] 指定文件名已存在且内容不同，覆盖: {filename}")
+                (self.thumbs_dir / filename).unlink(missing_ok=True)
+            # 先写临时文件再改名，避免并发上传同一图片时读到半个文件
+            tmp_path = image_path.with_suffix(image_path.suffix + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(image_bytes)
+            tmp_path.replace(image_path)
+
+        thumbnail = self._ensure_thumbnail(filename, image_bytes)
+
+        now = _now()
+        conn = self._get_connection()
+        try:
+            conn.execute('''
+                INSERT INTO image_blobs (filename, content_hash, size, ref_count, thumbnail, created_at, updated_at)
+                VALUES (?, ?, ?, 0, ?, ?, ?)
+                ON CONFLICT(filename) DO UPDATE SET
+                    content_hash = excluded.content_hash,
+                    size = excluded.size,
+                    thumbnail = COALESCE(excluded.thumbnail, image_blobs.thumbnail),
+                    updated_at = excluded.updated_at
+            ''', (filename, digest, len(image_bytes), thumbnail, now, now))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"[ImageStore] 登记图片失败: {filename}, 错误: {e}", exc_info=True)
+            raise
+        finally:
+            conn.close()
+
+        if deduplicated:
+            logger.debug(f"[ImageStore] 图片已存在，复用: {filename}")
+
+        return {
+            'image_url': f"images/{filename}",
+            'thumbnail_url': f"images/{THUMBNAIL_DIR}/{thumbnail}" if thumbnail else None,
+            'filename': filename,
+            'deduplicated': deduplicated,
+        }
+
+    def _ensure_thumbnail(self, filename: str, image_bytes: bytes) -> Optional[str]:
+        """生成缩略图（已存在则跳过）
+
+        Returns:
+            缩略图文件名，未生成时返回 None
+        """
+        thumb_path = self.thumbs_dir / filename
+        if thumb_path.exists():
+            return filename
+        if not PIL_AVAILABLE:
+            return None
+
+        try:
+            self.thumbs_dir.mkdir(parents=True, exist_ok=True)
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                img_format = img.format
+                img.thumbnail(THUMBNAIL_MAX_SIZE)
+                tmp_path = thumb_path.with_suffix(thumb_path.suffix + '.tmp')
+                img.save(tmp_path, format=img_format)
+            tmp_path.replace(thumb_path)
+            return filename
+        except Exception as e:
+            logger.warning(f"[ImageStore] 生成缩略图失败: {filename}, 错误: {e}")
+            return None
+
+    def get_thumbnail_path(self, filename: str) -> Optional[Path]:
+        """获取缩略图路径（不存在时返回 None）"""
+        thumb_path = self.thumbs_dir / filename
+        return thumb_path if thumb_path.is_file() else None
+
+    def delete_files(self, filenames: Iterable[str]) -> List[str]:
+        """删除未被引用的图片文件、缩略图以及对应的登记行
+
+        删除前再次确认 ref_count 为 0，避免删除期间被新记录引用的图片。
+
+        Args:
+            filenames: 文件名列表
+
+        Returns:
+            成功删除的文件名列表
+        """
+        deleted = []
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                cursor = conn.cursor()
+                removable = []
+                for filename in filenames:
+                    cursor.execute('SELECT ref_count FROM image_blobs WHERE filename = ?', (filename,))
+                    row = cursor.fetchone()
+                    if row is not None and row[0] > 0:
+                        continue
+                    cursor.execute('DELETE FROM image_blobs WHERE filename = ?', (filename,))
+                    removable.append(filename)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"[ImageStore] 删除图片登记失败: {e}", exc_info=True)
+                return deleted
+            finally:
+                conn.close()
+
+            for filename in removable:
+                try:
+                    for path in (self.images_dir / filename, self.thumbs_dir / filename):
+                        if path.is_file():
+                            path.unlink()
+                    deleted.append(filename)
+                    logger.debug(f"[ImageStore] 已删除图片文件: {filename}")
+                except Exception as e:
+                    logger.warning(f"[ImageStore] 删除图片文件失败: {filename}, 错误: {e}")
+        return deleted
+
+    def find_orphans(self, grace_hours: float = 24) -> Optional[List[str]]:
+        """查找孤儿图片（引用计数为 0 且超过宽限期）
+
+        刚上传尚未保存到记录中的图片引用计数也为 0，宽限期用于避免误删。
+
+        Args:
+            grace_hours: 宽限期（小时）
+
+        Returns:
+            孤儿图片文件名列表；引用计数尚未就绪（历史回填未完成）时返回 None
+        """
+        cutoff = datetime.now() - timedelta(hours=grace_hours)
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            if not is_refcount_ready(cursor):
+                return None
+
+            cursor.execute('''
+                SELECT filename FROM image_blobs
+                WHERE ref_count = 0 AND updated_at <= ?
+            ''', (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+            orphans = [row[0] for row in cursor.fetchall()]
+
+            # 未登记的文件（历史遗留且未被任何记录引用）
+            cursor.execute('SELECT filename FROM image_blobs')
+            registered: Set[str] = {row[0] for row in cursor.fetchall()}
+            referenced_avatars = self._get_avatar_filenames(cursor)
+        finally:
+            conn.close()
+
+        if self.images_dir.exists():
+            for image_file in self.images_dir.iterdir():
+                if not image_file.is_file() or image_file.name in registered or image_file.suffix == '.tmp':
+                    continue
+                if datetime.fromtimestamp(image_file.stat().st_mtime) < cutoff:
+                    orphans.append(image_file.name)
+
+        return [name for name in orphans if name not in referenced_avatars]
+
+    def get_referenced_filenames(self) -> Optional[Set[str]]:
+        """获取所有被记录引用的图片文件名（record_images 索引查询）
+
+        Returns:
+            文件名集合；关联表尚未回填完成时返回 None
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            if not is_backfill_completed(cursor, RECORD_IMAGES_BACKFILL_NAME):
+                return None
+            cursor.execute('SELECT DISTINCT filename FROM record_images')
+            referenced = {row[0] for row in cursor.fetchall()}
+            return referenced | self._get_avatar_filenames(cursor)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _get_avatar_filenames(cursor: sqlite3.Cursor) -> Set[str]:
+        """用户头像同样通过图片接口上传，不能作为孤儿删除"""
+        try:
+            cursor.execute("SELECT avatar_url FROM users WHERE avatar_url IS NOT NULL AND avatar_url != ''")
+        except sqlite3.OperationalError:
+            return set()
+        return {image_filename(row[0]) for row in cursor.fetchall()}
@@ -0,0 +1,641 @@
+"""
+数据库版本迁移引擎
+
+功能：
+- 按版本号顺序应用结构迁移（加列、建表、建索引、重建触发器等）
+- 每个迁移在独立事务中执行，并写入 schema_versions
+- 长耗时的数据回填（backfill）按批次在线执行，每批一个短事务，不长时间占用写锁
+- 回填进度持久化到 migration_backfills 表，进程重启后从断点继续
+- 提供进度查询，供 API 展示迁移状态
+"""
+import asyncio
+import sqlite3
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .chat_messages import create_chat_messages_table
+from .change_log import (
+    CHANGE_LOG_BACKFILL_NAMES,
+    backfill_record_tags,
+    backfill_records,
+    backfill_tags,
+    count_record_tags,
+    count_tags,
+    create_change_log,
+)
+from .consumption_rollups import (
+    ROLLUP_BACKFILL_NAME,
+    backfill_rollups,
+    count_consumption_records,
+    create_rollup_tables,
+)
+from .image_store import (
+    RECORD_IMAGES_BACKFILL_NAME,
+    REFCOUNT_BACKFILL_NAME,
+    create_image_tables,
+    create_record_images_table,
+    extract_image_urls,
+    image_filename,
+    link_record_images,
+)
+from .rolling_summary_store import create_rolling_summaries_table
+from .translation_memory import create_translation_memory_table
+from .user_stats import (
+    USER_STATS_BACKFILL_NAME,
+    backfill_user_stats,
+    count_stats_users,
+    create_user_stats,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# 回填批处理函数：(cursor, last_key, batch_size) -> (new_last_key, processed)
+# new_last_key 为 None 表示回填已完成
+BatchFunc = Callable[[sqlite3.Cursor, Optional[str], int], Tuple[Optional[str], int]]
+
+# 回填总量估算函数：(cursor) -> 需要处理的总行数
+CountFunc = Callable[[sqlite3.Cursor], int]
+
+
+@dataclass
+class Backfill:
+    """数据回填任务定义
+
+    Attributes:
+        name: 回填任务唯一名称
+        batch: 批处理函数，处理一批数据并返回新的断点
+        count: 总量估算函数（可选，用于进度展示）
+    """
+    name: str
+    batch: BatchFunc
+    count: Optional[CountFunc] = None
+
+
+@dataclass
+class Migration:
+    """数据库迁移定义
+
+    Attributes:
+        version: 目标版本号（如 '1.2.2'）
+        description: 迁移说明
+        upgrade: 结构变更函数，在迁移事务内执行（应保持快速，大批量数据改写放到 backfills）
+        backfills: 结构变更后需要在线执行的数据回填任务
+    """
+    version: str
+    description: str
+    upgrade: Optional[Callable[[sqlite3.Cursor], None]] = None
+    backfills: List[Backfill] = field(default_factory=list)
+
+
+def _version_key(version: str) -> Tuple[int, ...]:
+    """将版本号转换为可比较的元组"""
+    return tuple(int(part) for part in version.split('.'))
+
+
+def _column_exists(cursor: sqlite3.Cursor, table: str, column: str) -> bool:
+    """检查表中是否已存在指定列（ALTER TABLE ADD COLUMN 不支持 IF NOT EXISTS）"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+# ==================== 迁移定义 ====================
+
+def _backfill_records_updated_at(cursor: sqlite3.Cursor, last_key: Optional[str],
+                                 batch_size: int) -> Tuple[Optional[str], int]:
+    """补齐 records.updated_at（早期版本写入的记录该字段为空）"""
+    last_rowid = int(last_key) if last_key else 0
+    cursor.execute('''
+        SELECT rowid FROM records
+        WHERE rowid > ?
+        ORDER BY rowid
+        LIMIT ?
+    ''', (last_rowid, batch_size))
+    rowids = [row[0] for row in cursor.fetchall()]
+    if not rowids:
+        return None, 0
+
+    cursor.execute('''
+        UPDATE records SET updated_at = created_at
+        WHERE rowid BETWEEN ? AND ? AND updated_at IS NULL
+    ''', (rowids[0], rowids[-1]))
+    return str(rowids[-1]), len(rowids)
+
+
+def _count_records(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('SELECT COUNT(*) FROM records')
+    return cursor.fetchone()[0]
+
+
+def _upgrade_image_blobs(cursor: sqlite3.Cursor):
+    """创建图片引用计数表，records 增加 images_indexed 标记（是否已计入引用计数）"""
+    create_image_tables(cursor)
+    if not _column_exists(cursor, 'records', 'images_indexed'):
+        cursor.execute('ALTER TABLE records ADD COLUMN images_indexed INTEGER NOT NULL DEFAULT 0')
+
+
+def _backfill_image_refcount(cursor: sqlite3.Cursor, last_key: Optional[str],
+                             batch_size: int) -> Tuple[Optional[str], int]:
+    """将历史记录中的图片引用计入 image_blobs（按 images_indexed 标记保证每条记录只计一次）"""
+    last_rowid = int(last_key) if last_key else 0
+    cursor.execute('''
+        SELECT rowid, id, text, metadata, images_indexed FROM records
+        WHERE rowid > ?
+        ORDER BY rowid
+        LIMIT ?
+    ''', (last_rowid, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return None, 0
+
+    for row in rows:
+        if row[4]:
+            continue
+        link_record_images(cursor, row[1], extract_image_urls(row[2], row[3]))
+        cursor.execute('UPDATE records SET images_indexed = 1 WHERE rowid = ?', (row[0],))
+    return str(rows[-1][0]), len(rows)
+
+
+def _backfill_record_images(cursor: sqlite3.Cursor, last_key: Optional[str],
+                            batch_size: int) -> Tuple[Optional[str], int]:
+    """为 v1.3.0 已计入引用计数的记录补齐 record_images 关联（引用计数不变）"""
+    last_rowid = int(last_key) if last_key else 0
+    cursor.execute('''
+        SELECT rowid, id, text, metadata FROM records
+        WHERE rowid > ? AND images_indexed = 1
+        ORDER BY rowid
+        LIMIT ?
+    ''', (last_rowid, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return None, 0
+
+    for row in rows:
+        cursor.executemany('INSERT OR IGNORE INTO record_images (record_id, filename) VALUES (?, ?)',
+                           [(row[1], image_filename(url)) for url in extract_image_urls(row[2], row[3])])
+    return str(rows[-1][0]), len(rows)
+
+
+def _upgrade_activation_codes(cursor: sqlite3.Cursor):
+    """activation_codes 增加兑换用户列（激活码按用户兑换，设备可为空）"""
+    if not _column_exists(cursor, 'activation_codes', 'used_by_user_id'):
+        cursor.execute('ALTER TABLE activation_codes ADD COLUMN used_by_user_id TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activation_codes_user ON activation_codes(used_by_user_id)')
+
+
+def _upgrade_records_fts_trigger(cursor: sqlite3.Cursor):
+    """records_au 只在 text 变化时更新全文索引
+
+    收藏、归档、metadata 投影等不改 text 的更新不再重写索引；
+    只更新与旧 text 相同的索引行，对话追加消息的索引行不受影响。
+    """
+    cursor.execute('DROP TRIGGER IF EXISTS records_au')
+    cursor.execute('''
+        CREATE TRIGGER records_au AFTER UPDATE OF text ON records
+        WHEN old.text IS NOT new.text
+        BEGIN
+            UPDATE records_fts SET text = new.text WHERE record_id = old.id AND text = old.text;
+        END
+    ''')
+
+
+def _upgrade_rolling_summaries(cursor: sqlite3.Cursor):
+    """创建滚动小结状态表（早期版本由存储类自行建表，补齐设备和已并入语句列）"""
+    create_rolling_summaries_table(cursor)
+    if not _column_exists(cursor, 'rolling_summaries', 'device_id'):
+        cursor.execute('ALTER TABLE rolling_summaries ADD COLUMN device_id TEXT')
+    if not _column_exists(cursor, 'rolling_summaries', 'folded_texts'):
+        cursor.execute("ALTER TABLE rolling_summaries ADD COLUMN folded_texts TEXT NOT NULL DEFAULT '[]'")
+
+
+def _upgrade_rolling_summary_coverage(cursor: sqlite3.Cursor):
+    """rolling_summaries 增加已并入语句指纹列（取代保存语句原文的 folded_texts）"""
+    if not _column_exists(cursor, 'rolling_summaries', 'folded_coverage'):
+        cursor.execute("ALTER TABLE rolling_summaries ADD COLUMN folded_coverage TEXT NOT NULL DEFAULT '[]'")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        version='1.2.2',
+        description='补齐 records.updated_at 空值',
+        backfills=[
+            Backfill(
+                name='records_updated_at',
+                batch=_backfill_records_updated_at,
+                count=_count_records,
+            ),
+        ],
+    ),
+    Migration(
+        version='1.3.0',
+        description='内容寻址图片存储：图片引用计数表',
+        upgrade=_upgrade_image_blobs,
+        backfills=[
+            Backfill(
+                name=REFCOUNT_BACKFILL_NAME,
+                batch=_backfill_image_refcount,
+                count=_count_records,
+            ),
+        ],
+    ),
+    Migration(
+        version='1.3.1',
+        description='记录-图片关联表 record_images',
+        upgrade=create_record_images_table,
+        backfills=[
+            Backfill(
+                name=RECORD_IMAGES_BACKFILL_NAME,
+                batch=_backfill_record_images,
+                count=_count_records,
+            ),
+        ],
+    ),
+    Migration(
+        version='1.3.2',
+        description='消费统计汇总表（按小时 / 按天）',
+        upgrade=create_rollup_tables,
+        backfills=[
+            Backfill(
+                name=ROLLUP_BACKFILL_NAME,
+                batch=backfill_rollups,
+                count=count_consumption_records,
+            ),
+        ],
+    ),
+    Migration(
+        version='1.3.3',
+        description='激活码按批次入库兑换：activation_codes 增加兑换用户列',
+        upgrade=_upgrade_activation_codes,
+    ),
+    Migration(
+        version='1.3.4',
+        description='多设备同步变更日志 change_log（记录、标签、标签关联）',
+        upgrade=create_change_log,
+        backfills=[
+            Backfill(
+                name=CHANGE_LOG_BACKFILL_NAMES['record'],
+                batch=backfill_records,
+                count=_count_records,
+            ),
+            Backfill(
+                name=CHANGE_LOG_BACKFILL_NAMES['tag'],
+                batch=backfill_tags,
+                count=count_tags,
+            ),
+            Backfill(
+                name=CHANGE_LOG_BACKFILL_NAMES['record_tag'],
+                batch=backfill_record_tags,
+                count=count_record_tags,
+            ),
+        ],
+    ),
+    Migration(
+        version='1.3.5',
+        description='用户统计计数表 user_stats（记录数、收藏/归档/回收站、标签记录数）',
+        upgrade=create_user_stats,
+        backfills=[
+            Backfill(
+                name=USER_STATS_BACKFILL_NAME,
+                batch=backfill_user_stats,
+                count=count_stats_users,
+            ),
+        ],
+    ),
+    Migration(
+        version='1.3.6',
+        description='智能助手对话消息表 chat_messages（每轮追加，记录投影延迟刷新）',
+        upgrade=create_chat_messages_table,
+    ),
+    Migration(
+        version='1.3.7',
+        description='全文索引增量更新：records_au 只在 text 变化时重写索引，对话消息按轮追加索引',
+        upgrade=_upgrade_records_fts_trigger,
+    ),
+    Migration(
+        version='1.3.8',
+        description='滚动小结状态表 rolling_summaries（按设备区分录音会话）',
+        upgrade=_upgrade_rolling_summaries,
+    ),
+    Migration(
+        version='1.3.9',
+        description='翻译记忆表 translation_memory（早期版本由存储类自行建表）',
+        upgrade=create_translation_memory_table,
+    ),
+    Migration(
+        version='1.3.10',
+        description='滚动小结保存已并入语句的指纹（数量有上限），不再保存语句原文',
+        upgrade=_upgrade_rolling_summary_coverage,
+    ),
+]
+
+
+# ==================== 迁移执行器 ====================
+
+class MigrationRunner:
+    """数据库迁移执行器
+
+    结构迁移在启动时同步应用（快速的 DDL）；数据回填由后台任务按批次执行，
+    每批提交一次事务并短暂让出写锁，进度写入 migration_backfills 表。
+    """
+
+    def __init__(self, db_path: str, migrations: Optional[List[Migration]] = None,
+                 batch_size: int = 500, pause_ms: int = 50):
+        """初始化迁移执行器
+
+        Args:
+            db_path: 数据库文件路径
+            migrations: 迁移列表（默认使用模块内 MIGRATIONS）
+            batch_size: 每批回填处理的行数
+            pause_ms: 两批之间的让出时间（毫秒），让前台写请求有机会拿到写锁
+        """
+        self.db_path = Path(db_path)
+        self.migrations = sorted(migrations if migrations is not None else MIGRATIONS,
+                                 key=lambda m: _version_key(m.version))
+        self.batch_size = max(1, int(batch_size))
+        self.pause_ms = max(0, int(pause_ms))
+
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """获取数据库连接（手动管理事务）"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _ensure_tables(self, cursor: sqlite3.Cursor):
+        """创建迁移相关的元数据表"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_versions (
+                version TEXT PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL,
+                description TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS migration_backfills (
+                name TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                last_key TEXT,
+                processed INTEGER NOT NULL DEFAULT 0,
+                total INTEGER,
+                error_message TEXT,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                completed_at TIMESTAMP,
+                CHECK (status IN ('pending', 'running', 'completed', 'failed'))
+            )
+        ''')
+
+    def _find_backfill(self, name: str) -> Optional[Backfill]:
+        for migration in self.migrations:
+            for backfill in migration.backfills:
+                if backfill.name == name:
+                    return backfill
+        return None
+
+    def apply_pending(self) -> List[str]:
+        """应用所有未执行的结构迁移
+
+        Returns:
+            本次应用的版本号列表
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        applied = []
+        try:
+            self._ensure_tables(cursor)
+            cursor.execute('SELECT version FROM schema_versions')
+            existing = {row[0] for row in cursor.fetchall()}
+
+            for migration in self.migrations:
+                if migration.version in existing:
+                    continue
+
+                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    if migration.upgrade:
+                        migration.upgrade(cursor)
+                    for backfill in migration.backfills:
+                        cursor.execute('''
+                            INSERT OR IGNORE INTO migration_backfills (name, version, status, updated_at)
+                            VALUES (?, ?, 'pending', ?)
+                        ''', (backfill.name, migration.version, now))
+                    cursor.execute('''
+                        INSERT INTO schema_versions (version, applied_at, description)
+                        VALUES (?, ?, ?)
+                    ''', (migration.version, now, migration.description))
+                    cursor.execute('COMMIT')
+                except Exception:
+                    cursor.execute('ROLLBACK')
+                    raise
+
+                applied.append(migration.version)
+                logger.info(f"[Migration] 已应用迁移 v{migration.version}: {migration.description}")
+
+            return applied
+        except Exception as e:
+            logger.error(f"[Migration] 应用迁移失败: {e}", exc_info=True)
+            raise
+        finally:
+            conn.close()
+
+    def has_pending_backfills(self) -> bool:
+        """是否存在未完成的回填任务"""
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            self._ensure_tables(cursor)
+            cursor.execute("SELECT COUNT(*) FROM migration_backfills WHERE status != 'completed'")
+            return cursor.fetchone()[0] > 0
+        finally:
+            conn.close()
+
+    def run_backfill_batch(self, name: str) -> bool:
+        """执行指定回填任务的一批数据（单个短事务）
+
+        Args:
+            name: 回填任务名称
+
+        Returns:
+            回填是否已完成
+        """
+        backfill = self._find_backfill(name)
+        if not backfill:
+            logger.warning(f"[Migration] 未找到回填任务定义，跳过: {name}")
+            return True
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT * FROM migration_backfills WHERE name = ?', (name,))
+            state = cursor.fetchone()
+            if not state or state['status'] == 'completed':
+                return True
+
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+            # 首批前估算总量
+            if state['started_at'] is None:
+                total = backfill.count(cursor) if backfill.count else None
+                cursor.execute('''
+                    UPDATE migration_backfills
+                    SET status = 'running', total = ?, started_at = ?, updated_at = ?, error_message = NULL
+                    WHERE name = ?
+                ''', (total, now, now, name))
+
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                new_key, processed = backfill.batch(cursor, state['last_key'], self.batch_size)
+                if new_key is None:
+                    cursor.execute('''
+                        UPDATE migration_backfills
+                        SET status = 'completed', processed = processed + ?, updated_at = ?, completed_at = ?
+                        WHERE name = ?
+                    ''', (processed, now, now, name))
+                else:
+                    cursor.execute('''
+                        UPDATE migration_backfills
+                        SET status = 'running', last_key = ?, processed = processed + ?, updated_at = ?
+                        WHERE name = ?
+                    ''', (new_key, processed, now, name))
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+
+            if new_key is None:
+                logger.info(f"[Migration] 回填完成: {name}")
+            return new_key is None
+        except Exception as e:
+            logger.error(f"[Migration] 回填批次失败: {name}, 错误: {e}", exc_info=True)
+            cursor.execute('''
+                UPDATE migration_backfills SET status = 'failed', error_message = ?, updated_at = ?
+                WHERE name = ?
+            ''', (str(e), datetime.now().strftime('%Y-%m-%d %H:%M:%S'), name))
+            raise
+        finally:
+            conn.close()
+
+    def run_backfills(self) -> int:
+        """同步执行所有未完成的回填任务（用于脚本/测试）
+
+        Returns:
+            完成的回填任务数
+        """
+        completed = 0
+        for name in self._pending_backfill_names():
+            while not self.run_backfill_batch(name):
+                pass
+            completed += 1
+        return completed
+
+    def _pending_backfill_names(self) -> List[str]:
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            self._ensure_tables(cursor)
+            cursor.execute('''
+                SELECT name, version FROM migration_backfills
+                WHERE status != 'completed'
+            ''')
+            rows = sorted(cursor.fetchall(), key=lambda r: (_version_key(r['version']), r['name']))
+            return [row['name'] for row in rows]
+        finally:
+            conn.close()
+
+    async def start(self):
+        """启动后台回填任务"""
+        if self._running:
+            logger.warning("[Migration] 回填任务已在运行中")
+            return
+
+        if not self.has_pending_backfills():
+            logger.info("[Migration] 没有待执行的回填任务")
+            return
+
+        self._running = True
+        self._task = asyncio.create_task(self._backfill_loop())
+        logger.info(f"[Migration] 后台回填已启动 (批大小: {self.batch_size}, 间隔: {self.pause_ms}ms)")
+
+    async def stop(self):
+        """停止后台回填任务（进度已持久化，下次启动继续）"""
+        if not self._running:
+            return
+
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info("[Migration] 后台回填已停止")
+
+    async def _backfill_loop(self):
+        """后台回填循环：每批在线程池执行，批次之间让出写锁"""
+        loop = asyncio.get_running_loop()
+        try:
+            for name in await loop.run_in_executor(None, self._pending_backfill_names):
+                while self._running:
+                    try:
+                        done = await loop.run_in_executor(None, self.run_backfill_batch, name)
+                    except Exception:
+                        # 失败状态已记录，继续下一个任务
+                        break
+                    if done:
+                        break
+                    await asyncio.sleep(self.pause_ms / 1000)
+        except asyncio.CancelledError:
+            logger.info("[Migration] 回填循环已取消")
+        except Exception as e:
+            logger.error(f"[Migration] 回填循环异常: {e}", exc_info=True)
+        finally:
+            self._running = False
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取迁移状态和回填进度
+
+        Returns:
+            状态字典，包含当前版本、已应用版本、待应用版本和回填进度
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            self._ensure_tables(cursor)
+
+            cursor.execute('SELECT version, applied_at, description FROM schema_versions')
+            applied = sorted((dict(row) for row in cursor.fetchall()),
+                             key=lambda v: _version_key(v['version']))
+            applied_versions = {v['version'] for v in applied}
+
+            cursor.execute('''
+                SELECT name, version, status, processed, total, error_message,
+                       started_at, updated_at, completed_at
+                FROM migration_backfills
+            ''')
+            backfills = []
+            for row in sorted(cursor.fetchall(), key=lambda r: (_version_key(r['version']), r['name'])):
+                item = dict(row)
+                total = item.get('total')
+                item['progress'] = round(min(item['processed'] / total, 1.0), 4) if total else (
+                    1.0 if item['status'] == 'completed' else 0.0
+                )
+                backfills.append(item)
+
+            return {
+                'current_version': applied[-1]['version'] if applied else None,
+                'applied': applied,
+                'pending': [m.version for m in self.migrations if m.version not in applied_versions],
+                'backfills': backfills,
+                'backfill_running': self._running,
+            }
+        finally:
+            conn.close()
@@ -0,0 +1,139 @@
+"""
+滚动小结状态存储
+
+功能：
+- 持久化每个录音会话的增量小结状态（已并入的小结、已并入语句的指纹、尚未并入的语句、所属设备）
+- 服务重启后可继续使用会话的中间结果
+- 按最后更新时间清理过期会话
+
+rolling_summaries 表由迁移 v1.3.8 创建、v1.3.10 补齐语句指纹列（见 migrations.py）。
+"""
+
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from src.core.logger import get_logger
+
+logger = get_logger("RollingSummaryStore")
+
+
+def create_rolling_summaries_table(cursor: sqlite3.Cursor):
+    """创建 rolling_summaries 表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rolling_summaries (
+            session_id TEXT PRIMARY KEY,
+            app_id TEXT,
+            device_id TEXT,
+            summary_type TEXT NOT NULL,
+            summary TEXT,
+            folded_count INTEGER NOT NULL DEFAULT 0,
+            folded_texts TEXT NOT NULL DEFAULT '[]',
+            folded_coverage TEXT NOT NULL DEFAULT '[]',
+            pending TEXT NOT NULL DEFAULT '[]',
+            is_closed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rolling_summaries_updated ON rolling_summaries(updated_at)')
+
+
+class RollingSummaryStore:
+    """滚动小结状态存储（SQLite）"""
+
+    def __init__(self, db_path: str):
+        """初始化存储（表结构由 MigrationRunner 创建）
+
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = Path(db_path).expanduser()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """获取数据库连接"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def save(self, state: Dict[str, Any]):
+        """保存会话状态（不存在时创建）
+
+        Args:
+            state: 会话状态，包含 session_id、app_id、device_id、summary_type、summary、
+                   folded_count、folded_coverage（已并入语句的指纹 [[hash, length], ...]）、
+                   pending（[[start_time, text], ...]）、is_closed
+        """
+        now = datetime.now().isoformat()
+        conn = self._get_connection()
+        try:
+            conn.execute('''
+                INSERT INTO rolling_summaries
+                    (session_id, app_id, device_id, summary_type, summary, folded_count, folded_coverage,
+                     pending, is_closed, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    folded_count = excluded.folded_count,
+                    folded_texts = '[]',
+                    folded_coverage = excluded.folded_coverage,
+                    pending = excluded.pending,
+                    is_closed = excluded.is_closed,
+                    updated_at = excluded.updated_at
+            ''', (
+                state['session_id'], state.get('app_id'), state.get('device_id'), state['summary_type'],
+                state.get('summary'), state.get('folded_count', 0),
+                json.dumps(state.get('folded_coverage', [])),
+                json.dumps(state.get('pending', []), ensure_ascii=False),
+                1 if state.get('is_closed') else 0, now, now,
+            ))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话状态（不存在时返回 None）"""
+        conn = self._get_connection()
+        try:
+            row = conn.execute('''
+                SELECT session_id, app_id, device_id, summary_type, summary, folded_count, folded_texts,
+                       pending, is_closed, updated_at, folded_coverage
+                FROM rolling_summaries WHERE session_id = ?
+            ''', (session_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        return {
+            'session_id': row[0],
+            'app_id': row[1],
+            'device_id': row[2],
+            'summary_type': row[3],
+            'summary': row[4],
+            'folded_count': row[5],
+            'folded_coverage': json.loads(row[10] or '[]'),
+            # 早期版本保存的已并入语句原文（再次保存时清空）
+            'folded_texts': json.loads(row[6] or '[]'),
+            'pending': json.loads(row[7] or '[]'),
+            'is_closed': bool(row[8]),
+            'updated_at': row[9],
+        }
+
+    def prune(self, max_age_days: int = 7) -> int:
+        """删除超过 max_age_days 未更新的会话
+
+        Returns:
+            删除的会话数
+        """
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+        conn = self._get_connection()
+        try:
+            deleted = conn.execute('DELETE FROM rolling_summaries WHERE updated_at < ?', (cutoff,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if deleted:
+            logger.info(f"[滚动小结] 清理过期会话: {deleted} 个")
+        return deleted
@@ -5,12 +5,24 @@ SQLite 存储提供商
 """
 import sqlite3
 import json
-import re
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 from pathlib import Path
 
 from .base_storage import BaseStorageProvider
+from .migrations import MigrationRunner
+from .change_log import read_changes
+from .chat_messages import append_chat_messages, fill_chat_messages, read_chat_messages
+from .user_stats import read_record_count, read_user_stats
+from .image_store import (
+    ImageStore,
+    ensure_record_image_links,
+    extract_image_urls,
+    is_refcount_ready,
+    link_record_images,
+    sync_record_images,
+    unlink_record_images,
+)
 
 
 class SQLiteStorageProvider(BaseStorageProvider):
@@ -52,6 +64,7 @@ class SQLiteStorageProvider(BaseStorageProvider):
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
         
         self._create_table()
+        self.image_store = ImageStore(self.images_dir, self.db_path)
         return True
     
     def _create_table(self):
@@ -340,6 +353,9 @@ class SQLiteStorageProvider(BaseStorageProvider):
         logger.info(f"[Storage] 数据表已初始化 (v1.2.1): {self.db_path}")
         conn.commit()
         conn.close()
+        
+        # 应用 v1.2.1 之后的增量迁移（数据回填由后台任务分批执行）
+        MigrationRunner(str(self.db_path)).apply_pending()
     
     def _get_connection(self):
         """获取数据库连接"""
@@ -376,20 +392,27 @@ class SQLiteStorageProvider(BaseStorageProvider):
         
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO records (
-                id, text, metadata, app_type, user_id, device_id,
-                is_deleted, deleted_at, is_starred, is_archived,
-                created_at, updated_at
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            record_id, text, json.dumps(metadata, ensure_ascii=False), app_type, user_id, device_id,
-            0, None, 0, 0,  # is_deleted, deleted_at, is_starred, is_archived
-            now, now  # created_at, updated_at
-        ))
-        conn.commit()
-        conn.close()
+        try:
+            cursor.execute('''
+                INSERT INTO records (
+                    id, text, metadata, app_type, user_id, device_id,
+                    is_deleted, deleted_at, is_starred, is_archived,
+                    created_at, updated_at, images_indexed
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ''', (
+                record_id, text, json.dumps(metadata, ensure_ascii=False), app_type, user_id, device_id,
+                0, None, 0, 0,  # is_deleted, deleted_at, is_starred, is_archived
+                now, now  # created_at, updated_at
+            ))
+            # 图片关联和引用计数与记录写入在同一事务内
+            link_record_images(cursor, record_id, extract_image_urls(text, metadata))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
         logger.debug(f"[Storage] 记录已创建: id={record_id}, app_type={app_type}, user_id={user_id}, device_id={device_id}")
         return record_id
@@ -423,7 +446,7 @@ class SQLiteStorageProvider(BaseStorageProvider):
         cursor = conn.cursor()
         
         # 构建更新语句
-        update_fields = ['text = ?', 'metadata = ?', 'updated_at = ?']
+        update_fields = ['text = ?', 'metadata = ?', 'updated_at = ?', 'images_indexed = 1']
         params = [text, json.dumps(metadata, ensure_ascii=False), now]
         
         if user_id:
@@ -435,11 +458,20 @@ class SQLiteStorageProvider(BaseStorageProvider):
         
         params.append(record_id)
         query = f"UPDATE records SET {', '.join(update_fields)} WHERE id = ?"
-        cursor.execute(query, params)
-        
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        try:
+            ensure_record_image_links(cursor, [record_id])
+            cursor.execute(query, params)
+            success = cursor.rowcount > 0
+            
+            if success:
+                # 与 record_images 中的旧引用做差集，无需重新解析旧内容
+                sync_record_images(cursor, record_id, extract_image_urls(text, metadata))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
         logger.debug(f"[Storage] 记录已更新: id={record_id}, success={success}")
         return success
@@ -462,19 +494,25 @@ class SQLiteStorageProvider(BaseStorageProvider):
         ''', (record_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
-        if row:
-            return {
-                'id': row[0],
-                'text': row[1],
-                'metadata': json.loads(row[2]) if row[2] else {},
-                'app_type': row[3] or 'voice-note',
-                'user_id': row[4],
-                'device_id': row[5],
-                'created_at': row[6]
-            }
-        return None
+        if not row:
+            conn.close()
+            return None
+        
+        record = {
+            'id': row[0],
+            'text': row[1],
+            'metadata': json.loads(row[2]) if row[2] else {},
+            'app_type': row[3] or 'voice-note',
+            'user_id': row[4],
+            'device_id': row[5],
+            'created_at': row[6]
+        }
+        if record['app_type'] == 'smart-chat':
+            # 对话消息保存在消息表中，metadata 只有统计投影
+            fill_chat_messages(cursor, record_id, record['metadata'])
+        conn.close()
+        return record
     
     def list_records(self, limit: int = 100, offset: int = 0, app_type: Optional[str] = None,
                     user_id: Optional[str] = None, device_id: Optional[str] = None) -> list[Dict[str, Any]]:
@@ -537,7 +575,7 @@ class SQLiteStorageProvider(BaseStorageProvider):
         ]
     
     def delete_record(self, record_id: str) -> bool:
-        """删除单条记录（同步删除关联图片）
+        """删除单条记录（同步删除不再被引用的图片）
         
         Args:
             record_id: 记录 ID
@@ -545,32 +583,7 @@ class SQLiteStorageProvider(BaseStorageProvider):
         Returns:
             删除是否成功
         """
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        # 1. 先获取记录，提取图片URL
-        record = self.get_record(record_id)
-        if not record:
-            return False
-        
-        # 2. 提取并删除关联图片
-        image_urls = self._extract_image_urls(record)
-        deleted_images = self._delete_images(image_urls)
-        if deleted_images:
-            logger.info(f"[Storage] 删除记录 {record_id} 的关联图片: {deleted_images}")
-        
-        # 3. 删除数据库记录
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM records WHERE id = ?', (record_id,))
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
-        
-        if success:
-            logger.info(f"[Storage] 记录已删除: id={record_id}, 同时删除了 {len(deleted_images)} 个图片文件")
-        
-        return success
+        return self.delete_records([record_id]) > 0
     
     def _extract_image_urls(self, record: Dict[str, Any]) -> List[str]:
         """从记录中提取所有图片URL
@@ -581,62 +594,7 @@ class SQLiteStorageProvider(BaseStorageProvider):
         Returns:
             图片URL列表（相对路径，如 'images/xxx.png'）
         """
-        image_urls = []
-        
-        # 从 metadata.blocks 中提取图片
-        metadata = record.get('metadata', {})
-        if isinstance(metadata, dict):
-            blocks = metadata.get('blocks', [])
-            for block in blocks:
-                if isinstance(block, dict) and block.get('type') == 'image':
-                    image_url = block.get('imageUrl')
-                    if image_url:
-                        image_urls.append(image_url)
-        
-        # 从 text 字段提取图片占位符（降级方案）
-        text = record.get('text', '')
-        if text:
-            # 匹配 [IMAGE: images/xxx.png] 格式
-            pattern = r'\[IMAGE:\s*([^\]]+)\]'
-            matches = re.findall(pattern, text)
-            for match in matches:
-                if match not in image_urls:
-                    image_urls.append(match)
-        
-        return image_urls
-    
-    def _delete_images(self, image_urls: List[str]) -> List[str]:
-        """删除图片文件
-        
-        Args:
-            image_urls: 图片URL列表（相对路径，如 'images/xxx.png'）
-        
-        Returns:
-            成功删除的图片URL列表
-        """
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        deleted = []
-        for url in image_urls:
-            try:
-                # 处理相对路径
-                if url.startswith('images/'):
-                    filename = url.replace('images/', '')
-                else:
-                    filename = url
-                
-                image_path = self.images_dir / filename
-                if image_path.exists() and image_path.is_file():
-                    image_path.unlink()
-                    deleted.append(url)
-                    logger.debug(f"[Storage] 已删除图片文件: {url}")
-                else:
-                    logger.debug(f"[Storage] 图片文件不存在，跳过: {url}")
-            except Exception as e:
-                logger.warning(f"[Storage] 删除图片文件失败: {url}, 错误: {e}")
-        
-        return deleted
+        return extract_image_urls(record.get('text', ''), record.get('metadata', {}))
     
     def count_records(self, app_type: Optional[str] = None, 
                      user_id: Optional[str] = None, device_id: Optional[str] = None) -> int:
@@ -653,6 +611,13 @@ class SQLiteStorageProvider(BaseStorageProvider):
         conn = self._get_connection()
         cursor = conn.cursor()
         
+        # 按用户统计时直接读取物化计数
+        if user_id and not device_id:
+            count = read_record_count(cursor, user_id, app_type)
+            if count is not None:
+                conn.close()
+                return count
+        
         # 构建查询条件
         conditions = []
         params = []
@@ -678,7 +643,9 @@ class SQLiteStorageProvider(BaseStorageProvider):
         return count
     
     def delete_records(self, record_ids: list[str]) -> int:
-        """批量删除记录（同步删除关联图片）
+        """批量删除记录（同步删除不再被引用的图片）
+        
+        图片按内容去重存储，可能被多条记录共享，只有引用计数降为 0 的图片才会被删除。
         
         Args:
             record_ids: 记录 ID 列表
@@ -692,28 +659,120 @@ class SQLiteStorageProvider(BaseStorageProvider):
         if not record_ids:
             return 0
         
-        # 1. 先获取所有记录，提取图片URL
-        all_image_urls = []
-        for record_id in record_ids:
-            record = self.get_record(record_id)
-            if record:
-                image_urls = self._extract_image_urls(record)
-                all_image_urls.extend(image_urls)
-        
-        # 2. 删除所有关联图片
-        deleted_images = self._delete_images(all_image_urls)
-        if deleted_images:
-            logger.info(f"[Storage] 批量删除 {len(record_ids)} 条记录的关联图片: {len(deleted_images)} 个")
-        
-        # 3. 批量删除数据库记录
         conn = self._get_connection()
         cursor = conn.cursor()
         placeholders = ','.join(['?'] * len(record_ids))
-        cursor.execute(f'DELETE FROM records WHERE id IN ({placeholders})', record_ids)
-        deleted_count = cursor.rowcount
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"[Storage] 批量删除完成: 删除了 {deleted_count} 条记录和 {len(deleted_images)} 个图片文件")
+        try:
+            # 1. 通过 record_images 索引释放图片引用
+            ensure_record_image_links(cursor, record_ids)
+            unreferenced = unlink_record_images(cursor, record_ids)
+            
+            # 2. 批量删除数据库记录
+            cursor.execute(f'DELETE FROM records WHERE id IN ({placeholders})', record_ids)
+            deleted_count = cursor.rowcount
+            
+            # 历史引用计数回填完成前，计数可能偏小，图片交由清理服务处理
+            refcount_ready = is_refcount_ready(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        # 3. 删除不再被引用的图片文件
+        deleted_images = []
+        if unreferenced and refcount_ready:
+            deleted_images = self.image_store.delete_files(sorted(unreferenced))
+        
+        logger.info(f"[Storage] 删除完成: 删除了 {deleted_count} 条记录和 {len(deleted_images)} 个图片文件")
         
         return deleted_count
+    
+    def append_chat_messages(self, record_id: str, start_seq: int, messages: List[Dict[str, Any]],
+                             index_from: Optional[int] = None) -> int:
+        """追加智能助手对话消息（不改写记录本身）
+        
+        Args:
+            record_id: 对话记录 ID
+            start_seq: 第一条消息在对话中的序号
+            messages: 消息列表（id、role、content、timestamp）
+            index_from: 序号不小于该值的新消息写入全文检索（为 None 时不建立索引）
+        
+        Returns:
+            实际写入的消息数
+        """
+        conn = self._get_connection()
+        try:
+            written = append_chat_messages(conn.cursor(), record_id, start_seq, messages, index_from)
+            conn.commit()
+            return written
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def update_chat_projection(self, record_id: str, metadata: Dict[str, Any]) -> bool:
+        """刷新智能助手对话记录的 metadata 投影（不改写 text，全文检索不重建）
+        
+        Args:
+            record_id: 对话记录 ID
+            metadata: 对话统计等元数据（不含消息）
+        
+        Returns:
+            更新是否成功
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE records SET metadata = ?, updated_at = ? WHERE id = ?',
+                           (json.dumps(metadata, ensure_ascii=False), now, record_id))
+            conn.commit()
+            return cursor.rowcount > 0
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def get_chat_messages(self, record_id: str) -> List[Dict[str, Any]]:
+        """读取智能助手对话的全部消息（早期版本保存的对话返回空列表）"""
+        conn = self._get_connection()
+        try:
+            return read_chat_messages(conn.cursor(), record_id)
+        finally:
+            conn.close()
+    
+    def get_changes(self, user_id: str, since: int = 0, limit: int = 500) -> Dict[str, Any]:
+        """读取用户的增量变更（多设备同步）
+        
+        Args:
+            user_id: 用户ID
+            since: 客户端已同步到的变更序号（首次同步传 0）
+            limit: 本批最多读取的变更条数
+        
+        Returns:
+            {'changes': [...], 'next_since': int, 'has_more': bool}
+        """
+        conn = self._get_connection()
+        try:
+            return read_changes(conn.cursor(), user_id, since, limit)
+        finally:
+            conn.close()
+    
+    def get_user_stats(self, user_id: str) -> Dict[str, Any]:
+        """读取用户统计（记录数、各应用类型、收藏/归档/回收站、各标签记录数）
+        
+        Args:
+            user_id: 用户ID
+        
+        Returns:
+            {'total', 'app_types', 'starred', 'archived', 'deleted', 'tags'}
+        """
+        conn = self._get_connection()
+        try:
+            return read_user_stats(conn.cursor(), user_id)
+        finally:
+            conn.close()
@@ -174,9 +174,14 @@ class SQLiteExtended:
                 SELECT r.id, r.text, r.metadata, r.app_type, r.user_id, r.device_id,
                        r.is_starred, r.is_archived, r.created_at, r.updated_at,
                        f.rank
-                FROM records r
-                INNER JOIN records_fts f ON r.id = f.record_id
-                WHERE records_fts MATCH ? AND {where_clause}
+                FROM (
+                    -- 对话记录的追加消息有多行索引，按记录取最佳匹配
+                    SELECT record_id, MIN(rank) AS rank FROM records_fts
+                    WHERE records_fts MATCH ?
+                    GROUP BY record_id
+                ) f
+                INNER JOIN records r ON r.id = f.record_id
+                WHERE {where_clause}
                 ORDER BY f.rank
                 LIMIT ? OFFSET ?
             ''', params)
@@ -0,0 +1,344 @@
+"""
+翻译记忆缓存
+
+功能：
+- 按 (规范化原文, 源语言, 目标语言, 提示词版本) 缓存译文，重复的句子不再调用 LLM
+- 译文持久化到 SQLite translation_memory 表，进程内有容量有限的 LRU 缓存作为前端
+- 持久化条目超出上限时按最近使用时间淘汰
+- 命中时的使用时间和次数先记在内存中，积累一批后合并写入（淘汰、统计和关闭前也会写入），
+  查询路径上不再每次命中都开写事务
+- 提示词（translation_agent.yml）变更后版本号随之变化，旧版本的译文整体失效
+- 统计内存命中、数据库命中、未命中等指标
+
+translation_memory 表由迁移 v1.3.9 创建（见 migrations.py）。
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.core.logger import get_logger
+from src.providers.storage.identity_cache import LRUTTLCache, _MISSING
+
+logger = get_logger("TranslationMemory")
+
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MEMORY_ENTRIES = 2000
+DEFAULT_MEMORY_TTL_SECONDS = 3600
+
+# 每写入多少条检查一次持久化条目上限
+_PRUNE_EVERY_WRITES = 500
+
+# 积累多少个命中的条目后写回使用时间
+_TOUCH_FLUSH_EVERY = 200
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """规范化原文（全角/半角统一、去首尾空白、合并连续空白）"""
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def make_key(text: str, source_lang: str, target_lang: str, prompt_version: str) -> str:
+    """计算缓存键"""
+    raw = '\x1f'.join((prompt_version, source_lang, target_lang, normalize_text(text)))
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def create_translation_memory_table(cursor: sqlite3.Cursor):
+    """创建 translation_memory 表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS translation_memory (
+            key TEXT PRIMARY KEY,
+            prompt_version TEXT NOT NULL,
+            source_lang TEXT NOT NULL,
+            target_lang TEXT NOT NULL,
+            source_text TEXT NOT NULL,
+            translation TEXT NOT NULL,
+            hit_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL,
+            last_used_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_translation_memory_used ON translation_memory(last_used_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_translation_memory_version ON translation_memory(prompt_version)')
+
+
+class TranslationMemory:
+    """翻译记忆缓存（SQLite 持久化 + 进程内 LRU）"""
+
+    def __init__(self, db_path: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+                 memory_ttl_seconds: float = DEFAULT_MEMORY_TTL_SECONDS):
+        """初始化翻译记忆缓存（表结构由 MigrationRunner 创建）
+
+        Args:
+            db_path: 数据库文件路径
+            max_entries: 持久化条目上限（超出后淘汰最久未使用的条目）
+            memory_entries: 进程内 LRU 缓存条目数
+            memory_ttl_seconds: 进程内缓存过期时间（秒）
+        """
+        self.db_path = Path(db_path).expanduser()
+        self.max_entries = max(1, int(max_entries))
+        self.front = LRUTTLCache(memory_entries, memory_ttl_seconds)
+
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        # 尚未写回的命中：key → (命中次数, 最后使用时间)
+        self._touches: Dict[str, Tuple[int, str]] = {}
+        self.db_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.pruned = 0
+        self.invalidated = 0
+
+        logger.info(f"[翻译记忆] 初始化完成: {self.db_path}")
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """获取数据库连接"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    # ==================== 读取 ====================
+
+    def get(self, text: str, source_lang: str, target_lang: str, prompt_version: str) -> Optional[str]:
+        """查询单条译文（未命中返回 None）"""
+        return self.get_many([(text, source_lang, target_lang)], prompt_version)[0]
+
+    def get_many(self, items: List[Tuple[str, str, str]], prompt_version: str) -> List[Optional[str]]:
+        """批量查询译文
+
+        Args:
+            items: (text, source_lang, target_lang) 列表
+            prompt_version: 提示词版本
+
+        Returns:
+            与输入顺序一致的译文列表，未命中的为 None
+        """
+        keys = [make_key(text, src, tgt, prompt_version) for text, src, tgt in items]
+        results: List[Optional[str]] = [None] * len(items)
+
+        pending: Dict[str, List[int]] = {}
+        hit_keys = []
+        for i, key in enumerate(keys):
+            value = self.front.get(key)
+            if value is not _MISSING:
+                results[i] = value
+                hit_keys.append(key)
+            else:
+                pending.setdefault(key, []).append(i)
+
+        if pending:
+            found = self._load(list(pending))
+            for key, indices in pending.items():
+                translation = found.get(key)
+                if translation is not None:
+                    self.front.set(key, translation)
+                    hit_keys.extend(key for _ in indices)
+                for i in indices:
+                    results[i] = translation
+            with self._lock:
+                self.db_hits += sum(len(pending[key]) for key in found)
+                self.misses += sum(len(indices) for key, indices in pending.items() if key not in found)
+
+        if hit_keys:
+            self._touch(hit_keys)
+        return results
+
+    def _load(self, keys: List[str]) -> Dict[str, str]:
+        """从数据库读取译文（只读，使用时间由 _touch 合并写回）"""
+        placeholders = ', '.join('?' for _ in keys)
+        conn = self._get_connection()
+        try:
+            cursor = conn.execute(f'SELECT key, translation FROM translation_memory WHERE key IN ({placeholders})', keys)
+            return dict(cursor.fetchall())
+        except Exception as e:
+            logger.error(f"[翻译记忆] 读取失败: {e}", exc_info=True)
+            return {}
+        finally:
+            conn.close()
+
+    def _touch(self, keys: List[str]):
+        """记录命中（内存中累加），积累到一批后写回"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            for key in keys:
+                count = self._touches.get(key, (0, now))[0]
+                self._touches[key] = (count + 1, now)
+            should_flush = len(self._touches) >= _TOUCH_FLUSH_EVERY
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> int:
+        """写回积累的命中次数和使用时间
+
+        Returns:
+            写回的条目数
+        """
+        with self._lock:
+            touches, self._touches = self._touches, {}
+        if not touches:
+            return 0
+
+        conn = self._get_connection()
+        try:
+            conn.executemany('''
+                UPDATE translation_memory SET hit_count = hit_count + ?, last_used_at = MAX(last_used_at, ?)
+                WHERE key = ?
+            ''', [(count, used_at, key) for key, (count, used_at) in touches.items()])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"[翻译记忆] 写回使用时间失败: {e}", exc_info=True)
+            # 放回队列，下次一并写回
+            with self._lock:
+                for key, (count, used_at) in touches.items():
+                    pending_count, pending_used_at = self._touches.get(key, (0, used_at))
+                    self._touches[key] = (count + pending_count, max(used_at, pending_used_at))
+            return 0
+        finally:
+            conn.close()
+        return len(touches)
+
+    # ==================== 写入 ====================
+
+    def put(self, text: str, source_lang: str, target_lang: str, prompt_version: str, translation: str):
+        """写入单条译文"""
+        self.put_many([(text, source_lang, target_lang, translation)], prompt_version)
+
+    def put_many(self, entries: List[Tuple[str, str, str, str]], prompt_version: str):
+        """批量写入译文
+
+        Args:
+            entries: (text, source_lang, target_lang, translation) 列表
+            prompt_version: 提示词版本
+        """
+        rows = []
+        for text, src, tgt, translation in entries:
+            if not translation or not normalize_text(text):
+                continue
+            key = make_key(text, src, tgt, prompt_version)
+            self.front.set(key, translation)
+            rows.append((key, prompt_version, src, tgt, normalize_text(text), translation))
+        if not rows:
+            return
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn = self._get_connection()
+        try:
+            conn.executemany('''
+                INSERT INTO translation_memory
+                    (key, prompt_version, source_lang, target_lang, source_text, translation, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET translation = excluded.translation, last_used_at = excluded.last_used_at
+            ''', [row + (now, now) for row in rows])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"[翻译记忆] 写入失败: {e}", exc_info=True)
+            return
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.writes += len(rows)
+            self._writes_since_prune += len(rows)
+            should_prune = self._writes_since_prune >= _PRUNE_EVERY_WRITES
+            if should_prune:
+                self._writes_since_prune = 0
+        if should_prune:
+            self.prune()
+
+    # ==================== 淘汰与失效 ====================
+
+    def prune(self) -> int:
+        """淘汰超出上限的最久未使用条目
+
+        Returns:
+            淘汰的条目数
+        """
+        # 先写回使用时间，避免淘汰最近命中的条目
+        self.flush()
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM translation_memory')
+            excess = cursor.fetchone()[0] - self.max_entries
+            if excess <= 0:
+                return 0
+            cursor.execute('''
+                DELETE FROM translation_memory WHERE key IN (
+                    SELECT key FROM translation_memory ORDER BY last_used_at LIMIT ?
+                )
+            ''', (excess,))
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.pruned += excess
+        logger.info(f"[翻译记忆] 已淘汰 {excess} 条最久未使用的译文")
+        return excess
+
+    def invalidate(self, keep_version: Optional[str] = None) -> int:
+        """使缓存失效（提示词变更时调用）
+
+        Args:
+            keep_version: 保留的提示词版本（None 表示全部清除）
+
+        Returns:
+            删除的持久化条目数
+        """
+        conn = self._get_connection()
+        try:
+            if keep_version is None:
+                cursor = conn.execute('DELETE FROM translation_memory')
+            else:
+                cursor = conn.execute('DELETE FROM translation_memory WHERE prompt_version != ?', (keep_version,))
+            deleted = cursor.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.front.clear()
+        with self._lock:
+            self.invalidated += deleted
+        if deleted:
+            logger.info(f"[翻译记忆] 提示词已变更，清除 {deleted} 条旧译文")
+        return deleted
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中率等指标"""
+        self.flush()
+        conn = self._get_connection()
+        try:
+            entries = conn.execute('SELECT COUNT(*) FROM translation_memory').fetchone()[0]
+        finally:
+            conn.close()
+
+        front = self.front.get_stats()
+        with self._lock:
+            hits = front['hits'] + self.db_hits
+            lookups = hits + self.misses
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'hits': hits,
+                'memory_hits': front['hits'],
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'writes': self.writes,
+                'pruned': self.pruned,
+                'invalidated': self.invalidated,
+                'memory': front,
+            }
@@ -0,0 +1,253 @@
+"""
+用户维度统计计数（物化）
+
+功能：
+- user_stats 表按用户保存记录数、各应用类型记录数、收藏/归档/回收站数量和各标签的记录数
+- 计数由 records / record_tags / tags 上的触发器在写事务内同步增减，所有写入路径都会更新
+- 存量数据按用户分批重算（见 migrations.py），回填完成前读取时实时统计
+
+计数口径与对应的列表查询一致：
+- record/total、app_type/<类型>：全部记录（与 count_records 一致，含回收站）
+- record/starred、record/archived：未删除且已收藏 / 已归档
+- record/deleted：回收站中的记录
+- tag/<tag_id>：标签关联的记录数（与按标签查询记录一致）
+"""
+import sqlite3
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from .image_store import is_backfill_completed
+
+logger = logging.getLogger(__name__)
+
+# 存量数据重算任务名称（见 migrations.py）
+USER_STATS_BACKFILL_NAME = 'user_stats_rebuild'
+
+# 单条记录对各计数的贡献：(scope, key 表达式, 计数条件)，{r} 为 new / old
+_RECORD_COUNTERS = (
+    ('record', "'total'", '1'),
+    ('app_type', '{r}.app_type', '1'),
+    ('record', "'starred'", '{r}.is_starred = 1 AND {r}.is_deleted = 0'),
+    ('record', "'archived'", '{r}.is_archived = 1 AND {r}.is_deleted = 0'),
+    ('record', "'deleted'", '{r}.is_deleted = 1'),
+)
+
+_UPSERT = '''
+    INSERT INTO user_stats (user_id, scope, key, count)
+    SELECT {user_id}, '{scope}', {key}, {delta}
+    WHERE {condition}
+    ON CONFLICT(user_id, scope, key) DO UPDATE SET count = count + excluded.count;
+'''
+
+
+def _record_statements(row: str, delta: int) -> str:
+    """生成一条记录（new / old）增减各项计数的语句"""
+    statements = []
+    for scope, key, condition in _RECORD_COUNTERS:
+        statements.append(_UPSERT.format(
+            user_id=f'{row}.user_id', scope=scope, key=key.format(r=row), delta=delta,
+            condition=f'{row}.user_id IS NOT NULL AND ({condition.format(r=row)})',
+        ))
+    return ''.join(statements)
+
+
+_TRIGGERS = {
+    'user_stats_records_insert': f'''
+        AFTER INSERT ON records BEGIN
+            {_record_statements('new', 1)}
+        END
+    ''',
+    'user_stats_records_update': f'''
+        AFTER UPDATE OF user_id, app_type, is_deleted, is_starred, is_archived ON records
+        WHEN old.user_id IS NOT new.user_id OR old.app_type IS NOT new.app_type
+            OR old.is_deleted IS NOT new.is_deleted OR old.is_starred IS NOT new.is_starred
+            OR old.is_archived IS NOT new.is_archived
+        BEGIN
+            {_record_statements('old', -1)}
+            {_record_statements('new', 1)}
+        END
+    ''',
+    'user_stats_records_delete': f'''
+        AFTER DELETE ON records BEGIN
+            {_record_statements('old', -1)}
+        END
+    ''',
+    'user_stats_record_tags_insert': '''
+        AFTER INSERT ON record_tags BEGIN
+            INSERT INTO user_stats (user_id, scope, key, count)
+            SELECT user_id, 'tag', CAST(tag_id AS TEXT), 1 FROM tags WHERE tag_id = new.tag_id
+            ON CONFLICT(user_id, scope, key) DO UPDATE SET count = count + excluded.count;
+        END
+    ''',
+    'user_stats_record_tags_delete': '''
+        AFTER DELETE ON record_tags BEGIN
+            INSERT INTO user_stats (user_id, scope, key, count)
+            SELECT user_id, 'tag', CAST(tag_id AS TEXT), -1 FROM tags WHERE tag_id = old.tag_id
+            ON CONFLICT(user_id, scope, key) DO UPDATE SET count = count + excluded.count;
+        END
+    ''',
+    'user_stats_tags_delete': '''
+        AFTER DELETE ON tags BEGIN
+            DELETE FROM user_stats
+            WHERE user_id = old.user_id AND scope = 'tag' AND key = CAST(old.tag_id AS TEXT);
+        END
+    ''',
+}
+
+# 按用户实时统计（存量重算和回填完成前的读取共用），{users} 为用户ID占位符列表
+_AGGREGATE_SQL = '''
+    SELECT user_id, 'record', 'total', COUNT(*)
+    FROM records WHERE user_id IN ({users}) GROUP BY user_id
+    UNION ALL
+    SELECT user_id, 'app_type', app_type, COUNT(*)
+    FROM records WHERE user_id IN ({users}) GROUP BY user_id, app_type
+    UNION ALL
+    SELECT user_id, 'record', 'starred', COUNT(*)
+    FROM records WHERE user_id IN ({users}) AND is_starred = 1 AND is_deleted = 0 GROUP BY user_id
+    UNION ALL
+    SELECT user_id, 'record', 'archived', COUNT(*)
+    FROM records WHERE user_id IN ({users}) AND is_archived = 1 AND is_deleted = 0 GROUP BY user_id
+    UNION ALL
+    SELECT user_id, 'record', 'deleted', COUNT(*)
+    FROM records WHERE user_id IN ({users}) AND is_deleted = 1 GROUP BY user_id
+    UNION ALL
+    SELECT t.user_id, 'tag', CAST(t.tag_id AS TEXT), COUNT(*)
+    FROM tags t JOIN record_tags rt ON rt.tag_id = t.tag_id
+    WHERE t.user_id IN ({users}) GROUP BY t.tag_id
+'''
+_AGGREGATE_PARTS = 6
+
+
+def create_user_stats(cursor: sqlite3.Cursor):
+    """创建用户统计表及 records / record_tags / tags 上的计数触发器"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, scope, key)
+        ) WITHOUT ROWID
+    ''')
+
+    for name, body in _TRIGGERS.items():
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+
+def _aggregate(user_ids: List[str]) -> Tuple[str, List[str]]:
+    placeholders = ', '.join('?' for _ in user_ids)
+    return _AGGREGATE_SQL.format(users=placeholders), list(user_ids) * _AGGREGATE_PARTS
+
+
+def rebuild_user_stats(cursor: sqlite3.Cursor, user_ids: List[str]):
+    """按当前数据重算指定用户的全部计数（需在写事务内调用）"""
+    if not user_ids:
+        return
+    placeholders = ', '.join('?' for _ in user_ids)
+    cursor.execute(f'DELETE FROM user_stats WHERE user_id IN ({placeholders})', user_ids)
+    sql, params = _aggregate(user_ids)
+    cursor.execute(f'INSERT INTO user_stats (user_id, scope, key, count) {sql}', params)
+
+
+# ==================== 存量数据重算 ====================
+
+_USERS_SQL = '''
+    SELECT user_id FROM records WHERE user_id > ?
+    UNION
+    SELECT user_id FROM tags WHERE user_id > ?
+    ORDER BY user_id
+    LIMIT ?
+'''
+
+
+def backfill_user_stats(cursor: sqlite3.Cursor, last_key: Optional[str],
+                        batch_size: int) -> Tuple[Optional[str], int]:
+    """按用户分批重算计数
+
+    触发器在结构迁移时已生效，每批在同一事务内按当前数据整体重算，
+    与重算前触发器累加的增量不会重复计数。
+    """
+    last_user = last_key or ''
+    cursor.execute(_USERS_SQL, (last_user, last_user, batch_size))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    if not user_ids:
+        return None, 0
+
+    rebuild_user_stats(cursor, user_ids)
+    return user_ids[-1], len(user_ids)
+
+
+def count_stats_users(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('''
+        SELECT COUNT(*) FROM (
+            SELECT user_id FROM records WHERE user_id IS NOT NULL
+            UNION
+            SELECT user_id FROM tags
+        )
+    ''')
+    return cursor.fetchone()[0]
+
+
+def is_user_stats_ready(cursor: sqlite3.Cursor) -> bool:
+    """计数是否已覆盖全部存量数据"""
+    return is_backfill_completed(cursor, USER_STATS_BACKFILL_NAME)
+
+
+# ==================== 读取 ====================
+
+def read_user_stats(cursor: sqlite3.Cursor, user_id: str) -> Dict[str, Any]:
+    """读取用户统计
+
+    Args:
+        cursor: 数据库游标
+        user_id: 用户ID
+
+    Returns:
+        {
+            'total': int,               # 记录总数（含回收站）
+            'app_types': {type: int},   # 各应用类型记录数
+            'starred': int,
+            'archived': int,
+            'deleted': int,
+            'tags': [{'tag_id', 'tag_name', 'color', 'icon', 'count'}],  # 按排序返回全部标签
+        }
+    """
+    if is_user_stats_ready(cursor):
+        cursor.execute('SELECT user_id, scope, key, count FROM user_stats WHERE user_id = ?', (user_id,))
+    else:
+        sql, params = _aggregate([user_id])
+        cursor.execute(sql, params)
+    counters = {(scope, key): count for _, scope, key, count in cursor.fetchall()}
+
+    cursor.execute('''
+        SELECT tag_id, tag_name, color, icon
+        FROM tags WHERE user_id = ?
+        ORDER BY sort_order, created_at
+    ''', (user_id,))
+    tags = [
+        {'tag_id': tag_id, 'tag_name': tag_name, 'color': color, 'icon': icon,
+         'count': counters.get(('tag', str(tag_id)), 0)}
+        for tag_id, tag_name, color, icon in cursor.fetchall()
+    ]
+
+    return {
+        'total': counters.get(('record', 'total'), 0),
+        'app_types': {key: count for (scope, key), count in counters.items()
+                      if scope == 'app_type' and count > 0},
+        'starred': counters.get(('record', 'starred'), 0),
+        'archived': counters.get(('record', 'archived'), 0),
+        'deleted': counters.get(('record', 'deleted'), 0),
+        'tags': tags,
+    }
+
+
+def read_record_count(cursor: sqlite3.Cursor, user_id: str,
+                      app_type: Optional[str] = None) -> Optional[int]:
+    """从计数表读取用户记录数（计数未就绪时返回 None，由调用方实时统计）"""
+    if not is_user_stats_ready(cursor):
+        return None
+    scope, key = ('app_type', app_type) if app_type else ('record', 'total')
+    cursor.execute('SELECT count FROM user_stats WHERE user_id = ? AND scope = ? AND key = ?',
+                   (user_id, scope, key))
+    row = cursor.fetchone()
+    return row[0] if row else 0
@@ -14,6 +14,7 @@ from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, Any, List
 from src.core.logger import get_logger
+from src.providers.storage.identity_cache import get_identity_cache
 
 logger = get_logger("UserStorage")
 
@@ -30,6 +31,8 @@ class UserStorageService:
         self.db_path = Path(db_path).expanduser()
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
         self._init_database()
+        # 进程内共享的 device_id → user_id 缓存
+        self.identity_cache = get_identity_cache(self.db_path)
         logger.info(f"[用户存储] 初始化完成: {self.db_path}")
     
     def _init_database(self):
@@ -284,6 +287,7 @@ class UserStorageService:
             ''', (user_id, device_id, device_name, now))
             
             conn.commit()
+            self.identity_cache.invalidate_device(device_id)
             logger.info(f"[用户存储] 绑定设备成功: user_id={user_id}, device_id={device_id}")
             return True
             
@@ -309,6 +313,7 @@ class UserStorageService:
         try:
             cursor.execute('DELETE FROM user_devices WHERE device_id = ?', (device_id,))
             conn.commit()
+            self.identity_cache.invalidate_device(device_id)
             
             if cursor.rowcount > 0:
                 logger.info(f"[用户存储] 解绑设备成功: device_id={device_id}")
@@ -370,6 +375,34 @@ class UserStorageService:
         finally:
             conn.close()
     
+    def get_user_id_by_device(self, device_id: str) -> Optional[str]:
+        """通过设备ID获取用户ID（带缓存，供每个请求的身份解析使用）
+        
+        Args:
+            device_id: 设备ID
+        
+        Returns:
+            用户ID，设备未绑定或用户已删除时返回None
+        """
+        return self.identity_cache.get_user_id(device_id, self._load_user_id_by_device)
+    
+    def _load_user_id_by_device(self, device_id: str) -> Optional[str]:
+        """从数据库查询设备绑定的用户ID"""
+        conn = sqlite3.connect(str(self.db_path))
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT u.user_id
+                FROM users u
+                INNER JOIN user_devices ud ON u.user_id = ud.user_id
+                WHERE ud.device_id = ? AND u.is_deleted = 0
+            ''', (device_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+    
     def get_user_devices(self, user_id: str) -> List[Dict[str, Any]]:
         """获取用户的所有设备
         
@@ -474,6 +507,7 @@ class UserStorageService:
                 logger.info(f"[用户存储] 软删除用户成功: user_id={user_id}")
             
             conn.commit()
+            self.identity_cache.invalidate_user(user_id)
             
             if cursor.rowcount > 0:
                 return True
@@ -512,6 +546,11 @@ class UserStorageService:
             conn.commit()
             
             if cursor.rowcount > 0:
+                # 删除期间这些设备被缓存为“未绑定”，需逐个失效
+                cursor.execute('SELECT device_id FROM user_devices WHERE user_id = ?', (user_id,))
+                for (device_id,) in cursor.fetchall():
+                    self.identity_cache.invalidate_device(device_id)
+                self.identity_cache.invalidate_user(user_id)
                 logger.info(f"[用户存储] 恢复用户成功: user_id={user_id}")
                 return True
             else:
@@ -2,21 +2,41 @@
 激活码服务模块
 
 功能：
-- 激活码生成
+- 激活码批量生成（按批次写入 activation_codes 表）
 - 激活码验证
-- 黑名单管理
+- 激活码兑换（单条 UPDATE 原子标记已使用，多进程安全）
+- 按批次查询、导出兑换状态
+
+激活码的使用状态保存在数据库中，取代早期的 blacklist.json 黑名单文件
+（首次启动时会把旧黑名单中的激活码导入为已使用）。
+
+早期版本生成的激活码只写入 CSV 文件、不在表中，兑换时会提示“激活码不存在”。
+需要用 scripts/generate_activation_codes.py --import-csv 把当时发放的 CSV 导入为未使用的激活码
+（已在黑名单中的保持已使用）。不自动接受表中不存在的激活码：早期激活码没有校验位，
+自动接受等于任何格式正确的字符串都能兑换。
 """
 
+import csv
+import io
 import re
 import json
 import secrets
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Iterator, List
 from src.core.config import Config
 from src.core.logger import get_logger
 
 logger = get_logger("ActivationService")
 
+# 旧版黑名单导入时使用的批次ID
+LEGACY_BATCH_ID = 'legacy-blacklist'
+
+# 旧版 CSV 导入时使用的批次ID
+LEGACY_CSV_BATCH_ID = 'legacy-csv'
+
 
 class ActivationService:
     """激活码服务"""
@@ -34,6 +54,12 @@ class ActivationService:
     
     TIER_REVERSE_MAP = {v: k for k, v in TIER_MAP.items()}
     
+    # 可生成激活码的等级（与 activation_codes 表的 CHECK 约束一致）
+    REDEEMABLE_TIERS = ('vip', 'pro', 'pro_plus')
+    
+    # 导出时每次读取的行数
+    EXPORT_CHUNK_SIZE = 1000
+    
     def __init__(self, config: Config):
         """初始化激活码服务
         
@@ -42,47 +68,112 @@ class ActivationService:
         """
         self.config = config
         
-        # 黑名单文件路径
+        # 获取数据库路径
         data_dir = Path(config.get('storage.data_dir')).expanduser()
-        self.blacklist_path = data_dir / 'blacklist.json'
+        database_relative = Path(config.get('storage.database'))
+        self.db_path = data_dir / database_relative
         
-        # 加载黑名单
-        self.blacklist = self._load_blacklist()
+        # 旧版黑名单文件（仅用于一次性导入）
+        self.blacklist_path = data_dir / 'blacklist.json'
+        self._import_legacy_blacklist()
         
-        logger.info(f"[激活码服务] 初始化完成，黑名单: {len(self.blacklist)} 条")
+        logger.info(f"[激活码服务] 初始化完成，数据库: {self.db_path}")
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """获取数据库连接"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
     
-    def _load_blacklist(self) -> set:
-        """加载黑名单"""
+    def _import_legacy_blacklist(self) -> None:
+        """将旧版 blacklist.json 中的激活码导入为已使用，导入后重命名原文件"""
         if not self.blacklist_path.exists():
-            return set()
+            return
         
         try:
             with open(self.blacklist_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return set(data.get('codes', []))
+                codes = json.load(f).get('codes', [])
         except Exception as e:
-            logger.error(f"[激活码服务] 加载黑名单失败: {e}")
-            return set()
+            logger.error(f"[激活码服务] 读取旧版黑名单失败: {e}")
+            return
+        
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = []
+        for code in codes:
+            parsed = self.parse_code(code)
+            if parsed and parsed['tier'] in self.REDEEMABLE_TIERS:
+                rows.append((code, parsed['tier'], parsed['months'], now, now, LEGACY_BATCH_ID))
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO activation_codes
+                (code, tier, subscription_period, is_used, used_at, created_at, batch_id)
+                VALUES (?, ?, ?, 1, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"[激活码服务] 导入旧版黑名单失败: {e}")
+            return
+        finally:
+            conn.close()
+        
+        self.blacklist_path.replace(self.blacklist_path.with_name('blacklist.json.imported'))
+        logger.info(f"[激活码服务] 已导入旧版黑名单: {len(rows)} 条")
     
-    def _save_blacklist(self) -> None:
-        """保存黑名单"""
+    def import_codes(self, codes: Iterable[str], batch_id: str = LEGACY_CSV_BATCH_ID) -> Dict[str, int]:
+        """导入早期版本生成的激活码（一个事务）
+        
+        格式不正确或等级不可兑换的跳过；表中已有的激活码（包括从黑名单导入的已使用激活码）保持不变。
+        
+        Args:
+            codes: 激活码列表
+            batch_id: 导入批次ID
+        
+        Returns:
+            {'imported': 新导入数量, 'existing': 已存在数量, 'invalid': 无效数量}
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = []
+        invalid = 0
+        for code in codes:
+            code = (code or '').strip().upper()
+            parsed = self.parse_code(code)
+            if not parsed or parsed['tier'] not in self.REDEEMABLE_TIERS:
+                invalid += 1
+                continue
+            rows.append((code, parsed['tier'], parsed['months'], now, batch_id))
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
         try:
-            # 确保目录存在
-            self.blacklist_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            data = {
-                'codes': list(self.blacklist),
-                'updated_at': int(self.config._get_timestamp())
-            }
-            
-            with open(self.blacklist_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                
+            before = conn.total_changes
+            cursor.executemany('''
+                INSERT OR IGNORE INTO activation_codes
+                (code, tier, subscription_period, is_used, created_at, batch_id)
+                VALUES (?, ?, ?, 0, ?, ?)
+            ''', rows)
+            imported = conn.total_changes - before
+            conn.commit()
         except Exception as e:
-            logger.error(f"[激活码服务] 保存黑名单失败: {e}")
+            conn.rollback()
+            logger.error(f"[激活码服务] 导入激活码失败: {e}", exc_info=True)
+            raise
+        finally:
+            conn.close()
+        
+        logger.info(f"[激活码服务] 已导入激活码: batch_id={batch_id}, 新增 {imported}，"
+                    f"已存在 {len(rows) - imported}，无效 {invalid}")
+        return {'imported': imported, 'existing': len(rows) - imported, 'invalid': invalid}
+    
+    # ==================== 生成 ====================
     
     def generate_code(self, tier: str, months: int) -> str:
-        """生成激活码
+        """生成激活码字符串（不写入数据库）
         
         Args:
             tier: 会员等级（free/vip/pro/pro_plus）
@@ -105,14 +196,87 @@ class ActivationService:
         checksum = ''.join(secrets.choice(chars) for _ in range(8))
         
         # 组装激活码: TIER-MONTHS-XXXX-XXXX
-        code = f"{tier_code}-{months}-{checksum[:4]}-{checksum[4:]}"
+        return f"{tier_code}-{months}-{checksum[:4]}-{checksum[4:]}"
+    
+    def generate_batch(self, tier: str, months: int, count: int,
+                       expires_days: Optional[int] = None,
+                       batch_id: Optional[str] = None) -> Dict[str, Any]:
+        """批量生成激活码并写入数据库（一个事务）
         
-        logger.info(f"[激活码服务] 生成激活码: {code}")
+        Args:
+            tier: 会员等级（vip/pro/pro_plus）
+            months: 订阅月数
+            count: 生成数量
+            expires_days: 激活码有效天数（None 表示不过期）
+            batch_id: 批次ID（默认自动生成）
+        
+        Returns:
+            {'batch_id': str, 'codes': List[str], 'expires_at': Optional[str]}
+        """
+        if tier not in self.REDEEMABLE_TIERS:
+            raise ValueError(f"无效的会员等级: {tier}，可选: {', '.join(self.REDEEMABLE_TIERS)}")
+        if count <= 0:
+            raise ValueError(f"生成数量必须大于0: {count}")
+        
+        now = datetime.now()
+        batch_id = batch_id or f"{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+        expires_at = (now + timedelta(days=expires_days)).strftime('%Y-%m-%d %H:%M:%S') if expires_days else None
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            inserted = 0
+            # 与已有激活码冲突的会被忽略，补足差额后再插入
+            while inserted < count:
+                codes = {self.generate_code(tier, months) for _ in range(count - inserted)}
+                before = conn.total_changes
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO activation_codes
+                    (code, tier, subscription_period, is_used, created_at, expires_at, batch_id)
+                    VALUES (?, ?, ?, 0, ?, ?, ?)
+                ''', [(code, tier, months, now_str, expires_at, batch_id) for code in codes])
+                inserted += conn.total_changes - before
+            
+            cursor.execute('SELECT code FROM activation_codes WHERE batch_id = ? ORDER BY rowid', (batch_id,))
+            codes = [row['code'] for row in cursor.fetchall()]
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"[激活码服务] 批量生成激活码失败: {e}", exc_info=True)
+            raise
+        finally:
+            conn.close()
+        
+        logger.info(f"[激活码服务] 已生成激活码: batch_id={batch_id}, {tier} {months}个月 x {len(codes)}")
         
-        return code
+        return {
+            'batch_id': batch_id,
+            'codes': codes,
+            'expires_at': expires_at
+        }
+    
+    # ==================== 验证与兑换 ====================
+    
+    def parse_code(self, code: str) -> Optional[Dict[str, Any]]:
+        """解析激活码格式
+        
+        Returns:
+            {'tier': str, 'months': int}，格式不正确时返回 None
+        """
+        match = self.CODE_PATTERN.match(code or '')
+        if not match:
+            return None
+        tier_code, months_str, _, _ = match.groups()
+        tier = self.TIER_MAP.get(tier_code)
+        months = int(months_str)
+        if not tier or not (1 <= months <= 120):
+            return None
+        return {'tier': tier, 'months': months}
     
     def validate_code(self, code: str) -> Dict[str, Any]:
-        """验证激活码
+        """验证激活码（只读，不占用激活码）
         
         Args:
             code: 激活码
@@ -133,55 +297,116 @@ class ActivationService:
                 'error': '激活码格式不正确，正确格式: TIER-MONTHS-XXXX-XXXX'
             }
         
-        # 解析内容
-        match = self.CODE_PATTERN.match(code)
-        tier_code, months_str, _, _ = match.groups()
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT tier, subscription_period, is_used, expires_at
+                FROM activation_codes WHERE code = ?
+            ''', (code,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
         
-        # 验证会员等级
-        tier = self.TIER_MAP.get(tier_code)
-        if not tier:
+        if not row:
             return {
                 'valid': False,
-                'error': f'无效的会员等级: {tier_code}'
+                'error': '激活码不存在'
             }
         
-        # 验证月数
-        try:
-            months = int(months_str)
-            if not (1 <= months <= 120):
-                return {
-                    'valid': False,
-                    'error': f'无效的订阅周期: {months}个月'
-                }
-        except ValueError:
+        if row['is_used']:
             return {
                 'valid': False,
-                'error': '订阅周期必须是数字'
+                'error': '激活码已被使用或已失效'
             }
         
-        # 检查黑名单
-        if code in self.blacklist:
+        if row['expires_at'] and row['expires_at'] <= datetime.now().strftime('%Y-%m-%d %H:%M:%S'):
             return {
                 'valid': False,
-                'error': '激活码已被使用或已失效'
+                'error': '激活码已过期'
             }
         
         # 验证通过
         return {
             'valid': True,
-            'tier': tier,
-            'months': months
+            'tier': row['tier'],
+            'months': row['subscription_period']
         }
     
-    def mark_as_used(self, code: str) -> None:
-        """标记激活码为已使用
+    def redeem_code(self, code: str, user_id: str, device_id: Optional[str] = None) -> Dict[str, Any]:
+        """兑换激活码（原子操作，同一激活码只会被成功兑换一次）
         
         Args:
             code: 激活码
+            user_id: 兑换用户ID
+            device_id: 兑换设备ID（可选）
+        
+        Returns:
+            兑换结果字典，格式同 validate_code
         """
-        self.blacklist.add(code)
-        self._save_blacklist()
-        logger.info(f"[激活码服务] 激活码已标记为已使用: {code}")
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            # 单条 UPDATE 完成“检查未使用 + 标记已使用”，并发兑换时只有一个会成功
+            cursor.execute('''
+                UPDATE activation_codes
+                SET is_used = 1, used_by_user_id = ?, used_by_device_id = ?, used_at = ?
+                WHERE code = ? AND is_used = 0 AND (expires_at IS NULL OR expires_at > ?)
+            ''', (user_id, device_id, now, code, now))
+            redeemed = cursor.rowcount == 1
+            
+            cursor.execute('SELECT tier, subscription_period FROM activation_codes WHERE code = ?', (code,))
+            row = cursor.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        if not redeemed:
+            # 兑换失败时给出具体原因
+            return self.validate_code(code) if row else {'valid': False, 'error': '激活码不存在'}
+        
+        logger.info(f"[激活码服务] 激活码已兑换: {code}, user_id={user_id}")
+        
+        return {
+            'valid': True,
+            'tier': row['tier'],
+            'months': row['subscription_period']
+        }
+    
+    def release_code(self, code: str, user_id: str) -> bool:
+        """撤销兑换（会员激活失败时归还激活码）
+        
+        Args:
+            code: 激活码
+            user_id: 兑换用户ID（只归还该用户兑换的激活码）
+        
+        Returns:
+            是否归还成功
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE activation_codes
+                SET is_used = 0, used_by_user_id = NULL, used_by_device_id = NULL, used_at = NULL
+                WHERE code = ? AND is_used = 1 AND used_by_user_id = ?
+            ''', (code, user_id))
+            conn.commit()
+            released = cursor.rowcount == 1
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        if released:
+            logger.warning(f"[激活码服务] 激活码已归还: {code}, user_id={user_id}")
+        return released
     
     def is_code_used(self, code: str) -> bool:
         """检查激活码是否已使用
@@ -192,29 +417,154 @@ class ActivationService:
         Returns:
             是否已使用
         """
-        return code in self.blacklist
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT is_used FROM activation_codes WHERE code = ?', (code,))
+            row = cursor.fetchone()
+            return bool(row and row['is_used'])
+        finally:
+            conn.close()
+    
+    # ==================== 批次查询 ====================
+    
+    def get_batch_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """获取批次兑换状态汇总
+        
+        Args:
+            batch_id: 批次ID
+        
+        Returns:
+            批次汇总，批次不存在时返回 None
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT tier, subscription_period, MIN(created_at) AS created_at, MAX(expires_at) AS expires_at,
+                       COUNT(*) AS total,
+                       SUM(is_used) AS used,
+                       SUM(CASE WHEN is_used = 0 AND expires_at IS NOT NULL AND expires_at <= ? THEN 1 ELSE 0 END) AS expired,
+                       MAX(used_at) AS last_used_at
+                FROM activation_codes
+                WHERE batch_id = ?
+                GROUP BY tier, subscription_period
+            ''', (now, batch_id))
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        
+        if not rows:
+            return None
+        
+        total = sum(row['total'] for row in rows)
+        used = sum(row['used'] for row in rows)
+        expired = sum(row['expired'] for row in rows)
+        return {
+            'batch_id': batch_id,
+            'tier': rows[0]['tier'],
+            'months': rows[0]['subscription_period'],
+            'created_at': min(row['created_at'] for row in rows),
+            'expires_at': rows[0]['expires_at'],
+            'total': total,
+            'used': used,
+            'expired': expired,
+            'available': total - used - expired,
+            'last_used_at': max((row['last_used_at'] for row in rows if row['last_used_at']), default=None)
+        }
+    
+    def export_batch_csv(self, batch_id: str) -> Iterator[bytes]:
+        """分块导出批次内每个激活码的兑换状态（CSV）
+        
+        Args:
+            batch_id: 批次ID
+        
+        Yields:
+            CSV 内容片段
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['激活码', '等级', '月数', '生成时间', '过期时间', '状态', '兑换用户', '兑换设备', '兑换时间'])
+        yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+        
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT code, tier, subscription_period, created_at, expires_at, is_used,
+                       used_by_user_id, used_by_device_id, used_at
+                FROM activation_codes
+                WHERE batch_id = ?
+                ORDER BY rowid
+            ''', (batch_id,))
+            while True:
+                rows = cursor.fetchmany(self.EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                buffer.seek(0)
+                buffer.truncate()
+                for row in rows:
+                    if row['is_used']:
+                        status = '已使用'
+                    elif row['expires_at'] and row['expires_at'] <= now:
+                        status = '已过期'
+                    else:
+                        status = '未使用'
+                    writer.writerow([
+                        row['code'], row['tier'], row['subscription_period'], row['created_at'],
+                        row['expires_at'] or '', status, row['used_by_user_id'] or '',
+                        row['used_by_device_id'] or '', row['used_at'] or ''
+                    ])
+                yield buffer.getvalue().encode('utf-8')
+        finally:
+            conn.close()
+    
+    def list_batches(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """列出最近生成的批次"""
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT batch_id, tier, subscription_period, MIN(created_at) AS created_at,
+                       COUNT(*) AS total, SUM(is_used) AS used
+                FROM activation_codes
+                WHERE batch_id IS NOT NULL
+                GROUP BY batch_id
+                ORDER BY created_at DESC
+                LIMIT ?
+            ''', (limit,))
+            return [
+                {
+                    'batch_id': row['batch_id'],
+                    'tier': row['tier'],
+                    'months': row['subscription_period'],
+                    'created_at': row['created_at'],
+                    'total': row['total'],
+                    'used': row['used']
+                }
+                for row in cursor.fetchall()
+            ]
+        finally:
+            conn.close()
 
 
 def generate_activation_codes(tier: str, months: int, count: int) -> list[str]:
     """批量生成激活码（工具函数）
-    
+
     Args:
         tier: 会员等级
         months: 订阅月数
         count: 生成数量
-    
+
     Returns:
         激活码列表
     """
     from src.core.config import Config
-    
+
     config = Config()
     service = ActivationService(config)
-    
-    codes = []
-    for _ in range(count):
-        code = service.generate_code(tier, months)
-        codes.append(code)
-    
-    return codes
 
+    return service.generate_batch(tier, months, count)['codes']
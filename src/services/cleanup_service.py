@@ -16,6 +16,8 @@ import sqlite3
 import json
 import re
 
+from src.providers.storage.image_store import ImageStore
+
 logger = logging.getLogger(__name__)
 
 
@@ -36,6 +38,7 @@ class CleanupService:
                 - cleanup.interval_hours: 清理间隔（小时）
                 - cleanup.log_retention_days: 日志保留天数
                 - cleanup.orphan_images: 是否清理孤儿图片
+                - cleanup.orphan_grace_hours: 孤儿图片宽限期（小时，刚上传未保存的图片不清理）
                 - storage.data_dir: 数据根目录
                 - storage.database: 数据库路径
                 - storage.images: 图片目录
@@ -46,12 +49,14 @@ class CleanupService:
         self.interval_hours = config.get('cleanup', {}).get('interval_hours', 24)
         self.log_retention_days = config.get('cleanup', {}).get('log_retention_days', 7)
         self.orphan_images_enabled = config.get('cleanup', {}).get('orphan_images', True)
+        self.orphan_grace_hours = config.get('cleanup', {}).get('orphan_grace_hours', 24)
         
         # 路径配置
         self.data_dir = Path(config.get('storage', {}).get('data_dir', '~/Library/Application Support/MindVoice')).expanduser()
         self.db_path = self.data_dir / config.get('storage', {}).get('database', 'database/history.db')
         self.images_dir = self.data_dir / config.get('storage', {}).get('images', 'images')
         self.logs_dir = Path(config.get('logging', {}).get('directory', 'logs'))
+        self.image_store = ImageStore(self.images_dir, self.db_path)
         
         # 运行状态
         self._running = False
@@ -178,6 +183,11 @@ class CleanupService:
             logger.debug(f"[Cleanup] 图片目录不存在: {self.images_dir}")
             return {'deleted': 0, 'size_freed': 0}
         
+        # 优先使用引用计数索引查询；历史引用计数回填完成前降级为全表扫描
+        orphans = self.image_store.find_orphans(self.orphan_grace_hours) if self.db_path.exists() else None
+        if orphans is not None:
+            return self._delete_orphan_images(orphans)
+        
         try:
             # 1. 获取所有记录中引用的图片URL
             referenced_images = self._get_referenced_images()
@@ -211,6 +221,28 @@ class CleanupService:
             logger.error(f"[Cleanup] 清理孤儿图片失败: {e}", exc_info=True)
             return {'deleted': 0, 'size_freed': 0}
     
+    def _delete_orphan_images(self, filenames: list) -> dict:
+        """删除引用计数索引查出的孤儿图片
+        
+        Args:
+            filenames: 孤儿图片文件名列表
+        
+        Returns:
+            {'deleted': int, 'size_freed': float}
+        """
+        sizes = {}
+        for filename in filenames:
+            image_file = self.images_dir / filename
+            if image_file.is_file():
+                sizes[filename] = image_file.stat().st_size
+        
+        deleted = self.image_store.delete_files(filenames)
+        size_freed_mb = sum(sizes.get(name, 0) for name in deleted) / (1024 * 1024)
+        if deleted:
+            logger.info(f"[Cleanup] 清理孤儿图片: 删除 {len(deleted)} 个文件，释放 {size_freed_mb:.2f} MB")
+        
+        return {'deleted': len(deleted), 'size_freed': size_freed_mb}
+    
     def _get_referenced_images(self) -> Set[str]:
         """从数据库中获取所有被引用的图片URL
         
@@ -223,6 +255,18 @@ class CleanupService:
             logger.warning(f"[Cleanup] 数据库文件不存在: {self.db_path}")
             return referenced
         
+        # 优先使用 record_images 关联表（索引查询）；回填完成前降级为全表扫描
+        try:
+            indexed = self.image_store.get_referenced_filenames()
+        except Exception as e:
+            logger.warning(f"[Cleanup] 查询图片关联表失败，降级为全表扫描: {e}")
+            indexed = None
+        if indexed is not None:
+            for filename in indexed:
+                referenced.add(filename)
+                referenced.add(f"images/{filename}")
+            return referenced
+        
         try:
             conn = sqlite3.connect(str(self.db_path), timeout=30.0)
             conn.execute('PRAGMA journal_mode=WAL')
@@ -0,0 +1,321 @@
+"""
+消费事件队列模块
+
+功能：
+- 接收消费事件（ASR / LLM）时只追加到内存队列和溢写文件，不访问数据库
+- 后台线程定期将队列中的事件合并为一个事务批量写入 consumption_records，
+  同一事务内增量累加到按小时/按天的消费统计汇总表
+- 溢写文件（JSON Lines）保证进程崩溃后未写入的事件可在下次启动时恢复
+- 应用退出时写入全部剩余事件
+- 进程内按数据库路径共享同一个队列实例（多个服务实例共用）
+
+事件ID在入队时生成，批量写入使用 INSERT OR IGNORE，因此恢复时重复写入同一事件是安全的。
+额度账本首次加载用户用量时，会通过 pending_usage 计入尚未落盘的事件，避免漏算。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.core.logger import get_logger
+from src.providers.storage.consumption_rollups import apply_rollups, is_rollup_ready
+
+logger = get_logger("ConsumptionQueue")
+
+# consumption_records 的写入列（事件字典使用相同的键）
+EVENT_COLUMNS = (
+    'id', 'user_id', 'device_id', 'year', 'month', 'type', 'amount', 'unit',
+    'model_source', 'details', 'session_id', 'timestamp', 'created_at',
+)
+
+SPILL_SUFFIX = '.flushing'
+
+
+class ConsumptionQueue:
+    """消费事件队列（线程安全，批量写入）"""
+
+    def __init__(self, db_path: str, spill_path: Optional[str] = None,
+                 flush_interval: float = 1.0, batch_size: int = 500):
+        """初始化消费事件队列
+
+        Args:
+            db_path: 数据库文件路径
+            spill_path: 溢写文件路径（默认与数据库同目录的 consumption_events.jsonl）
+            flush_interval: 批量写入间隔（秒）
+            batch_size: 队列积压达到该数量时提前写入
+        """
+        self.db_path = Path(db_path)
+        self.spill_path = Path(spill_path).expanduser() if spill_path else self.db_path.parent / 'consumption_events.jsonl'
+        self.flush_interval = max(0.1, float(flush_interval))
+        self.batch_size = max(1, int(batch_size))
+
+        self._pending: List[Dict[str, Any]] = []
+        self._inflight: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        # 批量写入与额度账本加载互斥，保证两者看到一致的“已落盘/未落盘”划分
+        self.commit_lock = threading.Lock()
+
+        self._spill_file = None
+        self._flush_thread: Optional[threading.Thread] = None
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._closed = False
+
+        self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+        self._recover()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """获取数据库连接"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    # ==================== 溢写文件 ====================
+
+    @property
+    def _flushing_path(self) -> Path:
+        return self.spill_path.with_name(self.spill_path.name + SPILL_SUFFIX)
+
+    @staticmethod
+    def _read_spill(path: Path) -> List[Dict[str, Any]]:
+        """读取溢写文件（忽略崩溃时写了一半的最后一行）"""
+        events = []
+        if not path.exists():
+            return events
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"[消费队列] 跳过损坏的溢写记录: {path}")
+        return events
+
+    def _recover(self):
+        """启动时将上次未写入的事件补写到数据库"""
+        events = self._read_spill(self._flushing_path) + self._read_spill(self.spill_path)
+        if events:
+            self._write_batch(events)
+            logger.info(f"[消费队列] 已恢复 {len(events)} 条未写入的消费事件")
+        for path in (self._flushing_path, self.spill_path):
+            if path.exists():
+                path.unlink()
+
+    def _append_spill(self, events: List[Dict[str, Any]]):
+        """追加事件到溢写文件（调用方需持有锁）"""
+        if self._spill_file is None:
+            self._spill_file = open(self.spill_path, 'a', encoding='utf-8')
+        for event in events:
+            self._spill_file.write(json.dumps(event, ensure_ascii=False) + '\n')
+        # 只刷入操作系统缓冲区，fsync 由后台线程在写入批次时完成
+        self._spill_file.flush()
+
+    def _rotate_spill(self):
+        """将当前溢写文件转为“写入中”文件（调用方需持有锁）"""
+        if self._spill_file is not None:
+            os.fsync(self._spill_file.fileno())
+            self._spill_file.close()
+            self._spill_file = None
+        if self.spill_path.exists():
+            os.replace(self.spill_path, self._flushing_path)
+
+    def _rewrite_spill(self, events: List[Dict[str, Any]]):
+        """用指定事件重写溢写文件（调用方需持有锁）"""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        tmp_path = self.spill_path.with_name(self.spill_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spill_path)
+        self._flushing_path.unlink(missing_ok=True)
+
+    # ==================== 入队 ====================
+
+    def enqueue(self, event: Dict[str, Any]):
+        """事件入队（不访问数据库）
+
+        Args:
+            event: 消费事件，键与 consumption_records 列一致
+        """
+        with self._lock:
+            if not self._closed:
+                self._pending.append(event)
+                self._append_spill([event])
+                backlog = len(self._pending)
+        if self._closed:
+            # 队列已关闭（应用退出过程中产生的事件）：直接同步写入
+            self._write_batch([event])
+            return
+        self._ensure_flush_thread()
+        if backlog >= self.batch_size:
+            self._wake_event.set()
+
+    def pending_usage(self, user_id: str, year: int, month: int) -> Dict[str, int]:
+        """统计尚未落盘的平台额度用量（调用方需持有 commit_lock）
+
+        Returns:
+            {'asr_ms', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'record_count'}
+        """
+        usage = {'asr_ms': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'record_count': 0}
+        with self._lock:
+            events = self._inflight + self._pending
+        for event in events:
+            if event['user_id'] != user_id or event['year'] != year or event['month'] != month:
+                continue
+            if event['type'] == 'asr':
+                usage['asr_ms'] += event['amount']
+            elif event['model_source'] == 'vendor':
+                details = json.loads(event['details'])
+                usage['prompt_tokens'] += details.get('prompt_tokens', 0)
+                usage['completion_tokens'] += details.get('completion_tokens', 0)
+                usage['total_tokens'] += event['amount']
+            else:
+                continue
+            usage['record_count'] += 1
+        return usage
+
+    # ==================== 批量写入 ====================
+
+    def _write_batch(self, events: List[Dict[str, Any]]):
+        """在一个事务中写入一批事件，并增量累加到消费统计汇总表"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            sql = f'''
+                INSERT OR IGNORE INTO consumption_records ({', '.join(EVENT_COLUMNS)})
+                VALUES ({', '.join('?' for _ in EVENT_COLUMNS)})
+            '''
+            # 逐条插入以区分恢复时已写入过的事件（只有新写入的事件计入汇总表）
+            inserted = []
+            for event in events:
+                cursor.execute(sql, tuple(event.get(column) for column in EVENT_COLUMNS))
+                if cursor.rowcount > 0:
+                    inserted.append(event)
+            # 汇总表回填完成前，新明细由回填任务计入
+            if inserted and is_rollup_ready(cursor):
+                apply_rollups(cursor, inserted)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def flush(self) -> int:
+        """将队列中的事件批量写入数据库
+
+        Returns:
+            写入的事件数
+        """
+        with self.commit_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._inflight, self._pending = self._pending, []
+                self._rotate_spill()
+                batch = self._inflight
+
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # 写入失败：事件放回队首并重新溢写，等待下次重试
+                with self._lock:
+                    self._pending = batch + self._pending
+                    self._inflight = []
+                    self._rewrite_spill(self._pending)
+                logger.error(f"[消费队列] 批量写入失败，{len(batch)} 条事件将重试: {e}", exc_info=True)
+                return 0
+
+            with self._lock:
+                self._inflight = []
+                self._flushing_path.unlink(missing_ok=True)
+
+        logger.debug(f"[消费队列] 已批量写入 {len(batch)} 条消费事件")
+        return len(batch)
+
+    def _ensure_flush_thread(self):
+        """按需启动后台写入线程"""
+        if self._flush_thread is not None and self._flush_thread.is_alive():
+            return
+        with self._lock:
+            if self._flush_thread is not None and self._flush_thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._flush_thread = threading.Thread(
+                target=self._flush_loop, name="ConsumptionQueueFlush", daemon=True
+            )
+            self._flush_thread.start()
+
+    def _flush_loop(self):
+        """后台写入循环（按间隔写入，积压过多时提前写入）"""
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.flush_interval)
+            self._wake_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[消费队列] 后台写入异常: {e}", exc_info=True)
+
+    def close(self):
+        """停止后台线程并写入全部剩余事件"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout=self.flush_interval + 5)
+            self._flush_thread = None
+        self.flush()
+        with self._lock:
+            self._closed = True
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+
+# ==================== 进程内共享实例 ====================
+
+_queues: Dict[str, ConsumptionQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_consumption_queue(db_path, spill_path: Optional[str] = None,
+                          flush_interval: float = 1.0, batch_size: int = 500) -> ConsumptionQueue:
+    """获取指定数据库的共享消费事件队列
+
+    Args:
+        db_path: 数据库文件路径
+        spill_path: 溢写文件路径（仅在首次创建时生效）
+        flush_interval: 批量写入间隔（秒），仅在首次创建时生效
+        batch_size: 提前写入的积压阈值，仅在首次创建时生效
+
+    Returns:
+        消费事件队列实例
+    """
+    key = str(Path(db_path).expanduser().resolve())
+    with _queues_lock:
+        queue = _queues.get(key)
+        if queue is None or queue._closed:
+            queue = ConsumptionQueue(key, spill_path=spill_path,
+                                     flush_interval=flush_interval, batch_size=batch_size)
+            _queues[key] = queue
+        return queue
+
+
+def close_consumption_queues():
+    """写入并关闭所有消费事件队列（应用退出时调用）"""
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+    for queue in queues:
+        queue.close()
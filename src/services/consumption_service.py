@@ -8,10 +8,13 @@
 功能：
 - ASR消费记录
 - LLM消费记录
-- 月度汇总更新
+- 消费明细经由消费事件队列异步批量写入
+- 月度汇总更新（经由内存额度账本定期写回）
 - 消费历史查询
+- 按小时/按天的消费统计报表（只读取汇总表）
 """
 
+import json
 import sqlite3
 import uuid
 from datetime import datetime
@@ -19,6 +22,10 @@ from pathlib import Path
 from typing import Optional, Dict, Any, List
 from src.core.config import Config
 from src.core.logger import get_logger
+from src.providers.llm.usage import LLMUsage
+from src.providers.storage.consumption_rollups import is_rollup_ready, query_rollups
+from src.services.consumption_queue import get_consumption_queue
+from src.services.quota_ledger import get_quota_ledger
 
 logger = get_logger("ConsumptionService")
 
@@ -39,6 +46,20 @@ class ConsumptionService:
         database_relative = Path(config.get('storage.database'))
         self.db_path = data_dir / database_relative
         
+        # 进程内共享的额度账本（月度汇总由账本定期写回）
+        self.quota_ledger = get_quota_ledger(
+            self.db_path, config.get('membership.quota_ledger.flush_interval_seconds', 5)
+        )
+        
+        # 进程内共享的消费事件队列（明细由队列批量写入）
+        self.consumption_queue = get_consumption_queue(
+            self.db_path,
+            spill_path=config.get('membership.consumption_queue.spill_file'),
+            flush_interval=config.get('membership.consumption_queue.flush_interval_seconds', 1),
+            batch_size=config.get('membership.consumption_queue.batch_size', 500)
+        )
+        self.quota_ledger.pending_source = self.consumption_queue
+        
         logger.info(f"[消费服务] 初始化 (v1.2.1)，数据库: {self.db_path}")
     
     def _get_connection(self) -> sqlite3.Connection:
@@ -49,6 +70,36 @@ class ConsumptionService:
         conn.execute('PRAGMA foreign_keys=ON')
         return conn
     
+    def _build_event(
+        self,
+        record_id: str,
+        user_id: str,
+        device_id: str,
+        consumption_type: str,
+        amount: int,
+        unit: str,
+        model_source: str,
+        details: Dict[str, Any],
+        session_id: Optional[str]
+    ) -> Dict[str, Any]:
+        """构建消费事件（字段与 consumption_records 列一致）"""
+        now = datetime.now()
+        return {
+            'id': record_id,
+            'user_id': user_id,
+            'device_id': device_id,
+            'year': now.year,
+            'month': now.month,
+            'type': consumption_type,
+            'amount': amount,
+            'unit': unit,
+            'model_source': model_source,
+            'details': json.dumps(details, ensure_ascii=False),
+            'session_id': session_id,
+            'timestamp': now.timestamp(),
+            'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    
     def record_asr_consumption(
         self,
         user_id: str,
@@ -75,51 +126,27 @@ class ConsumptionService:
         Returns:
             消费记录ID
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        record_id = str(uuid.uuid4())
+        details = {
+            'duration_ms': duration_ms,
+            'start_time': start_time,
+            'end_time': end_time,
+            'provider': provider,
+            'language': language
+        }
+        event = self._build_event(record_id, user_id, device_id, 'asr', duration_ms, 'ms', 'vendor', details, session_id)
         
+        # 先记入额度账本（入队失败时回滚），账本负责写回月度汇总
+        self.quota_ledger.add_asr(user_id, duration_ms)
         try:
-            record_id = str(uuid.uuid4())
-            now = datetime.now()
-            year = now.year
-            month = now.month
-            timestamp = now.timestamp()
-            created_at = now.strftime('%Y-%m-%d %H:%M:%S')
-            
-            # 构建详情JSON
-            details = {
-                'duration_ms': duration_ms,
-                'start_time': start_time,
-                'end_time': end_time,
-                'provider': provider,
-                'language': language
-            }
-            
-            import json
-            details_json = json.dumps(details, ensure_ascii=False)
-            
-            # 插入消费记录
-            cursor.execute('''
-                INSERT INTO consumption_records 
-                (id, user_id, device_id, year, month, type, amount, unit, model_source, details, session_id, timestamp, created_at)
-                VALUES (?, ?, ?, ?, ?, 'asr', ?, 'ms', 'vendor', ?, ?, ?, ?)
-            ''', (record_id, user_id, device_id, year, month, duration_ms, details_json, session_id, timestamp, created_at))
-            
-            # 更新月度汇总
-            self._update_monthly_asr_with_cursor(cursor, user_id, device_id, year, month, duration_ms)
-            
-            conn.commit()
-            
-            logger.info(f"[消费服务] ASR消费已记录: user_id={user_id}, device_id={device_id}, {duration_ms}ms")
-            
-            return record_id
-            
+            self.consumption_queue.enqueue(event)
         except Exception as e:
-            conn.rollback()
+            self.quota_ledger.add_asr(user_id, -duration_ms)
             logger.error(f"[消费服务] 记录ASR消费失败: {e}", exc_info=True)
             raise
-        finally:
-            conn.close()
+        
+        logger.info(f"[消费服务] ASR消费已记录: user_id={user_id}, device_id={device_id}, {duration_ms}ms")
+        return record_id
     
     def record_llm_consumption(
         self,
@@ -149,115 +176,66 @@ class ConsumptionService:
         Returns:
             消费记录ID
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        record_id = str(uuid.uuid4())
+        details = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': total_tokens,
+            'model': model,
+            'provider': provider,
+            'model_source': model_source
+        }
+        # 用户自备模型也记录，但不计入额度
+        event = self._build_event(record_id, user_id, device_id, 'llm', total_tokens, 'tokens', model_source, details, request_id)
         
+        # 仅平台模型计入额度：先记入额度账本（入队失败时回滚），账本负责写回月度汇总
+        if model_source == 'vendor':
+            self.quota_ledger.add_llm(user_id, prompt_tokens, completion_tokens, total_tokens)
         try:
-            record_id = str(uuid.uuid4())
-            now = datetime.now()
-            year = now.year
-            month = now.month
-            timestamp = now.timestamp()
-            created_at = now.strftime('%Y-%m-%d %H:%M:%S')
-            
-            # 构建详情JSON
-            details = {
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens,
-                'total_tokens': total_tokens,
-                'model': model,
-                'provider': provider,
-                'model_source': model_source
-            }
-            
-            import json
-            details_json = json.dumps(details, ensure_ascii=False)
-            
-            # 插入消费记录（用户自备模型也记录，但不计入额度）
-            cursor.execute('''
-                INSERT INTO consumption_records 
-                (id, user_id, device_id, year, month, type, amount, unit, model_source, details, session_id, timestamp, created_at)
-                VALUES (?, ?, ?, ?, ?, 'llm', ?, 'tokens', ?, ?, ?, ?, ?)
-            ''', (record_id, user_id, device_id, year, month, total_tokens, model_source, details_json, request_id, timestamp, created_at))
-            
-            # 仅平台模型计入额度
-            if model_source == 'vendor':
-                self._update_monthly_llm_with_cursor(cursor, user_id, device_id, year, month, prompt_tokens, completion_tokens, total_tokens)
-            
-            conn.commit()
-            
-            logger.info(f"[消费服务] LLM消费已记录: user_id={user_id}, device_id={device_id}, {total_tokens} tokens, model_source={model_source}")
-            
-            return record_id
-            
+            self.consumption_queue.enqueue(event)
         except Exception as e:
-            conn.rollback()
+            if model_source == 'vendor':
+                self.quota_ledger.add_llm(user_id, -prompt_tokens, -completion_tokens, -total_tokens)
             logger.error(f"[消费服务] 记录LLM消费失败: {e}", exc_info=True)
             raise
-        finally:
-            conn.close()
-    
-    def _update_monthly_asr_with_cursor(
-        self, 
-        cursor: sqlite3.Cursor, 
-        user_id: str,
-        device_id: str, 
-        year: int, 
-        month: int, 
-        duration_ms: int
-    ) -> None:
-        """使用提供的游标更新月度ASR汇总（按user_id汇总，device_id仅用于记录）"""
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # 尝试更新（按user_id汇总，不区分device_id）
-        cursor.execute('''
-            UPDATE monthly_consumption
-            SET asr_duration_ms = asr_duration_ms + ?,
-                record_count = record_count + 1,
-                updated_at = ?
-            WHERE user_id = ? AND year = ? AND month = ?
-        ''', (duration_ms, now, user_id, year, month))
-        
-        # 如果没有更新任何行，说明记录不存在，需要插入
-        if cursor.rowcount == 0:
-            cursor.execute('''
-                INSERT INTO monthly_consumption 
-                (user_id, year, month, asr_duration_ms, llm_prompt_tokens, llm_completion_tokens, llm_total_tokens, record_count, created_at, updated_at)
-                VALUES (?, ?, ?, ?, 0, 0, 0, 1, ?, ?)
-            ''', (user_id, year, month, duration_ms, now, now))
+        logger.info(f"[消费服务] LLM消费已记录: user_id={user_id}, device_id={device_id}, {total_tokens} tokens, model_source={model_source}")
+        return record_id
     
-    def _update_monthly_llm_with_cursor(
+    def record_llm_usage(
         self,
-        cursor: sqlite3.Cursor,
         user_id: str,
         device_id: str,
-        year: int,
-        month: int,
-        prompt_tokens: int,
-        completion_tokens: int,
-        total_tokens: int
-    ) -> None:
-        """使用提供的游标更新月度LLM汇总（按user_id汇总，device_id仅用于记录）"""
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        usage: LLMUsage,
+        model_source: str = 'vendor',
+        request_id: Optional[str] = None
+    ) -> List[str]:
+        """按请求用量上下文记录LLM消费（每个模型一条记录）
         
-        # 尝试更新（按user_id汇总，不区分device_id）
-        cursor.execute('''
-            UPDATE monthly_consumption
-            SET llm_prompt_tokens = llm_prompt_tokens + ?,
-                llm_completion_tokens = llm_completion_tokens + ?,
-                llm_total_tokens = llm_total_tokens + ?,
-                record_count = record_count + 1,
-                updated_at = ?
-            WHERE user_id = ? AND year = ? AND month = ?
-        ''', (prompt_tokens, completion_tokens, total_tokens, now, user_id, year, month))
+        Args:
+            user_id: 用户ID
+            device_id: 设备ID
+            usage: 请求范围的用量对象（包含扇出调用的全部用量）
+            model_source: 模型来源（'vendor'或'user'）
+            request_id: 请求ID
         
-        # 如果没有更新任何行，说明记录不存在，需要插入
-        if cursor.rowcount == 0:
-            cursor.execute('''
-                INSERT INTO monthly_consumption 
-                (user_id, year, month, asr_duration_ms, llm_prompt_tokens, llm_completion_tokens, llm_total_tokens, record_count, created_at, updated_at)
-                VALUES (?, ?, ?, 0, ?, ?, ?, 1, ?, ?)
-            ''', (user_id, year, month, prompt_tokens, completion_tokens, total_tokens, now, now))
+        Returns:
+            消费记录ID列表
+        """
+        record_ids = []
+        for (model, provider), totals in usage.by_model().items():
+            record_ids.append(self.record_llm_consumption(
+                user_id=user_id,
+                device_id=device_id,
+                prompt_tokens=totals['prompt_tokens'],
+                completion_tokens=totals['completion_tokens'],
+                total_tokens=totals['total_tokens'],
+                model=model,
+                provider=provider,
+                model_source=model_source,
+                request_id=request_id
+            ))
+        return record_ids
     
     def get_monthly_consumption(
         self, 
@@ -277,6 +255,10 @@ class ConsumptionService:
         Returns:
             月度消费统计（按user_id汇总，包含所有设备的消费）
         """
+        # 先写入队列中的消费事件并写回账本，保证汇总是最新的
+        self.consumption_queue.flush()
+        self.quota_ledger.flush()
+        
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -368,6 +350,9 @@ class ConsumptionService:
         Returns:
             消费记录列表
         """
+        # 先写入队列中的消费事件，保证列表包含最新记录
+        self.consumption_queue.flush()
+        
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -399,3 +384,53 @@ class ConsumptionService:
             
         finally:
             conn.close()
+    
+    def get_consumption_report(
+        self,
+        granularity: str = 'day',
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        user_id: Optional[str] = None,
+        device_id: Optional[str] = None,
+        group_by: Optional[List[str]] = None,
+        limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """获取消费统计报表（只读取按小时/按天的汇总表，不扫描消费明细）
+        
+        Args:
+            granularity: 时间粒度（'hour'或'day'）
+            start: 起始时间（含），如 '2025-01-01'
+            end: 结束时间（含）
+            user_id: 用户ID（可选）
+            device_id: 设备ID（可选）
+            group_by: 分组维度（bucket/user_id/device_id/type/model/model_source，默认按时间桶）
+            limit: 返回行数上限
+        
+        Returns:
+            {'rows': 汇总行列表, 'complete': 历史明细是否已全部计入汇总表}
+        """
+        # 先写入队列中的消费事件，保证报表包含最新数据
+        self.consumption_queue.flush()
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            rows = query_rollups(
+                cursor,
+                granularity=granularity,
+                start=start,
+                end=end,
+                user_id=user_id,
+                device_id=device_id,
+                group_by=group_by,
+                limit=limit
+            )
+            return {
+                'granularity': granularity,
+                'rows': rows,
+                'complete': is_rollup_ready(cursor)
+            }
+            
+        finally:
+            conn.close()
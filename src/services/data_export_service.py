@@ -0,0 +1,342 @@
+"""
+数据批量导出服务
+
+功能：
+- 导出 consumption_records、monthly_consumption 与 records 元数据（不含正文）
+- 支持 CSV、Arrow IPC 流、Parquet 三种格式（Arrow/Parquet 需要 pyarrow，未安装时仅支持 CSV）
+- 按日期范围、用户过滤
+- 使用 fetchmany 分块读取并逐块写出，内存占用与表大小无关
+"""
+import csv
+import io
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.core.config import Config
+from src.core.logger import get_logger
+
+# 条件导入（Arrow/Parquet 导出为可选功能）
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = get_logger("DataExportService")
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+@dataclass(frozen=True)
+class ExportDataset:
+    """可导出的数据集定义"""
+    table: str
+    # (列表达式, 输出列名, 类型: string/int/float)
+    columns: Tuple[Tuple[str, str, str], ...]
+    # 日期过滤方式：'created_at'（按时间列）或 'year_month'（按年月列）
+    date_filter: str
+    order_by: str
+
+
+DATASETS: Dict[str, ExportDataset] = {
+    'consumption_records': ExportDataset(
+        table='consumption_records',
+        columns=(
+            ('id', 'id', 'string'),
+            ('user_id', 'user_id', 'string'),
+            ('device_id', 'device_id', 'string'),
+            ('year', 'year', 'int'),
+            ('month', 'month', 'int'),
+            ('type', 'type', 'string'),
+            ('amount', 'amount', 'float'),
+            ('unit', 'unit', 'string'),
+            ('model_source', 'model_source', 'string'),
+            ("json_extract(details, '$.model')", 'model', 'string'),
+            ("json_extract(details, '$.provider')", 'provider', 'string'),
+            ("json_extract(details, '$.prompt_tokens')", 'prompt_tokens', 'int'),
+            ("json_extract(details, '$.completion_tokens')", 'completion_tokens', 'int'),
+            ('session_id', 'session_id', 'string'),
+            ('timestamp', 'timestamp', 'float'),
+            ('created_at', 'created_at', 'string'),
+        ),
+        date_filter='created_at',
+        order_by='rowid',
+    ),
+    'monthly_consumption': ExportDataset(
+        table='monthly_consumption',
+        columns=(
+            ('user_id', 'user_id', 'string'),
+            ('year', 'year', 'int'),
+            ('month', 'month', 'int'),
+            ('asr_duration_ms', 'asr_duration_ms', 'int'),
+            ('llm_prompt_tokens', 'llm_prompt_tokens', 'int'),
+            ('llm_completion_tokens', 'llm_completion_tokens', 'int'),
+            ('llm_total_tokens', 'llm_total_tokens', 'int'),
+            ('record_count', 'record_count', 'int'),
+            ('updated_at', 'updated_at', 'string'),
+        ),
+        date_filter='year_month',
+        order_by='year, month, user_id',
+    ),
+    'records': ExportDataset(
+        table='records',
+        columns=(
+            ('id', 'id', 'string'),
+            ('user_id', 'user_id', 'string'),
+            ('device_id', 'device_id', 'string'),
+            ('app_type', 'app_type', 'string'),
+            ('LENGTH(text)', 'text_length', 'int'),
+            ("json_extract(metadata, '$.language_type')", 'language_type', 'string'),
+            ('is_deleted', 'is_deleted', 'int'),
+            ('is_starred', 'is_starred', 'int'),
+            ('is_archived', 'is_archived', 'int'),
+            ('created_at', 'created_at', 'string'),
+            ('updated_at', 'updated_at', 'string'),
+            ('deleted_at', 'deleted_at', 'string'),
+        ),
+        date_filter='created_at',
+        order_by='rowid',
+    ),
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的内存缓冲（每写完一块就取走数据，供 pyarrow 流式写出）"""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class DataExportService:
+    """数据批量导出服务"""
+
+    def __init__(self, config: Config):
+        """初始化导出服务
+
+        Args:
+            config: 配置对象
+        """
+        self.config = config
+
+        # 获取数据库路径
+        data_dir = Path(config.get('storage.data_dir')).expanduser()
+        database_relative = Path(config.get('storage.database'))
+        self.db_path = data_dir / database_relative
+
+        self.chunk_size = int(config.get('storage.export.chunk_size', 5000))
+
+        logger.info(f"[数据导出] 初始化，数据库: {self.db_path}")
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """获取数据库连接（只读查询）"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @staticmethod
+    def available_formats() -> List[str]:
+        """当前环境支持的导出格式"""
+        return [fmt for fmt in EXPORT_FORMATS if fmt == 'csv' or PYARROW_AVAILABLE]
+
+    # ==================== 查询 ====================
+
+    def _build_query(self, dataset: ExportDataset, start: Optional[str], end: Optional[str],
+                     user_id: Optional[str]) -> Tuple[str, List[Any]]:
+        """构建导出查询（日期格式不正确时抛出 ValueError）"""
+        where, params = [], []
+        start_date = _parse_date(start, 'start') if start else None
+        end_date = _parse_date(end, 'end') if end else None
+
+        if dataset.date_filter == 'created_at':
+            if start:
+                where.append('created_at >= ?')
+                params.append(start)
+            if end:
+                # 结束日期包含当天
+                where.append('created_at < ?')
+                params.append(_next_day(end))
+        else:
+            if start:
+                where.append('(year * 100 + month) >= ?')
+                params.append(start_date.year * 100 + start_date.month)
+            if end:
+                where.append('(year * 100 + month) <= ?')
+                params.append(end_date.year * 100 + end_date.month)
+
+        if user_id:
+            where.append('user_id = ?')
+            params.append(user_id)
+
+        sql = f'''
+            SELECT {', '.join(expression for expression, _, _ in dataset.columns)}
+            FROM {dataset.table}
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY {dataset.order_by}
+        '''
+        return sql, params
+
+    def iter_chunks(self, dataset_name: str, start: Optional[str] = None, end: Optional[str] = None,
+                    user_id: Optional[str] = None) -> Iterator[List[tuple]]:
+        """分块读取数据集（参数在调用时校验，返回的迭代器开始读取后不再因参数出错）
+
+        Args:
+            dataset_name: 数据集名称（consumption_records/monthly_consumption/records）
+            start: 起始日期（含），如 '2025-01-01'
+            end: 结束日期（含）
+            user_id: 用户ID（可选）
+
+        Returns:
+            迭代器，每块最多 chunk_size 行
+
+        Raises:
+            ValueError: 数据集不存在或日期格式不正确
+        """
+        dataset = get_dataset(dataset_name)
+        sql, params = self._build_query(dataset, start, end, user_id)
+        return self._fetch_chunks(sql, params)
+
+    def _fetch_chunks(self, sql: str, params: List[Any]) -> Iterator[List[tuple]]:
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    # ==================== 写出 ====================
+
+    def export(self, dataset_name: str, fmt: str = 'csv', start: Optional[str] = None,
+               end: Optional[str] = None, user_id: Optional[str] = None) -> Iterator[bytes]:
+        """流式导出数据集
+
+        Args:
+            dataset_name: 数据集名称
+            fmt: 导出格式（csv/arrow/parquet）
+            start: 起始日期（含）
+            end: 结束日期（含）
+            user_id: 用户ID（可选）
+
+        Returns:
+            文件内容片段的迭代器（逐块生成，可直接用于流式响应或写入文件）
+
+        Raises:
+            ValueError: 数据集、格式或日期不正确（在返回迭代器之前校验，流式响应开始后不会因参数出错中断）
+        """
+        dataset = get_dataset(dataset_name)
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        if fmt != 'csv' and not PYARROW_AVAILABLE:
+            raise ValueError(f"{fmt} 格式需要安装 pyarrow: pip install pyarrow")
+
+        chunks = self.iter_chunks(dataset_name, start, end, user_id)
+        if fmt == 'csv':
+            return self._write_csv(dataset, chunks)
+        return self._write_arrow(dataset, chunks, parquet=(fmt == 'parquet'))
+
+    def export_to_file(self, dataset_name: str, output_path: str, fmt: str = 'csv',
+                       start: Optional[str] = None, end: Optional[str] = None,
+                       user_id: Optional[str] = None) -> int:
+        """导出数据集到文件
+
+        Returns:
+            写入的字节数
+        """
+        output = Path(output_path).expanduser()
+        output.parent.mkdir(parents=True, exist_ok=True)
+        written = 0
+        with open(output, 'wb') as f:
+            for piece in self.export(dataset_name, fmt, start, end, user_id):
+                f.write(piece)
+                written += len(piece)
+        logger.info(f"[数据导出] 已导出 {dataset_name} → {output} ({written} 字节)")
+        return written
+
+    @staticmethod
+    def _write_csv(dataset: ExportDataset, chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+        """逐块生成 CSV（UTF-8 BOM，便于 Excel 打开）"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([name for _, name, _ in dataset.columns])
+        yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+
+        for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode('utf-8')
+
+    @staticmethod
+    def _write_arrow(dataset: ExportDataset, chunks: Iterator[List[tuple]], parquet: bool) -> Iterator[bytes]:
+        """逐块生成 Arrow IPC 流或 Parquet（每块一个 record batch / row group）"""
+        types = {'string': pa.string(), 'int': pa.int64(), 'float': pa.float64()}
+        schema = pa.schema([(name, types[kind]) for _, name, kind in dataset.columns])
+
+        sink = _ChunkSink()
+        stream = pa.PythonFile(sink, mode='w')
+        writer = pq.ParquetWriter(stream, schema) if parquet else pa.ipc.new_stream(stream, schema)
+        try:
+            for rows in chunks:
+                columns = list(zip(*rows))
+                batch = pa.record_batch(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema
+                )
+                writer.write_batch(batch)
+                yield sink.take()
+        finally:
+            writer.close()
+        yield sink.take()
+
+
+def get_dataset(name: str) -> ExportDataset:
+    """获取数据集定义（不存在时抛出 ValueError）"""
+    dataset = DATASETS.get(name)
+    if not dataset:
+        raise ValueError(f"不支持的数据集: {name}，可选: {', '.join(DATASETS)}")
+    return dataset
+
+
+def _parse_date(value: str, name: str) -> datetime:
+    """解析日期参数（YYYY-MM-DD，或带时间的 YYYY-MM-DD HH:MM:SS），格式不正确时抛出 ValueError"""
+    try:
+        return datetime.fromisoformat(value) if len(value) > 10 else datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"无效的日期 {name}={value}，格式应为 YYYY-MM-DD") from None
+
+
+def _next_day(date: str) -> str:
+    """日期字符串的下一天（用于包含结束日期的范围查询）"""
+    if len(date) > 10:
+        return date
+    return (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
@@ -0,0 +1,239 @@
+"""
+实时字幕翻译
+
+功能：
+- 订阅 VoiceService 的确定 utterance（is_definite_utterance=True），在服务端直接翻译
+- 翻译结果以 translation 消息写入同一消息流，通过 utterance_id 与原文 text_final 消息对应
+- 并发翻译数有上限；积压超过上限时丢弃最旧的未开始翻译
+- 同一 utterance 被二遍识别修正后，旧版本的翻译不再发布（只发布最新文本的译文）
+- 每次录音开始时清空开始时间到 utterance 的对应（新录音的开始时间从头计），
+  utterance 的版本记录在其翻译结束后删除
+- 中间结果（text_update）不翻译
+
+ASR 回调可能来自其他线程，翻译任务统一调度到服务启动时的事件循环上执行。
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from src.providers.llm.scheduler import PRIORITY_INTERACTIVE, llm_priority
+from src.providers.llm.usage import LLMUsage, usage_scope
+
+logger = logging.getLogger(__name__)
+
+# 按开始时间识别同一 utterance 的记录数上限
+_MAX_TRACKED_UTTERANCES = 256
+
+
+class LiveTranslationService:
+    """实时字幕翻译服务"""
+
+    def __init__(self, translation_agent, publish: Callable[[Dict[str, Any]], None],
+                 language_pair: str = 'zh-en', max_concurrency: int = 2, max_pending: int = 20,
+                 enabled: bool = False,
+                 on_usage: Optional[Callable[[Optional[str], LLMUsage], None]] = None):
+        """初始化实时翻译服务
+
+        Args:
+            translation_agent: TranslationAgent 实例
+            publish: 发布消息的函数（写入消息缓冲区）
+            language_pair: 默认语言对（如 'zh-en'，自动判断每句的翻译方向）
+            max_concurrency: 同时进行的翻译数
+            max_pending: 等待翻译的 utterance 上限（超过时丢弃最旧的）
+            enabled: 是否默认开启
+            on_usage: 每次翻译完成后的用量回调 (device_id, usage)
+        """
+        self.translation_agent = translation_agent
+        self.publish = publish
+        self.language_pair = language_pair
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_pending = max(1, int(max_pending))
+        self.enabled = enabled
+        self.device_id: Optional[str] = None
+        self.on_usage = on_usage
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._counter = 0
+        # utterance_id → 最新版本号（排队或翻译中的 utterance）
+        self._latest: "OrderedDict[str, int]" = OrderedDict()
+        # 开始时间 → utterance_id（二遍识别修正同一句时复用）
+        self._by_start: "OrderedDict[Any, str]" = OrderedDict()
+        # 尚未开始翻译的 utterance_id → 版本号（按提交顺序）
+        self._queued: "OrderedDict[str, int]" = OrderedDict()
+        self._futures = set()
+
+        self.translated = 0
+        self.dropped = 0
+        self.failed = 0
+
+    async def start(self):
+        """绑定当前事件循环（在服务启动时调用）"""
+        self._loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        logger.info(f"[实时翻译] 已启动 (语言对: {self.language_pair}, 并发: {self.max_concurrency}, "
+                    f"开启: {self.enabled})")
+
+    async def stop(self):
+        """停止服务，取消未完成的翻译"""
+        self._loop = None
+        for future in list(self._futures):
+            future.cancel()
+        self._futures.clear()
+        logger.info("[实时翻译] 已停止")
+
+    def configure(self, enabled: bool, language_pair: Optional[str] = None, device_id: Optional[str] = None):
+        """开启或关闭实时翻译
+
+        Args:
+            enabled: 是否开启
+            language_pair: 语言对（可选，不传则保持不变）
+            device_id: 设备ID（用于消费记录）
+
+        Raises:
+            ValueError: 不支持的语言对
+        """
+        if language_pair:
+            if language_pair not in self.translation_agent.SUPPORTED_PAIRS:
+                raise ValueError(f"不支持的语言对: {language_pair}")
+            self.language_pair = language_pair
+        self.enabled = enabled
+        if device_id:
+            self.device_id = device_id
+        if not enabled:
+            with self._lock:
+                self.dropped += len(self._queued)
+                self._queued.clear()
+        logger.info(f"[实时翻译] {'开启' if enabled else '关闭'}，语言对: {self.language_pair}")
+
+    def begin_recording(self):
+        """录音开始时调用：此后的开始时间属于新录音，不再对应上一次录音的 utterance"""
+        with self._lock:
+            self._by_start.clear()
+
+    def submit(self, text: str, time_info: Optional[dict] = None, app_id: Optional[str] = None) -> Optional[str]:
+        """提交一条确定的 utterance（可在任意线程调用）
+
+        Args:
+            text: utterance 文本
+            time_info: ASR 时间信息（start_time / end_time，毫秒）
+            app_id: 应用ID
+
+        Returns:
+            utterance_id（未开启或无需翻译时返回 None）
+        """
+        loop = self._loop
+        if not self.enabled or loop is None or not text or not text.strip():
+            return None
+
+        start_time = (time_info or {}).get('start_time')
+        with self._lock:
+            utterance_id = self._by_start.get(start_time) if start_time is not None else None
+            if utterance_id is None:
+                self._counter += 1
+                utterance_id = f"utt-{self._counter}"
+                if start_time is not None:
+                    self._by_start[start_time] = utterance_id
+                    while len(self._by_start) > _MAX_TRACKED_UTTERANCES:
+                        self._by_start.popitem(last=False)
+
+            generation = self._latest.pop(utterance_id, 0) + 1
+            self._latest[utterance_id] = generation
+            while len(self._latest) > _MAX_TRACKED_UTTERANCES:
+                self._latest.popitem(last=False)
+
+            # 同一句的旧版本尚未开始翻译时直接被替换
+            self._queued.pop(utterance_id, None)
+            self._queued[utterance_id] = generation
+            while len(self._queued) > self.max_pending:
+                dropped_id, _ = self._queued.popitem(last=False)
+                self.dropped += 1
+                logger.warning(f"[实时翻译] 积压过多，丢弃未翻译的 utterance: {dropped_id}")
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._translate(utterance_id, generation, text.strip(), time_info or {}, app_id), loop
+        )
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return utterance_id
+
+    def _is_latest(self, utterance_id: str, generation: int) -> bool:
+        with self._lock:
+            return self._latest.get(utterance_id) == generation
+
+    async def _translate(self, utterance_id: str, generation: int, text: str,
+                         time_info: dict, app_id: Optional[str]):
+        try:
+            await self._translate_latest(utterance_id, generation, text, time_info, app_id)
+        finally:
+            with self._lock:
+                # 最新版本结束（发布、失败或被丢弃）后不再需要版本记录
+                if self._latest.get(utterance_id) == generation:
+                    del self._latest[utterance_id]
+
+    async def _translate_latest(self, utterance_id: str, generation: int, text: str,
+                                time_info: dict, app_id: Optional[str]):
+        async with self._semaphore:
+            with self._lock:
+                if self._queued.get(utterance_id) != generation:
+                    # 已被丢弃或被同一句的新版本替换
+                    return
+                del self._queued[utterance_id]
+
+            source_lang, target_lang, is_valid = self.translation_agent.resolve_translation_direction(
+                self.language_pair, text
+            )
+            if not is_valid:
+                # 语种不在互译对中（如中英互译时说了日语），不翻译
+                return
+
+            device_id = self.device_id
+            try:
+                with usage_scope() as usage, llm_priority(PRIORITY_INTERACTIVE):
+                    result = await self.translation_agent.translate(text, source_lang, target_lang)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"[实时翻译] 翻译失败: {utterance_id}, 错误: {e}")
+                return
+
+        if self.on_usage:
+            self.on_usage(device_id, usage)
+
+        if not self._is_latest(utterance_id, generation):
+            self.dropped += 1
+            logger.debug(f"[实时翻译] utterance 已更新，丢弃旧译文: {utterance_id}")
+            return
+
+        message = {
+            "type": "translation",
+            "utterance_id": utterance_id,
+            "text": text,
+            "translation": result,
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+        }
+        if 'start_time' in time_info:
+            message["start_time"] = time_info.get('start_time', 0)
+            message["end_time"] = time_info.get('end_time', 0)
+        if app_id:
+            message["app_id"] = app_id
+
+        self.translated += 1
+        self.publish(message)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取运行状态"""
+        with self._lock:
+            pending = len(self._queued)
+        return {
+            'enabled': self.enabled,
+            'language_pair': self.language_pair,
+            'max_concurrency': self.max_concurrency,
+            'pending': pending,
+            'translated': self.translated,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
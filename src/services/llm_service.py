@@ -1,15 +1,80 @@
 """
 LLM 服务 - 提供大语言模型对话功能
+
+多模型路由：
+- llm 顶层配置为默认模型（别名 default），llm.models 定义其他模型别名
+- llm.routes 按 Agent / 任务选择模型（如翻译用快速模型、小结用大模型），每个路由是按顺序尝试的模型列表
+- 模型请求失败（含熔断）时切换到列表中的下一个模型；超过路由的延迟上限仍未返回时保留原请求并同时请求下一个模型，
+  先成功者胜出；流式请求以首个片段为准
+- 未配置的路由使用 default 路由（未配置时为默认模型）
+- reload_routes() 重新读取 config.yml 并整体替换模型和路由表，进行中的请求继续使用旧表
+- get_route_stats() 提供各路由的请求数、降级次数、各模型的服务次数和错误、延迟分位数及模型健康状态
 """
+import asyncio
 import logging
-from typing import Optional, AsyncIterator, Union, Dict, Any
+from collections import Counter, defaultdict, deque
+from functools import partial
+from typing import Optional, AsyncIterator, Awaitable, Callable, Union, Dict, Any, List, Tuple
 from ..core.config import Config
 from ..core.logger import get_logger, get_system_logger
 from ..core.error_codes import SystemError, SystemErrorInfo
 from ..providers.llm.litellm_provider import LiteLLMProvider
+from ..providers.llm.scheduler import (
+    LLMRequestScheduler,
+    classify_error,
+    ERROR_AUTH,
+    ERROR_CIRCUIT_OPEN,
+    ERROR_QUOTA,
+    ERROR_RATE_LIMIT,
+    ERROR_TIMEOUT,
+    summarize_samples,
+)
 
 logger = get_logger("LLM")
 
+# 默认模型别名（llm 顶层配置）和默认路由名
+DEFAULT_MODEL_ALIAS = 'default'
+DEFAULT_ROUTE = 'default'
+
+# 别名模型与默认模型使用同一提供商时继承的连接配置
+_INHERITED_KEYS = ('provider', 'api_key', 'base_url')
+
+# llm 顶层中不属于默认模型的配置段
+_NON_MODEL_KEYS = ('models', 'routes', 'scheduler')
+
+# 路由延迟样本保留数
+_ROUTE_SAMPLE_SIZE = 1000
+
+# 流式请求没有任何片段
+_EMPTY_STREAM = object()
+
+
+class _RoutingTable:
+    """模型和路由表（重新加载时整体替换）"""
+
+    def __init__(self, models: Dict[str, Dict[str, Any]], providers: Dict[str, LiteLLMProvider],
+                 routes: Dict[str, Dict[str, Any]]):
+        self.models = models
+        self.providers = providers
+        self.routes = routes
+
+    def is_available(self) -> bool:
+        return any(provider.is_available() for provider in self.providers.values())
+
+
+class _RouteStats:
+    """单个路由的请求统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.fallbacks = 0
+        self.latency_fallbacks = 0
+        self.served_by: Counter = Counter()
+        self.errors: Dict[str, Counter] = defaultdict(Counter)
+        self.latencies: deque = deque(maxlen=_ROUTE_SAMPLE_SIZE)
+
 
 class LLMService:
     """LLM 服务主类"""
@@ -22,10 +87,14 @@ class LLMService:
         """
         self.config = config
         self.llm_provider: Optional[LiteLLMProvider] = None
+        self._table = _RoutingTable({}, {}, {})
+        self._route_stats: Dict[str, _RouteStats] = {}
+        # 请求调度：按模型限制并发、优先级排队、重试、熔断和对冲
+        self.scheduler = LLMRequestScheduler.from_config(self.config.get('llm.scheduler', {}) or {})
         self._initialize_provider()
     
     def _initialize_provider(self):
-        """初始化 LLM 提供商"""
+        """初始化 LLM 提供商（默认模型、别名模型和路由表）"""
         sys_logger = get_system_logger()
         
         try:
@@ -43,11 +112,10 @@ class LLMService:
                 logger.warning("[LLM服务] 未找到 LLM 配置，服务将不可用")
                 return
             
-            # 创建并初始化 LiteLLM 提供商
-            self.llm_provider = LiteLLMProvider()
-            success = self.llm_provider.initialize(llm_config)
+            # 为每个模型别名创建并初始化 LiteLLM 提供商
+            self._set_table(self._build_routing_table(llm_config))
             
-            if success:
+            if self.llm_provider is not None:
                 logger.info("[LLM服务] LLM 提供商初始化成功")
                 sys_logger.log_llm_event("LLM初始化成功", 
                                          provider=llm_config.get('provider'),
@@ -72,9 +140,105 @@ class LLMService:
             logger.error(f"[LLM服务] 初始化 LLM 提供商异常: {e}")
             self.llm_provider = None
     
+    def _build_routing_table(self, llm_config: Dict[str, Any]) -> _RoutingTable:
+        """根据 llm 配置创建各模型的提供商并解析路由表"""
+        default_config = {k: v for k, v in llm_config.items() if k not in _NON_MODEL_KEYS}
+        models: Dict[str, Dict[str, Any]] = {DEFAULT_MODEL_ALIAS: default_config}
+        for alias, model_config in (llm_config.get('models') or {}).items():
+            if alias == DEFAULT_MODEL_ALIAS:
+                logger.warning(f"[LLM服务] 模型别名 {DEFAULT_MODEL_ALIAS} 保留给 llm 顶层配置，已忽略")
+                continue
+            if isinstance(model_config, str):
+                model_config = {'model': model_config}
+            model_config = dict(model_config or {})
+            if model_config.get('provider', default_config.get('provider')) == default_config.get('provider'):
+                for key in _INHERITED_KEYS:
+                    if default_config.get(key) and not model_config.get(key):
+                        model_config[key] = default_config[key]
+            models[alias] = model_config
+        
+        providers: Dict[str, LiteLLMProvider] = {}
+        for alias, model_config in models.items():
+            provider = LiteLLMProvider()
+            if provider.initialize(model_config):
+                providers[alias] = provider
+            elif alias != DEFAULT_MODEL_ALIAS:
+                logger.error(f"[LLM服务] 模型 {alias} 初始化失败，路由中将跳过该模型")
+        
+        routes: Dict[str, Dict[str, Any]] = {}
+        for name, spec in (llm_config.get('routes') or {}).items():
+            if not isinstance(spec, dict):
+                spec = {'models': spec}
+            aliases = spec.get('models') or [DEFAULT_MODEL_ALIAS]
+            if isinstance(aliases, str):
+                aliases = [aliases]
+            unknown = [alias for alias in aliases if alias not in models]
+            if unknown:
+                logger.warning(f"[LLM服务] 路由 {name} 引用了未定义的模型: {', '.join(unknown)}")
+            max_latency = spec.get('max_latency_seconds')
+            routes[name] = {
+                'models': [alias for alias in aliases if alias in models],
+                'max_latency_seconds': float(max_latency) if max_latency else None,
+            }
+        
+        return _RoutingTable(models, providers, routes)
+    
+    def _set_table(self, table: _RoutingTable):
+        self._table = table
+        self.llm_provider = table.providers.get(DEFAULT_MODEL_ALIAS)
+    
+    def reload_routes(self) -> Dict[str, Any]:
+        """重新读取 config.yml 的 llm 配置段并替换模型和路由表（热加载）
+        
+        只读取 llm 配置段，不修改其他服务共享的配置；调度器参数（llm.scheduler）需重启生效。
+        进行中的请求继续使用旧的路由表；新配置中没有可用模型时保留当前路由表。
+        
+        Returns:
+            新的路由统计（同 get_route_stats）
+            
+        Raises:
+            RuntimeError: 新配置中没有 LLM 配置或没有可用的模型
+        """
+        try:
+            llm_config = self.config.read_section('llm')
+        except Exception as e:
+            raise RuntimeError(f"读取 config.yml 失败，保留当前路由表: {e}") from e
+        if not llm_config:
+            raise RuntimeError("配置文件中未找到 LLM 配置，保留当前路由表")
+        table = self._build_routing_table(llm_config)
+        if not table.is_available():
+            raise RuntimeError("新配置中没有可用的模型，保留当前路由表")
+        self._set_table(table)
+        logger.info(f"[LLM服务] 路由表已重新加载，模型: {', '.join(table.models)}, "
+                    f"路由: {', '.join(table.routes) or '无'}")
+        return self.get_route_stats()
+    
+    def _resolve_route(self, route: Optional[str]) -> Tuple[str, List[Tuple[str, LiteLLMProvider, Dict[str, Any]]], Optional[float]]:
+        """解析路由
+        
+        Returns:
+            (路由名, 可用的候选模型 [(别名, 提供商, 模型配置)], 延迟上限)
+        """
+        table = self._table
+        name = route or DEFAULT_ROUTE
+        spec = table.routes.get(name) or table.routes.get(DEFAULT_ROUTE) \
+            or {'models': [DEFAULT_MODEL_ALIAS], 'max_latency_seconds': None}
+        candidates = [
+            (alias, table.providers[alias], table.models[alias])
+            for alias in spec['models']
+            if alias in table.providers and table.providers[alias].is_available()
+        ]
+        return name, candidates, spec['max_latency_seconds']
+    
+    def _stats_for(self, route: str) -> _RouteStats:
+        stats = self._route_stats.get(route)
+        if stats is None:
+            stats = self._route_stats[route] = _RouteStats()
+        return stats
+    
     def is_available(self) -> bool:
-        """检查 LLM 服务是否可用"""
-        return self.llm_provider is not None and self.llm_provider.is_available()
+        """检查 LLM 服务是否可用（至少一个模型可用）"""
+        return self._table.is_available()
     
     async def chat(
         self,
@@ -98,6 +262,8 @@ class LLMService:
             temperature: 温度参数（0-1），控制随机性
             max_tokens: 最大生成 token 数
             **kwargs: 其他参数
+                - priority: 调度优先级通道（interactive / normal / batch，默认使用 llm_priority() 设置的通道）
+                - route: 路由名（如 chat / translation / summary），未配置的路由使用默认路由
             
         Returns:
             如果 stream=True，返回 AsyncIterator[str]（流式生成）
@@ -119,6 +285,8 @@ class LLMService:
         
         try:
             # 准备参数
+            priority = kwargs.pop('priority', None)
+            route = kwargs.pop('route', None)
             params = {
                 'temperature': temperature,
                 **kwargs
@@ -127,46 +295,59 @@ class LLMService:
             if max_tokens is not None:
                 params['max_tokens'] = max_tokens
             
+            route_name, candidates, max_latency = self._resolve_route(route)
+            if not candidates:
+                raise RuntimeError(f"路由 {route_name} 没有可用的模型")
+            
             # 调用 LLM 提供商
-            logger.info(f"[LLM服务] 发送对话请求，消息数: {len(messages)}, 流式: {stream}")
+            logger.info(f"[LLM服务] 发送对话请求，路由: {route_name}, 模型: {candidates[0][0]}, "
+                        f"消息数: {len(messages)}, 流式: {stream}")
             sys_logger.log_llm_event("发送对话请求", 
                                      messages_count=len(messages), 
                                      stream=stream,
-                                     temperature=temperature)
+                                     temperature=temperature,
+                                     route=route_name)
             
-            result = await self.llm_provider.chat(messages, stream=stream, **params)
-            
-            return result
+            if stream:
+                return self._stream_route(route_name, candidates, max_latency, messages, params, priority)
+            return await self._chat_route(route_name, candidates, max_latency, messages, params, priority)
             
         except Exception as e:
             # 根据异常类型确定错误码
             error_type = type(e).__name__
             error_msg = str(e)
+            error_kind = classify_error(e)
             
-            if "rate" in error_msg.lower() or "limit" in error_msg.lower():
+            if error_kind == ERROR_RATE_LIMIT:
                 error_info = SystemErrorInfo(
                     SystemError.LLM_RATE_LIMIT,
                     details="请求频率超限",
                     technical_info=f"{error_type}: {error_msg}"
                 )
-            elif "auth" in error_msg.lower() or "401" in error_msg or "403" in error_msg:
+            elif error_kind == ERROR_AUTH:
                 error_info = SystemErrorInfo(
                     SystemError.LLM_AUTH_FAILED,
                     details="认证失败",
                     technical_info=f"{error_type}: {error_msg}"
                 )
-            elif "timeout" in error_msg.lower():
+            elif error_kind == ERROR_TIMEOUT:
                 error_info = SystemErrorInfo(
                     SystemError.LLM_REQUEST_TIMEOUT,
                     details="请求超时",
                     technical_info=f"{error_type}: {error_msg}"
                 )
-            elif "quota" in error_msg.lower() or "balance" in error_msg.lower():
+            elif error_kind == ERROR_QUOTA:
                 error_info = SystemErrorInfo(
                     SystemError.LLM_QUOTA_EXCEEDED,
                     details="配额已用完",
                     technical_info=f"{error_type}: {error_msg}"
                 )
+            elif error_kind == ERROR_CIRCUIT_OPEN:
+                error_info = SystemErrorInfo(
+                    SystemError.LLM_SERVICE_UNAVAILABLE,
+                    details="LLM 服务连续失败，暂停请求",
+                    technical_info=f"{error_type}: {error_msg}"
+                )
             else:
                 error_info = SystemErrorInfo(
                     SystemError.LLM_SERVICE_UNAVAILABLE,
@@ -178,6 +359,121 @@ class LLMService:
             logger.error(f"[LLM服务] 对话请求失败: {e}")
             raise
     
+    async def _chat_route(self, route: str, candidates: list, max_latency: Optional[float],
+                          messages: list, params: Dict[str, Any], priority: Optional[str]) -> str:
+        """按路由请求（非流式）"""
+        async def open_candidate(alias: str, provider: LiteLLMProvider, model_config: Dict[str, Any]) -> str:
+            # 经调度器发送（重试和对冲时会重新调用提供商）
+            return await self.scheduler.submit(
+                partial(provider.chat, messages, stream=False, **params),
+                model=model_config.get('model') or alias,
+                priority=priority
+            )
+        
+        return await self._race_route(route, candidates, max_latency, open_candidate)
+    
+    async def _stream_route(self, route: str, candidates: list, max_latency: Optional[float],
+                            messages: list, params: Dict[str, Any], priority: Optional[str]) -> AsyncIterator[str]:
+        """按路由请求（流式），以首个片段决定由哪个模型输出，开始输出后不再切换"""
+        async def open_candidate(alias: str, provider: LiteLLMProvider, model_config: Dict[str, Any]):
+            iterator = (await self.scheduler.submit(
+                partial(provider.chat, messages, stream=True, **params),
+                stream=True,
+                model=model_config.get('model') or alias,
+                priority=priority
+            )).__aiter__()
+            try:
+                return iterator, await iterator.__anext__()
+            except StopAsyncIteration:
+                return iterator, _EMPTY_STREAM
+            except BaseException:
+                await iterator.aclose()
+                raise
+        
+        async def close(opened):
+            await opened[0].aclose()
+        
+        iterator, first = await self._race_route(route, candidates, max_latency, open_candidate, discard=close)
+        try:
+            if first is _EMPTY_STREAM:
+                return
+            yield first
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            await iterator.aclose()
+    
+    async def _race_route(self, route: str, candidates: list, max_latency: Optional[float],
+                          open_candidate: Callable[..., Awaitable[Any]],
+                          discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Any:
+        """按路由顺序请求各模型
+        
+        模型出错时立即请求下一个模型；超过延迟上限仍未返回时保留该请求，同时请求下一个模型，
+        先成功者胜出，其余请求取消（取消时调度器归还并发槽位和熔断探测名额）。
+        
+        Args:
+            open_candidate: 协程函数 (别名, 提供商, 模型配置) -> 结果
+            discard: 释放落选但已成功的结果（流式请求关闭迭代器）
+        """
+        stats = self._stats_for(route)
+        stats.requests += 1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks: Dict[asyncio.Task, int] = {}
+        launched = 0
+        last_error: Optional[BaseException] = None
+        
+        def launch():
+            nonlocal launched
+            tasks[asyncio.ensure_future(open_candidate(*candidates[launched]))] = launched
+            launched += 1
+        
+        launch()
+        try:
+            while tasks:
+                # 还有备用模型时最多等待延迟上限（最后一个模型由调度器的时间预算兜底）
+                has_next = launched < len(candidates)
+                done, _ = await asyncio.wait(tasks, timeout=max_latency if has_next else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    stats.fallbacks += 1
+                    stats.latency_fallbacks += 1
+                    logger.warning(f"[LLM服务] 路由 {route} 超过 {max_latency} 秒未返回，"
+                                   f"同时请求 {candidates[launched][0]}")
+                    launch()
+                    continue
+                
+                finished = {task: tasks.pop(task) for task in done}
+                succeeded = sorted((index, task) for task, index in finished.items() if task.exception() is None)
+                for task, index in finished.items():
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        alias = candidates[index][0]
+                        kind = classify_error(last_error)
+                        stats.errors[alias][kind] += 1
+                        logger.warning(f"[LLM服务] 路由 {route} 的模型 {alias} 请求失败（{kind}）: {last_error}")
+                if succeeded:
+                    # 同时返回时优先路由中靠前的模型
+                    index, winner = succeeded[0]
+                    if discard is not None:
+                        for _, task in succeeded[1:]:
+                            await discard(task.result())
+                    alias = candidates[index][0]
+                    stats.succeeded += 1
+                    stats.served_by[alias] += 1
+                    stats.latencies.append(loop.time() - started)
+                    return winner.result()
+                if not tasks and launched < len(candidates):
+                    stats.fallbacks += 1
+                    launch()
+            stats.failed += 1
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+    
     async def simple_chat(
         self,
         user_message: str,
@@ -205,13 +501,18 @@ class LLMService:
         
         return await self.chat(messages, stream=stream, **kwargs)
     
-    def get_provider_info(self) -> Dict[str, Any]:
+    def get_provider_info(self, route: Optional[str] = None) -> Dict[str, Any]:
         """获取提供商信息
         
+        Args:
+            route: 路由名（为空时为默认路由）
+        
         Returns:
-            包含提供商信息的字典
+            包含提供商信息的字典：model 为路由首选模型；max_context_tokens 取路由内各模型的最小值，
+            保证切换模型后上下文仍然放得下
         """
-        if not self.llm_provider:
+        route_name, candidates, _ = self._resolve_route(route)
+        if not candidates:
             return {
                 "available": False,
                 "name": None,
@@ -219,12 +520,67 @@ class LLMService:
                 "provider": None
             }
         
-        llm_config = self.config.get('llm', {})
+        _, provider, model_config = candidates[0]
+        context_limits = [int(c[2]['max_context_tokens']) for c in candidates if c[2].get('max_context_tokens')]
         return {
             "available": self.is_available(),
-            "name": self.llm_provider.name,
-            "model": llm_config.get('model'),
-            "provider": llm_config.get('provider'),
-            "max_context_tokens": llm_config.get('max_context_tokens')
+            "name": provider.name,
+            "model": model_config.get('model'),
+            "provider": model_config.get('provider'),
+            "max_context_tokens": min(context_limits) if context_limits else None
+        }
+    
+    def get_route_model(self, route: Optional[str] = None) -> Optional[str]:
+        """获取路由首选模型名称（无可用模型时为 None）"""
+        _, candidates, _ = self._resolve_route(route)
+        return candidates[0][2].get('model') if candidates else None
+    
+    def get_route_stats(self) -> Dict[str, Any]:
+        """获取各路由的健康状态和延迟统计
+        
+        health：首选模型可用且未熔断为 healthy，仅备用模型可用为 degraded，全部不可用为 down
+        """
+        table = self._table
+        routes = {}
+        for name in list(dict.fromkeys([*table.routes, *self._route_stats])):
+            spec = table.routes.get(name) or table.routes.get(DEFAULT_ROUTE) \
+                or {'models': [DEFAULT_MODEL_ALIAS], 'max_latency_seconds': None}
+            models = {}
+            for alias in spec['models']:
+                model_config = table.models.get(alias, {})
+                provider = table.providers.get(alias)
+                model_name = model_config.get('model') or alias
+                circuit = self.scheduler.circuit_state(model_name)
+                models[alias] = {
+                    'model': model_config.get('model'),
+                    'available': provider is not None and provider.is_available(),
+                    'circuit': circuit,
+                    'healthy': provider is not None and provider.is_available() and circuit != 'open',
+                }
+            healthy = [alias for alias in spec['models'] if models[alias]['healthy']]
+            if healthy and healthy[0] == spec['models'][0]:
+                health = 'healthy'
+            elif healthy:
+                health = 'degraded'
+            else:
+                health = 'down'
+            
+            stats = self._route_stats.get(name) or _RouteStats()
+            routes[name] = {
+                'configured': name in table.routes,
+                'health': health,
+                'models': models,
+                'max_latency_seconds': spec['max_latency_seconds'],
+                'requests': stats.requests,
+                'succeeded': stats.succeeded,
+                'failed': stats.failed,
+                'fallbacks': stats.fallbacks,
+                'latency_fallbacks': stats.latency_fallbacks,
+                'served_by': dict(stats.served_by),
+                'errors': {alias: dict(kinds) for alias, kinds in stats.errors.items()},
+                'latency': summarize_samples(stats.latencies),
+            }
+        return {
+            'models': {alias: config.get('model') for alias, config in table.models.items()},
+            'routes': routes,
         }
-
@@ -21,6 +21,7 @@ from pathlib import Path
 from typing import Optional, Dict, Any, List
 from src.core.config import Config
 from src.core.logger import get_logger
+from src.services.quota_ledger import get_quota_ledger
 
 logger = get_logger("MembershipService")
 
@@ -78,6 +79,11 @@ class MembershipService:
         database_relative = Path(config.get('storage.database'))
         self.db_path = data_dir / database_relative
         
+        # 进程内共享的额度账本（额度检查走内存）
+        self.quota_ledger = get_quota_ledger(
+            self.db_path, config.get('membership.quota_ledger.flush_interval_seconds', 5)
+        )
+        
         logger.info(f"[会员服务] 初始化 (v1.2.1)，数据库: {self.db_path}")
     
     def _get_connection(self) -> sqlite3.Connection:
@@ -188,6 +194,7 @@ class MembershipService:
             
             conn.commit()
             
+            self._invalidate_membership_cache(user_id)
             logger.info(f"[会员服务] ✅ 会员已创建: user_id={user_id}, tier={tier}")
             
             return self.get_membership(user_id)
@@ -200,7 +207,10 @@ class MembershipService:
             conn.close()
     
     def get_membership(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """获取用户会员信息
+        """获取用户会员信息（纯读取，不写数据库）
+        
+        付费会员到期后由定时任务 sweep_expired_memberships 批量降级；
+        到期但尚未降级的会员按降级后的状态返回（免费会员，status 为 active），与定时任务写入的结果一致。
         
         Args:
             user_id: 用户ID
@@ -217,69 +227,105 @@ class MembershipService:
             ''', (user_id,))
             
             row = cursor.fetchone()
-            if not row:
-                return None
-            
-            # 检查会员是否过期
-            is_expired = False
-            days_remaining = None
-            
-            if row['expires_at']:
-                # 付费会员，检查过期时间
-                expires_at = datetime.strptime(row['expires_at'], '%Y-%m-%d %H:%M:%S')
-                now = datetime.now()
-                
-                if expires_at < now:
-                    is_expired = True
-                    # 自动降级到免费
-                    self._downgrade_to_free(user_id)
-                else:
-                    days_remaining = (expires_at - now).days
-            else:
-                # 免费会员，永久有效
-                is_expired = False
-                days_remaining = None
-            
-            # 获取额度配置
-            quota = MembershipQuota.QUOTAS.get(row['tier'], {})
-            
-            return {
-                'user_id': user_id,
-                'tier': row['tier'],
-                'status': MembershipStatus.EXPIRED if is_expired else row['status'],
-                'subscription_period': row['subscription_period'],
-                'activated_at': row['activated_at'],
-                'expires_at': row['expires_at'],
-                'permanent': row['expires_at'] is None,
-                'days_remaining': days_remaining,
-                'is_active': not is_expired and row['status'] == MembershipStatus.ACTIVE,
-                'quota': quota,
-                'auto_renew': bool(row['auto_renew']),
-                'created_at': row['created_at'],
-                'updated_at': row['updated_at']
-            }
-            
         finally:
             conn.close()
+        
+        if not row:
+            return None
+        
+        tier = row['tier']
+        status = row['status']
+        subscription_period = row['subscription_period']
+        expires_at = row['expires_at']
+        days_remaining = None
+        
+        if expires_at:
+            # 付费会员，检查过期时间
+            expires_at_time = datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S')
+            now = datetime.now()
+            
+            if expires_at_time < now:
+                # 已到期、等待定时降级：按降级后的免费会员返回（免费会员永久有效）；
+                # 定时任务只降级 active 会员，其他状态保持原样
+                if status == MembershipStatus.ACTIVE:
+                    tier = MembershipTier.FREE
+                    subscription_period = None
+                    expires_at = None
+            else:
+                days_remaining = (expires_at_time - now).days
+        
+        # 获取额度配置
+        quota = MembershipQuota.QUOTAS.get(tier, {})
+        
+        return {
+            'user_id': user_id,
+            'tier': tier,
+            'status': status,
+            'subscription_period': subscription_period,
+            'activated_at': row['activated_at'],
+            'expires_at': expires_at,
+            'permanent': expires_at is None,
+            'days_remaining': days_remaining,
+            'is_active': status == MembershipStatus.ACTIVE,
+            'quota': quota,
+            'auto_renew': bool(row['auto_renew']),
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+    
+    def _invalidate_membership_cache(self, user_id: str) -> None:
+        """会员信息变更后失效额度账本中缓存的会员信息"""
+        self.quota_ledger.invalidate_membership(user_id)
     
-    def _downgrade_to_free(self, user_id: str) -> None:
-        """自动降级到免费会员"""
+    def sweep_expired_memberships(self, limit: int = 1000) -> List[str]:
+        """批量降级已到期的付费会员（由定时任务调用）
+        
+        通过 idx_memberships_status(status, expires_at) 索引查找到期会员，
+        在一个写事务中完成查找与降级，避免与并发续费冲突。
+        
+        Args:
+            limit: 单次最多降级的会员数
+        
+        Returns:
+            已降级的用户ID列表
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
         conn = self._get_connection()
         cursor = conn.cursor()
         
         try:
-            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute('BEGIN IMMEDIATE')
             cursor.execute('''
-                UPDATE memberships
-                SET tier = ?, status = ?, expires_at = NULL, subscription_period = NULL, updated_at = ?
-                WHERE user_id = ?
-            ''', (MembershipTier.FREE, MembershipStatus.ACTIVE, now, user_id))
-            conn.commit()
-            
-            logger.info(f"[会员服务] 会员已过期，已自动降级到免费: user_id={user_id}")
+                SELECT user_id FROM memberships
+                WHERE status = ? AND expires_at IS NOT NULL AND expires_at < ?
+                LIMIT ?
+            ''', (MembershipStatus.ACTIVE, now, limit))
+            user_ids = [row['user_id'] for row in cursor.fetchall()]
+            
+            if user_ids:
+                placeholders = ', '.join('?' for _ in user_ids)
+                cursor.execute(f'''
+                    UPDATE memberships
+                    SET tier = ?, status = ?, expires_at = NULL, subscription_period = NULL, updated_at = ?
+                    WHERE user_id IN ({placeholders})
+                ''', (MembershipTier.FREE, MembershipStatus.ACTIVE, now, *user_ids))
             
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"[会员服务] 批量降级到期会员失败: {e}", exc_info=True)
+            raise
         finally:
             conn.close()
+        
+        for user_id in user_ids:
+            self._invalidate_membership_cache(user_id)
+        
+        if user_ids:
+            logger.info(f"[会员服务] 已将 {len(user_ids)} 个到期会员降级到免费")
+        
+        return user_ids
     
     def activate_membership(self, user_id: str, tier: str, months: int) -> Dict[str, Any]:
         """激活/升级会员
@@ -328,6 +374,7 @@ class MembershipService:
             ''', (tier, MembershipStatus.ACTIVE, months, now_str, expires_at_str, now_str, user_id))
             
             conn.commit()
+            self._invalidate_membership_cache(user_id)
             
             logger.info(f"[会员服务] ✅ 会员已激活: user_id={user_id}, {current['tier']} → {tier}, 有效期{months}个月")
             
@@ -353,32 +400,20 @@ class MembershipService:
         Returns:
             消费统计信息
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        # 用户维度的已用量和额度来自内存账本（按user_id汇总，不区分device_id）
+        usage = self.quota_ledger.get_usage(user_id, self.get_membership)
+        if not usage:
+            raise ValueError(f"会员信息不存在: {user_id}")
         
-        try:
-            year = datetime.now().year
-            month = datetime.now().month
-            
-            # 获取月度汇总（按user_id汇总，不区分device_id）
-            # device_id仅用于查询该设备的消费明细（从consumption_records表）
-            cursor.execute('''
-                SELECT * FROM monthly_consumption
-                WHERE user_id = ? AND year = ? AND month = ?
-            ''', (user_id, year, month))
-            
-            row = cursor.fetchone()
-            if not row:
-                # 没有记录
-                asr_used = 0
-                llm_used = 0
-            else:
-                asr_used = row['asr_duration_ms'] or 0
-                llm_used = row['llm_total_tokens'] or 0
-            
-            # 如果指定了device_id，查询该设备的消费明细（从consumption_records表）
-            device_detail = None
-            if device_id:
+        year = usage['year']
+        month = usage['month']
+        
+        # 如果指定了device_id，查询该设备的消费明细（从consumption_records表）
+        device_detail = None
+        if device_id:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            try:
                 cursor.execute('''
                     SELECT 
                         SUM(CASE WHEN type = 'asr' THEN amount ELSE 0 END) as asr_ms,
@@ -393,50 +428,42 @@ class MembershipService:
                         'asr_used_ms': int(detail_row[0] or 0),
                         'llm_used_tokens': int(detail_row[1] or 0)
                     }
-            
-            # 获取会员信息（获取额度限制）
-            membership = self.get_membership(user_id)
-            if not membership:
-                raise ValueError(f"会员信息不存在: {user_id}")
-            
-            quota = membership['quota']
-            asr_limit = quota.get('asr_duration_ms_monthly', 0)
-            llm_limit = quota.get('llm_tokens_monthly', 0)
-            
-            # 计算剩余额度
-            asr_remaining = max(0, asr_limit - asr_used)
-            llm_remaining = max(0, llm_limit - llm_used)
-            
-            # 计算使用百分比
-            asr_percentage = (asr_used / asr_limit * 100) if asr_limit > 0 else 0
-            llm_percentage = (llm_used / llm_limit * 100) if llm_limit > 0 else 0
-            
-            # 计算下次重置时间（下月1日00:00:00）
-            next_month = (datetime.now().replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            
-            return {
-                'user_id': user_id,
-                'device_id': device_id,
-                'year': year,
-                'month': month,
-                'asr': {
-                    'used': asr_used,
-                    'limit': asr_limit,
-                    'remaining': asr_remaining,
-                    'percentage': round(asr_percentage, 2)
-                },
-                'llm': {
-                    'used': llm_used,
-                    'limit': llm_limit,
-                    'remaining': llm_remaining,
-                    'percentage': round(llm_percentage, 2)
-                },
-                'is_active': membership['is_active'],
-                'reset_at': next_month.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-        finally:
-            conn.close()
+            finally:
+                conn.close()
+        
+        asr_used = usage['asr_used']
+        llm_used = usage['llm_used']
+        asr_limit = usage['asr_limit']
+        llm_limit = usage['llm_limit']
+        
+        # 计算剩余额度
+        asr_remaining = max(0, asr_limit - asr_used)
+        llm_remaining = max(0, llm_limit - llm_used)
+        
+        # 计算使用百分比
+        asr_percentage = (asr_used / asr_limit * 100) if asr_limit > 0 else 0
+        llm_percentage = (llm_used / llm_limit * 100) if llm_limit > 0 else 0
+        
+        return {
+            'user_id': user_id,
+            'device_id': device_id,
+            'year': year,
+            'month': month,
+            'asr': {
+                'used': asr_used,
+                'limit': asr_limit,
+                'remaining': asr_remaining,
+                'percentage': round(asr_percentage, 2)
+            },
+            'llm': {
+                'used': llm_used,
+                'limit': llm_limit,
+                'remaining': llm_remaining,
+                'percentage': round(llm_percentage, 2)
+            },
+            'is_active': usage['is_active'],
+            'reset_at': usage['reset_at']
+        }
     
     def check_quota(self, user_id: str, consumption_type: str, estimated_amount: int, model_source: str = 'vendor') -> Dict[str, Any]:
         """检查额度是否足够
@@ -454,33 +481,8 @@ class MembershipService:
         if consumption_type == 'llm' and model_source == 'user':
             return {'allowed': True, 'reason': '用户自备模型，不限额度'}
         
-        # 获取会员信息
-        membership = self.get_membership(user_id)
-        if not membership:
-            return {'allowed': False, 'reason': '会员信息不存在'}
-        
-        # 检查会员是否有效
-        if not membership['is_active']:
-            return {'allowed': False, 'reason': '会员已过期，请续费'}
-        
-        # 获取当前消费
-        consumption = self.get_current_consumption(user_id)
-        
-        # 检查额度
-        if consumption_type == 'asr':
-            if consumption['asr']['remaining'] < estimated_amount:
-                return {
-                    'allowed': False,
-                    'reason': f"ASR额度不足，剩余{consumption['asr']['remaining']}ms，需要{estimated_amount}ms"
-                }
-        elif consumption_type == 'llm':
-            if consumption['llm']['remaining'] < estimated_amount:
-                return {
-                    'allowed': False,
-                    'reason': f"LLM额度不足，剩余{consumption['llm']['remaining']}tokens，需要{estimated_amount}tokens"
-                }
-        
-        return {'allowed': True, 'reason': '额度充足'}
+        # 会员等级、额度和已用量均来自内存账本（首次访问时加载）
+        return self.quota_ledger.check(user_id, consumption_type, estimated_amount, self.get_membership)
     
     # ==================== 工具方法 ====================
     
@@ -0,0 +1,97 @@
+"""
+会员到期降级定时任务
+
+功能：
+- 按固定间隔批量降级已到期的付费会员（MembershipService.sweep_expired_memberships）
+- 启动时立即执行一次，补齐服务停机期间到期的会员
+- 降级在后台线程中执行，不阻塞事件循环
+
+会员信息读取（get_membership）不再写数据库，到期但尚未降级的会员按免费会员返回，
+因此降级时机只影响数据库中的会员状态，不影响额度检查。
+"""
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipExpirySweeper:
+    """会员到期降级定时任务"""
+
+    def __init__(self, membership_service, interval_minutes: float = 10, batch_size: int = 1000,
+                 enabled: bool = True):
+        """初始化定时任务
+
+        Args:
+            membership_service: 会员服务实例
+            interval_minutes: 执行间隔（分钟）
+            batch_size: 每批最多降级的会员数
+            enabled: 是否启用自动降级
+        """
+        self.membership_service = membership_service
+        self.interval_minutes = max(0.1, float(interval_minutes))
+        self.batch_size = max(1, int(batch_size))
+        self.enabled = enabled
+
+        # 运行状态
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+
+        logger.info(f"[会员降级] 定时任务已初始化 (间隔: {self.interval_minutes} 分钟)")
+
+    async def start(self):
+        """启动定时任务"""
+        if not self.enabled:
+            logger.info("[会员降级] 自动降级已禁用")
+            return
+
+        if self._running:
+            return
+
+        self._running = True
+        self._task = asyncio.create_task(self._sweep_loop())
+        logger.info(f"[会员降级] 定时任务已启动，每 {self.interval_minutes} 分钟执行一次")
+
+    async def stop(self):
+        """停止定时任务"""
+        if not self._running:
+            return
+
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info("[会员降级] 定时任务已停止")
+
+    async def _sweep_loop(self):
+        """定时降级循环"""
+        try:
+            while self._running:
+                await self.sweep()
+                await asyncio.sleep(self.interval_minutes * 60)
+        except asyncio.CancelledError:
+            logger.info("[会员降级] 定时任务已取消")
+
+    async def sweep(self) -> int:
+        """降级全部已到期的会员
+
+        Returns:
+            降级的会员数
+        """
+        total = 0
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                user_ids = await loop.run_in_executor(
+                    None, self.membership_service.sweep_expired_memberships, self.batch_size
+                )
+                total += len(user_ids)
+                if len(user_ids) < self.batch_size:
+                    break
+        except Exception as e:
+            logger.error(f"[会员降级] 降级到期会员失败: {e}", exc_info=True)
+        return total
@@ -0,0 +1,394 @@
+"""
+额度账本模块
+
+功能：
+- 在内存中按用户维护会员等级、额度上限、本月已用量和重置时间
+- 额度检查直接读取内存账本，不再访问数据库
+- 消费事件入队时同步更新账本（加锁保证原子性）
+- 后台线程定期将变更写回 monthly_consumption（write-behind）
+- 进程内按数据库路径共享同一个账本实例（多个服务实例共用）
+
+账本首次加载某用户时，已用量从 consumption_records 明细汇总（按 user_id, year, month 索引），
+写回 monthly_consumption 时写入绝对值，因此即使进程异常退出丢失未写回的数据，
+下次加载也会自动修正月度汇总。
+"""
+
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from src.core.logger import get_logger
+
+logger = get_logger("QuotaLedger")
+
+# 会员信息加载函数（通常为 MembershipService.get_membership）
+MembershipLoader = Callable[[str], Optional[Dict[str, Any]]]
+
+
+def _next_reset_at(year: int, month: int) -> datetime:
+    """计算额度重置时间（下月1日00:00:00）"""
+    if month == 12:
+        return datetime(year + 1, 1, 1)
+    return datetime(year, month + 1, 1)
+
+
+class _LedgerEntry:
+    """单个用户的账本条目"""
+
+    __slots__ = (
+        'user_id', 'year', 'month',
+        'asr_used_ms', 'llm_prompt_tokens', 'llm_completion_tokens', 'llm_total_tokens', 'record_count',
+        'dirty', 'membership', 'membership_expires_at',
+    )
+
+    def __init__(self, user_id: str, year: int, month: int):
+        self.user_id = user_id
+        self.year = year
+        self.month = month
+        self.asr_used_ms = 0
+        self.llm_prompt_tokens = 0
+        self.llm_completion_tokens = 0
+        self.llm_total_tokens = 0
+        self.record_count = 0
+        self.dirty = False
+        # 会员信息（tier / is_active / quota），按需加载
+        self.membership: Optional[Dict[str, Any]] = None
+        self.membership_expires_at: Optional[datetime] = None
+
+
+class QuotaLedger:
+    """内存额度账本（线程安全）"""
+
+    def __init__(self, db_path: str, flush_interval: float = 5.0):
+        """初始化额度账本
+
+        Args:
+            db_path: 数据库文件路径
+            flush_interval: 写回 monthly_consumption 的间隔（秒）
+        """
+        self.db_path = Path(db_path)
+        self.flush_interval = max(0.5, float(flush_interval))
+
+        self._entries: Dict[str, _LedgerEntry] = {}
+        self._lock = threading.RLock()
+
+        self._flush_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+        # 尚未落盘的消费事件来源（消费事件队列），加载用量时一并计入
+        self.pending_source = None
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """获取数据库连接"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    # ==================== 条目加载 ====================
+
+    def _load_usage(self, entry: _LedgerEntry):
+        """从消费明细汇总本月已用量（仅平台额度：ASR 与 vendor LLM）"""
+        source = self.pending_source
+        if source is None:
+            self._load_committed_usage(entry)
+            return
+
+        # 与消费事件队列的批量写入互斥，避免同一事件被重复或遗漏计入
+        with source.commit_lock:
+            self._load_committed_usage(entry)
+            pending = source.pending_usage(entry.user_id, entry.year, entry.month)
+        entry.asr_used_ms += pending['asr_ms']
+        entry.llm_prompt_tokens += pending['prompt_tokens']
+        entry.llm_completion_tokens += pending['completion_tokens']
+        entry.llm_total_tokens += pending['total_tokens']
+        entry.record_count += pending['record_count']
+
+    def _load_committed_usage(self, entry: _LedgerEntry):
+        """从已写入数据库的消费明细汇总本月已用量"""
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT
+                    SUM(CASE WHEN type = 'asr' THEN amount ELSE 0 END) AS asr_ms,
+                    SUM(CASE WHEN type = 'llm' THEN json_extract(details, '$.prompt_tokens') ELSE 0 END) AS prompt_tokens,
+                    SUM(CASE WHEN type = 'llm' THEN json_extract(details, '$.completion_tokens') ELSE 0 END) AS completion_tokens,
+                    SUM(CASE WHEN type = 'llm' THEN amount ELSE 0 END) AS total_tokens,
+                    COUNT(*) AS record_count
+                FROM consumption_records
+                WHERE user_id = ? AND year = ? AND month = ?
+                  AND (type = 'asr' OR model_source = 'vendor')
+            ''', (entry.user_id, entry.year, entry.month))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+
+        entry.asr_used_ms = int(row['asr_ms'] or 0)
+        entry.llm_prompt_tokens = int(row['prompt_tokens'] or 0)
+        entry.llm_completion_tokens = int(row['completion_tokens'] or 0)
+        entry.llm_total_tokens = int(row['total_tokens'] or 0)
+        entry.record_count = int(row['record_count'] or 0)
+
+    def _get_entry(self, user_id: str) -> _LedgerEntry:
+        """获取用户条目（不存在或跨月时重新加载，调用方需持有锁）"""
+        now = datetime.now()
+        entry = self._entries.get(user_id)
+
+        if entry is not None and (entry.year, entry.month) != (now.year, now.month):
+            # 跨月：先写回上月数据，再重新开始计数
+            if entry.dirty:
+                self._flush_entries([entry])
+            entry = None
+
+        if entry is None:
+            entry = _LedgerEntry(user_id, now.year, now.month)
+            self._load_usage(entry)
+            self._entries[user_id] = entry
+
+        return entry
+
+    def _ensure_membership(self, entry: _LedgerEntry, loader: MembershipLoader) -> Optional[Dict[str, Any]]:
+        """确保条目中已加载会员信息（会员到期时重新加载）"""
+        if entry.membership is not None and entry.membership_expires_at is not None:
+            if entry.membership_expires_at <= datetime.now():
+                entry.membership = None
+
+        if entry.membership is None:
+            membership = loader(entry.user_id)
+            if not membership:
+                return None
+            entry.membership = {
+                'tier': membership['tier'],
+                'is_active': membership['is_active'],
+                'quota': dict(membership.get('quota') or {}),
+            }
+            expires_at = membership.get('expires_at')
+            entry.membership_expires_at = (
+                datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S') if expires_at else None
+            )
+            # 未生效的会员（如 pending）不缓存，下次访问重新加载
+            if not membership['is_active']:
+                membership_snapshot = entry.membership
+                entry.membership = None
+                return membership_snapshot
+
+        return entry.membership
+
+    # ==================== 查询 ====================
+
+    def get_usage(self, user_id: str, loader: MembershipLoader) -> Optional[Dict[str, Any]]:
+        """获取用户本月额度使用情况
+
+        Args:
+            user_id: 用户ID
+            loader: 会员信息加载函数
+
+        Returns:
+            额度快照，会员不存在时返回 None
+        """
+        with self._lock:
+            entry = self._get_entry(user_id)
+            membership = self._ensure_membership(entry, loader)
+            if membership is None:
+                return None
+
+            quota = membership['quota']
+            return {
+                'user_id': user_id,
+                'year': entry.year,
+                'month': entry.month,
+                'tier': membership['tier'],
+                'is_active': membership['is_active'],
+                'asr_used': entry.asr_used_ms,
+                'asr_limit': quota.get('asr_duration_ms_monthly', 0),
+                'llm_used': entry.llm_total_tokens,
+                'llm_limit': quota.get('llm_tokens_monthly', 0),
+                'reset_at': _next_reset_at(entry.year, entry.month).strftime('%Y-%m-%d %H:%M:%S'),
+            }
+
+    def check(self, user_id: str, consumption_type: str, estimated_amount: int,
+              loader: MembershipLoader) -> Dict[str, Any]:
+        """检查额度是否足够（内存查找）
+
+        Args:
+            user_id: 用户ID
+            consumption_type: 消费类型（'asr'或'llm'）
+            estimated_amount: 预估消费量
+            loader: 会员信息加载函数
+
+        Returns:
+            检查结果 {'allowed': bool, 'reason': str}
+        """
+        usage = self.get_usage(user_id, loader)
+        if usage is None:
+            return {'allowed': False, 'reason': '会员信息不存在'}
+
+        if not usage['is_active']:
+            return {'allowed': False, 'reason': '会员已过期，请续费'}
+
+        if consumption_type == 'asr':
+            remaining = max(0, usage['asr_limit'] - usage['asr_used'])
+            if remaining < estimated_amount:
+                return {
+                    'allowed': False,
+                    'reason': f"ASR额度不足，剩余{remaining}ms，需要{estimated_amount}ms"
+                }
+        elif consumption_type == 'llm':
+            remaining = max(0, usage['llm_limit'] - usage['llm_used'])
+            if remaining < estimated_amount:
+                return {
+                    'allowed': False,
+                    'reason': f"LLM额度不足，剩余{remaining}tokens，需要{estimated_amount}tokens"
+                }
+
+        return {'allowed': True, 'reason': '额度充足'}
+
+    # ==================== 更新 ====================
+
+    def add_asr(self, user_id: str, duration_ms: int):
+        """累加ASR用量（在消费事件入队之前调用，入队失败时用负数回滚）"""
+        with self._lock:
+            entry = self._get_entry(user_id)
+            entry.asr_used_ms += duration_ms
+            entry.record_count += 1 if duration_ms >= 0 else -1
+            entry.dirty = True
+        self._ensure_flush_thread()
+
+    def add_llm(self, user_id: str, prompt_tokens: int, completion_tokens: int, total_tokens: int):
+        """累加平台LLM用量（在消费事件入队之前调用，入队失败时用负数回滚）"""
+        with self._lock:
+            entry = self._get_entry(user_id)
+            entry.llm_prompt_tokens += prompt_tokens
+            entry.llm_completion_tokens += completion_tokens
+            entry.llm_total_tokens += total_tokens
+            entry.record_count += 1 if total_tokens >= 0 else -1
+            entry.dirty = True
+        self._ensure_flush_thread()
+
+    def invalidate_membership(self, user_id: str):
+        """会员信息变更后使缓存的等级/额度失效（已用量保留）"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry.membership = None
+                entry.membership_expires_at = None
+
+    def forget(self, user_id: str):
+        """移除用户条目（先写回未保存的数据）"""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None and entry.dirty:
+                self._flush_entries([entry])
+
+    # ==================== 写回 ====================
+
+    def flush(self) -> int:
+        """将有变更的条目写回 monthly_consumption
+
+        Returns:
+            写回的条目数
+        """
+        with self._lock:
+            dirty = [entry for entry in self._entries.values() if entry.dirty]
+            if not dirty:
+                return 0
+            self._flush_entries(dirty)
+            return len(dirty)
+
+    def _flush_entries(self, entries):
+        """写回指定条目（调用方需持有锁）"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn = self._get_connection()
+        try:
+            conn.executemany('''
+                INSERT INTO monthly_consumption
+                (user_id, year, month, asr_duration_ms, llm_prompt_tokens, llm_completion_tokens,
+                 llm_total_tokens, record_count, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, year, month) DO UPDATE SET
+                    asr_duration_ms = excluded.asr_duration_ms,
+                    llm_prompt_tokens = excluded.llm_prompt_tokens,
+                    llm_completion_tokens = excluded.llm_completion_tokens,
+                    llm_total_tokens = excluded.llm_total_tokens,
+                    record_count = excluded.record_count,
+                    updated_at = excluded.updated_at
+            ''', [
+                (e.user_id, e.year, e.month, e.asr_used_ms, e.llm_prompt_tokens, e.llm_completion_tokens,
+                 e.llm_total_tokens, e.record_count, now, now)
+                for e in entries
+            ])
+            conn.commit()
+            for entry in entries:
+                entry.dirty = False
+            logger.debug(f"[额度账本] 已写回 {len(entries)} 个用户的月度汇总")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"[额度账本] 写回月度汇总失败: {e}", exc_info=True)
+        finally:
+            conn.close()
+
+    def _ensure_flush_thread(self):
+        """按需启动后台写回线程"""
+        if self._flush_thread is not None and self._flush_thread.is_alive():
+            return
+        with self._lock:
+            if self._flush_thread is not None and self._flush_thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._flush_thread = threading.Thread(
+                target=self._flush_loop, name="QuotaLedgerFlush", daemon=True
+            )
+            self._flush_thread.start()
+
+    def _flush_loop(self):
+        """后台写回循环"""
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[额度账本] 后台写回异常: {e}", exc_info=True)
+
+    def close(self):
+        """停止后台线程并写回所有变更"""
+        self._stop_event.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout=self.flush_interval + 1)
+            self._flush_thread = None
+        self.flush()
+
+
+# ==================== 进程内共享实例 ====================
+
+_ledgers: Dict[str, QuotaLedger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_quota_ledger(db_path, flush_interval: float = 5.0) -> QuotaLedger:
+    """获取指定数据库的共享额度账本
+
+    Args:
+        db_path: 数据库文件路径
+        flush_interval: 写回间隔（秒），仅在首次创建时生效
+
+    Returns:
+        额度账本实例
+    """
+    key = str(Path(db_path).expanduser().resolve())
+    with _ledgers_lock:
+        ledger = _ledgers.get(key)
+        if ledger is None:
+            ledger = QuotaLedger(key, flush_interval=flush_interval)
+            _ledgers[key] = ledger
+        return ledger
+
+
+def close_quota_ledgers():
+    """写回并关闭所有额度账本（应用退出时调用）"""
+    with _ledgers_lock:
+        ledgers = list(_ledgers.values())
+    for ledger in ledgers:
+        ledger.close()
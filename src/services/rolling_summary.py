@@ -0,0 +1,404 @@
+"""
+录音过程中的滚动小结
+
+功能：
+- 每个录音会话维护一份滚动小结：每积累 N 条确定的 utterance，通过增量提示词并入已有小结
+- 进行中的会话按设备区分，多台设备同时录音互不影响，用量记到会话所属设备
+- 会话的中间状态（已并入的小结和语句指纹、尚未并入的语句）持久化到 rolling_summaries 表
+- 录音结束时把剩余语句并入小结；生成小结时只需处理不足 N 条的尾部，几乎立即返回
+- 复用前核对请求的内容与会话语句一致（用户编辑过的内容改为完整生成）
+- 同一会话的增量更新串行执行，失败的批次保留在待并入队列中，下次重试
+
+ASR 回调可能来自其他线程，增量任务统一调度到服务启动时的事件循环上执行。
+"""
+import asyncio
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from src.agents.summary_agent import SummaryAgent
+from src.providers.llm.scheduler import PRIORITY_BATCH, llm_priority
+from src.providers.llm.usage import LLMUsage, usage_scope
+from src.providers.storage.rolling_summary_store import RollingSummaryStore
+
+logger = logging.getLogger(__name__)
+
+# 内存中保留的会话数上限（更早的会话从数据库按需加载）
+_MAX_SESSIONS = 16
+
+# 每个会话记录的已并入 utterance 开始时间数上限（用于忽略已并入语句的二遍修正）
+_MAX_FOLDED_KEYS = 1024
+
+# 复用小结时会话语句至少覆盖请求内容的比例（不含空白）
+_MIN_COVERAGE = 0.9
+
+# 每个会话保留的已并入语句指纹数上限（超出时相邻指纹两两合并）
+_MAX_COVERAGE_ENTRIES = 512
+
+# 语句指纹使用的多项式哈希参数
+_HASH_MOD = (1 << 61) - 1
+_HASH_BASE = 1_000_003
+
+
+def _fingerprint(text: str) -> List[int]:
+    """语句的指纹 [哈希, 长度]（不含空白）"""
+    text = ''.join(text.split())
+    value = 0
+    for char in text:
+        value = (value * _HASH_BASE + ord(char)) % _HASH_MOD
+    return [value, len(text)]
+
+
+def _compact(coverage: List[List[int]]) -> List[List[int]]:
+    """相邻指纹两两合并为拼接后文本的指纹，直到不超过上限
+
+    合并后的两句需要在内容中相邻出现（不含空白），核对只会更严格。
+    """
+    while len(coverage) > _MAX_COVERAGE_ENTRIES:
+        merged = []
+        for i in range(0, len(coverage) - 1, 2):
+            (first, first_len), (second, second_len) = coverage[i], coverage[i + 1]
+            merged.append([(first * pow(_HASH_BASE, second_len, _HASH_MOD) + second) % _HASH_MOD,
+                           first_len + second_len])
+        if len(coverage) % 2:
+            merged.append(coverage[-1])
+        coverage = merged
+    return coverage
+
+
+class _Session:
+    """单个录音会话的滚动小结状态"""
+
+    def __init__(self, session_id: str, summary_type: str, app_id: Optional[str] = None,
+                 device_id: Optional[str] = None):
+        self.session_id = session_id
+        self.summary_type = summary_type
+        self.app_id = app_id
+        self.device_id = device_id
+        self.summary: Optional[str] = None
+        self.folded_count = 0
+        # 已并入小结的语句指纹（按并入顺序），用于核对请求内容
+        self.folded_coverage: List[List[int]] = []
+        self.is_closed = False
+        # utterance 键（开始时间）→ 文本，按到达顺序
+        self.pending: "OrderedDict[Any, str]" = OrderedDict()
+        self.folded_keys: "OrderedDict[Any, None]" = OrderedDict()
+        self.lock: Optional[asyncio.Lock] = None
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'app_id': self.app_id,
+            'device_id': self.device_id,
+            'summary_type': self.summary_type,
+            'summary': self.summary,
+            'folded_count': self.folded_count,
+            'folded_coverage': [list(entry) for entry in self.folded_coverage],
+            'pending': [[key, text] for key, text in self.pending.items()],
+            'is_closed': self.is_closed,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> '_Session':
+        session = cls(state['session_id'], state['summary_type'], state.get('app_id'), state.get('device_id'))
+        session.summary = state.get('summary')
+        session.folded_count = state.get('folded_count', 0)
+        # 早期版本保存的是已并入的语句原文
+        session.folded_coverage = _compact(
+            [list(entry) for entry in state.get('folded_coverage') or []]
+            or [_fingerprint(text) for text in state.get('folded_texts') or []]
+        )
+        session.is_closed = state.get('is_closed', False)
+        session.pending = OrderedDict((key, text) for key, text in state.get('pending', []))
+        return session
+
+
+class RollingSummaryService:
+    """滚动小结服务"""
+
+    def __init__(self, llm_service, store: RollingSummaryStore, summary_type: str = 'meeting',
+                 fold_every: int = 8, enabled: bool = False,
+                 on_usage: Optional[Callable[[Optional[str], LLMUsage], None]] = None):
+        """初始化滚动小结服务
+
+        Args:
+            llm_service: LLM服务实例
+            store: 会话状态存储
+            summary_type: 小结场景（与 /api/summary/generate 的 summary_type 一致时才复用）
+            fold_every: 每积累多少条确定的 utterance 更新一次小结
+            enabled: 是否默认开启
+            on_usage: 每次增量更新后的用量回调 (device_id, usage)，device_id 为会话所属设备
+        """
+        self.llm_service = llm_service
+        self.store = store
+        self.summary_type = summary_type
+        self.fold_every = max(1, int(fold_every))
+        self.enabled = enabled
+        self.on_usage = on_usage
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._agents: Dict[str, SummaryAgent] = {}
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        # 设备ID → 进行中的会话（未知设备使用 None）
+        self._active: Dict[Optional[str], _Session] = {}
+        self._counter = 0
+        self._futures = set()
+
+        self.folds = 0
+        self.failed = 0
+
+    async def start(self):
+        """绑定当前事件循环（在服务启动时调用）"""
+        self._loop = asyncio.get_running_loop()
+        logger.info(f"[滚动小结] 已启动 (场景: {self.summary_type}, 每 {self.fold_every} 句更新, "
+                    f"开启: {self.enabled})")
+
+    async def stop(self):
+        """停止服务（会话状态已持久化）"""
+        self._loop = None
+        for future in list(self._futures):
+            future.cancel()
+        self._futures.clear()
+        logger.info("[滚动小结] 已停止")
+
+    def configure(self, enabled: bool, summary_type: Optional[str] = None,
+                  fold_every: Optional[int] = None, device_id: Optional[str] = None):
+        """开启或关闭滚动小结
+
+        Args:
+            enabled: 是否开启
+            summary_type: 小结场景（可选，只影响之后开始的会话）
+            fold_every: 每积累多少条 utterance 更新一次（可选）
+            device_id: 设备ID（关闭时只结束该设备进行中的会话，不传则结束全部会话）
+        """
+        if summary_type:
+            self.summary_type = summary_type
+        if fold_every:
+            self.fold_every = max(1, int(fold_every))
+        self.enabled = enabled
+        if not enabled:
+            if device_id:
+                self.end_session(device_id)
+            else:
+                with self._lock:
+                    device_ids = list(self._active)
+                for active_device in device_ids:
+                    self.end_session(active_device)
+        logger.info(f"[滚动小结] {'开启' if enabled else '关闭'}，场景: {self.summary_type}")
+
+    def _get_agent(self, summary_type: str) -> SummaryAgent:
+        agent = self._agents.get(summary_type)
+        if agent is None:
+            agent = SummaryAgent(self.llm_service, config={'prompt_variant': summary_type})
+            self._agents[summary_type] = agent
+        return agent
+
+    def _remember(self, session: _Session):
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > _MAX_SESSIONS:
+            self._sessions.popitem(last=False)
+
+    def _schedule(self, session: _Session, final: bool = False):
+        loop = self._loop
+        if loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._fold(session, final=final), loop)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def submit(self, text: str, time_info: Optional[dict] = None, app_id: Optional[str] = None,
+               device_id: Optional[str] = None) -> Optional[str]:
+        """提交一条确定的 utterance（可在任意线程调用）
+
+        Args:
+            text: utterance 文本
+            time_info: ASR 时间信息（start_time 用于识别同一句的二遍修正）
+            app_id: 应用ID
+            device_id: 录音设备ID（每台设备一个进行中的会话，用于消费记录）
+
+        Returns:
+            会话ID（未开启时返回 None）
+        """
+        if not self.enabled or self._loop is None or not text or not text.strip():
+            return None
+
+        start_time = (time_info or {}).get('start_time')
+        with self._lock:
+            session = self._active.get(device_id)
+            if session is None:
+                session = _Session(f"sum-{uuid.uuid4().hex[:12]}", self.summary_type, app_id, device_id)
+                self._active[device_id] = session
+                self._remember(session)
+                logger.info(f"[滚动小结] 新会话: {session.session_id}")
+
+            self._counter += 1
+            key = start_time if start_time is not None else f"#{self._counter}"
+            if key in session.folded_keys:
+                # 已并入小结的语句被二遍识别修正，不再重复并入
+                return session.session_id
+            session.pending[key] = text.strip()
+            should_fold = len(session.pending) >= self.fold_every
+
+        if should_fold:
+            self._schedule(session)
+        return session.session_id
+
+    def end_session(self, device_id: Optional[str] = None) -> Optional[str]:
+        """结束设备进行中的会话（录音停止时调用），剩余语句在后台并入小结
+
+        Args:
+            device_id: 录音设备ID
+
+        Returns:
+            结束的会话ID（没有进行中的会话时返回 None）
+        """
+        with self._lock:
+            session = self._active.pop(device_id, None)
+            if session is None:
+                return None
+            session.is_closed = True
+        self._schedule(session, final=True)
+        logger.info(f"[滚动小结] 会话结束: {session.session_id}, 待并入 {len(session.pending)} 句")
+        return session.session_id
+
+    def _take_batch(self, session: _Session, final: bool) -> List[tuple]:
+        with self._lock:
+            if not session.pending or (len(session.pending) < self.fold_every and not final):
+                return []
+            items = list(session.pending.items())
+            return items if final else items[:self.fold_every]
+
+    async def _fold(self, session: _Session, final: bool = False):
+        """把待并入的语句分批并入小结（同一会话串行执行）"""
+        if session.lock is None:
+            session.lock = asyncio.Lock()
+
+        async with session.lock:
+            while True:
+                batch = self._take_batch(session, final)
+                if not batch:
+                    break
+
+                try:
+                    with usage_scope() as usage, llm_priority(PRIORITY_BATCH):
+                        summary = await self._get_agent(session.summary_type).fold_utterances(
+                            session.summary, [text for _, text in batch]
+                        )
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"[滚动小结] 增量更新失败: {session.session_id}, 错误: {e}")
+                    break
+
+                if self.on_usage:
+                    self.on_usage(session.device_id, usage)
+
+                with self._lock:
+                    session.summary = summary
+                    for key, text in batch:
+                        # 并入期间被修正的语句保留在队列中，下次并入修正后的文本
+                        if session.pending.get(key) != text:
+                            continue
+                        del session.pending[key]
+                        session.folded_count += 1
+                        session.folded_keys[key] = None
+                        session.folded_coverage.append(_fingerprint(text))
+                    session.folded_coverage = _compact(session.folded_coverage)
+                    while len(session.folded_keys) > _MAX_FOLDED_KEYS:
+                        session.folded_keys.popitem(last=False)
+                self.folds += 1
+                self._save(session)
+
+            if final:
+                self._save(session)
+
+    def _save(self, session: _Session):
+        with self._lock:
+            state = session.to_state()
+        try:
+            self.store.save(state)
+        except Exception as e:
+            logger.error(f"[滚动小结] 保存会话状态失败: {session.session_id}, 错误: {e}")
+
+    async def get_summary(self, session_id: str, summary_type: str,
+                          content: Optional[str] = None) -> Optional[str]:
+        """获取会话的完整小结（先把剩余语句并入）
+
+        Args:
+            session_id: 会话ID
+            summary_type: 请求的小结场景（与会话场景不一致时不复用）
+            content: 请求小结的内容（可选，传入时核对会话语句与内容一致）
+
+        Returns:
+            小结内容；会话不存在、场景或内容不一致、仍有语句未能并入时返回 None（调用方应改为完整生成）
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            state = self.store.load(session_id)
+            if state is None:
+                return None
+            session = _Session.from_state(state)
+            with self._lock:
+                session = self._sessions.setdefault(session_id, session)
+
+        if session.summary_type != summary_type:
+            logger.info(f"[滚动小结] 场景不一致，不复用: {session.summary_type} != {summary_type}")
+            return None
+
+        await self._fold(session, final=True)
+        if session.pending or not session.summary:
+            return None
+        if content is not None and not self._matches(session, content):
+            logger.info(f"[滚动小结] 内容与会话语句不一致，不复用: {session.session_id}")
+            return None
+        return session.summary
+
+    def _matches(self, session: _Session, content: str) -> bool:
+        """会话语句按顺序出现在内容中，且覆盖内容的绝大部分（用户编辑或补充过的内容不复用）"""
+        try:
+            content = self._get_agent(session.summary_type).preprocess_input(content)
+        except ValueError:
+            return False
+        target = ''.join(content.split())
+        with self._lock:
+            coverage = list(session.folded_coverage)
+        # 内容前缀哈希，任意片段的哈希 O(1) 得到
+        prefix = [0]
+        for char in target:
+            prefix.append((prefix[-1] * _HASH_BASE + ord(char)) % _HASH_MOD)
+        position = matched = 0
+        for value, length in coverage:
+            scale = pow(_HASH_BASE, length, _HASH_MOD)
+            index = position
+            while index + length <= len(target) and \
+                    (prefix[index + length] - prefix[index] * scale) % _HASH_MOD != value:
+                index += 1
+            if index + length > len(target):
+                return False
+            position = index + length
+            matched += length
+        return bool(target) and matched >= len(target) * _MIN_COVERAGE
+
+    def get_stats(self, device_id: Optional[str] = None) -> Dict[str, Any]:
+        """获取运行状态
+
+        Args:
+            device_id: 设备ID（返回该设备进行中的会话）
+        """
+        with self._lock:
+            active = self._active.get(device_id)
+            return {
+                'enabled': self.enabled,
+                'summary_type': self.summary_type,
+                'fold_every': self.fold_every,
+                'active_sessions': len(self._active),
+                'active_session_id': active.session_id if active else None,
+                'pending': len(active.pending) if active else 0,
+                'folded': active.folded_count if active else 0,
+                'folds': self.folds,
+                'failed': self.failed,
+            }
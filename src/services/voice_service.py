@@ -109,9 +109,7 @@ class VoiceService:
             user_id = None
             if self.user_storage:
                 try:
-                    user_info = self.user_storage.get_user_by_device(self._device_id)
-                    if user_info:
-                        user_id = user_info['user_id']
+                    user_id = self.user_storage.get_user_id_by_device(self._device_id)
                 except Exception as e:
                     logger.error(f"[语音服务] 获取user_id失败: {e}", exc_info=True)
             
@@ -160,9 +158,7 @@ class VoiceService:
             user_id = None
             if self.user_storage and self._device_id:
                 try:
-                    user_info = self.user_storage.get_user_by_device(self._device_id)
-                    if user_info:
-                        user_id = user_info['user_id']
+                    user_id = self.user_storage.get_user_id_by_device(self._device_id)
                 except Exception as e:
                     logger.error(f"[语音服务] 获取user_id失败: {e}", exc_info=True)
             
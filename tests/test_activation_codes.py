@@ -0,0 +1,98 @@
+"""
+测试激活码批量生成与兑换
+
+测试场景：
+1. 按批次批量生成激活码并写入数据库
+2. 并发兑换同一激活码时只有一个成功
+3. 批次兑换状态汇总与导出
+4. 导入早期版本 CSV 中的激活码后可兑换，已在黑名单中的保持已使用
+"""
+import json
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.sqlite import SQLiteStorageProvider
+from src.services.activation_service import ActivationService
+
+
+class _Config:
+    def __init__(self, data_dir):
+        self._values = {
+            'storage.data_dir': str(data_dir),
+            'storage.database': 'database/test.db',
+        }
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+
+@pytest.fixture
+def service(tmp_path):
+    SQLiteStorageProvider().initialize({'data_dir': str(tmp_path), 'database': 'database/test.db'})
+    return ActivationService(_Config(tmp_path))
+
+
+class TestActivationCodes:
+    """激活码服务测试"""
+
+    def test_generate_batch(self, service):
+        batch = service.generate_batch('pro', 3, 50, batch_id='batch-1')
+
+        assert batch['batch_id'] == 'batch-1'
+        assert len(set(batch['codes'])) == 50
+        assert service.validate_code(batch['codes'][0]) == {'valid': True, 'tier': 'pro', 'months': 3}
+        assert not service.validate_code('PRO-3-AAAA-AAAA')['valid']
+
+        with pytest.raises(ValueError):
+            service.generate_batch('free', 1, 1)
+
+    def test_concurrent_redeem_single_winner(self, service):
+        code = service.generate_batch('vip', 1, 1)['codes'][0]
+        results = []
+        threads = [
+            threading.Thread(target=lambda i=i: results.append(service.redeem_code(code, f'user-{i}')))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sum(1 for result in results if result['valid']) == 1
+        assert service.is_code_used(code)
+        assert not service.validate_code(code)['valid']
+
+    def test_batch_status_and_export(self, service):
+        codes = service.generate_batch('vip', 6, 5, batch_id='batch-2')['codes']
+        service.redeem_code(codes[0], 'user-1', 'dev-1')
+        service.redeem_code(codes[1], 'user-2')
+        assert service.release_code(codes[1], 'user-2')
+
+        status = service.get_batch_status('batch-2')
+        assert (status['total'], status['used'], status['available']) == (5, 1, 4)
+        assert service.get_batch_status('missing') is None
+
+        lines = b''.join(service.export_batch_csv('batch-2')).decode('utf-8-sig').splitlines()
+        assert len(lines) == 6
+        assert lines[1].startswith(codes[0]) and 'user-1' in lines[1] and '已使用' in lines[1]
+
+    def test_import_legacy_codes(self, tmp_path):
+        SQLiteStorageProvider().initialize({'data_dir': str(tmp_path), 'database': 'database/test.db'})
+        (tmp_path / 'blacklist.json').write_text(json.dumps({'codes': ['VIP-1-USED-0001']}), encoding='utf-8')
+        service = ActivationService(_Config(tmp_path))
+
+        assert service.validate_code('VIP-1-OLD0-0001')['error'] == '激活码不存在'
+        result = service.import_codes(['激活码', 'vip-1-old0-0001', 'VIP-1-USED-0001', 'FREE-1-AAAA-AAAA'])
+        assert result == {'imported': 1, 'existing': 1, 'invalid': 2}
+
+        assert service.redeem_code('VIP-1-OLD0-0001', 'user-1')['valid']
+        assert not service.validate_code('VIP-1-USED-0001')['valid']
+        assert service.import_codes(['VIP-1-OLD0-0001'])['existing'] == 1
+        assert service.is_code_used('VIP-1-OLD0-0001')
@@ -0,0 +1,249 @@
+"""
+测试智能助手的对话会话
+
+测试场景：
+1. 不同对话的历史互不影响，可以并行进行；同一对话的轮次串行执行
+2. 内存中的对话数超过上限时淘汰最久未使用的对话，再次访问时从记录恢复（含早期对话摘要）
+3. 结束对话只影响指定的对话；不存在的对话或其他应用的记录返回 None
+4. 每轮只追加新消息并增量建立全文索引（记录 text 不再改写，检索结果按记录去重）；
+   metadata 投影不含消息，对话空闲后刷新，读取记录和同步变更时用消息表补齐消息
+5. 对话结束、被淘汰出内存或服务关闭时刷新待写入的投影
+6. 继续早期版本保存的对话（只有 metadata 中的消息）时补写完整历史，已在 text 中的消息不重复索引
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.smart_chat_agent import SmartChatAgent
+from src.providers.storage.sqlite import SQLiteStorageProvider
+from src.providers.storage.sqlite_extended import SQLiteExtended
+
+
+class _LLMService:
+    """模拟 LLM：回复中带上收到的消息数，记录同时进行的请求数"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    def is_available(self):
+        return True
+
+    def get_provider_info(self, route=None):
+        return {'model': 'test-model', 'max_context_tokens': 8192}
+
+    async def chat(self, messages, stream=False, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.02)
+        self.active -= 1
+        reply = f"收到{len(messages)}条:{messages[-1]['content']}"
+        if stream:
+            async def chunks():
+                yield reply
+            return chunks()
+        return reply
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        return '摘要'
+
+
+class _Storage(SQLiteExtended, SQLiteStorageProvider):
+    """带全文搜索的存储"""
+
+
+def _storage(tmp_path):
+    storage = _Storage()
+    storage.initialize({'data_dir': str(tmp_path), 'database': 'database/history.db'})
+    return storage
+
+
+class TestChatSession:
+    """对话会话测试"""
+
+    def test_conversations_are_isolated_and_parallel(self, tmp_path):
+        llm = _LLMService()
+        agent = SmartChatAgent(llm, storage_provider=_storage(tmp_path))
+        first, second = agent.get_session(), agent.get_session()
+
+        async def scenario():
+            await asyncio.gather(
+                agent.chat('甲的问题', use_knowledge=False, session=first),
+                agent.chat('乙的问题', use_knowledge=False, session=second),
+            )
+            # 同一对话的两条消息串行：第二条能看到第一轮历史
+            stream = await agent.chat('甲的追问', stream=True, use_knowledge=False, session=first)
+            replies = await asyncio.gather(
+                agent.chat('乙的追问', use_knowledge=False, session=second),
+                agent.chat('乙的第三问', use_knowledge=False, session=second),
+            )
+            return ''.join([chunk async for chunk in stream]), replies
+
+        streamed, replies = asyncio.run(scenario())
+        assert llm.max_active == 2
+        assert first.conversation_id and second.conversation_id and first.conversation_id != second.conversation_id
+        assert [m['content'] for m in first.history if m['role'] == 'user'] == ['甲的问题', '甲的追问']
+        assert all('乙' not in m['content'] for m in first.history)
+        assert streamed == '收到4条:甲的追问'
+        assert sorted(replies) == ['收到4条:乙的追问', '收到6条:乙的第三问']
+        assert agent.get_session(first.conversation_id) is first
+
+    def test_lru_eviction_and_lazy_reload(self, tmp_path):
+        storage = _storage(tmp_path)
+        agent = SmartChatAgent(_LLMService(), storage_provider=storage,
+                               config={'max_sessions': 2, 'projection_delay_seconds': 0})
+        sessions = [agent.get_session() for _ in range(3)]
+
+        async def scenario():
+            for i, session in enumerate(sessions):
+                await agent.chat(f'问题{i}', use_knowledge=False, session=session)
+
+        asyncio.run(scenario())
+        sessions[0].history_summary = '早期摘要'
+        sessions[0].summarized_count = 2
+        asyncio.run(agent.save_conversation(sessions[0]))
+
+        stats = agent.sessions.get_stats()
+        assert stats['sessions'] == 2 and stats['evictions'] == 1
+
+        reloaded = agent.get_session(sessions[0].conversation_id)
+        assert reloaded is not sessions[0]
+        assert [m['content'] for m in reloaded.history] == [m['content'] for m in sessions[0].history]
+        assert [m['id'] for m in reloaded.history] == [m['id'] for m in sessions[0].history]
+        assert reloaded.history_summary == '早期摘要' and reloaded.summarized_count == 2
+        assert agent.sessions.get_stats()['loads'] == 1
+
+        # 继续已恢复的对话，仍写入原记录
+        asyncio.run(agent.chat('继续', use_knowledge=False, session=reloaded))
+        record = storage.get_record(sessions[0].conversation_id)
+        assert record['metadata']['message_count'] == 4
+
+    def test_clear_and_missing_conversations(self, tmp_path):
+        storage = _storage(tmp_path)
+        agent = SmartChatAgent(_LLMService(), storage_provider=storage)
+        first, second = agent.get_session(), agent.get_session()
+
+        async def scenario():
+            await agent.chat('第一个对话', use_knowledge=False, session=first)
+            await agent.chat('第二个对话', use_knowledge=False, session=second)
+
+        asyncio.run(scenario())
+        assert agent.clear_history(first.conversation_id) is True
+        assert agent.get_session(second.conversation_id) is second
+        # 已结束的对话仍可从记录恢复
+        assert agent.get_session(first.conversation_id) is not first
+
+        note_id = storage.save_record('笔记内容', {'app_type': 'voice-note'})
+        assert agent.get_session(note_id) is None
+        assert agent.get_session('missing') is None
+        assert SmartChatAgent(_LLMService()).get_session('missing') is None
+
+    def test_appends_messages_and_coalesces_projection(self, tmp_path):
+        storage = _storage(tmp_path)
+        agent = SmartChatAgent(_LLMService(), storage_provider=storage, config={'projection_delay_seconds': 0.2})
+        session = agent.get_session()
+
+        async def scenario():
+            for i in range(5):
+                await agent.chat(f'question{i}', use_knowledge=False, session=session)
+                # 空闲计时每轮重新开始，持续对话期间不刷新
+                await asyncio.sleep(0.1)
+            before_flush = storage.get_record(session.conversation_id)
+            await asyncio.sleep(0.3)
+            return before_flush
+
+        before_flush = asyncio.run(scenario())
+        # 首轮创建记录，之后 4 轮在对话空闲后合并为一次投影刷新
+        assert agent.projection_writes == 1
+        assert len(storage.get_chat_messages(session.conversation_id)) == 10
+        # 刷新前读取记录，消息由消息表补齐
+        assert before_flush['metadata']['message_count'] == 10
+        assert before_flush['metadata']['messages'][-1]['content'] == '收到10条:question4'
+
+        record = storage.get_record(session.conversation_id)
+        assert record['metadata']['conversation_metadata']['total_messages'] == 10
+        assert [m['id'] for m in record['metadata']['messages']] == [m['id'] for m in session.history]
+        # text 保持首轮内容，之后的消息通过追加的索引检索，每条记录只返回一次
+        assert 'question4' not in record['text']
+        assert [r['id'] for r in storage.search_records('question4')] == [session.conversation_id]
+        assert [r['id'] for r in storage.search_records('收到2条')] == [session.conversation_id]
+        conn = storage._get_connection()
+        stored = conn.execute('SELECT metadata FROM records WHERE id = ?', (session.conversation_id,)).fetchone()[0]
+        conn.close()
+        assert 'question3' not in stored
+
+        # 同步变更同样补齐消息
+        conn = storage._get_connection()
+        conn.execute("UPDATE records SET user_id = 'u1' WHERE id = ?", (session.conversation_id,))
+        conn.commit()
+        conn.close()
+        changes = storage.get_changes('u1')['changes']
+        assert len(changes[-1]['data']['metadata']['messages']) == 10
+
+        # 收藏等不改 text 的更新不重写索引
+        SQLiteExtended.toggle_starred(storage, session.conversation_id)
+        assert [r['id'] for r in storage.search_records('question1')] == [session.conversation_id]
+
+        # 服务关闭前刷新待更新的记录
+        async def shutdown():
+            await agent.chat('final', use_knowledge=False, session=session)
+            await agent.flush_all()
+
+        asyncio.run(shutdown())
+        record = storage.get_record(session.conversation_id)
+        assert record['metadata']['conversation_metadata']['total_messages'] == 12
+        assert agent.get_conversation_summary(session)['pending_projections'] == 0
+
+    def test_flush_on_end_and_eviction(self, tmp_path):
+        storage = _storage(tmp_path)
+        agent = SmartChatAgent(_LLMService(), storage_provider=storage,
+                               config={'max_sessions': 1, 'projection_delay_seconds': 60})
+        first, second = agent.get_session(), agent.get_session()
+
+        def total(session):
+            record = storage.get_record(session.conversation_id)
+            return record['metadata']['conversation_metadata']['total_messages']
+
+        async def scenario():
+            await agent.chat('one', use_knowledge=False, session=first)
+            await agent.chat('two', use_knowledge=False, session=first)
+            assert total(first) == 2
+            # 第二个对话加入后第一个被淘汰，淘汰时刷新投影
+            await agent.chat('three', use_knowledge=False, session=second)
+            assert total(first) == 4
+            await agent.chat('four', use_knowledge=False, session=second)
+            assert total(second) == 2
+            # 结束对话时刷新投影
+            agent.clear_history(second.conversation_id)
+            assert total(second) == 4
+
+        asyncio.run(scenario())
+        assert agent.projection_writes == 2
+        assert agent.get_conversation_summary()['pending_projections'] == 0
+
+    def test_continue_legacy_conversation(self, tmp_path):
+        storage = _storage(tmp_path)
+        legacy = [
+            {'id': '1', 'role': 'user', 'content': '旧问题', 'timestamp': 1000},
+            {'id': '2', 'role': 'assistant', 'content': '旧回答', 'timestamp': 2000},
+        ]
+        record_id = storage.save_record('旧对话', {'app_type': 'smart-chat', 'messages': legacy})
+        agent = SmartChatAgent(_LLMService(), storage_provider=storage, config={'projection_delay_seconds': 0})
+
+        session = agent.get_session(record_id)
+        assert session.persisted_count == 0 and len(session.history) == 2
+        asyncio.run(agent.chat('新问题', use_knowledge=False, session=session))
+
+        messages = storage.get_chat_messages(record_id)
+        assert [m['content'] for m in messages] == ['旧问题', '旧回答', '新问题', '收到4条:新问题']
+        assert storage.get_record(record_id)['metadata']['message_count'] == 4
+        # 早期消息已在 text 中，只为新消息追加索引
+        conn = storage._get_connection()
+        rows = [row[0] for row in conn.execute('SELECT text FROM records_fts WHERE record_id = ?', (record_id,))]
+        conn.close()
+        assert rows[0] == '旧对话' and len(rows) == 2
+        assert '新问题' in rows[1] and '旧问题' not in rows[1]
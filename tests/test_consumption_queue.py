@@ -0,0 +1,116 @@
+"""
+测试消费事件队列
+
+测试场景：
+1. 事件入队后不立即写库，flush 时批量写入
+2. 进程崩溃后从溢写文件恢复未写入的事件（重复恢复不产生重复记录）
+3. 额度账本加载用量时计入尚未落盘的事件
+"""
+import sys
+import sqlite3
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.services.consumption_queue import ConsumptionQueue
+from src.services.quota_ledger import QuotaLedger
+
+
+def _make_event(user_id, amount, consumption_type='asr'):
+    now = datetime.now()
+    return {
+        'id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'device_id': 'dev-1',
+        'year': now.year,
+        'month': now.month,
+        'type': consumption_type,
+        'amount': amount,
+        'unit': 'ms',
+        'model_source': 'vendor',
+        'details': '{}',
+        'session_id': None,
+        'timestamp': 0,
+        'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def _count_records(db_path):
+    conn = sqlite3.connect(str(db_path))
+    try:
+        return conn.execute('SELECT COUNT(*) FROM consumption_records').fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / 'test.db'
+    conn = sqlite3.connect(str(path))
+    conn.execute('''
+        CREATE TABLE consumption_records (
+            id TEXT PRIMARY KEY, user_id TEXT, device_id TEXT, year INTEGER, month INTEGER,
+            type TEXT, amount INTEGER, unit TEXT, model_source TEXT, details TEXT,
+            session_id TEXT, timestamp REAL, created_at TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    return path
+
+
+class TestConsumptionQueue:
+    """测试消费事件队列"""
+
+    def test_flush_writes_batch(self, db_path):
+        """事件在 flush 时批量写入"""
+        queue = ConsumptionQueue(str(db_path), flush_interval=60)
+        for _ in range(3):
+            queue.enqueue(_make_event('u1', 100))
+
+        assert _count_records(db_path) == 0
+        assert queue.flush() == 3
+        assert _count_records(db_path) == 3
+        assert not queue.spill_path.exists() or queue.spill_path.stat().st_size == 0
+        queue.close()
+
+    def test_recover_from_spill_file(self, db_path):
+        """崩溃后从溢写文件恢复，重复恢复不重复写入"""
+        queue = ConsumptionQueue(str(db_path), flush_interval=60)
+        queue.enqueue(_make_event('u1', 100))
+        queue.enqueue(_make_event('u1', 200))
+        spill_copy = queue.spill_path.read_bytes()
+        # 模拟崩溃：不调用 close，直接丢弃实例
+
+        ConsumptionQueue(str(db_path), flush_interval=60)
+        assert _count_records(db_path) == 2
+
+        queue.spill_path.write_bytes(spill_copy)
+        ConsumptionQueue(str(db_path), flush_interval=60)
+        assert _count_records(db_path) == 2
+
+    def test_ledger_counts_pending_events(self, db_path):
+        """额度账本加载时计入未落盘事件"""
+        queue = ConsumptionQueue(str(db_path), flush_interval=60)
+        event = _make_event('u1', 300)
+        queue.enqueue(event)
+
+        ledger = QuotaLedger(str(db_path))
+        ledger.pending_source = queue
+        assert ledger._get_entry('u1').asr_used_ms == 300
+
+        # 落盘后重新加载，用量不重复计入
+        queue.flush()
+        ledger._entries.clear()
+        assert ledger._get_entry('u1').asr_used_ms == 300
+        queue.close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,101 @@
+"""
+测试消费统计汇总表
+
+测试场景：
+1. 回填完成前写入的明细由回填计入，完成后由写入方增量计入，每条明细只计一次
+2. 按小时/按天、按维度查询汇总
+"""
+import sys
+import json
+import sqlite3
+import uuid
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.consumption_rollups import query_rollups
+from src.providers.storage.migrations import MIGRATIONS, MigrationRunner
+from src.services.consumption_queue import ConsumptionQueue
+
+
+def _make_event(created_at, consumption_type, amount, model):
+    details = {'model': model, 'prompt_tokens': amount // 2, 'completion_tokens': amount - amount // 2} \
+        if consumption_type == 'llm' else {'provider': model}
+    return {
+        'id': str(uuid.uuid4()),
+        'user_id': 'u1',
+        'device_id': 'dev-1',
+        'year': int(created_at[:4]),
+        'month': int(created_at[5:7]),
+        'type': consumption_type,
+        'amount': amount,
+        'unit': 'tokens' if consumption_type == 'llm' else 'ms',
+        'model_source': 'vendor',
+        'details': json.dumps(details),
+        'session_id': None,
+        'timestamp': 0,
+        'created_at': created_at,
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / 'test.db'
+    conn = sqlite3.connect(str(path))
+    conn.execute('''
+        CREATE TABLE consumption_records (
+            id TEXT PRIMARY KEY, user_id TEXT, device_id TEXT, year INTEGER, month INTEGER,
+            type TEXT, amount INTEGER, unit TEXT, model_source TEXT, details TEXT,
+            session_id TEXT, timestamp REAL, created_at TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    return path
+
+
+class TestConsumptionRollups:
+    """测试消费统计汇总表"""
+
+    def test_backfill_then_incremental(self, db_path):
+        """回填与增量维护衔接，不重复计数"""
+        migrations = [m for m in MIGRATIONS if m.version == '1.3.2']
+        runner = MigrationRunner(str(db_path), migrations=migrations, batch_size=1)
+        runner.apply_pending()
+
+        queue = ConsumptionQueue(str(db_path), flush_interval=60)
+        # 回填完成前写入：由回填计入
+        queue.enqueue(_make_event('2025-01-01 08:10:00', 'asr', 1000, 'volcano'))
+        queue.enqueue(_make_event('2025-01-01 09:20:00', 'llm', 100, 'gpt'))
+        queue.flush()
+        runner.run_backfills()
+
+        # 回填完成后写入：由写入方增量计入
+        queue.enqueue(_make_event('2025-01-01 09:40:00', 'llm', 50, 'gpt'))
+        queue.enqueue(_make_event('2025-01-02 10:00:00', 'asr', 500, 'volcano'))
+        queue.close()
+
+        conn = sqlite3.connect(str(db_path))
+        cursor = conn.cursor()
+
+        daily = query_rollups(cursor, granularity='day')
+        assert [(row['bucket'], row['record_count']) for row in daily] == [('2025-01-01', 3), ('2025-01-02', 1)]
+        assert daily[0]['asr_duration_ms'] == 1000
+        assert daily[0]['llm_total_tokens'] == 150
+
+        hourly = query_rollups(cursor, granularity='hour', start='2025-01-01', end='2025-01-01')
+        assert [row['bucket'] for row in hourly] == ['2025-01-01 08:00:00', '2025-01-01 09:00:00']
+
+        by_model = {row['model']: row for row in query_rollups(cursor, group_by=['model'])}
+        assert by_model['gpt']['record_count'] == 2
+        assert by_model['gpt']['llm_prompt_tokens'] == 75
+        assert by_model['volcano']['asr_duration_ms'] == 1500
+        conn.close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
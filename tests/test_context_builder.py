@@ -0,0 +1,111 @@
+"""
+测试智能助手的上下文构建
+
+测试场景：
+1. 在 Token 预算内从最新一轮开始向前填入历史，超出预算或轮数上限的早期轮次被淘汰
+2. 知识库片段不超过知识库预算；历史以角色消息发送，知识库内容放在最后一条用户消息
+3. 被淘汰的早期对话并入历史摘要，之后不再发送给模型，摘要随系统提示词发送
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.context_builder import ContextBuilder, count_tokens
+from src.agents.smart_chat_agent import SmartChatAgent
+
+
+def _history(turns, chars=100):
+    history = []
+    for i in range(turns):
+        history.append({'role': 'user', 'content': f'问题{i}' + '问' * chars})
+        history.append({'role': 'assistant', 'content': f'回答{i}' + '答' * chars})
+    return history
+
+
+class _LLMService:
+    """模拟 LLM：记录对话消息，摘要请求返回固定文本"""
+
+    def __init__(self):
+        self.chat_calls = []
+        self.summary_calls = []
+
+    def is_available(self):
+        return True
+
+    def get_provider_info(self, route=None):
+        return {'model': 'test-model', 'max_context_tokens': 1200}
+
+    async def chat(self, messages, stream=False, **kwargs):
+        self.chat_calls.append((messages, kwargs))
+        return f'回复{len(self.chat_calls)}' + '好' * 100
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        self.summary_calls.append(user_message)
+        return f'摘要{len(self.summary_calls)}'
+
+
+class TestContextBuilder:
+    """上下文构建测试"""
+
+    def test_packs_newest_history_within_budget(self):
+        builder = ContextBuilder(max_context_tokens=1000, max_history_turns=10)
+        history = _history(8)
+        context = builder.build('系统提示词', '最新问题', history=history, max_output_tokens=300)
+
+        kept = context.stats['history_turns']
+        assert 0 < kept < 8
+        assert context.stats['used_tokens'] <= context.stats['budget_tokens'] == 700
+        # 保留的是最新的轮次，淘汰的是最早的轮次
+        assert context.messages[1:-1] == history[-kept * 2:]
+        assert context.evicted == history[:-kept * 2]
+
+        limited = ContextBuilder(max_context_tokens=100000, max_history_turns=2).build(
+            '系统提示词', '最新问题', history=history
+        )
+        assert limited.stats['history_turns'] == 2 and len(limited.evicted) == 12
+        assert count_tokens('hello world') > 0
+
+    def test_knowledge_budget_and_roles(self):
+        builder = ContextBuilder(max_context_tokens=1000, knowledge_ratio=0.4)
+        chunks = [f'片段{i}' + '知' * 100 for i in range(6)]
+        context = builder.build(
+            '系统提示词', '最新问题', history=_history(1, chars=10), knowledge_chunks=chunks,
+            knowledge_template='【知识库】\n{knowledge_content}\n', max_output_tokens=200
+        )
+
+        assert 0 < context.stats['knowledge_chunks'] < 6
+        assert context.stats['dropped_knowledge_chunks'] == 6 - context.stats['knowledge_chunks']
+        assert [m['role'] for m in context.messages] == ['system', 'user', 'assistant', 'user']
+        final = context.messages[-1]['content']
+        assert final.startswith('【知识库】\n片段0') and final.endswith('最新问题')
+        assert '知识库' not in context.messages[0]['content']
+
+    def test_agent_summarizes_evicted_turns(self):
+        llm = _LLMService()
+        agent = SmartChatAgent(llm, config={'max_tokens': 400})
+        session = agent.get_session()
+
+        async def scenario():
+            for i in range(8):
+                await agent.chat(f'第{i}个问题' + '问' * 100, use_knowledge=False, session=session)
+
+        asyncio.run(scenario())
+
+        assert agent.context_builder.max_context_tokens == 1200
+        assert len(session.history) == 16
+        assert llm.summary_calls and session.summarized_count > 0
+        assert session.history_summary == f'摘要{len(llm.summary_calls)}'
+        # 后续摘要在已有摘要基础上合并
+        if len(llm.summary_calls) > 1:
+            assert '【已有摘要】\n摘要1' in llm.summary_calls[1]
+
+        messages, kwargs = llm.chat_calls[-1]
+        assert kwargs['max_tokens'] == 400
+        assert messages[0]['role'] == 'system' and '摘要' in messages[0]['content']
+        sent = [m['content'] for m in messages[1:-1]]
+        assert sent == [m['content'] for m in session.history[session.summarized_count:-2]]
+        assert all('第0个问题' not in m['content'] for m in messages)
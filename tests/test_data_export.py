@@ -0,0 +1,96 @@
+"""
+测试数据批量导出
+
+测试场景：
+1. CSV 分块导出，按日期范围（结束日期含当天）和用户过滤
+2. Parquet 导出每块一个 row group，读回行数与类型一致（需要 pyarrow）
+3. 日期参数不正确时在开始输出前抛出 ValueError
+"""
+import csv
+import io
+import sys
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.services.data_export_service import DataExportService, PYARROW_AVAILABLE
+
+
+class _Config:
+    def __init__(self, data_dir):
+        self._values = {
+            'storage.data_dir': str(data_dir),
+            'storage.database': 'test.db',
+            'storage.export.chunk_size': 10,
+        }
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+
+@pytest.fixture
+def service(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'test.db'))
+    conn.execute('''
+        CREATE TABLE consumption_records (
+            id TEXT PRIMARY KEY, user_id TEXT, device_id TEXT, year INTEGER, month INTEGER,
+            type TEXT, amount INTEGER, unit TEXT, model_source TEXT, details TEXT,
+            session_id TEXT, timestamp REAL, created_at TEXT
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO consumption_records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [
+            (f'r{i}', f'u{i % 2}', 'dev-1', 2025, 1, 'llm', 30, 'tokens', 'vendor',
+             '{"model": "m1", "prompt_tokens": 10, "completion_tokens": 20}', None, 0,
+             f'2025-01-{1 + i % 31:02d} 12:00:00')
+            for i in range(95)
+        ]
+    )
+    conn.commit()
+    conn.close()
+    return DataExportService(_Config(tmp_path))
+
+
+class TestDataExport:
+    """数据批量导出测试"""
+
+    def test_csv_streams_filtered_chunks(self, service):
+        pieces = list(service.export('consumption_records', 'csv',
+                                     start='2025-01-01', end='2025-01-10', user_id='u0'))
+        rows = list(csv.DictReader(io.StringIO(b''.join(pieces).decode('utf-8-sig'))))
+
+        assert len(rows) == sum(1 for i in range(95) if i % 2 == 0 and 1 + i % 31 <= 10)
+        assert {row['user_id'] for row in rows} == {'u0'}
+        assert max(row['created_at'] for row in rows) >= '2025-01-10'
+        assert rows[0]['model'] == 'm1' and rows[0]['prompt_tokens'] == '10'
+        # 表头一块 + 每 chunk_size 行一块
+        assert len(pieces) == 1 + (len(rows) + 9) // 10
+
+    def test_invalid_dates_rejected_before_streaming(self, service):
+        for kwargs in ({'start': 'bogus'}, {'end': '2025-13-01'}):
+            for dataset in ('consumption_records', 'monthly_consumption'):
+                with pytest.raises(ValueError):
+                    service.export(dataset, 'csv', **kwargs)
+        with pytest.raises(ValueError):
+            service.export('consumption_records', 'csv', start='2025-01-01 xx')
+        # 带时间的日期仍然可用
+        assert list(service.export('consumption_records', 'csv', start='2025-01-01 00:00:00'))
+
+    @pytest.mark.skipif(not PYARROW_AVAILABLE, reason="需要 pyarrow")
+    def test_parquet_row_groups(self, service, tmp_path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        output = tmp_path / 'export.parquet'
+        service.export_to_file('consumption_records', str(output), 'parquet')
+
+        parquet_file = pq.ParquetFile(output)
+        assert parquet_file.metadata.num_rows == 95
+        assert parquet_file.num_row_groups == 10
+        assert parquet_file.schema_arrow.field('completion_tokens').type == pa.int64()
@@ -0,0 +1,84 @@
+"""
+测试身份映射缓存
+
+测试场景：
+1. device_id → user_id 命中缓存后不再查询数据库
+2. 绑定/解绑设备、删除/恢复用户后缓存失效
+3. LRU 容量淘汰与命中率统计
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.identity_cache import LRUTTLCache
+from src.providers.storage.user_storage import UserStorageService
+
+
+@pytest.fixture
+def user_storage(tmp_path):
+    return UserStorageService(str(tmp_path / 'test.db'))
+
+
+class TestIdentityCache:
+    """测试身份映射缓存"""
+
+    def test_lookup_is_cached(self, user_storage, monkeypatch):
+        """命中缓存时不查询数据库"""
+        user_id = user_storage.create_user(nickname='a')
+        user_storage.bind_device(user_id, 'dev-1')
+
+        calls = []
+        original = user_storage._load_user_id_by_device
+        monkeypatch.setattr(user_storage, '_load_user_id_by_device',
+                            lambda device_id: calls.append(device_id) or original(device_id))
+
+        assert user_storage.get_user_id_by_device('dev-1') == user_id
+        assert user_storage.get_user_id_by_device('dev-1') == user_id
+        assert calls == ['dev-1']
+
+        stats = user_storage.identity_cache.get_stats()['device_to_user']
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+
+    def test_invalidation(self, user_storage):
+        """绑定关系与用户状态变更后返回最新结果"""
+        user_a = user_storage.create_user(nickname='a')
+        user_b = user_storage.create_user(nickname='b')
+
+        assert user_storage.get_user_id_by_device('dev-1') is None
+        user_storage.bind_device(user_a, 'dev-1')
+        assert user_storage.get_user_id_by_device('dev-1') == user_a
+
+        user_storage.bind_device(user_b, 'dev-1')
+        assert user_storage.get_user_id_by_device('dev-1') == user_b
+
+        user_storage.delete_user(user_b)
+        assert user_storage.get_user_id_by_device('dev-1') is None
+        user_storage.restore_user(user_b)
+        assert user_storage.get_user_id_by_device('dev-1') == user_b
+
+        user_storage.unbind_device('dev-1')
+        assert user_storage.get_user_id_by_device('dev-1') is None
+
+    def test_lru_eviction(self):
+        """超出容量时淘汰最久未使用的条目"""
+        cache = LRUTTLCache(max_entries=2, ttl_seconds=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        stats = cache.get_stats()
+        assert stats['size'] == 2
+        assert stats['evictions'] == 1
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
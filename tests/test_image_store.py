@@ -0,0 +1,103 @@
+"""
+测试内容寻址图片存储
+
+测试场景：
+1. 相同内容的图片只存储一份；指定文件名已存在但内容不同时覆盖文件，登记的哈希与文件一致
+2. 图片被多条记录引用时，删除其中一条不会删除图片
+3. 最后一个引用删除后图片文件被删除
+4. record_images 关联随记录保存和删除维护
+"""
+import sys
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.migrations import MigrationRunner
+from src.providers.storage.sqlite import SQLiteStorageProvider
+
+PNG_BYTES = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+@pytest.fixture
+def storage(tmp_path):
+    provider = SQLiteStorageProvider()
+    provider.initialize({'data_dir': str(tmp_path), 'database': 'database/history.db'})
+    # 新库没有历史记录，执行回填使引用计数就绪
+    MigrationRunner(str(provider.db_path)).run_backfills()
+    return provider
+
+
+def _image_note(image_url):
+    return {'app_type': 'voice-note', 'blocks': [{'type': 'image', 'imageUrl': image_url}]}
+
+
+class TestImageStore:
+    """测试图片存储"""
+
+    def test_same_content_deduplicated(self, storage):
+        """相同内容复用同一文件"""
+        first = storage.image_store.save(PNG_BYTES)
+        second = storage.image_store.save(PNG_BYTES)
+
+        assert first['image_url'] == second['image_url']
+        assert first['filename'].endswith('.png')
+        assert second['deduplicated'] is True
+        assert len(list(storage.images_dir.glob('*.png'))) == 1
+
+    def test_named_upload_with_different_content(self, storage):
+        """指定文件名已存在但内容不同时覆盖"""
+        store = storage.image_store
+        store.save(PNG_BYTES, filename='photo.png')
+        assert store.save(PNG_BYTES, filename='photo.png')['deduplicated'] is True
+
+        new_bytes = PNG_BYTES + b'\x01'
+        result = store.save(new_bytes, filename='photo.png')
+        assert result['deduplicated'] is False
+        assert (storage.images_dir / 'photo.png').read_bytes() == new_bytes
+
+        conn = sqlite3.connect(str(storage.db_path))
+        row = conn.execute('SELECT content_hash, size FROM image_blobs WHERE filename = ?', ('photo.png',)).fetchone()
+        conn.close()
+        assert row == (store.content_hash(new_bytes), len(new_bytes))
+
+    def test_shared_image_deleted_with_last_reference(self, storage):
+        """共享图片在最后一个引用删除后才删除"""
+        image = storage.image_store.save(PNG_BYTES)
+        image_path = storage.images_dir / image['filename']
+
+        first_id = storage.save_record('a', _image_note(image['image_url']))
+        second_id = storage.save_record(f"b [IMAGE: {image['image_url']}]", {'app_type': 'voice-note'})
+
+        assert storage.delete_record(first_id)
+        assert image_path.exists()
+
+        assert storage.delete_record(second_id)
+        assert not image_path.exists()
+
+    def test_update_moves_reference(self, storage):
+        """更新记录时引用计数随之变化"""
+        image = storage.image_store.save(PNG_BYTES)
+        record_id = storage.save_record('a', _image_note(image['image_url']))
+
+        storage.update_record(record_id, 'a', {'app_type': 'voice-note', 'blocks': []})
+        assert storage.image_store.find_orphans(grace_hours=0) == [image['filename']]
+
+    def test_record_images_index(self, storage):
+        """record_images 随记录保存和删除维护"""
+        image = storage.image_store.save(PNG_BYTES)
+        record_id = storage.save_record('a', _image_note(image['image_url']))
+        assert storage.image_store.get_referenced_filenames() == {image['filename']}
+
+        storage.delete_record(record_id)
+        conn = sqlite3.connect(str(storage.db_path))
+        assert conn.execute('SELECT COUNT(*) FROM record_images').fetchone()[0] == 0
+        conn.close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
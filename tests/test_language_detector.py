@@ -0,0 +1,87 @@
+"""
+测试语言检测
+
+测试场景：
+1. 判定结果与原有正则统计法一致，并给出置信度
+2. 中英夹杂文本按语言切分，片段拼接后与原文一致
+3. 批量检测与逐条检测结果一致，批量翻译复用检测结果
+"""
+import asyncio
+import re
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents import language_detector
+from src.agents.translation_agent import TranslationAgent
+
+
+def _legacy_detect(text):
+    """TranslationAgent 原有的正则统计法"""
+    if not text or not text.strip():
+        return 'en'
+    chinese = len(re.findall(r'[\u4e00-\u9fa5]', text))
+    kana = len(re.findall(r'[\u3040-\u309f]', text)) + len(re.findall(r'[\u30a0-\u30ff]', text))
+    korean = len(re.findall(r'[\uac00-\ud7af]', text))
+    if chinese / len(text) > 0.2:
+        return 'zh'
+    if kana > 0:
+        return 'ja'
+    if korean > 0:
+        return 'ko'
+    return 'en'
+
+
+TEXTS = [
+    '你好世界', 'Hello world', 'こんにちは', '今日は良い天気ですね', '안녕하세요',
+    '我们用 React 重构了 front end', 'OK 好', 'This is a 测试', '', '   ', '123 !?',
+    'Café naïve', '😀 表情', 'カタカナ and English',
+]
+
+
+class _LLMService:
+    def is_available(self):
+        return True
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        return f'T:{user_message}'
+
+
+class TestLanguageDetector:
+    """语言检测测试"""
+
+    def test_matches_legacy_rules_with_confidence(self):
+        for text in TEXTS:
+            assert language_detector.detect(text)[0] == _legacy_detect(text), text
+
+        assert language_detector.detect('你好世界') == ('zh', 1.0)
+        assert language_detector.detect('') == ('en', 0.0)
+        lang, confidence = language_detector.detect('我们用 React 重构了 front end')
+        assert lang == 'zh' and 0 < confidence < 1
+        # 汉字未超过 20% 时按假名判为日文，日文中的汉字计入日文
+        assert language_detector.detect('ありがとうございます、今日') == ('ja', 1.0)
+
+    def test_segments_mixed_text(self):
+        text = '我们用React框架重构 front end，性能提升30%。'
+        segments = language_detector.segment(text)
+        assert [lang for lang, _ in segments] == ['zh', 'en', 'zh', 'en', 'zh']
+        assert segments[1] == ('en', 'React')
+        assert ''.join(part for _, part in segments) == text
+
+        assert language_detector.segment('今日はReactを使う') == [
+            ('ja', '今日は'), ('en', 'React'), ('ja', 'を使う')
+        ]
+        assert language_detector.segment('123 !?') == [('en', '123 !?')]
+        assert language_detector.segment('') == []
+
+    def test_batch_matches_single_and_agent_reuses_detection(self):
+        assert language_detector.detect_batch(TEXTS) == [language_detector.detect(t) for t in TEXTS]
+
+        agent = TranslationAgent(_LLMService(), config={'batch': {'requests_per_second': 0}})
+        results = asyncio.run(agent.batch_translate_with_pair(['你好', 'Hello', 'こんにちは', ''], 'zh-en'))
+        assert results[0] and results[1] and results[3] == ''
+        assert results[2]['detected_lang'] == 'ja'
+        assert agent.detect_language_with_confidence('Hello') == ('en', 1.0)
@@ -0,0 +1,124 @@
+"""
+测试实时字幕翻译
+
+测试场景：
+1. 确定的 utterance 翻译后以 translation 消息发布，utterance_id 与提交时返回的一致
+2. 同一句被二遍识别修正（开始时间相同）后只发布最新文本的译文
+3. 积压超过上限时丢弃最旧的未开始翻译，并发数不超过上限
+4. 新录音的开始时间不对应上一次录音的 utterance；翻译结束后不保留版本记录
+"""
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.services.live_translation import LiveTranslationService
+
+
+class _Agent:
+    """模拟 TranslationAgent：译文为原文加前缀"""
+
+    SUPPORTED_PAIRS = {'zh-en': ('zh', 'en', '中文', '英文')}
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.calls = []
+
+    def resolve_translation_direction(self, pair_key, text):
+        return 'zh', 'en', True
+
+    async def translate(self, text, source_lang, target_lang, stream=False, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        self.calls.append(text)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return f'EN:{text}'
+
+
+def _run(service, scenario):
+    async def main():
+        await service.start()
+        await scenario()
+        while service._futures:
+            await asyncio.sleep(0.01)
+        await service.stop()
+    asyncio.run(main())
+
+
+class TestLiveTranslation:
+    """实时字幕翻译测试"""
+
+    def test_publishes_translation_with_utterance_id(self):
+        published = []
+        service = LiveTranslationService(_Agent(), published.append, enabled=True)
+        ids = []
+
+        async def scenario():
+            # ASR 回调来自其他线程
+            worker = threading.Thread(target=lambda: ids.append(
+                service.submit('你好', {'start_time': 0, 'end_time': 800}, 'voice-note')
+            ))
+            worker.start()
+            worker.join()
+            assert service.submit('   ') is None
+
+        _run(service, scenario)
+        assert len(published) == 1
+        assert published[0]['utterance_id'] == ids[0]
+        assert published[0]['translation'] == 'EN:你好'
+        assert (published[0]['start_time'], published[0]['app_id']) == (0, 'voice-note')
+
+    def test_revised_utterance_publishes_latest_only(self):
+        published = []
+        agent = _Agent(delay=0.05)
+        service = LiveTranslationService(agent, published.append, enabled=True)
+        ids = []
+
+        async def scenario():
+            ids.append(service.submit('今天天汽', {'start_time': 100}))
+            await asyncio.sleep(0.01)  # 第一版已开始翻译
+            ids.append(service.submit('今天天气', {'start_time': 100}))
+
+        _run(service, scenario)
+        assert ids[0] == ids[1]
+        assert [message['translation'] for message in published] == ['EN:今天天气']
+        assert service.get_stats()['dropped'] == 1
+
+    def test_backlog_and_concurrency_limits(self):
+        published = []
+        agent = _Agent(delay=0.02)
+        service = LiveTranslationService(agent, published.append, enabled=True,
+                                         max_concurrency=2, max_pending=3)
+
+        async def scenario():
+            for i in range(6):
+                service.submit(f'句子{i}', {'start_time': i * 1000})
+
+        _run(service, scenario)
+        assert [message['text'] for message in published] == ['句子3', '句子4', '句子5']
+        assert agent.max_active <= 2
+        assert service.get_stats()['dropped'] == 3
+
+    def test_new_recording_starts_fresh(self):
+        published = []
+        service = LiveTranslationService(_Agent(), published.append, enabled=True)
+        ids = []
+
+        async def scenario():
+            ids.append(service.submit('第一次录音', {'start_time': 0}))
+            await asyncio.sleep(0.05)
+            service.begin_recording()
+            # 新录音的开始时间同样从 0 计
+            ids.append(service.submit('第二次录音', {'start_time': 0}))
+
+        _run(service, scenario)
+        assert ids[0] != ids[1]
+        assert [message['translation'] for message in published] == ['EN:第一次录音', 'EN:第二次录音']
+        assert len(service._latest) == 0 and list(service._by_start.values()) == [ids[1]]
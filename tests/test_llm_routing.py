@@ -0,0 +1,190 @@
+"""
+测试 LLM 多模型路由
+
+测试场景：
+1. 按路由选择模型，未配置的路由使用默认模型；别名模型继承默认模型的连接配置；上下文长度取路由内最小值
+2. 模型出错时切换到下一个模型；超过路由延迟上限时保留原请求并同时请求下一个模型，先返回者胜出
+   （流式请求以首个片段为准），统计降级次数和服务模型
+3. 重新加载 llm 配置段后替换路由表（共享配置不变），新配置没有可用模型时保留当前路由表
+"""
+import asyncio
+import copy
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.services import llm_service as llm_service_module
+from src.services.llm_service import LLMService
+
+
+class AuthenticationError(Exception):
+    """模拟 litellm 的认证异常"""
+    status_code = 401
+
+
+# 各模型的行为：延迟（秒）或异常
+BEHAVIOR = {}
+
+
+class _Provider:
+    """模拟 LiteLLM 提供商：按模型名返回固定回复"""
+
+    def __init__(self):
+        self.config = None
+
+    @property
+    def name(self):
+        return 'fake'
+
+    def initialize(self, config):
+        self.config = config
+        return bool(config.get('model'))
+
+    def is_available(self):
+        return self.config is not None and bool(self.config.get('model'))
+
+    async def chat(self, messages, stream=False, **kwargs):
+        model = self.config['model']
+        behavior = BEHAVIOR.get(model, 0)
+        if isinstance(behavior, Exception):
+            raise behavior
+        if not stream:
+            await asyncio.sleep(behavior)
+            return f'{model}:{messages[-1]["content"]}'
+
+        async def chunks():
+            await asyncio.sleep(behavior)
+            yield f'{model}:'
+            yield messages[-1]['content']
+        return chunks()
+
+
+class _Config:
+    """模拟配置：read_section 读取 pending 中的新配置（模拟修改后的 config.yml）"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pending = None
+
+    def get(self, key, default=None):
+        value = self.data
+        for k in key.split('.'):
+            value = value.get(k) if isinstance(value, dict) else None
+        return default if value is None else value
+
+    def read_section(self, key):
+        value = self.pending if self.pending is not None else self.data
+        for k in key.split('.'):
+            value = value.get(k) if isinstance(value, dict) else None
+        return value
+
+
+LLM_CONFIG = {
+    'llm': {
+        'provider': 'deepseek',
+        'api_key': 'key',
+        'model': 'big',
+        'max_context_tokens': 128000,
+        'scheduler': {'max_retries': 0, 'circuit_failure_threshold': 0},
+        'models': {
+            'fast': {'model': 'fast', 'max_context_tokens': 32000},
+            'backup': {'provider': 'openai', 'model': 'backup'},
+        },
+        'routes': {
+            'translation': {'models': ['fast', 'default'], 'max_latency_seconds': 0.05},
+            'summary': ['default', 'backup'],
+        },
+    }
+}
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(llm_service_module, 'LiteLLMProvider', _Provider)
+    BEHAVIOR.clear()
+    return LLMService(_Config(copy.deepcopy(LLM_CONFIG)))
+
+
+def _ask(service, route=None, stream=False):
+    async def main():
+        result = await service.simple_chat('你好', route=route, stream=stream)
+        if stream:
+            return ''.join([chunk async for chunk in result])
+        return result
+    return asyncio.run(main())
+
+
+class TestLLMRouting:
+    """LLM 多模型路由测试"""
+
+    def test_route_selection(self, service):
+        assert _ask(service, 'translation') == 'fast:你好'
+        assert _ask(service, 'summary') == 'big:你好'
+        assert _ask(service, 'unknown') == 'big:你好'
+        assert _ask(service) == 'big:你好'
+
+        fast = service._table.providers['fast'].config
+        backup = service._table.providers['backup'].config
+        assert fast['api_key'] == 'key' and fast['provider'] == 'deepseek'
+        assert 'api_key' not in backup
+
+        assert service.get_route_model('translation') == 'fast'
+        assert service.get_provider_info('translation')['max_context_tokens'] == 32000
+        assert service.get_provider_info()['max_context_tokens'] == 128000
+
+    def test_fallback_on_error_and_latency(self, service):
+        BEHAVIOR['big'] = AuthenticationError('invalid key')
+        assert _ask(service, 'summary') == 'backup:你好'
+
+        BEHAVIOR['big'] = 0
+        BEHAVIOR['fast'] = 0.5
+        assert _ask(service, 'translation', stream=True) == 'big:你好'
+        assert _ask(service, 'translation') == 'big:你好'
+
+        stats = service.get_route_stats()['routes']
+        assert stats['summary']['fallbacks'] == 1
+        assert stats['summary']['served_by'] == {'backup': 1}
+        assert stats['summary']['errors'] == {'default': {'auth': 1}}
+        assert stats['translation']['fallbacks'] == stats['translation']['latency_fallbacks'] == 2
+        assert stats['translation']['errors'] == {}
+        assert stats['translation']['latency']['count'] == 2
+        # 落选的慢请求被取消后归还并发槽位
+        assert service.scheduler.get_stats()['models']['fast']['in_flight'] == 0
+
+        # 慢但仍在延迟上限附近的首选模型先返回时胜出
+        BEHAVIOR['fast'] = 0.06
+        BEHAVIOR['big'] = 0.5
+        assert _ask(service, 'translation') == 'fast:你好'
+        assert _ask(service, 'translation', stream=True) == 'fast:你好'
+        BEHAVIOR['big'] = 0
+
+        # 路由内全部模型失败
+        BEHAVIOR['big'] = BEHAVIOR['backup'] = AuthenticationError('invalid key')
+        with pytest.raises(AuthenticationError):
+            _ask(service, 'summary')
+        assert service.get_route_stats()['routes']['summary']['failed'] == 1
+
+    def test_reload_routes(self, service):
+        _ask(service, 'translation')
+        pending = copy.deepcopy(LLM_CONFIG)
+        pending['llm']['routes'] = {'translation': {'models': ['backup', 'fast']}}
+        service.config.pending = pending
+
+        stats = service.reload_routes()
+        assert _ask(service, 'translation') == 'backup:你好'
+        # 共享配置不被替换
+        assert service.config.data['llm']['routes'] == LLM_CONFIG['llm']['routes']
+        assert 'summary' not in service._table.routes
+        # 统计跨重新加载保留
+        assert stats['routes']['translation']['requests'] == 1
+        assert stats['routes']['translation']['health'] == 'healthy'
+
+        service.config.pending = {'llm': {'model': ''}}
+        with pytest.raises(RuntimeError):
+            service.reload_routes()
+        assert _ask(service, 'translation') == 'backup:你好'
@@ -0,0 +1,235 @@
+"""
+测试 LLM 请求调度
+
+测试场景：
+1. 并发达到上限时排队，按优先级通道出队（交互对话先于批量任务），统计排队等待时间
+2. 可重试的错误按退避重试，不可重试的错误直接抛出；连续失败后熔断，冷却后探测成功恢复；
+   探测请求被取消、排队超时或流式请求未迭代时不会让熔断一直保持
+3. 慢请求触发对冲请求，先返回者胜出；流式请求只在首个片段之前重试
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.llm.scheduler import (
+    CircuitOpenError,
+    LLMRequestScheduler,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    classify_error,
+    llm_priority,
+)
+
+
+class RateLimitError(Exception):
+    """模拟 litellm 的频率限制异常"""
+    status_code = 429
+    retry_after = None
+
+
+class AuthenticationError(Exception):
+    """模拟 litellm 的认证异常"""
+    status_code = 401
+
+
+def _scheduler(**kwargs):
+    params = {'base_backoff_seconds': 0.001, 'max_backoff_seconds': 0.01}
+    params.update(kwargs)
+    return LLMRequestScheduler(**params)
+
+
+class TestLLMScheduler:
+    """LLM 请求调度测试"""
+
+    def test_priority_lanes_and_queue_wait(self):
+        scheduler = _scheduler(max_concurrency=1)
+        order = []
+
+        def call(name, delay=0.01):
+            async def run():
+                order.append(name)
+                await asyncio.sleep(delay)
+                return name
+            return run
+
+        async def scenario():
+            first = asyncio.ensure_future(scheduler.submit(call('first', 0.05), model='m'))
+            await asyncio.sleep(0.01)
+            with llm_priority(PRIORITY_BATCH):
+                batch = [asyncio.ensure_future(scheduler.submit(call(f'batch{i}'), model='m')) for i in range(2)]
+            await asyncio.sleep(0)
+            interactive = asyncio.ensure_future(
+                scheduler.submit(call('chat'), model='m', priority=PRIORITY_INTERACTIVE)
+            )
+            await asyncio.sleep(0.01)
+            queued = scheduler.get_stats()['models']['m']['queued']
+            return await asyncio.gather(first, *batch, interactive), queued
+
+        results, queued = asyncio.run(scenario())
+        assert results == ['first', 'batch0', 'batch1', 'chat']
+        assert order == ['first', 'chat', 'batch0', 'batch1']
+        assert queued == {'interactive': 1, 'normal': 0, 'batch': 2}
+
+        stats = scheduler.get_stats()['models']['m']
+        assert stats['in_flight'] == 0 and stats['succeeded'] == 4
+        assert stats['queue_wait']['batch']['count'] == 2
+        assert stats['queue_wait']['batch']['max_ms'] > stats['queue_wait']['interactive']['max_ms'] > 0
+
+    def test_retries_and_circuit_breaker(self):
+        assert classify_error(RateLimitError('too many')) == 'rate_limit'
+        assert classify_error(AuthenticationError('bad key')) == 'auth'
+        assert classify_error(asyncio.TimeoutError()) == 'timeout'
+        assert classify_error(Exception('insufficient balance')) == 'quota'
+        assert classify_error(ValueError('bad request')) == 'other'
+
+        scheduler = _scheduler(max_retries=3, circuit_failure_threshold=0)
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise RateLimitError('rate limit')
+            return 'ok'
+
+        assert asyncio.run(scheduler.submit(flaky, model='m')) == 'ok'
+        assert len(attempts) == 3 and scheduler.get_stats()['models']['m']['retries'] == 2
+
+        async def auth_error():
+            attempts.append(1)
+            raise AuthenticationError('bad key')
+
+        attempts.clear()
+        with pytest.raises(AuthenticationError):
+            asyncio.run(scheduler.submit(auth_error, model='m'))
+        assert len(attempts) == 1
+
+        breaker = _scheduler(max_retries=0, circuit_failure_threshold=2, circuit_cooldown_seconds=0.05)
+        fail = {'on': True}
+
+        async def service():
+            if fail['on']:
+                raise RateLimitError('rate limit')
+            return 'ok'
+
+        async def scenario():
+            for _ in range(2):
+                with pytest.raises(RateLimitError):
+                    await breaker.submit(service, model='m')
+            with pytest.raises(CircuitOpenError):
+                await breaker.submit(service, model='m')
+            state = breaker.get_stats()['models']['m']['circuit']
+            await asyncio.sleep(0.06)
+            fail['on'] = False
+            return state, await breaker.submit(service, model='m')
+
+        state, result = asyncio.run(scenario())
+        stats = breaker.get_stats()['models']['m']
+        assert state == 'open' and result == 'ok'
+        assert stats['circuit'] == 'closed' and stats['rejected'] == 1 and stats['circuit_opens'] == 1
+
+    def test_abandoned_probe_does_not_stick(self):
+        breaker = _scheduler(max_retries=0, max_concurrency=1, circuit_failure_threshold=1,
+                             circuit_cooldown_seconds=0.02)
+        queued = _scheduler(max_retries=0, max_concurrency=1, circuit_failure_threshold=1,
+                            circuit_cooldown_seconds=0.02, timeout_seconds=0.05)
+
+        async def failing():
+            raise RateLimitError('rate limit')
+
+        async def slow():
+            await asyncio.sleep(1)
+            return 'slow'
+
+        async def fast():
+            return 'ok'
+
+        async def reopen(scheduler):
+            with pytest.raises(RateLimitError):
+                await scheduler.submit(failing, model='m')
+            await asyncio.sleep(0.03)
+
+        async def scenario():
+            results = []
+            # 探测请求被取消
+            await reopen(breaker)
+            probe = asyncio.ensure_future(breaker.submit(slow, model='m'))
+            await asyncio.sleep(0.01)
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+            results.append(breaker.circuit_state('m'))
+            results.append(await breaker.submit(fast, model='m'))
+
+            # 探测请求排队超时（并发槽位被占满）
+            state = queued._state('m')
+            await reopen(queued)
+            state.in_flight = state.max_concurrency
+            with pytest.raises(asyncio.TimeoutError):
+                await queued.submit(fast, model='m')
+            queued._release(state)
+            results.append(await queued.submit(fast, model='m'))
+
+            # 流式探测只打开不迭代、或在首个片段前关闭
+            await reopen(breaker)
+
+            async def open_stream():
+                async def chunks():
+                    await asyncio.sleep(1)
+                    yield 'a'
+                return chunks()
+
+            await breaker.submit(open_stream, stream=True, model='m')
+            stream = await breaker.submit(open_stream, stream=True, model='m')
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(stream.__anext__(), 0.01)
+            results.append(await breaker.submit(fast, model='m'))
+            return results
+
+        assert asyncio.run(scenario()) == ['half_open', 'ok', 'ok', 'ok']
+        assert breaker.get_stats()['models']['m']['in_flight'] == 0
+
+    def test_hedging_and_streaming_retries(self):
+        scheduler = _scheduler(max_concurrency=4, hedge_after_seconds=0.02)
+        calls = []
+
+        async def slow_then_fast():
+            calls.append(1)
+            await asyncio.sleep(0.5 if len(calls) == 1 else 0.01)
+            return f'call{len(calls)}'
+
+        assert asyncio.run(scheduler.submit(slow_then_fast, model='m')) == 'call2'
+        stats = scheduler.get_stats()['models']['m']
+        assert stats['hedges'] == 1 and stats['hedge_wins'] == 1 and stats['in_flight'] == 0
+
+        streamer = _scheduler(max_retries=2)
+        starts = []
+
+        async def open_stream():
+            starts.append(1)
+            attempt = len(starts)
+
+            async def chunks():
+                if attempt == 1:
+                    raise RateLimitError('rate limit')
+                yield 'a'
+                yield 'b'
+                if attempt == 3:
+                    raise RateLimitError('rate limit')
+            return chunks()
+
+        async def collect():
+            return [chunk async for chunk in await streamer.submit(open_stream, stream=True, model='m')]
+
+        assert asyncio.run(collect()) == ['a', 'b']
+        assert len(starts) == 2
+        # 开始输出后出错不重试
+        with pytest.raises(RateLimitError):
+            asyncio.run(collect())
+        assert len(starts) == 3
+        assert streamer.get_stats()['models']['m']['in_flight'] == 0
@@ -0,0 +1,58 @@
+"""
+测试 LLM 用量上下文
+
+测试场景：
+1. 并发请求各自记录自己的用量，互不覆盖
+2. 扇出调用（asyncio.gather）的用量累加到同一请求
+3. 不在作用域内的调用不记录
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.llm.usage import get_current_usage, record_usage, usage_scope
+
+
+async def _fake_call(tokens, model='model-a'):
+    """模拟一次 LLM 调用：等待后记录用量"""
+    await asyncio.sleep(0.01)
+    record_usage(tokens, tokens, tokens * 2, model=model, provider='test')
+
+
+class TestUsageScope:
+    """测试请求范围的用量上下文"""
+
+    def test_concurrent_requests_are_isolated(self):
+        """并发请求的用量互不干扰"""
+        async def request(tokens):
+            with usage_scope() as usage:
+                await _fake_call(tokens)
+                return usage.total_tokens
+
+        async def main():
+            return await asyncio.gather(request(10), request(20), request(30))
+
+        assert asyncio.run(main()) == [20, 40, 60]
+
+    def test_fan_out_is_aggregated(self):
+        """扇出调用的用量累加，并按模型汇总"""
+        async def main():
+            with usage_scope() as usage:
+                await asyncio.gather(_fake_call(1), _fake_call(2), _fake_call(3, model='model-b'))
+                return usage
+
+        usage = asyncio.run(main())
+        assert usage.call_count == 3
+        assert usage.total_tokens == 12
+        by_model = usage.by_model()
+        assert by_model[('model-a', 'test')]['total_tokens'] == 6
+        assert by_model[('model-b', 'test')]['calls'] == 1
+
+    def test_outside_scope_not_recorded(self):
+        """作用域外的调用不记录"""
+        assert get_current_usage() is None
+        assert record_usage(1, 1, 2) is False
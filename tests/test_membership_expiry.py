@@ -0,0 +1,92 @@
+"""
+测试会员到期定时降级
+
+测试场景：
+1. 到期会员读取时按降级后的免费会员返回（与定时降级结果一致），且不写数据库
+2. 定时任务批量降级到期会员，并失效额度账本中缓存的会员信息
+"""
+import sys
+import sqlite3
+import asyncio
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.sqlite import SQLiteStorageProvider
+from src.services.membership_service import MembershipService
+from src.services.membership_sweeper import MembershipExpirySweeper
+
+
+class _Config:
+    def __init__(self, data_dir):
+        self._values = {
+            'storage.data_dir': str(data_dir),
+            'storage.database': 'database/test.db',
+        }
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    SQLiteStorageProvider().initialize({'data_dir': str(tmp_path), 'database': 'database/test.db'})
+    path = tmp_path / 'database' / 'test.db'
+    conn = sqlite3.connect(str(path))
+    for user_id, tier, expires_at in [
+        ('expired', 'vip', '2020-01-01 00:00:00'),
+        ('paid', 'pro', '2999-01-01 00:00:00'),
+        ('free', 'free', None),
+    ]:
+        conn.execute('''
+            INSERT INTO memberships (user_id, tier, status, subscription_period, activated_at, expires_at, created_at, updated_at)
+            VALUES (?, ?, 'active', ?, '2020-01-01 00:00:00', ?, '2020-01-01 00:00:00', '2020-01-01 00:00:00')
+        ''', (user_id, tier, 1 if expires_at else None, expires_at))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _stored_tier(db_path, user_id):
+    conn = sqlite3.connect(str(db_path))
+    try:
+        return conn.execute('SELECT tier FROM memberships WHERE user_id = ?', (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+class TestMembershipExpiry:
+    """会员到期降级测试"""
+
+    def test_read_is_pure(self, db_path):
+        service = MembershipService(_Config(db_path.parent.parent))
+
+        membership = service.get_membership('expired')
+        assert membership['tier'] == 'free'
+        assert membership['status'] == 'active'
+        assert membership['is_active'] and membership['permanent']
+        assert membership['expires_at'] is None and membership['subscription_period'] is None
+        assert service.check_quota('expired', 'asr', 1000)['allowed']
+        # 读取不降级数据库中的会员
+        assert _stored_tier(db_path, 'expired') == 'vip'
+
+    def test_sweep_downgrades_in_batches(self, db_path):
+        service = MembershipService(_Config(db_path.parent.parent))
+        assert service.check_quota('expired', 'asr', 1000)['allowed']
+        assert service.quota_ledger._entries['expired'].membership is not None
+
+        before_sweep = service.get_membership('expired')
+        sweeper = MembershipExpirySweeper(service, batch_size=1)
+        assert asyncio.run(sweeper.sweep()) == 1
+
+        assert _stored_tier(db_path, 'expired') == 'free'
+        assert _stored_tier(db_path, 'paid') == 'pro'
+        assert service.quota_ledger._entries['expired'].membership is None
+        after_sweep = service.get_membership('expired')
+        for field in ('tier', 'status', 'is_active', 'expires_at', 'subscription_period', 'quota'):
+            assert before_sweep[field] == after_sweep[field]
+        assert service.sweep_expired_memberships() == []
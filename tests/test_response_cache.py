@@ -0,0 +1,105 @@
+"""
+测试 Agent 响应缓存
+
+测试场景：
+1. 相同请求第二次命中缓存且不再调用 LLM，温度较高时不缓存，use_cache=False 时强制重新生成
+2. 流式请求完整生成后写入缓存，命中时通过同一 AsyncIterator 接口回放
+3. 缓存键随模型、提示词、输入和参数变化；超出容量时淘汰最久未使用的条目
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.response_cache import ResponseCache, get_cache_status, make_key
+from src.agents.summary_agent import SummaryAgent
+
+
+class _LLMService:
+    """模拟 LLM：返回固定小结，记录调用次数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def is_available(self):
+        return True
+
+    def get_provider_info(self, route=None):
+        return {'model': 'test-model'}
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        self.calls += 1
+        text = f'小结{self.calls}：' + '要点' * 20
+        if not stream:
+            return text
+
+        async def chunks():
+            for i in range(0, len(text), 7):
+                yield text[i:i + 7]
+        return chunks()
+
+
+async def _collect(iterator):
+    return ''.join([chunk async for chunk in iterator])
+
+
+class TestResponseCache:
+    """响应缓存测试"""
+
+    def test_hit_bypass_and_refresh(self):
+        llm = _LLMService()
+        agent = SummaryAgent(llm, config={'prompt_variant': 'meeting'}, response_cache=ResponseCache())
+
+        async def scenario():
+            first = await agent.generate_summary('会议记录', temperature=0.2)
+            statuses = [get_cache_status()]
+            second = await agent.generate_summary('会议记录', temperature=0.2)
+            statuses.append(get_cache_status())
+            await agent.generate_summary('会议记录', temperature=0.8)
+            statuses.append(get_cache_status())
+            refreshed = await agent.generate_summary('会议记录', use_cache=False, temperature=0.2)
+            statuses.append(get_cache_status())
+            return first, second, refreshed, statuses
+
+        first, second, refreshed, statuses = asyncio.run(scenario())
+        assert first == second and refreshed != first
+        assert statuses == ['miss', 'hit', 'bypass', 'miss']
+        assert llm.calls == 3
+        # 强制重新生成的结果刷新了缓存
+        assert asyncio.run(agent.generate_summary('会议记录', temperature=0.2)) == refreshed
+
+    def test_stream_stores_and_replays(self):
+        llm = _LLMService()
+        cache = ResponseCache()
+        agent = SummaryAgent(llm, config={'prompt_variant': 'meeting'}, response_cache=cache)
+
+        async def scenario():
+            generated = await _collect(await agent.generate_summary('会议记录', stream=True, temperature=0))
+            replayed_iter = await agent.generate_summary('会议记录', stream=True, temperature=0)
+            status = get_cache_status()
+            return generated, await _collect(replayed_iter), status
+
+        generated, replayed, status = asyncio.run(scenario())
+        assert replayed == generated and status == 'hit'
+        assert llm.calls == 1
+        assert cache.get_stats()['stores'] == 1
+
+    def test_key_components_and_eviction(self):
+        base = make_key('m1', 'prompt', 'input', {'temperature': 0, 'max_tokens': 100})
+        assert base == make_key('m1', 'prompt', 'input', {'max_tokens': 100, 'temperature': 0})
+        assert base != make_key('m2', 'prompt', 'input', {'temperature': 0, 'max_tokens': 100})
+        assert base != make_key('m1', 'prompt2', 'input', {'temperature': 0, 'max_tokens': 100})
+        assert base != make_key('m1', 'prompt', 'input2', {'temperature': 0, 'max_tokens': 100})
+        assert base != make_key('m1', 'prompt', 'input', {'temperature': 0, 'max_tokens': 200})
+
+        cache = ResponseCache(max_entries=2, max_entry_chars=10)
+        cache.put('a', 'A')
+        cache.put('b', 'B')
+        assert cache.get('a') == 'A'
+        cache.put('c', 'C')
+        cache.put('d', 'x' * 11)
+        assert (cache.get('a'), cache.get('b'), cache.get('c'), cache.get('d')) == ('A', None, 'C', None)
+        assert cache.get_stats()['evictions'] == 1
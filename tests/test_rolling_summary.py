@@ -0,0 +1,242 @@
+"""
+测试录音过程中的滚动小结
+
+测试场景：
+1. 每积累 N 条确定的 utterance 增量更新一次小结，结束录音后剩余语句并入并持久化
+2. 生成小结时只并入尾部语句；场景不一致时不复用；服务重启后从数据库恢复会话
+3. 增量更新失败时语句保留在待并入队列，已并入语句的二遍修正不重复并入
+4. 多台设备同时录音时各自维护会话，用量记到会话所属设备，结束录音只结束本设备的会话
+5. 请求内容与会话语句不一致（被编辑或补充）时不复用；状态表由迁移创建，兼容早期自建的表
+6. 并入期间被修正的语句不计入已并入语句，修正后的文本下次并入；已并入语句的指纹数量有上限
+"""
+import sqlite3
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.migrations import MIGRATIONS, MigrationRunner
+from src.providers.storage.rolling_summary_store import RollingSummaryStore
+from src.services import rolling_summary
+from src.services.rolling_summary import RollingSummaryService
+
+
+class _LLMService:
+    """模拟 LLM：小结为已有小结加上新增记录的行数"""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    def is_available(self):
+        return True
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        if self.fail:
+            raise RuntimeError('LLM 不可用')
+        await asyncio.sleep(0.01)
+        self.calls.append(user_message)
+        previous, new = user_message.split('【新增记录】\n')
+        count = len(new.split('\n'))
+        total = count + (int(previous.split('共')[1].split('句')[0]) if '共' in previous else 0)
+        return f'共{total}句'
+
+
+def _store(tmp_path):
+    db_path = tmp_path / 'test.db'
+    MigrationRunner(str(db_path), migrations=[m for m in MIGRATIONS if m.version in ('1.3.8', '1.3.10')]).apply_pending()
+    return RollingSummaryStore(db_path)
+
+
+def _run(service, scenario):
+    async def main():
+        await service.start()
+        result = await scenario()
+        while service._futures:
+            await asyncio.sleep(0.01)
+        await service.stop()
+        return result
+    return asyncio.run(main())
+
+
+class TestRollingSummary:
+    """滚动小结测试"""
+
+    def test_folds_every_n_and_on_end(self, tmp_path):
+        llm = _LLMService()
+        store = _store(tmp_path)
+        service = RollingSummaryService(llm, store, fold_every=3, enabled=True)
+
+        async def scenario():
+            ids = {service.submit(f'第{i}句', {'start_time': i * 1000}, 'voice-note') for i in range(7)}
+            await asyncio.sleep(0.1)
+            folded = service.get_stats()['folded']
+            service.end_session()
+            return ids, folded
+
+        ids, folded = _run(service, scenario)
+        assert len(ids) == 1 and folded == 6
+        session_id = ids.pop()
+        state = store.load(session_id)
+        assert state['summary'] == '共7句' and state['folded_count'] == 7
+        assert state['pending'] == [] and state['is_closed'] is True
+        assert len(llm.calls) == 3
+        assert service.submit('', {}) is None
+
+    def test_final_summary_reuses_rolling_state(self, tmp_path):
+        llm = _LLMService()
+        store = _store(tmp_path)
+        service = RollingSummaryService(llm, store, fold_every=4, enabled=True)
+
+        async def scenario():
+            for i in range(5):
+                session_id = service.submit(f'第{i}句', {'start_time': i})
+            await asyncio.sleep(0.05)
+            assert await service.get_summary(session_id, 'diary') is None
+            summary = await service.get_summary(session_id, 'meeting')
+            return session_id, summary
+
+        session_id, summary = _run(service, scenario)
+        assert summary == '共5句'
+        # 最后一次只并入了尾部的 1 句
+        assert llm.calls[-1].endswith('【新增记录】\n第4句')
+
+        # 服务重启后从数据库恢复
+        restarted = RollingSummaryService(_LLMService(), _store(tmp_path))
+        assert asyncio.run(restarted.get_summary(session_id, 'meeting')) == '共5句'
+        assert asyncio.run(restarted.get_summary('sum-missing', 'meeting')) is None
+
+    def test_failure_keeps_pending_and_ignores_folded_revisions(self, tmp_path):
+        llm = _LLMService()
+        service = RollingSummaryService(llm, _store(tmp_path), fold_every=2, enabled=True)
+
+        async def scenario():
+            llm.fail = True
+            session_id = service.submit('第一句', {'start_time': 0})
+            service.submit('第二句', {'start_time': 1})
+            await asyncio.sleep(0.05)
+            failed_pending = service.get_stats()['pending']
+
+            llm.fail = False
+            service.submit('第三句', {'start_time': 2})
+            await asyncio.sleep(0.05)
+            # 已并入的语句被二遍修正
+            service.submit('第一句（修正）', {'start_time': 0})
+            return session_id, failed_pending, await service.get_summary(session_id, 'meeting')
+
+        session_id, failed_pending, summary = _run(service, scenario)
+        assert failed_pending == 2
+        assert service.get_stats()['failed'] == 1
+        assert summary == '共3句'
+        assert all('修正' not in call for call in llm.calls)
+
+    def test_sessions_are_per_device(self, tmp_path):
+        usage = []
+        service = RollingSummaryService(_LLMService(), _store(tmp_path), fold_every=2, enabled=True,
+                                        on_usage=lambda device_id, _: usage.append(device_id))
+
+        async def scenario():
+            first = {service.submit(f'甲{i}', {'start_time': i}, device_id='dev-a') for i in range(2)}
+            second = {service.submit(f'乙{i}', {'start_time': i}, device_id='dev-b') for i in range(3)}
+            await asyncio.sleep(0.05)
+            # 结束本设备的会话不影响另一台设备
+            assert service.end_session('dev-a') == next(iter(first))
+            stats = service.get_stats('dev-b')
+            return first, second, stats
+
+        first, second, stats = _run(service, scenario)
+        assert len(first) == len(second) == 1 and first != second
+        assert stats['active_sessions'] == 1 and stats['active_session_id'] == next(iter(second))
+        assert stats['pending'] == 1 and stats['folded'] == 2
+        assert sorted(usage) == ['dev-a', 'dev-b']
+        assert service.store.load(next(iter(first)))['device_id'] == 'dev-a'
+
+        # 关闭时不指定设备则结束全部会话
+        service.configure(False)
+        assert service.get_stats('dev-b')['active_sessions'] == 0
+
+    def test_content_must_match_session(self, tmp_path):
+        service = RollingSummaryService(_LLMService(), _store(tmp_path), fold_every=2, enabled=True)
+
+        async def scenario():
+            for i in range(3):
+                session_id = service.submit(f'第{i}句。', {'start_time': i})
+            service.end_session()
+            await asyncio.sleep(0.05)
+            return session_id, [
+                await service.get_summary(session_id, 'meeting', '第0句。\n第1句。\n\n第2句。'),
+                await service.get_summary(session_id, 'meeting', '第0句。第1句（已编辑）。第2句。'),
+                await service.get_summary(session_id, 'meeting', '第0句。第1句。第2句。' + '补充的大段内容' * 3),
+                await service.get_summary(session_id, 'meeting', '第2句。第1句。第0句。'),
+            ]
+
+        session_id, summaries = _run(service, scenario)
+        assert summaries == ['共3句', None, None, None]
+        # 重启后仍能核对内容
+        restarted = RollingSummaryService(_LLMService(), _store(tmp_path))
+        assert asyncio.run(restarted.get_summary(session_id, 'meeting', '第0句。第1句。第2句。')) == '共3句'
+
+    def test_migration_upgrades_legacy_table(self, tmp_path):
+        db_path = tmp_path / 'test.db'
+        conn = sqlite3.connect(str(db_path))
+        conn.execute('''
+            CREATE TABLE rolling_summaries (
+                session_id TEXT PRIMARY KEY, app_id TEXT, summary_type TEXT NOT NULL, summary TEXT,
+                folded_count INTEGER NOT NULL DEFAULT 0, pending TEXT NOT NULL DEFAULT '[]',
+                is_closed INTEGER NOT NULL DEFAULT 0, created_at TIMESTAMP NOT NULL, updated_at TIMESTAMP NOT NULL
+            )
+        ''')
+        conn.execute('''
+            INSERT INTO rolling_summaries (session_id, summary_type, summary, folded_count, created_at, updated_at)
+            VALUES ('sum-old', 'meeting', '旧小结', 4, '2026-01-01', '2026-01-01')
+        ''')
+        conn.commit()
+        conn.close()
+
+        state = _store(tmp_path).load('sum-old')
+        assert state['summary'] == '旧小结' and state['folded_coverage'] == [] and state['device_id'] is None
+
+    def test_revision_during_fold_and_coverage_cap(self, tmp_path, monkeypatch):
+        llm = _LLMService()
+        store = _store(tmp_path)
+        service = RollingSummaryService(llm, store, fold_every=2, enabled=True)
+
+        async def scenario():
+            session_id = service.submit('第0句。', {'start_time': 0})
+            service.submit('第1句。', {'start_time': 1})
+            # 并入进行中时第 0 句被二遍修正
+            await asyncio.sleep(0.005)
+            service.submit('第0句（修正）。', {'start_time': 0})
+            await asyncio.sleep(0.05)
+            stats = service.get_stats()
+            service.end_session()
+            await asyncio.sleep(0.05)
+            return session_id, stats
+
+        session_id, stats = _run(service, scenario)
+        assert stats['pending'] == 1 and stats['folded'] == 1
+        assert llm.calls[-1].endswith('【新增记录】\n第0句（修正）。')
+        assert store.load(session_id)['folded_count'] == 2
+        assert asyncio.run(service.get_summary(session_id, 'meeting', '第0句（修正）。第1句。')) is None
+        assert asyncio.run(service.get_summary(session_id, 'meeting', '第1句。第0句（修正）。')) == '共3句'
+
+        # 指纹超过上限时相邻两两合并，核对仍然有效
+        monkeypatch.setattr(rolling_summary, '_MAX_COVERAGE_ENTRIES', 4)
+        service = RollingSummaryService(_LLMService(), store, fold_every=1, enabled=True)
+
+        async def long_session():
+            for i in range(10):
+                session_id = service.submit(f'第{i}句。', {'start_time': i})
+                await asyncio.sleep(0.02)
+            service.end_session()
+            return session_id
+
+        session_id = _run(service, long_session)
+        assert len(store.load(session_id)['folded_coverage']) <= 4
+        content = '\n'.join(f'第{i}句。' for i in range(10))
+        restarted = RollingSummaryService(_LLMService(), store)
+        assert asyncio.run(restarted.get_summary(session_id, 'meeting', content)) == '共10句'
+        assert asyncio.run(restarted.get_summary(session_id, 'meeting', content.replace('第5句', '第五句'))) is None
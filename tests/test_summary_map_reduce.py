@@ -0,0 +1,107 @@
+"""
+测试长记录分段小结（map-reduce）
+
+测试场景：
+1. 按 utterance（行）边界切分，超长单行按句末标点切分，各段不超过上限
+2. 各段在并发上限内同时小结，每段完成发送进度，最终合并以流式输出；笔记信息作为每段的上下文
+3. 合并输入过长时逐层分组合并；记录只有一段时按普通方式生成
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.summary_agent import SummaryAgent
+
+
+class _LLMService:
+    """模拟 LLM：分段小结返回固定长度文本，合并返回流式结果"""
+
+    def __init__(self, partial_chars=20):
+        self.partial_chars = partial_chars
+        self.active = 0
+        self.max_active = 0
+        self.calls = []
+
+    def is_available(self):
+        return True
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        self.calls.append((user_message, system_prompt, stream, kwargs))
+        if stream:
+            async def chunks():
+                for part in ('最终', '小结'):
+                    yield part
+            return chunks()
+
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        return '要' * self.partial_chars
+
+
+def _collect(agent, content, **kwargs):
+    async def run():
+        return [event async for event in agent.generate_map_reduce(content, **kwargs)]
+    return asyncio.run(run())
+
+
+class TestSummaryMapReduce:
+    """分段小结测试"""
+
+    def test_split_on_utterance_boundaries(self):
+        agent = SummaryAgent(_LLMService(), config={'prompt_variant': 'meeting'})
+        lines = [f'第{i}句话，内容比较长一些。' for i in range(30)]
+        chunks = agent.split_transcript('\n'.join(lines), 200)
+
+        assert len(chunks) > 1
+        assert all(len(chunk) <= 200 for chunk in chunks)
+        assert '\n'.join(chunks).split('\n') == lines
+
+        long_line = '这是一句话。' * 50
+        pieces = agent.split_transcript(long_line, 200)
+        assert ''.join(pieces) == long_line and all(len(p) <= 200 for p in pieces)
+        assert all(p.endswith('。') for p in pieces)
+
+    def test_concurrent_map_then_streamed_reduce(self):
+        llm = _LLMService()
+        agent = SummaryAgent(llm, config={'prompt_variant': 'meeting'})
+        body = '\n'.join(f'说话人{i}: 今天讨论第{i}个议题的进展和风险。' for i in range(60))
+        content = f'【笔记信息】\n标题: 周会\n\n【笔记内容】\n{body}'
+
+        events = _collect(agent, content, chunk_chars=300, max_concurrency=2, max_tokens=800)
+        map_events = [e for e in events if e.get('stage') == 'map']
+        total = map_events[0]['total']
+
+        assert total > 2
+        assert [e['completed'] for e in map_events] == list(range(1, total + 1))
+        assert llm.max_active <= 2
+        assert ''.join(e['text'] for e in events if e['type'] == 'chunk') == '最终小结'
+
+        map_calls = [call for call in llm.calls if not call[2]]
+        assert all(call[0].startswith('【笔记信息】\n标题: 周会') for call in map_calls)
+        assert all('分段处理说明' in call[1] for call in map_calls)
+        assert all(call[3]['max_tokens'] == 1000 for call in map_calls)
+        reduce_call = llm.calls[-1]
+        assert reduce_call[2] and '合并说明' in reduce_call[1] and reduce_call[3]['max_tokens'] == 800
+        assert reduce_call[0].count('段小结】') == total
+
+    def test_hierarchical_reduce_and_single_chunk(self):
+        llm = _LLMService(partial_chars=150)
+        agent = SummaryAgent(llm, config={'prompt_variant': 'meeting'})
+        body = '\n'.join('这是一段比较长的发言内容，' * 8 for _ in range(40))
+
+        events = _collect(agent, body, chunk_chars=400)
+        reduce_levels = [e['level'] for e in events if e.get('stage') == 'reduce']
+        assert reduce_levels[0] == 1 and reduce_levels[-1] > 1
+        assert ''.join(e['text'] for e in events if e['type'] == 'chunk') == '最终小结'
+
+        llm = _LLMService()
+        agent = SummaryAgent(llm, config={'prompt_variant': 'meeting'})
+        events = _collect(agent, '简短的会议记录')
+        assert events == [{'type': 'chunk', 'text': '最终'}, {'type': 'chunk', 'text': '小结'}]
+        assert len(llm.calls) == 1
@@ -0,0 +1,87 @@
+"""
+测试多设备同步变更日志
+
+测试场景：
+1. 记录新建/修改返回完整内容，收藏、软删除只返回状态字段
+2. 标签与标签关联变更、彻底删除
+3. 按 since 分批读取，同一批次内同一实体只返回一次
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.sqlite import SQLiteStorageProvider
+from src.providers.storage.sqlite_extended import SQLiteExtended
+from src.providers.storage.tag_storage import TagStorageService
+
+
+class _Storage(SQLiteStorageProvider, SQLiteExtended):
+    pass
+
+
+@pytest.fixture
+def storage(tmp_path):
+    provider = _Storage()
+    provider.initialize({'data_dir': str(tmp_path), 'database': 'database/test.db'})
+    return provider
+
+
+class TestSyncChanges:
+    """同步变更日志测试"""
+
+    def test_record_deltas(self, storage):
+        first = storage.save_record('hello', {'app_type': 'voice-note'}, user_id='u1', device_id='dev-1')
+        second = storage.save_record('world', {'app_type': 'voice-note'}, user_id='u1', device_id='dev-1')
+        storage.save_record('other user', {'app_type': 'voice-note'}, user_id='u2')
+
+        initial = storage.get_changes('u1')
+        assert [change['id'] for change in initial['changes']] == [first, second]
+        assert initial['changes'][0]['data']['text'] == 'hello'
+
+        storage.toggle_starred(first)
+        storage.soft_delete_record(second)
+        storage.update_record(first, 'hello again', {'app_type': 'voice-note'})
+
+        delta = storage.get_changes('u1', since=initial['next_since'])
+        changes = {change['id']: change for change in delta['changes']}
+        assert len(delta['changes']) == 2
+        assert changes[first]['op'] == 'upsert'
+        assert changes[first]['data']['text'] == 'hello again'
+        assert changes[first]['data']['is_starred'] == 1
+        assert changes[second]['op'] == 'patch'
+        assert changes[second]['data']['is_deleted'] == 1
+        assert 'text' not in changes[second]['data']
+
+    def test_tags_links_and_purge(self, storage):
+        record_id = storage.save_record('tagged', {'app_type': 'voice-note'}, user_id='u1')
+        since = storage.get_changes('u1')['next_since']
+
+        tags = TagStorageService(str(storage.db_path))
+        tag_id = tags.create_tag('u1', 'work')
+        tags.add_tag_to_record(record_id, tag_id)
+        tags.remove_tag_from_record(record_id, tag_id)
+        storage.delete_records([record_id])
+
+        changes = storage.get_changes('u1', since=since)['changes']
+        assert [(change['entity'], change['op']) for change in changes] == [
+            ('tag', 'upsert'), ('record_tag', 'unlink'), ('record', 'delete')
+        ]
+
+    def test_batches(self, storage):
+        for i in range(5):
+            storage.save_record(f'note {i}', {'app_type': 'voice-note'}, user_id='u1')
+
+        seen, since = [], 0
+        while True:
+            batch = storage.get_changes('u1', since=since, limit=2)
+            seen.extend(change['id'] for change in batch['changes'])
+            since = batch['next_since']
+            if not batch['has_more']:
+                break
+
+        assert len(seen) == len(set(seen)) == 5
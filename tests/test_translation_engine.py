@@ -0,0 +1,85 @@
+"""
+测试批量翻译引擎
+
+测试场景：
+1. 短文本按翻译方向打包为一次调用，结果顺序与输入一致
+2. 打包译文缺少片段时只对缺失片段逐条重试
+3. 同时进行的 LLM 调用数不超过并发上限
+"""
+import asyncio
+import re
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.translation_agent import TranslationAgent
+from src.agents.translation_engine import pack_segments, unpack_segments
+
+
+class _LLMService:
+    """模拟 LLM：译文为 <目标语言>:<原文>，打包请求按序号逐段返回"""
+
+    def __init__(self, drop_index=None, delay=0.0):
+        self.calls = []
+        self.drop_index = drop_index
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    def is_available(self):
+        return True
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            target = re.search(r'翻译成(\S+?)。', system_prompt).group(1)
+            self.calls.append(user_message)
+            segments = re.findall(r'^\[(\d+)\] (.*)$', user_message, re.MULTILINE)
+            if not segments or '多段翻译格式' not in system_prompt:
+                return f'{target}:{user_message}'
+            return '\n'.join(f'[{i}] {target}:{text}' for i, text in segments if int(i) != self.drop_index)
+        finally:
+            self.active -= 1
+
+
+def _agent(llm, **batch):
+    return TranslationAgent(llm, config={'batch': {'requests_per_second': 0, **batch}})
+
+
+class TestBatchTranslationEngine:
+    """批量翻译引擎测试"""
+
+    def test_pack_round_trip(self):
+        packed = pack_segments(['a', 'b', 'c'])
+        assert unpack_segments(packed.replace('[2] b', '[2]'), 3) == ['a', None, 'c']
+
+    def test_packs_by_direction_and_keeps_order(self):
+        llm = _LLMService()
+        texts = ['你好', 'Hello', '', '谢谢', 'Thanks', 'x' * 300]
+        results = asyncio.run(_agent(llm).batch_translate_with_pair(texts, 'zh-en'))
+
+        assert results == ['英文:你好', '中文:Hello', '', '英文:谢谢', '中文:Thanks', '中文:' + 'x' * 300]
+        # zh->en 一个打包、en->zh 一个打包、长文本单独一次
+        assert len(llm.calls) == 3
+
+    def test_missing_segment_retried_individually(self):
+        llm = _LLMService(drop_index=2)
+        results = asyncio.run(_agent(llm).batch_translate(['一', '二', '三'], 'zh', 'en'))
+
+        assert results == ['英文:一', '英文:二', '英文:三']
+        assert llm.calls[-1] == '二'
+        assert len(llm.calls) == 2
+
+    def test_concurrency_limit(self):
+        llm = _LLMService(delay=0.01)
+        agent = _agent(llm, max_concurrency=2, pack_max_segments=1)
+        results = asyncio.run(agent.batch_translate([f'句子{i}' for i in range(8)], 'zh', 'en'))
+
+        assert results == [f'英文:句子{i}' for i in range(8)]
+        assert len(llm.calls) == 8
+        assert llm.max_active == 2
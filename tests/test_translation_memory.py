@@ -0,0 +1,148 @@
+"""
+测试翻译记忆缓存
+
+测试场景：
+1. 规范化原文后命中，进程内未命中时从数据库加载，统计命中指标
+2. 超出条目上限时淘汰最久未使用的译文
+3. 翻译与批量翻译复用译文；提示词文件变更后旧译文失效
+4. 命中时不写数据库，使用时间和次数积累一批后合并写回（淘汰前先写回）；表由迁移创建
+"""
+import asyncio
+import shutil
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.prompts import PromptLoader
+from src.agents.translation_agent import TranslationAgent
+from src.providers.storage import translation_memory as translation_memory_module
+from src.providers.storage.migrations import MIGRATIONS, MigrationRunner
+from src.providers.storage.translation_memory import TranslationMemory
+
+
+class _LLMService:
+    """模拟 LLM：译文为原文加前缀"""
+
+    def __init__(self):
+        self.calls = []
+
+    def is_available(self):
+        return True
+
+    async def simple_chat(self, user_message, system_prompt, stream=False, **kwargs):
+        self.calls.append(user_message)
+        return f'T:{user_message}'
+
+
+def _memory(db_path, **kwargs):
+    MigrationRunner(str(db_path), migrations=[m for m in MIGRATIONS if m.version == '1.3.9']).apply_pending()
+    return TranslationMemory(db_path, **kwargs)
+
+
+class TestTranslationMemory:
+    """翻译记忆缓存测试"""
+
+    def test_normalized_hits_and_persistence(self, tmp_path):
+        db_path = tmp_path / 'test.db'
+        memory = _memory(db_path)
+        memory.put('你好，  世界', 'zh', 'en', 'v1', 'Hello, world')
+
+        assert memory.get(' 你好， 世界 ', 'zh', 'en', 'v1') == 'Hello, world'
+        assert memory.get('你好，  世界', 'zh', 'ja', 'v1') is None
+        assert memory.get('你好，  世界', 'zh', 'en', 'v2') is None
+
+        reopened = _memory(db_path)
+        assert reopened.get_many([('你好， 世界', 'zh', 'en'), ('再见', 'zh', 'en')], 'v1') == ['Hello, world', None]
+        stats = reopened.get_stats()
+        assert (stats['db_hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+    def test_prune_least_recently_used(self, tmp_path):
+        memory = _memory(tmp_path / 'test.db', max_entries=2)
+        conn = memory._get_connection()
+        for i, used_at in enumerate(['2026-01-03', '2026-01-01', '2026-01-02']):
+            conn.execute('''
+                INSERT INTO translation_memory VALUES (?, 'v1', 'zh', 'en', ?, ?, 0, ?, ?)
+            ''', (f'k{i}', f's{i}', f't{i}', used_at, used_at))
+        conn.commit()
+        conn.close()
+
+        assert memory.prune() == 1
+        conn = memory._get_connection()
+        assert {row[0] for row in conn.execute('SELECT key FROM translation_memory')} == {'k0', 'k2'}
+        conn.close()
+
+    def test_agent_reuses_and_invalidates_on_prompt_change(self, tmp_path, monkeypatch):
+        prompts_dir = tmp_path / 'prompts'
+        prompts_dir.mkdir()
+        prompt_file = prompts_dir / 'translation_agent.yml'
+        shutil.copy(PromptLoader.PROMPTS_DIR / 'translation_agent.yml', prompt_file)
+        monkeypatch.setattr(PromptLoader, 'PROMPTS_DIR', prompts_dir)
+        monkeypatch.setattr(PromptLoader, '_cache', {})
+
+        llm = _LLMService()
+        memory = _memory(tmp_path / 'test.db')
+        agent = TranslationAgent(llm, config={'batch': {'requests_per_second': 0}}, translation_memory=memory)
+
+        assert asyncio.run(agent.translate('你好', 'zh', 'en')) == 'T:你好'
+        results = asyncio.run(agent.batch_translate(['你好', '谢谢', '谢谢'], 'zh', 'en'))
+        assert results == ['T:你好', 'T:谢谢', 'T:谢谢']
+        assert llm.calls == ['你好', '谢谢']
+
+        # 修改提示词后旧译文失效
+        prompt_file.write_text(prompt_file.read_text(encoding='utf-8') + '\n# changed\n', encoding='utf-8')
+        old_version = agent.prompt_version
+        assert asyncio.run(agent.translate('你好', 'zh', 'en')) == 'T:你好'
+        assert agent.prompt_version != old_version
+        assert llm.calls[-1] == '你好' and len(llm.calls) == 3
+        assert memory.get_stats()['entries'] == 1
+
+    def test_hits_are_batched(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(translation_memory_module, '_TOUCH_FLUSH_EVERY', 3)
+        memory = _memory(tmp_path / 'test.db', max_entries=3)
+        memory.put_many([(f'句子{i}', 'zh', 'en', f'S{i}') for i in range(4)], 'v1')
+        conn = memory._get_connection()
+        conn.execute("UPDATE translation_memory SET last_used_at = '2026-01-01 00:00:00'")
+        conn.commit()
+
+        def used():
+            return dict(conn.execute('SELECT source_text, hit_count FROM translation_memory WHERE last_used_at > ?',
+                                     ('2026-01-01 00:00:00',)).fetchall())
+
+        # 命中不写数据库（内存命中也计入）
+        memory.get_many([('句子0', 'zh', 'en'), ('句子0', 'zh', 'en'), ('句子1', 'zh', 'en')], 'v1')
+        assert used() == {}
+        # 第 3 个不同的条目命中后合并写回
+        memory.get('句子3', 'zh', 'en', 'v1')
+        assert used() == {'句子0': 2, '句子1': 1, '句子3': 1}
+
+        # 淘汰前写回，刚命中（尚未写回）的条目保留
+        conn.execute("UPDATE translation_memory SET last_used_at = '2026-01-01 00:00:00'")
+        conn.commit()
+        memory.get('句子2', 'zh', 'en', 'v1')
+        assert memory.prune() == 1
+        keys = {row[0] for row in conn.execute('SELECT source_text FROM translation_memory')}
+        conn.close()
+        assert len(keys) == 3 and '句子2' in keys
+        assert memory.flush() == 0
+
+    def test_writes_keep_pending_hits(self, tmp_path):
+        memory = _memory(tmp_path / 'test.db')
+        memory.put('hello', 'en', 'zh', 'v1', '你好')
+        conn = memory._get_connection()
+        conn.execute("UPDATE translation_memory SET last_used_at = '2026-01-01 00:00:00'")
+        conn.commit()
+
+        for _ in range(5):
+            assert memory.get('hello', 'en', 'zh', 'v1') == '你好'
+        # 写入其他译文不影响尚未写回的命中
+        memory.put('bye', 'en', 'zh', 'v1', '再见')
+        assert memory.flush() == 1
+
+        hit_count, last_used_at = conn.execute(
+            "SELECT hit_count, last_used_at FROM translation_memory WHERE source_text = 'hello'"
+        ).fetchone()
+        conn.close()
+        assert hit_count == 5 and last_used_at > '2026-01-01 00:00:00'
@@ -0,0 +1,117 @@
+"""
+测试用户统计计数
+
+测试场景：
+1. 重算完成前实时统计，重算与触发器累加的增量不重复计数
+2. 收藏、归档、软删除/恢复、彻底删除、标签关联增删后计数与实时统计一致
+3. count_records 按用户统计时读取物化计数
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.providers.storage.migrations import MigrationRunner
+from src.providers.storage.sqlite import SQLiteStorageProvider
+from src.providers.storage.sqlite_extended import SQLiteExtended
+from src.providers.storage.tag_storage import TagStorageService
+from src.providers.storage.user_stats import _aggregate
+
+
+class _Storage(SQLiteStorageProvider, SQLiteExtended):
+    pass
+
+
+@pytest.fixture
+def storage(tmp_path):
+    provider = _Storage()
+    provider.initialize({'data_dir': str(tmp_path), 'database': 'database/test.db'})
+    return provider
+
+
+def _live_stats(storage, user_id):
+    conn = storage._get_connection()
+    try:
+        sql, params = _aggregate([user_id])
+        return {(scope, key): count for _, scope, key, count in conn.execute(sql, params)}
+    finally:
+        conn.close()
+
+
+def _stored_stats(storage, user_id):
+    conn = storage._get_connection()
+    try:
+        rows = conn.execute('SELECT scope, key, count FROM user_stats WHERE user_id = ? AND count != 0',
+                            (user_id,))
+        return {(scope, key): count for scope, key, count in rows}
+    finally:
+        conn.close()
+
+
+class TestUserStats:
+    """用户统计计数测试"""
+
+    def test_rebuild_does_not_double_count(self, storage):
+        for i in range(3):
+            storage.save_record(f'note {i}', {'app_type': 'voice-note'}, user_id='u1')
+        storage.save_record('chat', {'app_type': 'smart-chat'}, user_id='u1')
+
+        # 重算前：触发器已累加，读取走实时统计
+        stats = storage.get_user_stats('u1')
+        assert stats['total'] == 4
+        assert stats['app_types'] == {'voice-note': 3, 'smart-chat': 1}
+
+        MigrationRunner(str(storage.db_path), batch_size=1).run_backfills()
+        assert _stored_stats(storage, 'u1') == _live_stats(storage, 'u1')
+        assert storage.get_user_stats('u1')['total'] == 4
+
+    def test_counters_follow_mutations(self, storage):
+        MigrationRunner(str(storage.db_path)).run_backfills()
+        tags = TagStorageService(storage.db_path)
+        work = tags.create_tag('u1', 'work')
+        home = tags.create_tag('u1', 'home')
+
+        first = storage.save_record('a', {'app_type': 'voice-note'}, user_id='u1')
+        second = storage.save_record('b', {'app_type': 'voice-zen'}, user_id='u1')
+        third = storage.save_record('c', {'app_type': 'voice-note'}, user_id='u1')
+        storage.save_record('other', {'app_type': 'voice-note'}, user_id='u2')
+
+        storage.toggle_starred(first)
+        storage.toggle_archived(second)
+        storage.toggle_starred(third)
+        storage.soft_delete_record(third)
+        tags.add_tag_to_record(first, work)
+        tags.add_tag_to_record(second, work)
+        tags.add_tag_to_record(second, home)
+        tags.remove_tag_from_record(second, home)
+
+        stats = storage.get_user_stats('u1')
+        assert stats['total'] == 3
+        assert stats['app_types'] == {'voice-note': 2, 'voice-zen': 1}
+        assert (stats['starred'], stats['archived'], stats['deleted']) == (1, 1, 1)
+        assert {tag['tag_name']: tag['count'] for tag in stats['tags']} == {'work': 2, 'home': 0}
+
+        storage.restore_record(third)
+        storage.delete_records([second])
+        tags.delete_tag(home)
+        assert _stored_stats(storage, 'u1') == _live_stats(storage, 'u1')
+        assert storage.get_user_stats('u1')['starred'] == 2
+        assert storage.get_user_stats('u2')['total'] == 1
+
+    def test_count_records_reads_counters(self, storage):
+        MigrationRunner(str(storage.db_path)).run_backfills()
+        for app_type in ('voice-note', 'voice-note', 'smart-chat'):
+            storage.save_record('x', {'app_type': app_type}, user_id='u1', device_id='dev-1')
+
+        conn = storage._get_connection()
+        conn.execute("UPDATE user_stats SET count = 42 WHERE user_id = 'u1' AND scope = 'record'")
+        conn.commit()
+        conn.close()
+
+        assert storage.count_records(user_id='u1') == 42
+        assert storage.count_records(app_type='voice-note', user_id='u1') == 2
+        assert storage.count_records(user_id='u1', device_id='dev-1') == 3